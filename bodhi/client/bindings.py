@@ -404,6 +404,10 @@ class BodhiClient(OpenIdBaseClient):
             rows_per_page (int): Limit the results to a certain number of rows per page
                 (min:1 max: 100 default: 20).
             page (int): Return a specific page of results.
+            cursor (str): Return the page of results after this cursor, instead of a page
+                number. Each response has the ``next_cursor`` of the page after it.
+            count (str): ``exact`` to count the total number of results for this query, or
+                ``cached`` to accept a count recently cached by the server.
         Returns:
             The response from Bodhi describing the query results.
         """
@@ -439,6 +443,31 @@ class BodhiClient(OpenIdBaseClient):
             kwargs['bugs'] = None
         return self.send_request('updates/', verb='GET', params=kwargs)
 
+    def query_all(self, **kwargs) -> typing.Iterator['munch.Munch']:
+        """
+        Query bodhi for updates, and yield the updates of every page of results.
+
+        The pages are walked with the cursor returned with each page, so that updates submitted
+        while walking don't shift the pages. The following pages accept a total count cached by the
+        server. Servers that don't return cursors are walked by page number.
+
+        Args:
+            kwargs: The arguments of :meth:`query`, except ``page`` and ``cursor``.
+        Yields:
+            The updates matching the query.
+        """
+        response = self.query(**kwargs)
+        kwargs['count'] = 'cached'
+        while True:
+            yield from response['updates']
+            if response.get('next_cursor'):
+                kwargs['cursor'] = response['next_cursor']
+            elif 'next_cursor' not in response and response['page'] < response['pages']:
+                kwargs['page'] = response['page'] + 1
+            else:
+                return
+            response = self.query(**kwargs)
+
     def get_test_status(self, update: str) -> 'munch.Munch':
         """
         Query bodhi for the test status of the specified update..
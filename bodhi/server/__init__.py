@@ -335,7 +335,7 @@ def main(global_config, testing=None, session=None, **settings):
     # Though importing in the middle of this function is the darkest of evils, we cannot do it any
     # other way without a backwards-incompatible change. See
     # https://github.com/fedora-infra/bodhi/issues/2294
-    from bodhi.server import models
+    from bodhi.server import critpath, models
     from bodhi.server.views import generic
 
     # Let's put a cache on the home page stats, but only if it isn't already cached. The cache adds
@@ -354,6 +354,13 @@ def main(global_config, testing=None, session=None, **settings):
         # need to capture the return value.
         models.Release.all_releases()
 
+        # Let's warm up the critical path index of the releases that can get updates.
+        critpath.index.warm(
+            release.name.lower() for release in models.Release.query.filter(
+                models.Release.state.in_(
+                    [models.ReleaseState.pending, models.ReleaseState.frozen,
+                     models.ReleaseState.current])))
+
         # Let's warm up the home page cache by calling _generate_home_page_stats(). We can ignore
         # the return value.
         generic._generate_home_page_stats()
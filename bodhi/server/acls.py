@@ -0,0 +1,113 @@
+# Copyright © 2020 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""Cache who can commit to packages, so ACL checks don't query Pagure for every request."""
+from collections import OrderedDict
+import logging
+import threading
+import time
+import typing
+
+from bodhi.server.config import config
+from bodhi.server.services.metrics_tween import acl_cache_lookups
+
+
+log = logging.getLogger(__name__)
+
+ACL = typing.Tuple[typing.List[str], typing.List[str]]
+
+
+class ACLCache:
+    """
+    Map packages to the users and groups that can commit to them.
+
+    Entries are keyed by the namespace and the name of the package in the ACL system. They expire
+    ``pagure_acl_cache_ttl`` seconds after they were fetched, and the least recently used entries
+    are evicted once the cache holds more than ``pagure_acl_cache_max_size`` of them. Setting the
+    TTL to 0 disables the cache.
+
+    The cache is shared by the threads of the process. The number of lookups that were found in the
+    cache (hits) or not (misses) are counted, and exported in the bodhi_acl_cache_lookups metric.
+    """
+
+    def __init__(self):
+        """Initialize an empty cache."""
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, name: str, fetch: typing.Callable[[], ACL]) -> ACL:
+        """
+        Return the ACL of the given package, fetching it if it isn't cached or expired.
+
+        The lock is not held while fetching, so that several threads can fetch different packages
+        concurrently. Errors raised by fetch are not cached.
+
+        Args:
+            namespace: The namespace of the package, such as "rpms".
+            name: The name of the package.
+            fetch: A callable that returns the ACL of the package from the ACL system.
+        Returns:
+            A 2-tuple of the list of usernames and the list of group names with commit access.
+        """
+        key = (namespace, name)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                acl_cache_lookups.labels(result='hit').inc()
+                return list(entry[1][0]), list(entry[1][1])
+            self.misses += 1
+        acl_cache_lookups.labels(result='miss').inc()
+        log.debug('ACL cache miss for %s/%s', namespace, name)
+
+        committers, groups = fetch()
+
+        ttl = config['pagure_acl_cache_ttl']
+        if ttl > 0:
+            with self._lock:
+                self._entries[key] = (time.monotonic() + ttl, (list(committers), list(groups)))
+                self._entries.move_to_end(key)
+                while len(self._entries) > config['pagure_acl_cache_max_size']:
+                    self._entries.popitem(last=False)
+        return list(committers), list(groups)
+
+    def invalidate(self, namespace: typing.Optional[str] = None,
+                   name: typing.Optional[str] = None):
+        """
+        Forget the cached ACL of the given package, or of all the packages.
+
+        Args:
+            namespace: The namespace of the package to forget. If None, all the packages are
+                forgotten.
+            name: The name of the package to forget. Ignored if namespace is None.
+        """
+        with self._lock:
+            if namespace is None:
+                self._entries.clear()
+            else:
+                self._entries.pop((namespace, name), None)
+
+    def __len__(self) -> int:
+        """Return the number of cached entries, including the expired ones not evicted yet."""
+        return len(self._entries)
+
+
+pagure_acls = ACLCache()
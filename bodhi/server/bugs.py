@@ -17,9 +17,12 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """Defines utilities for accessing Bugzilla."""
 
-from collections import namedtuple
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from xmlrpc import client as xmlrpc_client
 import logging
+import threading
 import typing
 
 import bugzilla
@@ -49,6 +52,28 @@ class FakeBugTracker(object):
         """
         return FakeBug(bug_id=int(bug_id))
 
+    def getbugs(self, bug_ids: typing.Iterable[typing.Union[str, int]]) \
+            -> typing.Dict[int, FakeBug]:
+        """
+        Return FakeBugs representing the requested bug ids.
+
+        Args:
+            bug_ids: The requested bug ids.
+        Returns:
+            A mapping of the bug ids to FakeBugs.
+        """
+        return {int(bug_id): FakeBug(bug_id=int(bug_id)) for bug_id in bug_ids}
+
+    @contextmanager
+    def batch(self, bug_ids: typing.Iterable[typing.Union[str, int]]) -> typing.Iterator[None]:
+        """
+        Do nothing, as batching has no effect here.
+
+        Args:
+            bug_ids: Unused.
+        """
+        yield
+
     def __noop__(self, *args, **kw) -> None:
         """
         Log the method call at debug.
@@ -66,12 +91,52 @@ class InvalidComment(Exception):
     """Exception thrown when the comment posted is invalid (for example too long)."""
 
 
+class _Batch(object):
+    """
+    The state of a Bugzilla.batch().
+
+    Attributes:
+        bugs: The prefetched Bugzilla bugs, keyed by id.
+        deferred: Whether the changes to the bugs are queued and made by the thread pool, rather
+            than right away.
+        changes: The queued changes to the bugs, in order, keyed by bug id.
+    """
+
+    def __init__(self, bugs: typing.Dict[int, 'bugzilla.bug.Bug'], deferred: bool) -> None:
+        """
+        Initialize the batch.
+
+        Args:
+            bugs: The prefetched Bugzilla bugs, keyed by id.
+            deferred: Whether the changes to the bugs are queued and made by the thread pool.
+        """
+        self.bugs = bugs
+        self.deferred = deferred
+        self.changes = defaultdict(list)  # type: typing.DefaultDict[int, typing.List[tuple]]
+
+
 class Bugzilla(object):
-    """Provide methods for Bodhi's frequent Bugzilla operations."""
+    """
+    Provide methods for Bodhi's frequent Bugzilla operations.
+
+    Each thread uses its own client, since a client can't be used by several threads at once.
+    """
 
     def __init__(self) -> None:
-        """Initialize self._bz as None."""
-        self._bz = None
+        """Initialize the thread local storage of the clients, and the thread pool lazily."""
+        self._local = threading.local()
+        self._executor = None  # type: typing.Optional[ThreadPoolExecutor]
+        self._executor_lock = threading.Lock()
+
+    @property
+    def _bz(self) -> typing.Optional[bugzilla.Bugzilla]:
+        """Return the client of the current thread, or None if it didn't connect yet."""
+        return getattr(self._local, 'bz', None)
+
+    @_bz.setter
+    def _bz(self, value: typing.Optional[bugzilla.Bugzilla]) -> None:
+        """Set the client of the current thread."""
+        self._local.bz = value
 
     def _connect(self) -> None:
         """Create a Bugzilla client instance and store it on self._bz."""
@@ -93,7 +158,7 @@ class Bugzilla(object):
     @property
     def bz(self) -> bugzilla.Bugzilla:
         """
-        Ensure we have connected to Bugzilla and return the client instance.
+        Ensure the current thread has connected to Bugzilla and return its client instance.
 
         Returns:
             A client Bugzilla instance.
@@ -104,15 +169,143 @@ class Bugzilla(object):
 
     def getbug(self, bug_id: int) -> 'bugzilla.bug.Bug':
         """
-        Retrieve a bug from Bugzilla.
+        Retrieve a bug from Bugzilla, unless it was prefetched by the current batch().
 
         Args:
             bug_id: The id of the bug you wish to retrieve.
         Returns:
             A Bug instance representing the bug in Bugzilla.
         """
+        batch = getattr(self._local, 'batch', None)
+        if batch is not None and int(bug_id) in batch.bugs:
+            return batch.bugs[int(bug_id)]
         return self.bz.getbug(bug_id)
 
+    def getbugs(self, bug_ids: typing.Iterable[typing.Union[int, str]]) \
+            -> typing.Dict[int, 'bugzilla.bug.Bug']:
+        """
+        Retrieve several bugs from Bugzilla with a single call.
+
+        Args:
+            bug_ids: The ids of the bugs you wish to retrieve.
+        Returns:
+            A mapping of bug ids to Bug instances. The bugs that could not be retrieved, such as
+            private bugs, are absent.
+        """
+        bug_ids = sorted(set(int(bug_id) for bug_id in bug_ids))
+        if not bug_ids:
+            return {}
+        try:
+            found = self.bz.getbugs(bug_ids, permissive=True)
+        except Exception:
+            log.exception('Unable to retrieve bugs %s', bug_ids)
+            return {}
+        return {bug.bug_id: bug for bug in found if bug is not None}
+
+    @contextmanager
+    def batch(self, bug_ids: typing.Iterable[typing.Union[int, str]]) -> typing.Iterator[None]:
+        """
+        Prefetch the given bugs, and change them with a pool of bz_threads threads.
+
+        The bugs are retrieved with a single call, and the methods of this object use them instead
+        of retrieving them again. Within the block, comment(), on_qa(), close() and modified()
+        return right away, and their changes are queued. On exit, the pool makes the changes of
+        each bug in a single task, one at a time and in order, while the bugs are changed
+        concurrently. The block waits for all the changes to be made, and re-raises the first
+        exception that one of them raised. Nested batches just prefetch their bugs into the outer
+        one.
+
+        Args:
+            bug_ids: The ids of the bugs that are going to be changed.
+        """
+        bug_ids = [bug_id for bug_id in bug_ids if bug_id is not None]
+        batch = getattr(self._local, 'batch', None)
+        if batch is not None:
+            batch.bugs.update(self.getbugs(bug_id for bug_id in bug_ids
+                                           if int(bug_id) not in batch.bugs))
+            yield
+            return
+
+        batch = self._local.batch = _Batch(self.getbugs(bug_ids), config.get('bz_threads') > 1)
+        try:
+            yield
+        finally:
+            self._local.batch = None
+            futures = [self._get_executor().submit(self._run_deferred, batch, bug_id, changes)
+                       for bug_id, changes in batch.changes.items()]
+            wait(futures)
+        for future in futures:
+            future.result()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """
+        Return the thread pool that makes the changes queued by batch(), starting it on first use.
+
+        The pool is kept for the next batches, so that its threads keep their clients.
+
+        Returns:
+            The thread pool.
+        """
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=config.get('bz_threads'),
+                                                    thread_name_prefix='bugzilla')
+            return self._executor
+
+    def _defer(self, method: typing.Callable[..., None], bug_id: typing.Union[int, str],
+               *args, **kwargs) -> bool:
+        """
+        Queue a change to a bug in the current batch(), if there is one.
+
+        Args:
+            method: The method that changes the bug.
+            bug_id: The id of the bug.
+            args: The other positional arguments of the method.
+            kwargs: The keyword arguments of the method.
+        Returns:
+            True if the change was queued, False if it should be made right away.
+        """
+        batch = getattr(self._local, 'batch', None)
+        if batch is None or not batch.deferred:
+            return False
+        batch.changes[int(bug_id)].append((method, args, kwargs))
+        return True
+
+    def _run_deferred(self, batch: _Batch, bug_id: int,
+                      changes: typing.List[tuple]) -> None:
+        """
+        Make the queued changes to a bug in order, in a thread of the pool.
+
+        The prefetched bug is bound to the client of this thread. It is retrieved again by the
+        changes after the first one, since its prefetched state is stale by then. All the changes
+        are made even if one of them fails.
+
+        Args:
+            batch: The batch the changes were queued in.
+            bug_id: The id of the bug.
+            changes: The methods that change the bug, with their other positional and keyword
+                arguments.
+        Raises:
+            Exception: The first exception raised by one of the changes.
+        """
+        bugs = {}
+        if bug_id in batch.bugs:
+            bugs[bug_id] = batch.bugs[bug_id]
+            bugs[bug_id].bugzilla = self.bz
+        self._local.batch = _Batch(bugs, False)
+        error = None
+        try:
+            for method, args, kwargs in changes:
+                try:
+                    method(bug_id, *args, **kwargs)
+                except Exception as e:
+                    error = error or e
+                bugs.pop(bug_id, None)
+        finally:
+            self._local.batch = None
+        if error is not None:
+            raise error
+
     def comment(self, bug_id: int, comment: str) -> None:
         """
         Add a comment to the given bug.
@@ -121,10 +314,12 @@ class Bugzilla(object):
             bug_id: The id of the bug you wish to comment on.
             comment: The comment to add to the bug.
         """
+        if self._defer(self.comment, bug_id, comment):
+            return
         try:
             if len(comment) > 65535:
                 raise InvalidComment(f"Comment is too long: {comment}")
-            bug = self.bz.getbug(bug_id)
+            bug = self.getbug(bug_id)
             attempts = 0
             while attempts < 5:
                 try:
@@ -163,8 +358,10 @@ class Bugzilla(object):
             bug_id: The bug id you wish to set to ON_QA.
             comment: The comment to be included with the state change.
         """
+        if self._defer(self.on_qa, bug_id, comment):
+            return
         try:
-            bug = self.bz.getbug(bug_id)
+            bug = self.getbug(bug_id)
             if bug.product not in config.get('bz_products'):
                 log.info("Skipping set on_qa on {0!r} bug #{1}".format(bug.product, bug_id))
                 return
@@ -195,9 +392,11 @@ class Bugzilla(object):
             versions: A mapping of package names to nvrs of those packages that close the bug.
             comment: A comment to leave on the bug when closing it.
         """
+        if self._defer(self.close, bug_id, versions, comment):
+            return
         args = {'comment': comment}
         try:
-            bug = self.bz.getbug(bug_id)
+            bug = self.getbug(bug_id)
             if bug.product not in config.get('bz_products'):
                 log.info("Skipping set closed on {0!r} bug #{1}".format(bug.product, bug_id))
                 return
@@ -242,7 +441,7 @@ class Bugzilla(object):
         """
         if not bug:
             try:
-                bug = self.bz.getbug(bug_entity.bug_id)
+                bug = self.getbug(bug_entity.bug_id)
             except xmlrpc_client.Fault as err:
                 if err.faultCode == 102:
                     log.info('Cannot retrieve private bug #%d.', bug_entity.bug_id)
@@ -279,8 +478,10 @@ class Bugzilla(object):
             bug_id: The bug you wish to mark MODIFIED.
             comment: The comment to be included with the state change.
         """
+        if self._defer(self.modified, bug_id, comment):
+            return
         try:
-            bug = self.bz.getbug(bug_id)
+            bug = self.getbug(bug_id)
             if bug.product not in config.get('bz_products'):
                 log.info("Skipping set modified on {0!r} bug #{1}".format(bug.product, bug_id))
                 return
@@ -144,6 +144,7 @@ class DevBuildsys:
         """Emulate Koji's multiCall."""
         result = self.multicall_result
         self.multicall = False
+        self.multicall_result = []
         return result
 
     def moveBuild(self, from_tag: str, to_tag: str, build: str, *args, **kw):
@@ -302,6 +303,7 @@ class DevBuildsys:
 
         return data
 
+    @multicall_enabled
     def listBuildRPMs(self, id: int, *args, **kw) -> typing.List[typing.Dict[str, object]]:
         """Emulate Koji's listBuildRPMs."""
         rpms = [{'arch': 'src',
@@ -335,6 +337,7 @@ class DevBuildsys:
         rpms += DevBuildsys.__rpms__
         return rpms
 
+    @multicall_enabled
     def listTags(self, build: str, *args, **kw) -> typing.List[typing.Dict[str, object]]:
         """Emulate Koji's listTags."""
         if 'el5' in build or 'el6' in build:
@@ -540,6 +543,7 @@ class DevBuildsys:
         else:
             del self.__tags__[tagid]
 
+    @multicall_enabled
     def getRPMHeaders(self, rpmID: str,
                       headers: typing.Any) -> typing.Union[typing.Mapping[str, str], None]:
         """
@@ -291,6 +291,9 @@ class BodhiConfig(dict):
         'bz_server_rest': {
             'value': 'https://bugzilla.redhat.com/rest/',
             'validator': str},
+        'bz_threads': {
+            'value': 4,
+            'validator': int},
         'cache_dir': {
             'value': None,
             'validator': _validate_none_or(validate_path)},
@@ -303,9 +306,21 @@ class BodhiConfig(dict):
         'clean_old_composes': {
             'value': True,
             'validator': _validate_bool},
+        'consumer_handler_threads': {
+            'value': 0,
+            'validator': int},
+        'consumer_metrics_port': {
+            'value': 0,
+            'validator': int},
+        'container.copy_threads': {
+            'value': 4,
+            'validator': int},
         'container.destination_registry': {
             'value': 'registry.fedoraproject.org',
             'validator': str},
+        'container.native_copy': {
+            'value': False,
+            'validator': _validate_bool},
         'container.source_registry': {
             'value': 'candidate-registry.fedoraproject.org',
             'validator': str},
@@ -318,6 +333,9 @@ class BodhiConfig(dict):
         'cors_origins_rw': {
             'value': 'https://bodhi.fedoraproject.org',
             'validator': str},
+        'critpath.cache_ttl': {
+            'value': 3600,
+            'validator': int},
         'critpath_pkgs': {
             'value': [],
             'validator': _generate_list_validator()},
@@ -359,11 +377,32 @@ class BodhiConfig(dict):
         'fmn_url': {
             'value': 'https://apps.fedoraproject.org/notifications/',
             'validator': str},
+        'http_backoff_base': {
+            'value': 1.0,
+            'validator': float},
+        'http_backoff_max': {
+            'value': 30.0,
+            'validator': float},
+        'http_circuit_breaker_threshold': {
+            'value': 5,
+            'validator': int},
+        'http_circuit_breaker_timeout': {
+            'value': 60,
+            'validator': int},
+        'http_pool_size': {
+            'value': 10,
+            'validator': int},
+        'http_timeout': {
+            'value': 60,
+            'validator': int},
         'important_groups': {
             # Defined in and tied to the Fedora Account System (limited to 16 characters)
             'value': ['proventesters', 'provenpackager', 'releng', 'security_respons', 'packager',
                       'bodhiadmin'],
             'validator': _generate_list_validator()},
+        'incremental_updateinfo': {
+            'value': False,
+            'validator': _validate_bool},
         'initial_bug_msg': {
             'value': '%s has been submitted as an update to %s. %s',
             'validator': str},
@@ -376,6 +415,15 @@ class BodhiConfig(dict):
         'greenwave_batch_size': {
             'value': 8,
             'validator': int},
+        'greenwave_decision_cache_ttl': {
+            'value': 21600,
+            'validator': int},
+        'greenwave_handler.debounce_window': {
+            'value': 0.0,
+            'validator': float},
+        'greenwave_max_concurrent_requests': {
+            'value': 8,
+            'validator': int},
         'waiverdb_api_url': {
             'value': 'https://waiverdb-web-waiverdb.app.os.fedoraproject.org/api/v1.0',
             'validator': _validate_rstripped_str},
@@ -427,6 +475,9 @@ class BodhiConfig(dict):
         'max_concurrent_composes': {
             'value': 2,
             'validator': int},
+        'max_concurrent_sanity_checks': {
+            'value': 4,
+            'validator': int},
         'message_id_email_domain': {
             'value': 'admin.fedoraproject.org',
             'validator': str},
@@ -457,6 +508,15 @@ class BodhiConfig(dict):
         'openid_template': {
             'value': '{username}.id.fedoraproject.org',
             'validator': str},
+        'pagure_acl_cache_max_size': {
+            'value': 1000,
+            'validator': int},
+        'pagure_acl_cache_ttl': {
+            'value': 300,
+            'validator': int},
+        'pagure_acl_max_concurrent_requests': {
+            'value': 8,
+            'validator': int},
         'pagure_flatpak_namespace': {
             'value': 'modules',
             'validator': str},
@@ -496,6 +556,21 @@ class BodhiConfig(dict):
         'resultsdb_api_url': {
             'value': 'https://taskotron.fedoraproject.org/resultsdb_api/',
             'validator': str},
+        'rpm_cache_max_age': {
+            'value': 90,
+            'validator': int},
+        'rpm_cache_max_entries': {
+            'value': 0,
+            'validator': int},
+        'rpm_header_cache_size': {
+            'value': 1000,
+            'validator': int},
+        'rpm_prefetch_batch_size': {
+            'value': 100,
+            'validator': int},
+        'rpm_prefetch_threads': {
+            'value': 1,
+            'validator': int},
         'session.secret': {
             'value': 'CHANGEME',
             'validator': _validate_secret},
@@ -510,6 +585,15 @@ class BodhiConfig(dict):
             'value': '',
             'validator': str,
         },
+        'smtp_background_queue': {
+            'value': False,
+            'validator': _validate_bool},
+        'smtp_idle_timeout': {
+            'value': 30,
+            'validator': int},
+        'smtp_pool_size': {
+            'value': 0,
+            'validator': int},
         'smtp_server': {
             'value': None,
             'validator': _validate_none_or(str)},
@@ -563,6 +647,15 @@ class BodhiConfig(dict):
         'wait_for_repo_sig': {
             'value': False,
             'validator': _validate_bool},
+        'wait_for_repo_sig_interval': {
+            'value': 300,
+            'validator': int},
+        'wait_for_sync_max_interval': {
+            'value': 200,
+            'validator': int},
+        'wait_for_sync_min_interval': {
+            'value': 10,
+            'validator': int},
         'warm_cache_on_start': {
             'value': True,
             'validator': _validate_bool},
@@ -21,9 +21,15 @@ fedora-messaging consumer.
 This module is responsible for consuming the messaging from the fedora-messaging bus.
 It has the role to inspect the topics of the message and call the correct handler.
 """
-from collections import namedtuple
+from collections import deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+import functools
 import logging
+import threading
+import time
+import typing
 
+from prometheus_client import start_http_server
 import fedora_messaging
 
 from bodhi.server import bugs, buildsys, initialize_db
@@ -32,6 +38,9 @@ from bodhi.server.consumers.automatic_updates import AutomaticUpdateHandler
 from bodhi.server.consumers.signed import SignedHandler
 from bodhi.server.consumers.greenwave import GreenwaveHandler
 from bodhi.server.consumers.ci import CIHandler
+from bodhi.server.models import Build
+from bodhi.server.services.metrics_tween import consumer_handler, consumer_queue_depth
+from bodhi.server.util import TransactionalSessionMaker, transactional_session_maker
 
 
 log = logging.getLogger('bodhi')
@@ -40,8 +49,144 @@ log = logging.getLogger('bodhi')
 HandlerInfo = namedtuple('HandlerInfo', ['topic_suffix', 'name', 'handler'])
 
 
+def partition_key(msg: fedora_messaging.api.Message,
+                  db_factory: TransactionalSessionMaker) -> typing.Optional[str]:
+    """
+    Return the key of the update a message is about, if it can be found.
+
+    The messages about the builds of an update are keyed by the update, so that they are handled
+    one after the other even if they are about different builds.
+
+    Args:
+        msg: The message.
+        db_factory: Provides the database session to look the update of the build up with.
+    Returns:
+        The alias of the update of the build the message is about, or the NVR or the ID of the
+        build, or the subject of a Greenwave decision, if the build doesn't belong to an update.
+        None if the message isn't about a build or an update.
+    """
+    body = msg.body if isinstance(msg.body, dict) else {}
+    if all(key in body for key in ('name', 'version', 'release')):
+        key = '{name}-{version}-{release}'.format(**body)
+    elif body.get('subject_identifier'):
+        key = str(body['subject_identifier'])
+    elif isinstance(body.get('artifact'), dict) and body['artifact'].get('nvr'):
+        key = body['artifact']['nvr']
+    else:
+        return None
+
+    with db_factory():
+        build = Build.get(key)
+        if build is not None and build.update is not None:
+            return build.update.alias
+    return key
+
+
+class HandlerPool:
+    """
+    A bounded pool of threads running a handler, keeping the messages with the same key in order.
+
+    The messages with the same key are handled one after the other, in the order they were
+    submitted. The messages with different keys are handled concurrently, by up to size threads.
+    """
+
+    def __init__(self, handler_info: HandlerInfo, size: int):
+        """
+        Initialize the HandlerPool.
+
+        Args:
+            handler_info: The handler to run.
+            size: The maximum number of messages handled at the same time.
+        """
+        self.handler_info = handler_info
+        self._executor = ThreadPoolExecutor(
+            size, thread_name_prefix=f'bodhi-consumer-{handler_info.name}')
+        self._lock = threading.Lock()
+        self._queues = {}
+
+    def submit(self, msg: fedora_messaging.api.Message, key: typing.Optional[str]) -> Future:
+        """
+        Queue a message to be handled after the messages with the same key.
+
+        Args:
+            msg: The message.
+            key: The key of the message. Messages without a key are not ordered.
+        Returns:
+            The future result of the handler.
+        """
+        future = Future()
+        if key is None:
+            key = object()
+        consumer_queue_depth.labels(handler=self.handler_info.name).inc()
+        with self._lock:
+            if key in self._queues:
+                self._queues[key].append((msg, future))
+                return future
+            self._queues[key] = deque([(msg, future)])
+        self._executor.submit(self._drain, key)
+        return future
+
+    def _drain(self, key: typing.Hashable):
+        """
+        Handle the queued messages with the given key, until there are none left.
+
+        Args:
+            key: The key of the messages.
+        """
+        while True:
+            with self._lock:
+                queue = self._queues[key]
+                if not queue:
+                    del self._queues[key]
+                    return
+                msg, future = queue.popleft()
+            consumer_queue_depth.labels(handler=self.handler_info.name).dec()
+            try:
+                future.set_result(run_handler(self.handler_info, msg))
+            except Exception as e:
+                future.set_exception(e)
+
+
+def run_handler(handler_info: HandlerInfo, msg: fedora_messaging.api.Message):
+    """
+    Pass a message to a handler, and record how long it took.
+
+    Args:
+        handler_info: The handler.
+        msg: The message.
+    Returns:
+        What the handler returned.
+    """
+    log.debug(f'Passing message to the {handler_info.name} handler')
+    start = time.monotonic()
+    status = 'error'
+    try:
+        result = handler_info.handler(msg)
+        status = 'success'
+        return result
+    finally:
+        consumer_handler.labels(handler=handler_info.name, status=status).observe(
+            time.monotonic() - start)
+
+
 class Consumer:
-    """All Bodhi messages are received by this class's __call__() method."""
+    """
+    All Bodhi messages are received by this class's __call__() method.
+
+    fedora-messaging passes the messages of a queue one at a time, and each message is only
+    acknowledged once its handlers are done, so the messages are only handled concurrently if the
+    topics are bound to several queues.
+
+    If the consumer_handler_threads setting is more than 0, each handler runs on its own pool of
+    that many threads, so that the handlers matching a message run at the same time. The messages
+    about the builds of the same update that several handlers match are then handled in the order
+    they were received, even if they come from different queues. The messages matched by a single
+    handler are handled right away.
+
+    The number of messages waiting for each handler and the time the handlers take are recorded in
+    the bodhi_consumer_queue_depth and bodhi_consumer_handler metrics, which are served on the
+    consumer_metrics_port if it is set.
+    """
 
     def __init__(self):
         """Set up the database, build system, bug tracker, and handlers."""
@@ -49,6 +194,8 @@ class Consumer:
         initialize_db(config)
         buildsys.setup_buildsystem(config)
         bugs.set_bugtracker()
+        if config.get('consumer_metrics_port'):
+            start_http_server(config['consumer_metrics_port'])
 
         self.handler_infos = [
             HandlerInfo('.buildsys.tag', "Signed", SignedHandler()),
@@ -56,13 +203,31 @@ class Consumer:
             HandlerInfo('.greenwave.decision.update', 'Greenwave', GreenwaveHandler()),
             HandlerInfo('.ci.koji-build.test.running', 'CI', CIHandler())
         ]
+        self.pools = {}
+        self._pools_lock = threading.Lock()
+        self.db_factory = transactional_session_maker()
+
+    def _get_pool(self, handler_info: HandlerInfo) -> HandlerPool:
+        """
+        Return the pool of threads of a handler, creating it if needed.
+
+        Args:
+            handler_info: The handler.
+        Returns:
+            The pool of the handler.
+        """
+        with self._pools_lock:
+            if handler_info.name not in self.pools:
+                self.pools[handler_info.name] = HandlerPool(
+                    handler_info, config['consumer_handler_threads'])
+            return self.pools[handler_info.name]
 
     def __call__(self, msg: fedora_messaging.api.Message):  # noqa: D401
         """
         Callback method called by fedora-messaging consume.
 
         Redirect messages to the correct handler using the
-        message topic.
+        message topic. The message is only acknowledged once all the handlers succeeded.
 
         Args:
             msg: The message received from the broker.
@@ -70,13 +235,20 @@ class Consumer:
         log.info(f'Received message from fedora-messaging with topic: {msg.topic}')
 
         error_handlers_msgs = []
+        handler_infos = [handler_info for handler_info in self.handler_infos
+                         if msg.topic.endswith(handler_info.topic_suffix)]
+
+        if config.get('consumer_handler_threads') and len(handler_infos) > 1:
+            key = partition_key(msg, self.db_factory)
+            results = [(handler_info, self._get_pool(handler_info).submit(msg, key).result)
+                       for handler_info in handler_infos]
+        else:
+            results = [(handler_info, functools.partial(run_handler, handler_info, msg))
+                       for handler_info in handler_infos]
 
-        for handler_info in self.handler_infos:
-            if not msg.topic.endswith(handler_info.topic_suffix):
-                continue
-            log.debug(f'Passing message to the {handler_info.name} handler')
+        for handler_info, result in results:
             try:
-                handler_info.handler(msg)
+                result()
             except Exception as e:
                 log.exception(f'{str(e)}: Unable to handle message in {handler_info.name} handler: '
                               f'{msg}')
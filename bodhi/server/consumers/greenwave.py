@@ -22,15 +22,98 @@ This module is responsible for listening for messages from greenwave.
 It then updates the policies of the build that greenwave checked.
 """
 
+import collections
 import logging
+import threading
+import time
+import typing
 
 import fedora_messaging
 
-from bodhi.server.models import Build, TestGatingStatus
+from bodhi.server.config import config
+from bodhi.server.models import Build, TestGatingStatus, Update
 from bodhi.server.util import transactional_session_maker
 
 log = logging.getLogger(__name__)
 
+# The maximum number of subjects the handler remembers the decisions of.
+MAX_DECISIONS = 10000
+
+
+class Debouncer:
+    """Call a function with the keys scheduled during a window, from a background thread."""
+
+    def __init__(self, callback: typing.Callable[[typing.List[str]], None], window: float):
+        """
+        Initialize the debouncer, without starting the thread yet.
+
+        Args:
+            callback: The function to call with the keys whose window is over.
+            window: How many seconds to wait after a key was first scheduled before calling the
+                callback with it.
+        """
+        self._callback = callback
+        self._window = window
+        self._deadlines = collections.OrderedDict()  # type: typing.Dict[str, float]
+        self._condition = threading.Condition()
+        self._thread = None  # type: typing.Optional[threading.Thread]
+
+    def schedule(self, key: str) -> None:
+        """
+        Schedule the callback for the given key, unless it already is.
+
+        Args:
+            key: The key to call the callback with.
+        """
+        with self._condition:
+            if key in self._deadlines:
+                return
+            self._deadlines[key] = time.monotonic() + self._window
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='debouncer', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _pop_due(self) -> typing.List[str]:
+        """Wait for and return the keys whose window is over, in the order they were scheduled."""
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                keys = [key for key, deadline in self._deadlines.items() if deadline <= now]
+                if keys:
+                    for key in keys:
+                        del self._deadlines[key]
+                    return keys
+                # The keys are scheduled with the same window, so the first one is due first.
+                timeout = None
+                if self._deadlines:
+                    timeout = next(iter(self._deadlines.values())) - now
+                self._condition.wait(timeout)
+
+    def _run(self) -> None:
+        """Call the callback with the keys as their windows end."""
+        while True:
+            self.flush(self._pop_due())
+
+    def flush(self, keys: typing.Optional[typing.List[str]] = None) -> None:
+        """
+        Call the callback right away.
+
+        Args:
+            keys: The keys to call the callback with. Defaults to all the scheduled keys, which are
+                then unscheduled.
+        """
+        if keys is None:
+            with self._condition:
+                keys = list(self._deadlines)
+                self._deadlines.clear()
+        if not keys:
+            return
+        try:
+            self._callback(keys)
+        except Exception:
+            log.exception(f'Failed to handle {", ".join(keys)}')
+
 
 class GreenwaveHandler:
     """
@@ -42,6 +125,11 @@ class GreenwaveHandler:
     def __init__(self):
         """Initialize the GreenwaveHandler."""
         self.db_factory = transactional_session_maker()
+        self.debouncer = Debouncer(self._reevaluate, config['greenwave_handler.debounce_window'])
+        self._decisions = collections.OrderedDict()  # type: typing.Dict[tuple, tuple]
+        # When the debounce window of each scheduled update opened.
+        self._windows = {}  # type: typing.Dict[str, float]
+        self._decisions_lock = threading.Lock()
 
     def __call__(self, message: fedora_messaging.api.Message):
         """Handle messages arriving with the configured topic."""
@@ -67,6 +155,10 @@ class GreenwaveHandler:
             log.debug("Couldn't find policies_satisfied in Greenwave message")
             return
 
+        received = time.monotonic()
+        if config['greenwave_handler.debounce_window'] > 0:
+            self._remember_decision(msg, received)
+
         with self.db_factory():
 
             build = Build.get(subject_identifier)
@@ -77,10 +169,111 @@ class GreenwaveHandler:
             update = build.update
             log.info(f"Updating the test_gating_status for: {update.alias}")
             if len(update.builds) > 1:
-                update.update_test_gating_status()
+                if config['greenwave_handler.debounce_window'] > 0:
+                    with self._decisions_lock:
+                        self._windows.setdefault(update.alias, received)
+                    self.debouncer.schedule(update.alias)
+                else:
+                    update.update_test_gating_status()
             else:
                 update.test_gating_status = self._extract_gating_status(msg)
 
+    def _remember_decision(self, msg: dict, received: float):
+        """
+        Remember the decision of a Greenwave message about a subject, and when it was received.
+
+        Messages that don't say which decision context and product version the decision is about
+        are ignored, since there is no telling which updates it applies to.
+
+        Args:
+            msg: The body of the Greenwave message.
+            received: The :func:`time.monotonic` time the message was received at.
+        """
+        if "decision_context" not in msg or "product_version" not in msg:
+            return
+        key = (msg.get("subject_type"), msg["subject_identifier"])
+        decision = (msg["decision_context"], msg["product_version"],
+                    self._extract_gating_status(msg), received)
+        with self._decisions_lock:
+            self._decisions.pop(key, None)
+            self._decisions[key] = decision
+            while len(self._decisions) > MAX_DECISIONS:
+                self._decisions.popitem(last=False)
+
+    def _decide_from_messages(self, update: Update,
+                              since: float) -> typing.Optional[TestGatingStatus]:
+        """
+        Return the test gating status of an update according to the decisions of the messages.
+
+        The statuses of the subjects are combined the same way as the decisions of the batches
+        Greenwave is queried with. Older decisions than the given time are not trusted, since
+        Greenwave may have changed its mind since then.
+
+        Args:
+            update: The update to decide about.
+            since: The :func:`time.monotonic` time of the oldest decision to trust.
+        Returns:
+            The test gating status of the update, or None if no recent decision is known for some
+            of its subjects.
+        """
+        statuses = []
+        with self._decisions_lock:
+            for data in update.greenwave_request_batches(verbose=False):
+                for subject in data['subject']:
+                    decision = self._decisions.get((subject['type'], subject['item']))
+                    if decision is None \
+                            or decision[:2] != (data['decision_context'], data['product_version']) \
+                            or decision[3] < since:
+                        return None
+                    statuses.append(decision[2])
+
+        if TestGatingStatus.failed in statuses:
+            return TestGatingStatus.failed
+        if all(status == TestGatingStatus.ignored for status in statuses):
+            return TestGatingStatus.ignored
+        return TestGatingStatus.passed
+
+    def _update_test_gating_status(self, update: Update, since: float):
+        """
+        Set the test gating status of an update with several builds.
+
+        Greenwave is only queried if the recent messages didn't announce a decision for every
+        subject of the update.
+
+        Args:
+            update: The update to set the test gating status of.
+            since: The :func:`time.monotonic` time of the oldest decision to trust.
+        """
+        status = self._decide_from_messages(update, since)
+        if status is None:
+            update.update_test_gating_status()
+        else:
+            log.debug(f"Every subject of {update.alias} has a decision, not querying Greenwave")
+            update.test_gating_status = status
+
+    def _reevaluate(self, aliases: typing.List[str]):
+        """
+        Set the test gating status of the given updates, once their debounce window is over.
+
+        Args:
+            aliases: The aliases of the updates.
+        """
+        # Only the decisions received during the debounce window of an update, or during the
+        # window before it opened, are trusted.
+        window = config['greenwave_handler.debounce_window']
+        now = time.monotonic()
+        with self._decisions_lock:
+            since = {alias: self._windows.pop(alias, now) - window for alias in aliases}
+
+        with self.db_factory():
+            for alias in aliases:
+                update = Update.get(alias)
+                if update is None:
+                    log.debug(f"Couldn't find update {alias} in DB")
+                    continue
+                log.info(f"Re-evaluating the test_gating_status for: {alias}")
+                self._update_test_gating_status(update, since[alias])
+
     def _extract_gating_status(self, msg):
         """
         Extract gating information from the Greenwave message and return it.
@@ -0,0 +1,158 @@
+# Copyright © 2020 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""Index the critical path components, so that checking updates doesn't query PDC every time."""
+import logging
+import threading
+import typing
+
+from dogpile.cache import make_region
+
+from bodhi.server import util
+from bodhi.server.config import config
+
+
+log = logging.getLogger(__name__)
+
+
+def _refresh_in_background(cache, key, creator, mutex):
+    """
+    Regenerate an expired entry of the index in a thread, while the expired entry is still served.
+
+    This is the async_creation_runner of the dogpile.cache region of the index.
+
+    Args:
+        cache (dogpile.cache.region.CacheRegion): The region of the index.
+        key (str): The key of the expired entry.
+        creator (callable): Returns the new value of the entry.
+        mutex (object): The lock held on the key, which must be released once done.
+    """
+    def refresh():
+        try:
+            cache.set(key, creator())
+        except Exception:
+            log.exception('Unable to refresh the critical path index %s', key)
+        finally:
+            mutex.release()
+
+    threading.Thread(target=refresh, name='critpath-refresh', daemon=True).start()
+
+
+class CritpathIndex:
+    """
+    Map each branch and component type to the set of its critical path components.
+
+    The critical path components of a branch and type are fetched whole, and kept in the
+    dogpile.cache backend configured with the ``dogpile.cache.`` settings, so that they are shared
+    with the other processes using the same backend. Entries are refreshed in the background once
+    they are older than ``critpath.cache_ttl`` seconds, and the expired entry is served until the
+    refresh completes.
+
+    If ``critpath.type`` is not ``pdc``, the ``critpath_pkgs`` setting is used for every branch and
+    type instead.
+    """
+
+    def __init__(self):
+        """Initialize the index, without fetching anything yet."""
+        self._region = None
+        self._lock = threading.Lock()
+
+    @property
+    def region(self):
+        """
+        Return the dogpile.cache region of the index, configuring it on first use.
+
+        Returns:
+            dogpile.cache.region.CacheRegion: The region the index is kept in.
+        """
+        with self._lock:
+            if self._region is None:
+                region = make_region(async_creation_runner=_refresh_in_background)
+                region.configure_from_config(config, 'dogpile.cache.')
+                self._region = region
+        return self._region
+
+    def get(self, branch: str, component_type: str = 'rpm') -> typing.FrozenSet[str]:
+        """
+        Return the critical path components of the given branch and type.
+
+        Args:
+            branch: The branch to get the components of, such as "f33".
+            component_type: The type of the components, such as "rpm" or "module".
+        Returns:
+            The names of the critical path components.
+        Raises:
+            RuntimeError: If PDC did not give us a 200 code while fetching components that weren't
+                in the index.
+        """
+        def fetch():
+            log.debug('Fetching the %s critical path components of %s', component_type, branch)
+            return frozenset(util.get_critpath_components(branch, component_type))
+
+        if config.get('critpath.type') != 'pdc':
+            # The critpath_pkgs setting is already in memory.
+            return fetch()
+
+        return self.region.get_or_create(
+            f'critpath:{branch}:{component_type}', fetch,
+            expiration_time=config['critpath.cache_ttl'])
+
+    def contains(self, branch: str, component_type: str,
+                 components: typing.Iterable[str]) -> bool:
+        """
+        Return whether any of the given components are in the critical path.
+
+        Args:
+            branch: The branch of the components, such as "f33".
+            component_type: The type of the components, such as "rpm" or "module".
+            components: The names of the components.
+        Returns:
+            True if any of the components are critical path components, False otherwise.
+        Raises:
+            RuntimeError: If PDC did not give us a 200 code while fetching components that weren't
+                in the index.
+        """
+        critpath = self.get(branch, component_type)
+        return any(component in critpath for component in components)
+
+    def warm(self, branches: typing.Iterable[str],
+             component_types: typing.Iterable[str] = ('rpm',)):
+        """
+        Fetch the critical path components of the given branches and types that aren't indexed yet.
+
+        Errors are logged rather than raised, so that they are fetched again on first use.
+
+        Args:
+            branches: The branches to fetch the components of.
+            component_types: The types of the components to fetch.
+        """
+        if config.get('critpath.type') != 'pdc':
+            return
+        for branch in branches:
+            for component_type in component_types:
+                try:
+                    self.get(branch, component_type)
+                except Exception:
+                    log.exception('Unable to fetch the %s critical path components of %s',
+                                  component_type, branch)
+
+    def invalidate(self):
+        """Make the index fetch all the components again on their next use by this process."""
+        self.region.invalidate()
+
+
+index = CritpathIndex()
@@ -0,0 +1,237 @@
+# Copyright © 2020 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""Send HTTP requests to the remote services Bodhi depends on, and keep track of how they do."""
+from urllib.parse import urlsplit
+import logging
+import random
+import threading
+import time
+import typing
+import weakref
+
+from requests.adapters import HTTPAdapter
+import requests
+
+from bodhi.server.config import config
+from bodhi.server.services.metrics_tween import outbound_request, outbound_request_errors
+
+
+log = logging.getLogger(__name__)
+
+Status = typing.Union[int, BaseException]
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of sending a request to a service that failed too many times in a row."""
+
+
+class Service:
+    """
+    The connection pool, backoff and circuit breaker of a remote service.
+
+    The requests to a service are sent through its own pool of connections, mounted on the session
+    for the service's base URL. When http_circuit_breaker_threshold requests in a row fail with a
+    connection error or a 5xx status, the circuit opens: requests fail right away with
+    :class:`CircuitOpenError` for http_circuit_breaker_timeout seconds. After that, a single
+    request is sent to probe the service while the others keep failing right away, and the circuit
+    closes if it succeeds, or opens again if it fails. Another request is let through if the probe
+    didn't finish within http_circuit_breaker_timeout seconds.
+
+    The duration and the status of the requests are recorded in the outbound_request histogram, and
+    their failures counted in the outbound_request_errors counter.
+    """
+
+    def __init__(self, name: str, url_setting: typing.Optional[str] = None,
+                 pool_size_setting: str = 'http_pool_size'):
+        """
+        Initialize the Service.
+
+        Args:
+            name: The name of the service, used in error messages and metrics.
+            url_setting: The name of the setting holding the service's URL. The connection pool is
+                used for all the URLs on the same host. If None, the session's default pool is
+                used.
+            pool_size_setting: The name of the setting holding the number of connections to keep
+                open to the service.
+        """
+        self.name = name
+        self.url_setting = url_setting
+        self.pool_size_setting = pool_size_setting
+        self._lock = threading.Lock()
+        self._mounted_on = weakref.WeakSet()  # type: weakref.WeakSet
+        self.reset()
+
+    def reset(self):
+        """Close the circuit."""
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            # The thread sending the request that probes the service, and when it started.
+            self._probe = None  # type: typing.Optional[typing.Tuple[int, float]]
+
+    @property
+    def timeout(self) -> int:
+        """Return the number of seconds to wait for the service to answer."""
+        return config.get('http_timeout')
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Return how long to wait before retrying a failed request.
+
+        The delay doubles with each attempt up to http_backoff_max seconds, and is randomly reduced
+        by up to half, so that the clients that failed at the same time don't retry together.
+
+        Args:
+            attempt: The number of the attempt that failed, starting at 0.
+        Returns:
+            The number of seconds to wait.
+        """
+        delay = min(config.get('http_backoff_base') * 2 ** attempt, config.get('http_backoff_max'))
+        return random.uniform(delay / 2, delay)
+
+    def _mount(self, session: requests.Session):
+        """
+        Mount the connection pool of the service on the given session, if it isn't already.
+
+        Args:
+            session: The session the requests are sent with.
+        """
+        if session in self._mounted_on or not self.url_setting or \
+                not config.get(self.url_setting):
+            return
+        url = urlsplit(config[self.url_setting])
+        size = config.get(self.pool_size_setting)
+        session.mount(f'{url.scheme}://{url.netloc}/',
+                      HTTPAdapter(pool_connections=1, pool_maxsize=size))
+        self._mounted_on.add(session)
+
+    def check_circuit(self):
+        """
+        Raise CircuitOpenError if the circuit is open, unless the request should probe the service.
+
+        Raises:
+            CircuitOpenError: If the service failed too many times in a row recently.
+        """
+        threshold = config.get('http_circuit_breaker_threshold')
+        with self._lock:
+            if not threshold or self.failures < threshold:
+                return
+            now = time.monotonic()
+            timeout = config.get('http_circuit_breaker_timeout')
+            if now - self._opened_at >= timeout and \
+                    (self._probe is None or now - self._probe[1] >= timeout):
+                self._probe = threading.get_ident(), now
+                return
+        outbound_request_errors.labels(service=self.name, error='CircuitOpen').inc()
+        raise CircuitOpenError(
+            f'Bodhi is not sending requests to {self.name} for now, after {self.failures} '
+            'failed requests in a row.')
+
+    def record(self, method: str, status: Status, duration: float):
+        """
+        Record the outcome of a request, and open or close the circuit accordingly.
+
+        Args:
+            method: The HTTP method of the request.
+            status: The HTTP status code of the response, or the exception raised instead.
+            duration: How many seconds the request took.
+        """
+        failed = isinstance(status, BaseException) or status >= 500
+        label = type(status).__name__ if isinstance(status, BaseException) else str(status)
+        outbound_request.labels(service=self.name, method=method, status=label).observe(duration)
+        if failed:
+            outbound_request_errors.labels(service=self.name, error=label).inc()
+
+        threshold = config.get('http_circuit_breaker_threshold')
+        with self._lock:
+            if self._probe is not None and self._probe[0] == threading.get_ident():
+                self._probe = None
+            if not failed:
+                self.failures = 0
+                self._probe = None
+                return
+            self.failures += 1
+            if threshold and self.failures >= threshold:
+                if self.failures == threshold:
+                    log.warning('%s failed %d times in a row, not sending it requests for %d '
+                                'seconds', self.name, self.failures,
+                                config.get('http_circuit_breaker_timeout'))
+                self._opened_at = time.monotonic()
+
+    def send(self, session: requests.Session, method: str, url: str,
+             **kwargs) -> requests.Response:
+        """
+        Send a request to the service with the given session.
+
+        Args:
+            session: The session to send the request with.
+            method: The HTTP method of the request.
+            url: The URL to send the request to.
+            kwargs: Passed on to the session's method named after the HTTP method.
+        Returns:
+            The response.
+        Raises:
+            CircuitOpenError: If the service failed too many times in a row recently.
+            requests.RequestException: If the request could not be sent.
+        """
+        self.check_circuit()
+        self._mount(session)
+        start = time.monotonic()
+        try:
+            response = getattr(session, method.lower())(url, **kwargs)
+        except requests.RequestException as e:
+            self.record(method, e, time.monotonic() - start)
+            raise
+        self.record(method, response.status_code, time.monotonic() - start)
+        return response
+
+
+services = {
+    service.name: service for service in (
+        Service('Greenwave', 'greenwave_api_url', 'greenwave_max_concurrent_requests'),
+        Service('Pagure', 'pagure_url', 'pagure_acl_max_concurrent_requests'),
+        Service('PDC', 'pdc_url'),
+        Service('ResultsDB', 'resultsdb_api_url'),
+        Service('WaiverDB', 'waiverdb_api_url'),
+        # The mirrors are on many hosts, and fetched with urllib by waits.ConditionalFetcher.
+        Service('mirrors'),
+    )
+}
+_services_lock = threading.Lock()
+
+
+def get_service(name: str) -> Service:
+    """
+    Return the Service of the given name, creating it if it isn't known.
+
+    Args:
+        name: The name of the service.
+    Returns:
+        The Service.
+    """
+    with _services_lock:
+        if name not in services:
+            services[name] = Service(name)
+        return services[name]
+
+
+def reset():
+    """Close the circuits of all the services."""
+    with _services_lock:
+        for service in services.values():
+            service.reset()
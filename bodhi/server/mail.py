@@ -18,8 +18,13 @@
 # 02110-1301, USA.
 """A collection of utilities for sending e-mail to Bodhi users."""
 from textwrap import wrap
+import atexit
+import contextlib
 import os
+import queue
 import smtplib
+import threading
+import time
 import typing
 
 from bodhi.server import log
@@ -344,6 +349,229 @@ def get_template(update: 'Update', use_template: str = 'fedora_errata_template')
     return templates
 
 
+# An e-mail to deliver: the envelope from address, the envelope recipients, and the message.
+Mail = typing.Tuple[str, typing.List[str], str]
+
+
+class SMTPTransport:
+    """
+    Deliver e-mails to the smtp_server, keeping connections open between deliveries.
+
+    Up to smtp_pool_size connections are kept open once a delivery is done, and used by the next
+    deliveries unless they have been unused for more than smtp_idle_timeout seconds. A connection
+    that the server closed meanwhile is replaced once.
+    """
+
+    def __init__(self):
+        """Initialize the transport, without connecting yet."""
+        self._idle = []  # type: typing.List[typing.Tuple[str, float, smtplib.SMTP]]
+        self._lock = threading.Lock()
+
+    def _connect(self, server: str) -> smtplib.SMTP:
+        """
+        Return an open connection to the given server, reusing a kept one if possible.
+
+        Args:
+            server: The SMTP server to connect to.
+        Returns:
+            The connection.
+        """
+        expired = []
+        connection = None
+        with self._lock:
+            while self._idle and connection is None:
+                idle_server, used, smtp = self._idle.pop()
+                if idle_server == server and \
+                        time.monotonic() - used < config.get('smtp_idle_timeout'):
+                    connection = smtp
+                else:
+                    expired.append(smtp)
+        for smtp in expired:
+            self._quit(smtp)
+        if connection is not None:
+            return connection
+
+        log.debug('Connecting to %s', server)
+        return smtplib.SMTP(server)
+
+    def _release(self, server: str, smtp: smtplib.SMTP) -> None:
+        """
+        Keep the given connection open for the next deliveries if the pool has room, or close it.
+
+        Args:
+            server: The SMTP server the connection is open to.
+            smtp: The connection.
+        """
+        with self._lock:
+            if len(self._idle) < config.get('smtp_pool_size'):
+                self._idle.append((server, time.monotonic(), smtp))
+                return
+        self._quit(smtp)
+
+    @staticmethod
+    def _quit(smtp: smtplib.SMTP) -> None:
+        """
+        Close the given connection, even if the server already closed it.
+
+        Args:
+            smtp: The connection to close.
+        """
+        try:
+            smtp.quit()
+        except smtplib.SMTPException:
+            smtp.close()
+
+    def close(self) -> None:
+        """Close the connections kept open."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, used, smtp in idle:
+            self._quit(smtp)
+
+    def deliver(self, mails: typing.Iterable[Mail]) -> None:
+        """
+        Deliver the given e-mails over the same connection.
+
+        Identical messages from the same address are delivered in one envelope with all their
+        recipients. Errors are logged rather than raised. An envelope the server rejects doesn't
+        prevent the others from being delivered, and the delivery only stops if the connection
+        can't be established again once the server closed it.
+
+        Args:
+            mails: The e-mails to deliver.
+        """
+        smtp_server = config.get('smtp_server')
+        if not smtp_server:
+            log.info('Not sending email: No smtp_server defined')
+            return
+
+        envelopes = {}  # type: typing.Dict[typing.Tuple[str, str], typing.List[str]]
+        for from_addr, to_addrs, body in mails:
+            recipients = envelopes.setdefault((from_addr, body), [])
+            recipients.extend(addr for addr in to_addrs if addr not in recipients)
+
+        smtp = None
+        try:
+            for (from_addr, body), to_addrs in envelopes.items():
+                if smtp is None:
+                    smtp = self._connect(smtp_server)
+                try:
+                    try:
+                        smtp.sendmail(from_addr, to_addrs, body.encode('utf-8'))
+                    except smtplib.SMTPServerDisconnected:
+                        # The server closed the connection, for instance while it was kept open.
+                        smtp.close()
+                        smtp = None
+                        log.debug('Connecting to %s again', smtp_server)
+                        smtp = smtplib.SMTP(smtp_server)
+                        smtp.sendmail(from_addr, to_addrs, body.encode('utf-8'))
+                except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError):
+                    raise
+                except smtplib.SMTPRecipientsRefused as e:
+                    log.warning('"recipient refused" for %r, %r' % (', '.join(to_addrs), e))
+                except smtplib.SMTPException:
+                    log.exception('Unable to send mail to %s' % ', '.join(to_addrs))
+        except Exception:
+            log.exception('Unable to send mail')
+            if smtp is not None:
+                self._quit(smtp)
+                smtp = None
+        finally:
+            if smtp is not None:
+                self._release(smtp_server, smtp)
+
+
+class MailQueue:
+    """Deliver e-mails from a background thread, so that the senders don't wait for the server."""
+
+    def __init__(self, transport: SMTPTransport):
+        """
+        Initialize the queue, without starting the thread yet.
+
+        Args:
+            transport: The transport to deliver the e-mails with.
+        """
+        self._transport = transport
+        self._queue = queue.Queue()  # type: queue.Queue
+        self._thread = None  # type: typing.Optional[threading.Thread]
+        self._lock = threading.Lock()
+
+    def put(self, mails: typing.List[Mail]) -> None:
+        """
+        Queue the given e-mails for delivery, starting the thread on first use.
+
+        Args:
+            mails: The e-mails to deliver.
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='mail', daemon=True)
+                self._thread.start()
+        self._queue.put(mails)
+
+    def _run(self) -> None:
+        """Deliver the queued e-mails, together with whatever else is queued by then."""
+        while True:
+            mails = self._queue.get()
+            count = 1
+            while True:
+                try:
+                    mails = mails + self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                count += 1
+            try:
+                self._transport.deliver(mails)
+            finally:
+                for i in range(count):
+                    self._queue.task_done()
+
+    def join(self) -> None:
+        """Wait until the queued e-mails are delivered."""
+        self._queue.join()
+
+
+transport = SMTPTransport()
+mail_queue = MailQueue(transport)
+atexit.register(mail_queue.join)
+_batches = threading.local()
+
+
+@contextlib.contextmanager
+def batch() -> typing.Iterator[None]:
+    """
+    Deliver the e-mails sent in the context together, over the same connection, once it exits.
+
+    Batches can be nested, in which case the e-mails are delivered when the outermost one exits.
+    """
+    if getattr(_batches, 'mails', None) is not None:
+        yield
+        return
+    _batches.mails = []
+    try:
+        yield
+    finally:
+        mails, _batches.mails = _batches.mails, None
+        _deliver(mails)
+
+
+def _deliver(mails: typing.List[Mail]) -> None:
+    """
+    Deliver the given e-mails, once the current batch exits, or from the queue if it is enabled.
+
+    Args:
+        mails: The e-mails to deliver.
+    """
+    if not mails:
+        return
+    if getattr(_batches, 'mails', None) is not None:
+        _batches.mails.extend(mails)
+    elif config.get('smtp_background_queue'):
+        mail_queue.put(mails)
+    else:
+        transport.deliver(mails)
+
+
 def _send_mail(from_addr: str, to_addr: str, body: str) -> None:
     """
     Send emails with smtplib. This is a lower level function than send_e-mail().
@@ -353,22 +581,7 @@ def _send_mail(from_addr: str, to_addr: str, body: str) -> None:
         to_addr: The e-mail address to use in the envelope to field.
         body: The body of the e-mail.
     """
-    smtp_server = config.get('smtp_server')
-    if not smtp_server:
-        log.info('Not sending email: No smtp_server defined')
-        return
-    smtp = None
-    try:
-        log.debug('Connecting to %s', smtp_server)
-        smtp = smtplib.SMTP(smtp_server)
-        smtp.sendmail(from_addr, [to_addr], body.encode('utf-8'))
-    except smtplib.SMTPRecipientsRefused as e:
-        log.warning('"recipient refused" for %r, %r' % (to_addr, e))
-    except Exception:
-        log.exception('Unable to send mail')
-    finally:
-        if smtp:
-            smtp.quit()
+    _deliver([(from_addr, [to_addr], body)])
 
 
 def send_mail(from_addr: str, to_addr: str, subject: str, body_text: str,
@@ -444,11 +657,13 @@ def send(to: typing.Iterable[str], msg_type: str, update: 'Update',
             headers["In-Reply-To"] = initial_message_id
 
     subject_template = '[Fedora Update] %s[%s] %s'
-    for person in to:
-        subject = subject_template % (critpath, msg_type, update.get_title(nvr=True, beautify=True))
-        fields = MESSAGES[msg_type]['fields'](agent, update)
-        body = MESSAGES[msg_type]['body'] % fields
-        send_mail(sender, person, subject, body, headers=headers)
+    with batch():
+        for person in to:
+            subject = subject_template % (
+                critpath, msg_type, update.get_title(nvr=True, beautify=True))
+            fields = MESSAGES[msg_type]['fields'](agent, update)
+            body = MESSAGES[msg_type]['body'] % fields
+            send_mail(sender, person, subject, body, headers=headers)
 
 
 def send_releng(subject: str, body: str) -> None:
@@ -29,6 +29,7 @@ from bodhi.server import util
 from bodhi.server.buildsys import get_session
 from bodhi.server.config import config
 from bodhi.server.models import Build, UpdateStatus, UpdateRequest, UpdateSuggestion
+from bodhi.server.rpmcache import open_rpm_cache
 
 
 __version__ = '2.0'
@@ -104,9 +105,15 @@ class UpdateInfoMetadata(object):
     It is generated during push time by the bodhi composer based on koji tags
     and is injected into the yum repodata using the `modifyrepo_c` tool,
     which is included in the `createrepo_c` package.
+
+    When the ``incremental_updateinfo`` setting is enabled, the serialized record of each update is
+    kept in the ``cache_dir`` between composes, and is only generated again if the update has been
+    modified, pushed, or changed status since the previous compose of the same tag.
     """
 
-    def __init__(self, release, request, db, composedir, close_shelf=True):
+    _GENERATION_KEY = '__generation__'
+
+    def __init__(self, release, request, db, composedir, close_shelf=True, rpm_cache=None):
         """
         Initialize the UpdateInfoMetadata object.
 
@@ -115,8 +122,11 @@ class UpdateInfoMetadata(object):
             request (bodhi.server.models.UpdateRequest): The Request that is being composed.
             db (): A database session to be used for queries.
             composedir (str): A path to the composedir.
-            close_shelf (bool): Whether to close the shelve, which is used to cache updateinfo
+            close_shelf (bool): Whether to close the caches, which are used to cache updateinfo
                 between composes.
+            rpm_cache (bodhi.server.rpmcache.RPMCache or None): The cache of the RPMs of each
+                build. Defaults to the one returned by
+                :func:`bodhi.server.rpmcache.open_rpm_cache`.
         """
         self.request = request
         if request is UpdateRequest.stable:
@@ -128,12 +138,14 @@ class UpdateInfoMetadata(object):
         self.updates = set()
         self.builds = {}
         self._from = config.get('bodhi_email')
-        if config.get('cache_dir'):
-            self.shelf = shelve.open(os.path.join(config.get('cache_dir'), '%s.shelve' % self.tag))
-        else:
-            # If we have no cache dir, let's at least cache in-memory.
-            self.shelf = {}
-            close_shelf = False
+        # The serialized records of the previous compose, only used in incremental mode.
+        self.records = None
+        self.reused_records = 0
+        if config.get('cache_dir') and config.get('incremental_updateinfo'):
+            self.records = self._open_records()
+        self.rpm_cache = rpm_cache if rpm_cache is not None else open_rpm_cache()
+        # The RPMs of the builds of the updates, as prefetched from the cache or Koji.
+        self.rpms = {}
         self._fetch_updates()
 
         self.uinfo = cr.UpdateInfo()
@@ -157,11 +169,47 @@ class UpdateInfoMetadata(object):
             self.zchunk = False
 
         self.uinfo = cr.UpdateInfo()
+        self._prefetch_rpms()
         for update in self.updates:
             self.add_update(update)
 
+        if self.records is not None:
+            self._prune_records()
+            log.info('Reused %d of %d updateinfo records from the previous compose of %s',
+                     self.reused_records, len(self.updates), self.tag)
+
         if close_shelf:
-            self.shelf.close()
+            self.rpm_cache.close()
+            if self.records is not None:
+                self.records.close()
+
+    def _open_records(self):
+        """
+        Open the shelve holding the serialized records of the previous compose of our tag.
+
+        The records are discarded if they were generated by another version of this module or
+        for a different file_url, since they would not match what add_update() produces now.
+
+        Returns:
+            shelve.Shelf: A mapping of update aliases to their fingerprint and serialized record.
+        """
+        generation = '%s %s' % (__version__, config.get('file_url'))
+        records = shelve.open(
+            os.path.join(config.get('cache_dir'), '%s-updateinfo.shelve' % self.tag))
+        if records.get(self._GENERATION_KEY) != generation:
+            records.clear()
+            records[self._GENERATION_KEY] = generation
+        return records
+
+    def _prune_records(self):
+        """Drop the serialized records of updates whose builds are not in our tag anymore."""
+        aliases = {update.alias for update in self.updates}
+        aliases.add(self._GENERATION_KEY)
+        stale = [alias for alias in self.records.keys() if alias not in aliases]
+        for alias in stale:
+            del self.records[alias]
+        if stale:
+            log.debug('Dropped %d updateinfo records from %s', len(stale), self.tag)
 
     def _fetch_updates(self):
         """Based on our given koji tag, populate a list of Update objects."""
@@ -171,14 +219,16 @@ class UpdateInfoMetadata(object):
         log.debug("%d builds found" % len(kojiBuilds))
         for build in kojiBuilds:
             self.builds[build['nvr']] = build
-            build_obj = self.db.query(Build).filter_by(nvr=str(build['nvr'])).first()
+        build_objs = Build.from_nvrs(self.builds.keys(), self.db)
+        for nvr in self.builds:
+            build_obj = build_objs.get(nvr)
             if build_obj:
                 if build_obj.update:
                     self.updates.add(build_obj.update)
                 else:
-                    log.warning('%s does not have a corresponding update' % build['nvr'])
+                    log.warning('%s does not have a corresponding update' % nvr)
             else:
-                nonexistent.append(build['nvr'])
+                nonexistent.append(nvr)
         if nonexistent:
             log.warning("Couldn't find the following koji builds tagged as "
                         "%s in bodhi: %s" % (self.tag, nonexistent))
@@ -194,8 +244,12 @@ class UpdateInfoMetadata(object):
             list: A list of dictionaries describing all the subpackages that are part of the given
                 nvr.
         """
-        if str(nvr) in self.shelf:
-            return self.shelf[str(nvr)]
+        if nvr in self.rpms:
+            return self.rpms[nvr]
+
+        rpms = self.rpm_cache.get(nvr)
+        if rpms is not None:
+            return rpms
 
         if nvr in self.builds:
             buildid = self.builds[nvr]['id']
@@ -203,66 +257,112 @@ class UpdateInfoMetadata(object):
             buildid = koji.getBuild(nvr)['id']
 
         rpms = koji.listBuildRPMs(buildid)
-        self.shelf[str(nvr)] = rpms
+        self.rpm_cache.set(nvr, rpms)
         return rpms
 
+    def _prefetch_rpms(self):
+        """
+        Fetch the RPMs of all the builds whose records will be generated, before generating them.
+
+        The builds that are missing from the RPM cache are then queried from Koji with a few
+        multicalls, instead of one at a time while the records are generated.
+        """
+        nvrs = [build.nvr for update in self.updates if not self._record_is_reusable(update)
+                for build in update.builds]
+        if nvrs:
+            self.rpms = self.rpm_cache.prefetch(nvrs, self.builds)
+
+    @staticmethod
+    def _record_fingerprint(update):
+        """
+        Return the values that must be unchanged for a previously serialized record to be reused.
+
+        Editing an update (including adding or removing builds and bugs) sets its date_modified,
+        and pushing it sets its date_pushed and status. The titles of the bugs are refreshed from
+        the bug tracker without touching the update, so they are part of the fingerprint too.
+
+        Args:
+            update (bodhi.server.models.Update): The Update to fingerprint.
+        Returns:
+            tuple: The fingerprint of the update.
+        """
+        return (update.date_modified, update.date_pushed, update.status.value,
+                tuple((bug.bug_id, bug.title) for bug in update.bugs))
+
+    def _record_is_reusable(self, update):
+        """
+        Return whether the record serialized for the given update by a previous compose is current.
+
+        Args:
+            update (bodhi.server.models.Update): The Update whose record is looked up.
+        Returns:
+            bool: True in incremental mode if the update hasn't changed since its record was
+                serialized, False otherwise.
+        """
+        if self.records is None:
+            return False
+        cached = self.records.get(update.alias)
+        return cached is not None and cached['fingerprint'] == self._record_fingerprint(update)
+
     def add_update(self, update):
         """
         Generate the extended metadata for a given update, adding it to self.uinfo.
 
+        In incremental mode, the record serialized during a previous compose is reused if the
+        update hasn't changed since then.
+
         Args:
             update (bodhi.server.models.Update): The Update to be added to self.uinfo.
         """
-        rec = cr.UpdateRecord()
-        rec.version = __version__
-        rec.fromstr = config.get('bodhi_email')
-        rec.status = update.status.value
-        rec.type = update.type.value
-        rec.id = update.alias.encode('utf-8')
-        rec.title = update.title.encode('utf-8')
-        rec.severity = util.severity_updateinfo_str(update.severity.value)
-        rec.summary = ('%s %s update' % (update.get_title(),
-                                         update.type.value)).encode('utf-8')
-        rec.description = update.notes.encode('utf-8')
-        rec.release = update.release.long_name.encode('utf-8')
-        rec.rights = config.get('updateinfo_rights')
-
-        if update.date_pushed:
-            rec.issued_date = update.date_pushed
+        if self._record_is_reusable(update):
+            data = self.records[update.alias]['record']
+            self.reused_records += 1
         else:
-            # Sometimes we only set the date_pushed after it's pushed out, however,
-            # it seems that Satellite does not like update entries without issued_date.
-            # Since we know that we are pushing it now, and the next push will get the data
-            # correctly, let's just insert utcnow().
-            rec.issued_date = datetime.utcnow()
-        if update.date_modified:
-            rec.updated_date = update.date_modified
-        else:
-            rec.updated_date = datetime.utcnow()
+            data = self._serialize_update(update)
+            if self.records is not None:
+                self.records[update.alias] = {
+                    'fingerprint': self._record_fingerprint(update), 'record': data}
 
-        col = cr.UpdateCollection()
-        col.name = update.release.long_name.encode('utf-8')
-        col.shortname = update.release.name.encode('utf-8')
+        self.uinfo.append(self._create_record(data))
+
+    def _serialize_update(self, update):
+        """
+        Gather the data needed to create the updateinfo record of the given update.
+
+        Args:
+            update (bodhi.server.models.Update): The Update to be serialized.
+        Returns:
+            dict: The record data, made only of builtin types so it can be pickled.
+        """
+        data = {
+            'status': update.status.value,
+            'type': update.type.value,
+            'id': update.alias,
+            'title': update.title,
+            'severity': util.severity_updateinfo_str(update.severity.value),
+            'summary': '%s %s update' % (update.get_title(), update.type.value),
+            'description': update.notes,
+            'release': update.release.long_name,
+            # Sometimes we only set the date_pushed after it's pushed out, so these are None and
+            # are replaced by utcnow() when creating the record.
+            'issued_date': update.date_pushed,
+            'updated_date': update.date_modified,
+            'collection_name': update.release.long_name,
+            'collection_shortname': update.release.name,
+            'packages': [],
+            'references': [],
+        }
 
         koji = get_session()
         for build in update.builds:
             rpms = self.get_rpms(koji, build.nvr)
             for rpm in rpms:
-                pkg = cr.UpdateCollectionPackage()
-                pkg.name = rpm['name']
-                pkg.version = rpm['version']
-                pkg.release = rpm['release']
                 if rpm['epoch'] is not None:
-                    pkg.epoch = str(rpm['epoch'])
+                    epoch = str(rpm['epoch'])
                 else:
-                    pkg.epoch = '0'
-                pkg.arch = rpm['arch']
-
-                # TODO: how do we handle UpdateSuggestion.logout, etc?
-                pkg.reboot_suggested = update.suggest is UpdateSuggestion.reboot
+                    epoch = '0'
 
                 filename = '%s.%s.rpm' % (rpm['nvr'], rpm['arch'])
-                pkg.filename = filename
 
                 # Build the URL
                 if rpm['arch'] == 'src':
@@ -272,25 +372,94 @@ class UpdateInfoMetadata(object):
                 else:
                     arch = rpm['arch']
 
-                pkg.src = os.path.join(
-                    config.get('file_url'),
-                    update.status is UpdateStatus.testing and 'testing' or '',
-                    str(update.release.version), arch, filename[0], filename)
+                data['packages'].append({
+                    'name': rpm['name'],
+                    'version': rpm['version'],
+                    'release': rpm['release'],
+                    'epoch': epoch,
+                    'arch': rpm['arch'],
+                    # TODO: how do we handle UpdateSuggestion.logout, etc?
+                    'reboot_suggested': update.suggest is UpdateSuggestion.reboot,
+                    'filename': filename,
+                    'src': os.path.join(
+                        config.get('file_url'),
+                        update.status is UpdateStatus.testing and 'testing' or '',
+                        str(update.release.version), arch, filename[0], filename),
+                })
 
-                col.append(pkg)
+        # Create references for each bug
+        for bug in update.bugs:
+            data['references'].append({
+                'type': 'bugzilla',
+                'id': str(bug.bug_id),
+                'href': bug.url,
+                'title': bug.title,
+            })
+
+        return data
+
+    def _create_record(self, data):
+        """
+        Create an updateinfo record from the data returned by _serialize_update().
+
+        Args:
+            data (dict): The serialized record.
+        Returns:
+            createrepo_c.UpdateRecord: The updateinfo record.
+        """
+        rec = cr.UpdateRecord()
+        rec.version = __version__
+        rec.fromstr = config.get('bodhi_email')
+        rec.status = data['status']
+        rec.type = data['type']
+        rec.id = data['id'].encode('utf-8')
+        rec.title = data['title'].encode('utf-8')
+        rec.severity = data['severity']
+        rec.summary = data['summary'].encode('utf-8')
+        rec.description = data['description'].encode('utf-8')
+        rec.release = data['release'].encode('utf-8')
+        rec.rights = config.get('updateinfo_rights')
+
+        if data['issued_date']:
+            rec.issued_date = data['issued_date']
+        else:
+            # Sometimes we only set the date_pushed after it's pushed out, however,
+            # it seems that Satellite does not like update entries without issued_date.
+            # Since we know that we are pushing it now, and the next push will get the data
+            # correctly, let's just insert utcnow().
+            rec.issued_date = datetime.utcnow()
+        if data['updated_date']:
+            rec.updated_date = data['updated_date']
+        else:
+            rec.updated_date = datetime.utcnow()
+
+        col = cr.UpdateCollection()
+        col.name = data['collection_name'].encode('utf-8')
+        col.shortname = data['collection_shortname'].encode('utf-8')
+
+        for package in data['packages']:
+            pkg = cr.UpdateCollectionPackage()
+            pkg.name = package['name']
+            pkg.version = package['version']
+            pkg.release = package['release']
+            pkg.epoch = package['epoch']
+            pkg.arch = package['arch']
+            pkg.reboot_suggested = package['reboot_suggested']
+            pkg.filename = package['filename']
+            pkg.src = package['src']
+            col.append(pkg)
 
         rec.append_collection(col)
 
-        # Create references for each bug
-        for bug in update.bugs:
+        for reference in data['references']:
             ref = cr.UpdateReference()
-            ref.type = 'bugzilla'
-            ref.id = str(bug.bug_id).encode('utf-8')
-            ref.href = bug.url.encode('utf-8')
-            ref.title = bug.title.encode('utf-8') if bug.title else ''
+            ref.type = reference['type']
+            ref.id = reference['id'].encode('utf-8')
+            ref.href = reference['href'].encode('utf-8')
+            ref.title = reference['title'].encode('utf-8') if reference['title'] else ''
             rec.append_reference(ref)
 
-        self.uinfo.append(rec)
+        return rec
 
     def insert_updateinfo(self, compose_path):
         """
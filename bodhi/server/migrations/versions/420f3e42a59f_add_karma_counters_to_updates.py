@@ -0,0 +1,110 @@
+# Copyright © 2020 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+Add karma counters to updates.
+
+Revision ID: 420f3e42a59f
+Revises: 559acf7e2c16
+Create Date: 2020-11-24 10:12:41.518023
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '420f3e42a59f'
+down_revision = '559acf7e2c16'
+
+
+COUNTERS = ('positive_karma', 'negative_karma', 'admin_approvals', 'stable_comment_posted',
+            'date_karma_reset')
+
+
+def _count(comments):
+    """
+    Count the karma counters of an update but its admin approvals, like Update._count_karma().
+
+    Args:
+        comments (list): The (timestamp, karma, text, user name) of the comments of the update, in
+            chronological order.
+    Returns:
+        dict: The karma counters, keyed by column name.
+    """
+    counters = dict(stable_comment_posted=False, date_karma_reset=None)
+    votes = {}
+    for timestamp, karma, text, user in comments:
+        if user == 'bodhi' and ('New build' in text or 'Removed build' in text):
+            counters = dict(stable_comment_posted=False, date_karma_reset=timestamp)
+            votes = {}
+            continue
+        if karma:
+            votes[user] = karma
+        if user == 'bodhi' and text.startswith('This update ') and \
+                'can be pushed to stable now if the maintainer wishes' in text:
+            counters['stable_comment_posted'] = True
+    counters['positive_karma'] = sum(karma for karma in votes.values() if karma > 0)
+    counters['negative_karma'] = sum(karma for karma in votes.values() if karma < 0)
+    return counters
+
+
+def upgrade():
+    """Add the karma counter columns to the updates, and count most of them from the comments."""
+    op.add_column('updates', sa.Column('positive_karma', sa.Integer(), nullable=False,
+                                       server_default='0'))
+    op.add_column('updates', sa.Column('negative_karma', sa.Integer(), nullable=False,
+                                       server_default='0'))
+    # The admin approvals depend on the admin_groups setting, so they are left NULL here. Bodhi
+    # counts them the first time they are needed, or bodhi-check-karma --fix stores them.
+    op.add_column('updates', sa.Column('admin_approvals', sa.Integer(), nullable=True))
+    op.add_column('updates', sa.Column('stable_comment_posted', sa.Boolean(), nullable=False,
+                                       server_default=sa.false()))
+    op.add_column('updates', sa.Column('date_karma_reset', sa.DateTime(), nullable=True))
+
+    connection = op.get_bind()
+    update_counters = sa.text(
+        'UPDATE updates SET positive_karma = :positive_karma, negative_karma = :negative_karma, '
+        'stable_comment_posted = :stable_comment_posted, '
+        'date_karma_reset = :date_karma_reset WHERE id = :id')
+    # The comments are read through a server side cursor, since there are many of them.
+    rows = connection.execution_options(stream_results=True).execute(
+        'SELECT comments.update_id, comments.timestamp, comments.karma, comments.text, users.name '
+        'FROM comments JOIN users ON users.id = comments.user_id '
+        'ORDER BY comments.update_id, comments.timestamp, comments.id')
+
+    # The counters are counted update by update, and written in batches.
+    batch = []
+    update_id, comments = None, []
+    for row in rows:
+        if row[0] != update_id and comments:
+            batch.append(dict(_count(comments), id=update_id))
+            comments = []
+        update_id = row[0]
+        comments.append(tuple(row[1:]))
+        if len(batch) == 1000:
+            connection.execute(update_counters, batch)
+            batch = []
+    if comments:
+        batch.append(dict(_count(comments), id=update_id))
+    if batch:
+        connection.execute(update_counters, batch)
+
+
+def downgrade():
+    """Drop the karma counter columns from the updates."""
+    for column in reversed(COUNTERS):
+        op.drop_column('updates', column)
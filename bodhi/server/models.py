@@ -31,26 +31,26 @@ import uuid
 from urllib.error import URLError
 
 from simplemediawiki import MediaWiki
-from sqlalchemy import (and_, Boolean, Column, DateTime, event, func, ForeignKey,
-                        Integer, or_, Table, Unicode, UnicodeText, UniqueConstraint)
+from sqlalchemy import (and_, Boolean, Column, DateTime, event, func, ForeignKey, inspect,
+                        Integer, or_, String, Table, Unicode, UnicodeText, UniqueConstraint)
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import class_mapper, relationship, backref, validates
+from sqlalchemy.orm import (backref, class_mapper, joinedload, relationship, selectinload,
+                            validates, with_polymorphic)
 from sqlalchemy.orm.base import NEVER_SET
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.orm.properties import RelationshipProperty
+from sqlalchemy.orm.properties import ColumnProperty, RelationshipProperty
 from sqlalchemy.types import SchemaType, TypeDecorator, Enum
 import requests.exceptions
 import rpm
 
 from bodhi.messages.schemas import (buildroot_override as override_schemas,
                                     errata as errata_schemas, update as update_schemas)
-from bodhi.server import bugs, buildsys, log, mail, notifications, Session, util
+from bodhi.server import acls, bugs, buildsys, critpath, log, mail, notifications, Session, util
 from bodhi.server.config import config
 from bodhi.server.exceptions import BodhiException, ExternalCallException, LockedUpdateException
 from bodhi.server.tasks import fetch_test_cases_task, tag_update_builds_task, work_on_bugs_task
 from bodhi.server.util import (
-    avatar as get_avatar, build_evr, get_critpath_components,
-    get_rpm_header, header, tokenize, pagure_api_get)
+    avatar as get_avatar, build_evr, get_rpm_header, header, tokenize, pagure_api_get)
 
 if typing.TYPE_CHECKING:  # pragma: no cover
     import pyramid  # noqa: 401
@@ -296,6 +296,10 @@ class DeclEnumType(SchemaType, TypeDecorator):
             t.impl.drop(bind=bind, checkfirst=checkfirst)
 
 
+# Maps a model and the exclude and include arguments of BodhiBase._to_json() to what it serializes.
+_json_plans = {}
+
+
 class BodhiBase(object):
     """
     Base class for the SQLAlchemy model base class.
@@ -393,39 +397,86 @@ class BodhiBase(object):
         if not obj:
             return
 
-        if exclude is None:
-            exclude = getattr(obj, '__exclude_columns__', [])
-        properties = list(class_mapper(type(obj)).iterate_properties)
-        rels = [p.key for p in properties if isinstance(p, RelationshipProperty)]
-        attrs = [p.key for p in properties if p.key not in rels]
-        d = dict([(attr, getattr(obj, attr)) for attr in attrs
-                  if attr not in exclude and not attr.startswith('_')])
-
-        if include is None:
-            include = getattr(obj, '__include_extras__', [])
+        attrs, include, rels = cls._json_plan(type(obj), exclude, include)
+        d = {}
+        for attr, convert in attrs:
+            value = getattr(obj, attr)
+            if convert:
+                value = cls._json_value(value)
+            d[attr] = value
 
         for name in include:
             attribute = getattr(obj, name)
             if callable(attribute):
                 attribute = attribute(request)
-            d[name] = attribute
+            d[name] = cls._json_value(attribute)
 
-        for attr in rels:
-            if attr in exclude:
-                continue
-            target = getattr(type(obj), attr).property.mapper.class_
+        for attr, target in rels:
             if target in seen:
                 continue
             d[attr] = cls._expand(obj, getattr(obj, attr), seen, request)
 
-        for key, value in d.items():
-            if isinstance(value, datetime):
-                d[key] = value.strftime('%Y-%m-%d %H:%M:%S')
-            if isinstance(value, EnumSymbol):
-                d[key] = str(value)
-
         return d
 
+    @staticmethod
+    def _json_value(value):
+        """
+        Return value in the form used in JSON representations.
+
+        Args:
+            value (object): An attribute of a model.
+        Returns:
+            object: value formatted as a string if it is a datetime or an EnumSymbol, else value.
+        """
+        if isinstance(value, datetime):
+            return value.strftime('%Y-%m-%d %H:%M:%S')
+        if isinstance(value, EnumSymbol):
+            return str(value)
+        return value
+
+    @classmethod
+    def _json_plan(cls, model, exclude, include):
+        """
+        Return what :meth:`_to_json` serializes for instances of model.
+
+        Inspecting the mapper for every serialized object is expensive, so the plan is computed
+        once per model and exclude and include arguments, and cached.
+
+        Args:
+            model (type): The class of the objects to serialize.
+            exclude (iterable or None): See :meth:`_to_json`.
+            include (iterable or None): See :meth:`_to_json`.
+        Returns:
+            tuple: A 3-tuple. The first element is a tuple of (name, convert) 2-tuples for the
+                attributes to copy, where convert is False if the attribute's column type can't hold
+                a datetime or an EnumSymbol. The second element is a tuple of the names of the
+                extras to include. The third element is a tuple of (name, target class) 2-tuples for
+                the relationships to expand.
+        """
+        key = (model, None if exclude is None else frozenset(exclude),
+               None if include is None else tuple(include))
+        try:
+            return _json_plans[key]
+        except KeyError:
+            pass
+
+        if exclude is None:
+            exclude = getattr(model, '__exclude_columns__', [])
+        if include is None:
+            include = getattr(model, '__include_extras__', [])
+        properties = list(class_mapper(model).iterate_properties)
+        rels = [p for p in properties if isinstance(p, RelationshipProperty)]
+        rel_keys = [p.key for p in rels]
+        attrs = tuple(
+            (p.key, not (isinstance(p, ColumnProperty) and len(p.columns) == 1
+                         and isinstance(p.columns[0].type, (Boolean, Integer, String))))
+            for p in properties
+            if p.key not in rel_keys and p.key not in exclude and not p.key.startswith('_'))
+        rels = tuple((p.key, p.mapper.class_) for p in rels if p.key not in exclude)
+
+        plan = _json_plans[key] = (attrs, tuple(include), rels)
+        return plan
+
     @classmethod
     def _expand(cls, obj, relation, seen, req):
         """
@@ -1110,6 +1161,23 @@ class Package(Base):
         """
         return self.name
 
+    @property
+    def pagure_namespace(self):
+        """
+        Return the namespace of this package in Pagure.
+
+        Returns:
+            str: The namespace, such as "rpms".
+        """
+        # Pagure uses plural names for its namespaces such as "rpms" except for
+        # container. Flatpaks were moved from 'modules' to 'flatpaks' - hence
+        # a config setting.
+        if self.type == ContentType.container:
+            return self.type.name
+        elif self.type == ContentType.flatpak:
+            return config.get('pagure_flatpak_namespace')
+        return self.type.name + 's'
+
     def get_pkg_committers_from_pagure(self):
         """
         Pull users and groups who can commit on a package in Pagure.
@@ -1118,21 +1186,48 @@ class Package(Base):
         * The first list contains usernames that have commit access.
         * The second list contains FAS group names that have commit access.
 
+        The answers of Pagure are cached for ``pagure_acl_cache_ttl`` seconds.
+
+        Raises:
+            RuntimeError: If Pagure did not give us a 200 code.
+        """
+        return self.get_committers_from_pagure(self.pagure_namespace, self.external_name)
+
+    @staticmethod
+    def get_committers_from_pagure(namespace, name):
+        """
+        Pull users and groups who can commit on the given package in Pagure, from the cache.
+
+        This only takes plain values, so that it can be called from threads that don't own the
+        database session of the package.
+
+        Args:
+            namespace (str): The namespace of the package in Pagure.
+            name (str): The name of the package in Pagure.
+        Returns:
+            tuple: See :meth:`get_pkg_committers_from_pagure`.
+        Raises:
+            RuntimeError: If Pagure did not give us a 200 code.
+        """
+        return acls.pagure_acls.get(
+            namespace, name, lambda: Package._fetch_pkg_committers_from_pagure(namespace, name))
+
+    @staticmethod
+    def _fetch_pkg_committers_from_pagure(namespace, name):
+        """
+        Query Pagure for the users and groups who can commit on a package.
+
+        Args:
+            namespace (str): The namespace of the package in Pagure.
+            name (str): The name of the package in Pagure.
+        Returns:
+            tuple: See :meth:`get_pkg_committers_from_pagure`.
         Raises:
             RuntimeError: If Pagure did not give us a 200 code.
         """
         pagure_url = config.get('pagure_url')
-        # Pagure uses plural names for its namespaces such as "rpms" except for
-        # container. Flatpaks were moved from 'modules' to 'flatpaks' - hence
-        # a config setting.
-        if self.type == ContentType.container:
-            namespace = self.type.name
-        elif self.type == ContentType.flatpak:
-            namespace = config.get('pagure_flatpak_namespace')
-        else:
-            namespace = self.type.name + 's'
         package_pagure_url = '{0}/api/0/{1}/{2}?expand_group=1'.format(
-            pagure_url.rstrip('/'), namespace, self.external_name)
+            pagure_url.rstrip('/'), namespace, name)
         package_json = pagure_api_get(package_pagure_url)
 
         committers = set()
@@ -1351,6 +1446,32 @@ class Build(Base):
         'polymorphic_identity': ContentType.base,
     }
 
+    @classmethod
+    def from_nvrs(cls, nvrs, session, chunk_size=500):
+        """
+        Return the Builds with the given NVRs, with their Updates eagerly loaded.
+
+        The Builds are queried with chunk_size NVRs at a time, and each Build's Update is loaded
+        along with the Update's builds, bugs and release. Compose metadata can then be generated
+        from them without any further query.
+
+        Args:
+            nvrs (iterable): The NVRs of the Builds to look up.
+            session (sqlalchemy.orm.session.Session): A database session.
+            chunk_size (int): The maximum number of NVRs in each query.
+        Returns:
+            dict: A mapping of NVRs to Builds. NVRs that Bodhi doesn't know about are absent.
+        """
+        nvrs = list(nvrs)
+        builds = {}
+        for i in range(0, len(nvrs), chunk_size):
+            query = session.query(cls).filter(cls.nvr.in_(nvrs[i:i + chunk_size])).options(
+                joinedload(cls.update).selectinload(Update.builds),
+                joinedload(cls.update).selectinload(Update.bugs))
+            for build in query:
+                builds[build.nvr] = build
+        return builds
+
     def _get_kojiinfo(self):
         """
         Return Koji build info about this build, from a cache if possible.
@@ -1832,7 +1953,8 @@ class Update(Base):
     """
 
     __tablename__ = 'updates'
-    __exclude_columns__ = ('id', 'user_id', 'release_id')
+    __exclude_columns__ = ('id', 'user_id', 'release_id', 'positive_karma', 'negative_karma',
+                           'admin_approvals', 'stable_comment_posted', 'date_karma_reset')
     __include_extras__ = ('meets_testing_requirements', 'url', 'title', 'version_hash')
     __get_by__ = ('alias',)
 
@@ -1906,6 +2028,22 @@ class Update(Base):
     # Koji tag, if any, from which the list of builds was populated initially.
     from_tag = Column(UnicodeText, nullable=True)
 
+    # Karma counters, counted from the comments since the last karma reset. They are kept up to
+    # date as comments are added so that they don't have to be counted from all the comments every
+    # time they are needed. See _count_karma() for what they are.
+    positive_karma = Column(Integer, default=0, nullable=False)
+    negative_karma = Column(Integer, default=0, nullable=False)
+    # NULL for the updates from before the counters were stored, until it is first needed.
+    admin_approvals = Column(Integer, default=0)
+    stable_comment_posted = Column(Boolean, default=False, nullable=False)
+    date_karma_reset = Column(DateTime)
+
+    # Set when the comments of the update changed in a way the karma counters don't account for
+    # yet, in which case they are counted again before the next flush.
+    _karma_stale = False
+    _karma_counter_names = ('positive_karma', 'negative_karma', 'admin_approvals',
+                            'stable_comment_posted', 'date_karma_reset')
+
     def __init__(self, *args, **kwargs):
         """
         Initialize the Update.
@@ -1930,6 +2068,34 @@ class Update(Base):
         if self.status == UpdateStatus.testing:
             self._ready_for_testing(self, self.status, None, None)
 
+    @classmethod
+    def serialization_options(cls):
+        """
+        Return the loader options that eagerly load what serializing Updates needs.
+
+        Serializing an Update reads its builds and their test cases, its bugs and their feedback,
+        its compose, and its comments with their authors and feedback. Loaded lazily, each of these
+        costs a query per Update (or per comment), so queries that list Updates should pass these
+        options to :meth:`sqlalchemy.orm.query.Query.options` to load them with a fixed number of
+        queries.
+
+        Returns:
+            list: Loader options for queries of Updates.
+        """
+        # Build subclasses have their own columns, so load them with their subclasses to avoid a
+        # query per build for those columns.
+        builds = with_polymorphic(Build, '*')
+        comments = selectinload(cls.comments)
+        return [
+            selectinload(cls.builds.of_type(builds)).selectinload(builds.testcases),
+            selectinload(cls.bugs).selectinload(Bug.feedback),
+            selectinload(cls.compose),
+            selectinload(cls.user).selectinload(User.groups),
+            comments.selectinload(Comment.user).selectinload(User.groups),
+            comments.selectinload(Comment.bug_feedback).selectinload(BugKarma.bug),
+            comments.selectinload(Comment.testcase_feedback).selectinload(TestCaseKarma.testcase),
+        ]
+
     @property
     def version_hash(self):
         """
@@ -2028,27 +2194,16 @@ class Update(Base):
     @property
     def _composite_karma(self):
         """
-        Calculate and return a 2-tuple of the positive and negative karma.
+        Return a 2-tuple of the positive and negative karma.
 
-        Sums the positive karma comments, and then sums the negative karma comments. The total karma
-        is simply the sum of the two elements of this 2-tuple.
+        Only the most recent karma of each user since the last karma reset is counted. The total
+        karma is simply the sum of the two elements of this 2-tuple.
 
         Returns:
             tuple: A 2-tuple of (positive_karma, negative_karma).
         """
-        positive_karma = 0
-        negative_karma = 0
-        users_counted = set()
-        for comment in self.comments_since_karma_reset:
-            if comment.karma and comment.user.name not in users_counted:
-                # Make sure we only count the last comment this user made
-                users_counted.add(comment.user.name)
-                if comment.karma > 0:
-                    positive_karma += comment.karma
-                else:
-                    negative_karma += comment.karma
-
-        return positive_karma, negative_karma
+        counters = self._karma_counters
+        return counters['positive_karma'], counters['negative_karma']
 
     @property
     def comments_since_karma_reset(self):
@@ -2066,8 +2221,7 @@ class Update(Base):
         comments_since_karma_reset = []
 
         for comment in reversed(self.comments):
-            if comment.user.name == 'bodhi' and \
-                    ('New build' in comment.text or 'Removed build' in comment.text):
+            if self._resets_karma(comment):
                 # We only want to consider comments since the most recent karma
                 # reset, which happens whenever a build is added or removed
                 # from an Update. Since we are traversing the comments in
@@ -2078,6 +2232,137 @@ class Update(Base):
 
         return comments_since_karma_reset
 
+    @staticmethod
+    def _resets_karma(comment):
+        """
+        Return whether the given comment resets the karma of its update.
+
+        Bodhi comments that the karma is reset when builds are added or removed from an update.
+
+        Args:
+            comment (Comment): The comment to check.
+        Returns:
+            bool: True if the comment resets the karma, False otherwise.
+        """
+        return comment.user.name == 'bodhi' and \
+            ('New build' in comment.text or 'Removed build' in comment.text)
+
+    @staticmethod
+    def _add_to_karma_counters(counters, comment, previous_karma):
+        """
+        Account for a new comment in the given karma counters.
+
+        Args:
+            counters (dict): The karma counters before the comment, keyed by column name. They are
+                modified in place.
+            comment (Comment): The comment to account for.
+            previous_karma (int or None): The karma the author of the comment last gave since the
+                last karma reset, if any.
+        """
+        if Update._resets_karma(comment):
+            counters.update(positive_karma=0, negative_karma=0, admin_approvals=0,
+                            stable_comment_posted=False, date_karma_reset=comment.timestamp)
+            return
+
+        if comment.karma:
+            # Only the most recent karma of each user is counted.
+            if previous_karma:
+                key = 'positive_karma' if previous_karma > 0 else 'negative_karma'
+                counters[key] -= previous_karma
+            key = 'positive_karma' if comment.karma > 0 else 'negative_karma'
+            counters[key] += comment.karma
+
+        if comment.karma == 1:
+            admin_groups = config.get('admin_groups')
+            if any(group.name in admin_groups for group in comment.user.groups):
+                counters['admin_approvals'] += 1
+
+        if comment.user.name == 'bodhi' and comment.text.startswith('This update ') and \
+                'can be pushed to stable now if the maintainer wishes' in comment.text:
+            counters['stable_comment_posted'] = True
+
+    def _count_karma(self, ignore=()):
+        """
+        Count the karma counters from all the comments of the update.
+
+        This is the slow computation that the stored counters must agree with. They are:
+
+        * positive_karma and negative_karma: the sums of the positive and of the negative karma,
+          counting only the most recent karma of each user since the last karma reset.
+        * admin_approvals: the number of +1 karma comments from members of the admin_groups since
+          the last karma reset.
+        * stable_comment_posted: whether Bodhi commented since the last karma reset that the update
+          can be pushed to stable.
+        * date_karma_reset: the time of the last karma reset, if any.
+
+        Args:
+            ignore (collection): Comments to leave out, such as those about to be deleted.
+        Returns:
+            dict: The karma counters, keyed by column name.
+        """
+        counters = {'positive_karma': 0, 'negative_karma': 0, 'admin_approvals': 0,
+                    'stable_comment_posted': False, 'date_karma_reset': None}
+        votes = {}
+        for comment in self.comments:
+            if comment in ignore:
+                continue
+            if self._resets_karma(comment):
+                votes = {}
+            self._add_to_karma_counters(counters, comment, votes.get(comment.user.name))
+            if comment.karma:
+                votes[comment.user.name] = comment.karma
+        return counters
+
+    @property
+    def _karma_counters(self):
+        """
+        Return the karma counters, counting them if the stored ones are not up to date.
+
+        The admin approvals of the updates from before they were stored are counted and stored the
+        first time they are needed.
+
+        Returns:
+            dict: The karma counters, keyed by column name.
+        """
+        if self._karma_stale or self.positive_karma is None:
+            return self._count_karma()
+        if self.admin_approvals is None:
+            self._store_karma_counters(self._count_karma())
+        return {name: getattr(self, name) for name in self._karma_counter_names}
+
+    def _store_karma_counters(self, counters):
+        """
+        Store the given karma counters in their columns.
+
+        Args:
+            counters (dict): The karma counters, keyed by column name.
+        """
+        for name, value in counters.items():
+            # Only set the changed values, not to make the update dirty for nothing.
+            if getattr(self, name) != value:
+                setattr(self, name, value)
+        self._karma_stale = False
+
+    @staticmethod
+    def _karma_comments_changed(target, *args):
+        """
+        Mark the karma counters of an update as stale when its comments change.
+
+        This is the listener of the events changing the comments of updates, or the comments
+        themselves. Comments added with :meth:`comment` are accounted for there.
+
+        Args:
+            target (Update or Comment): The update whose comments changed, or the comment that
+                changed.
+            args (list): The other arguments of the event, which are not used.
+        """
+        if isinstance(target, Comment):
+            # Don't load the update of the comment here. If it isn't loaded, the comment will be
+            # accounted for before the next flush.
+            target = target.__dict__.get('update')
+        if target is not None:
+            target._karma_stale = True
+
     @staticmethod
     def contains_critpath_component(builds, release_name):
         """
@@ -2100,7 +2385,7 @@ class Update(Base):
             components[ptype].append(pname)
 
         for ptype in components:
-            if get_critpath_components(relname, ptype, frozenset(components[ptype])):
+            if critpath.index.contains(relname, ptype, components[ptype]):
                 return True
 
         return False
@@ -2192,10 +2477,15 @@ class Update(Base):
         }
         return util.greenwave_api_post(self._greenwave_api_url, data)
 
-    def _get_test_gating_status(self):
+    @staticmethod
+    def _get_test_gating_status(greenwave_api_url, batches):
         """
-        Query Greenwave about this update and return the information retrieved.
+        Query Greenwave about an update and return the information retrieved.
 
+        Args:
+            greenwave_api_url (str): The URL of the Greenwave decision API.
+            batches (list): The requests to send to Greenwave, as returned by
+                :meth:`greenwave_request_batches`.
         Returns:
             TestGatingStatus:
                 - TestGatingStatus.ignored if no tests are required
@@ -2210,8 +2500,8 @@ class Update(Base):
         # If an unrestricted policy is applied and no tests are required
         # on this update, let's set the test gating as ignored in Bodhi.
         status = TestGatingStatus.ignored
-        for data in self.greenwave_request_batches(verbose=False):
-            response = util.greenwave_api_post(self._greenwave_api_url, data)
+        for data in batches:
+            response = util.greenwave_api_post(greenwave_api_url, data)
             if not response['policies_satisfied']:
                 return TestGatingStatus.failed
 
@@ -2262,16 +2552,35 @@ class Update(Base):
             r' \*' if self.type == UpdateType.newpackage else '')
         return command
 
-    def update_test_gating_status(self):
-        """Query Greenwave about this update and set the test_gating_status as appropriate."""
+    @staticmethod
+    def decide_test_gating_status(greenwave_api_url, batches):
+        """
+        Query Greenwave about an update and return the test_gating_status it should have.
+
+        This doesn't touch the database, so that the decisions about several updates can be
+        requested from different threads.
+
+        Args:
+            greenwave_api_url (str): The URL of the Greenwave decision API.
+            batches (list): The requests to send to Greenwave, as returned by
+                :meth:`greenwave_request_batches`.
+        Returns:
+            TestGatingStatus: The test gating status of the update, or TestGatingStatus.waiting if
+                Greenwave timed out or failed.
+        """
         try:
-            self.test_gating_status = self._get_test_gating_status()
+            return Update._get_test_gating_status(greenwave_api_url, batches)
         except (requests.exceptions.Timeout, RuntimeError) as e:
             log.error(str(e))
             # If we receive a 500 error code from Greenwave, we set the test_gating_status to
             # waiting. The status will then be updated later by the greenwave fedora-messaging
             # consumer.
-            self.test_gating_status = TestGatingStatus.waiting
+            return TestGatingStatus.waiting
+
+    def update_test_gating_status(self):
+        """Query Greenwave about this update and set the test_gating_status as appropriate."""
+        self.test_gating_status = self.decide_test_gating_status(
+            self._greenwave_api_url, self.greenwave_request_batches(verbose=False))
 
     @classmethod
     def new(cls, request, data):
@@ -3341,19 +3650,34 @@ class Update(Base):
             user = User(name=author)
             session.add(user)
 
-        comment = Comment(text=text, karma=karma, karma_critpath=karma_critpath,
-                          update=self, user=user)
-        session.add(comment)
-
+        # Determine whether this user has already left karma, and if so what the most recent
+        # karma value they left was.
+        previous_karma = None
+        karma_reset_since = False
         if karma != 0:
-            # Determine whether this user has already left karma, and if so what the most recent
-            # karma value they left was. We should examine all but the most recent comment, since
-            # that is the comment we just added.
-            previous_karma = None
-            for c in reversed(self.comments[:-1]):
+            for c in reversed(self.comments):
                 if c.user.name == author and c.karma:
                     previous_karma = c.karma
                     break
+                karma_reset_since = karma_reset_since or self._resets_karma(c)
+
+        # The karma counters can only be kept up to date if they already were.
+        counters = None if self._karma_stale or self.positive_karma is None \
+            or self.admin_approvals is None \
+            else {name: getattr(self, name) for name in self._karma_counter_names}
+
+        comment = Comment(text=text, karma=karma, karma_critpath=karma_critpath,
+                          update=self, user=user, timestamp=datetime.utcnow())
+        session.add(comment)
+
+        if counters is None:
+            self._store_karma_counters(self._count_karma())
+        else:
+            self._add_to_karma_counters(
+                counters, comment, None if karma_reset_since else previous_karma)
+            self._store_karma_counters(counters)
+
+        if karma != 0:
             if previous_karma and karma != previous_karma:
                 caveats.append({
                     'name': 'karma',
@@ -3797,12 +4121,7 @@ class Update(Base):
         Returns:
             bool: See description above for what the bool might mean.
         """
-        for comment in self.comments_since_karma_reset:
-            if comment.user.name == 'bodhi' and \
-               comment.text.startswith('This update ') and \
-               'can be pushed to stable now if the maintainer wishes' in comment.text:
-                return True
-        return False
+        return self._karma_counters['stable_comment_posted']
 
     @property
     def days_to_stable(self):
@@ -3845,16 +4164,7 @@ class Update(Base):
         Returns:
             int: The number of admin approvals found in the comments of this update.
         """
-        approvals = 0
-        for comment in self.comments_since_karma_reset:
-            if comment.karma != 1:
-                continue
-            admin_groups = config.get('admin_groups')
-            for group in comment.user.groups:
-                if group.name in admin_groups:
-                    approvals += 1
-                    break
-        return approvals
+        return self._karma_counters['admin_approvals']
 
     @property
     def test_cases(self):
@@ -4416,6 +4726,24 @@ class Comment(Base):
         """
         return "{} comment #{}".format(self.update.alias, self.id)
 
+    @classmethod
+    def serialization_options(cls) -> list:
+        """
+        Return the loader options that eagerly load what serializing Comments needs.
+
+        Serializing a Comment also serializes its author, its feedback, and its Update, so these are
+        loaded with :meth:`Update.serialization_options` to avoid several queries per Comment.
+
+        Returns:
+            Loader options for queries of Comments.
+        """
+        return [
+            selectinload(cls.user).selectinload(User.groups),
+            selectinload(cls.bug_feedback).selectinload(BugKarma.bug),
+            selectinload(cls.testcase_feedback).selectinload(TestCaseKarma.testcase),
+            selectinload(cls.update).options(*Update.serialization_options()),
+        ]
+
     def __json__(self, *args, **kwargs) -> dict:
         """
         Return a JSON string representation of this comment.
@@ -4455,6 +4783,40 @@ class Comment(Base):
         return "%s - %s (karma: %s)\n%s" % (self.user.name, self.timestamp, karma, self.text)
 
 
+event.listen(Update.comments, 'append', Update._karma_comments_changed)
+event.listen(Update.comments, 'remove', Update._karma_comments_changed)
+for attribute in (Comment.karma, Comment.text, Comment.timestamp):
+    event.listen(attribute, 'set', Update._karma_comments_changed)
+
+
+@event.listens_for(Session, 'before_flush')
+def count_changed_karma(session, flush_context, instances):
+    """
+    Count the karma counters of the updates whose comments changed since they were counted.
+
+    The changed updates whose admin approvals were never counted have them counted too.
+
+    Args:
+        session (sqlalchemy.orm.session.Session): The session being flushed.
+        flush_context (sqlalchemy.orm.unitofwork.UOWTransaction): The flush context, not used.
+        instances (list): Unused, deprecated by SQLAlchemy.
+    """
+    deleted = [obj for obj in session.deleted if isinstance(obj, Comment)]
+    updates = {obj for obj in list(session.new) + list(session.dirty)
+               if isinstance(obj, Update) and obj._karma_stale}
+    updates.update(obj for obj in session.dirty
+                   if isinstance(obj, Update) and obj.admin_approvals is None)
+    updates.update(comment.update for comment in deleted)
+    for comment in session.dirty:
+        if isinstance(comment, Comment) and any(
+                inspect(comment).attrs[name].history.has_changes()
+                for name in ('karma', 'text', 'timestamp', 'user_id', 'user')):
+            updates.add(comment.update)
+    for update in updates:
+        if update is not None and update not in session.deleted:
+            update._store_karma_counters(update._count_karma(ignore=deleted))
+
+
 class Bug(Base):
     """
     Represents a Bugzilla bug.
@@ -0,0 +1,514 @@
+# Copyright © 2020 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""Cache the RPMs and RPM headers that Koji returns for builds, so they aren't queried again."""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import typing
+
+from bodhi.server.buildsys import get_session
+from bodhi.server.config import config
+
+
+log = logging.getLogger(__name__)
+
+RPMList = typing.List[typing.Dict[str, typing.Any]]
+RPMHeaders = typing.Dict[str, typing.Any]
+
+#: The headers of the source RPMs that are fetched from Koji and cached by RPMHeaderCache.
+RPM_HEADERS = [
+    'name', 'summary', 'version', 'release', 'url', 'description',
+    'changelogtime', 'changelogname', 'changelogtext',
+]
+
+
+class RPMCache:
+    """
+    Map build NVRs to the RPMs Koji lists for them.
+
+    The RPMs of a build never change once it is complete, so entries never need to be invalidated,
+    but they may be evicted to bound the size of the cache. Subclasses store the entries by
+    implementing :meth:`_get_many` and :meth:`_set_many`, and can override :meth:`evict`.
+
+    The number of lookups that were found in the cache (hits) or not (misses) are counted.
+    """
+
+    def __init__(self):
+        """Initialize the hit and miss counters."""
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _get_many(self, nvrs: typing.List[str]) -> typing.Dict[str, RPMList]:
+        """
+        Return the cached RPMs of the given NVRs.
+
+        Args:
+            nvrs: The NVRs to look up.
+        Returns:
+            A mapping of NVRs to lists of RPMs. NVRs that are not cached are absent.
+        """
+        raise NotImplementedError()
+
+    def _set_many(self, rpms: typing.Dict[str, RPMList]):
+        """
+        Store the RPMs of the given NVRs.
+
+        Args:
+            rpms: A mapping of NVRs to lists of RPMs.
+        """
+        raise NotImplementedError()
+
+    def get(self, nvr: str) -> typing.Optional[RPMList]:
+        """
+        Return the cached RPMs of the given NVR.
+
+        Args:
+            nvr: The NVR to look up.
+        Returns:
+            The list of RPMs of the build, or None if it is not cached.
+        """
+        return self.get_many([nvr]).get(nvr)
+
+    def get_many(self, nvrs: typing.Iterable[str]) -> typing.Dict[str, RPMList]:
+        """
+        Return the cached RPMs of the given NVRs, counting the hits and misses.
+
+        Args:
+            nvrs: The NVRs to look up.
+        Returns:
+            A mapping of NVRs to lists of RPMs. NVRs that are not cached are absent.
+        """
+        nvrs = list(set(str(nvr) for nvr in nvrs))
+        with self._lock:
+            found = self._get_many(nvrs)
+            self.hits += len(found)
+            self.misses += len(nvrs) - len(found)
+        return found
+
+    def set(self, nvr: str, rpms: RPMList):
+        """
+        Store the RPMs of the given NVR.
+
+        Args:
+            nvr: The NVR of the build.
+            rpms: The RPMs Koji lists for the build.
+        """
+        self.set_many({nvr: rpms})
+
+    def set_many(self, rpms: typing.Dict[str, RPMList]):
+        """
+        Store the RPMs of the given NVRs.
+
+        Args:
+            rpms: A mapping of NVRs to lists of RPMs.
+        """
+        if not rpms:
+            return
+        with self._lock:
+            self._set_many({str(nvr): value for nvr, value in rpms.items()})
+
+    def prefetch(self, nvrs: typing.Iterable[str],
+                 builds: typing.Optional[typing.Mapping[str, dict]] = None) \
+            -> typing.Dict[str, RPMList]:
+        """
+        Return the RPMs of the given NVRs, fetching all the cache misses from Koji up front.
+
+        The misses are split in batches of rpm_prefetch_batch_size NVRs, which are each fetched
+        with Koji multicalls. If rpm_prefetch_threads is more than 1, the batches are fetched
+        concurrently by that many threads, each with its own Koji session. NVRs that Koji failed to
+        return are left out, so that the caller can query them on their own and get a meaningful
+        error.
+
+        Args:
+            nvrs: The NVRs of the builds.
+            builds: A mapping of NVRs to Koji build info, as returned by listTagged(), used to
+                avoid looking up the IDs of these builds.
+        Returns:
+            A mapping of NVRs to lists of RPMs.
+        """
+        builds = builds or {}
+        rpms = self.get_many(nvrs)
+        missing = sorted(set(str(nvr) for nvr in nvrs) - set(rpms))
+        if not missing:
+            return rpms
+
+        batch_size = config.get('rpm_prefetch_batch_size')
+        batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+        threads = min(config.get('rpm_prefetch_threads'), len(batches))
+        log.info('Fetching the RPMs of %d builds from Koji in %d batches with %d threads',
+                 len(missing), len(batches), threads)
+        if threads > 1:
+            sessions = threading.local()
+
+            def fetch(batch):
+                if not hasattr(sessions, 'koji'):
+                    sessions.koji = get_session()
+                return self._fetch_batch(sessions.koji, batch, builds)
+
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                for fetched in executor.map(fetch, batches):
+                    rpms.update(fetched)
+        else:
+            koji = get_session()
+            for batch in batches:
+                rpms.update(self._fetch_batch(koji, batch, builds))
+        return rpms
+
+    def _fetch_batch(self, koji, nvrs: typing.List[str], builds: typing.Mapping[str, dict]) \
+            -> typing.Dict[str, RPMList]:
+        """
+        Fetch the RPMs of the given NVRs from Koji with at most two multicalls, and cache them.
+
+        The IDs of the builds that are not in the given builds are first looked up with a
+        multicall, then the RPMs of all the builds are listed with another one.
+
+        Args:
+            koji (koji.ClientSession): An initialized Koji client.
+            nvrs: The NVRs of the builds.
+            builds: A mapping of NVRs to Koji build info, as returned by listTagged().
+        Returns:
+            A mapping of NVRs to lists of RPMs.
+        """
+        build_ids = {nvr: builds[nvr]['id'] for nvr in nvrs if nvr in builds}
+        unknown = [nvr for nvr in nvrs if nvr not in build_ids]
+        if unknown:
+            koji.multicall = True
+            for nvr in unknown:
+                koji.getBuild(nvr)
+            for nvr, result in zip(unknown, koji.multiCall()):
+                if isinstance(result, list) and isinstance(result[0], dict):
+                    build_ids[nvr] = result[0]['id']
+
+        fetching = [nvr for nvr in nvrs if nvr in build_ids]
+        koji.multicall = True
+        for nvr in fetching:
+            koji.listBuildRPMs(build_ids[nvr])
+        fetched = {}
+        for nvr, result in zip(fetching, koji.multiCall()):
+            if isinstance(result, list):
+                fetched[nvr] = result[0]
+            else:
+                log.warning('Failed to list the RPMs of %s: %r', nvr, result)
+        self.set_many(fetched)
+        return fetched
+
+    def evict(self):
+        """Remove the entries that exceed the limits of the cache. The default does nothing."""
+
+    def close(self):
+        """Evict old entries, log the hit and miss counters, and release the cache's resources."""
+        self.evict()
+        log.info('RPM cache: %d hits, %d misses', self.hits, self.misses)
+
+
+class MemoryRPMCache(RPMCache):
+    """An RPMCache that only lives as long as the process."""
+
+    def __init__(self):
+        """Initialize the in-memory storage."""
+        super().__init__()
+        self._rpms = {}
+
+    def _get_many(self, nvrs: typing.List[str]) -> typing.Dict[str, RPMList]:
+        """
+        Return the cached RPMs of the given NVRs.
+
+        Args:
+            nvrs: The NVRs to look up.
+        Returns:
+            A mapping of NVRs to lists of RPMs. NVRs that are not cached are absent.
+        """
+        return {nvr: self._rpms[nvr] for nvr in nvrs if nvr in self._rpms}
+
+    def _set_many(self, rpms: typing.Dict[str, RPMList]):
+        """
+        Store the RPMs of the given NVRs.
+
+        Args:
+            rpms: A mapping of NVRs to lists of RPMs.
+        """
+        self._rpms.update(rpms)
+
+
+class SQLiteRPMCache(RPMCache):
+    """
+    An RPMCache stored in an SQLite database, indexed by NVR.
+
+    The database can be shared by several composes running at the same time: it uses write-ahead
+    logging so that readers don't block the writer, and waits for the other writers to finish
+    instead of failing. The RPMs are stored as JSON, and the last time each entry was used is
+    recorded so that the least recently used entries can be evicted.
+    """
+
+    #: How many NVRs are looked up in each query, below SQLite's limit of 999 parameters.
+    chunk_size = 500
+
+    def __init__(self, path: str, max_age: int = 0, max_entries: int = 0):
+        """
+        Open (or create) the cache database.
+
+        Args:
+            path: The path to the database file.
+            max_age: Evict the entries that have not been used for this many days. 0 disables
+                eviction by age.
+            max_entries: Evict the least recently used entries beyond this count. 0 disables
+                eviction by size.
+        """
+        super().__init__()
+        self.path = path
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self._connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS rpms '
+            '(nvr TEXT PRIMARY KEY, rpms TEXT NOT NULL, last_used REAL NOT NULL)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS rpms_last_used ON rpms (last_used)')
+
+    def _get_many(self, nvrs: typing.List[str]) -> typing.Dict[str, RPMList]:
+        """
+        Return the cached RPMs of the given NVRs, and record that they were used.
+
+        Args:
+            nvrs: The NVRs to look up.
+        Returns:
+            A mapping of NVRs to lists of RPMs. NVRs that are not cached are absent.
+        """
+        found = {}
+        for i in range(0, len(nvrs), self.chunk_size):
+            chunk = nvrs[i:i + self.chunk_size]
+            placeholders = ', '.join('?' * len(chunk))
+            rows = self._connection.execute(
+                'SELECT nvr, rpms FROM rpms WHERE nvr IN (%s)' % placeholders, chunk)
+            found.update((nvr, json.loads(rpms)) for nvr, rpms in rows)
+        if found:
+            now = time.time()
+            with self._connection:
+                self._connection.executemany('UPDATE rpms SET last_used = ? WHERE nvr = ?',
+                                             [(now, nvr) for nvr in found])
+        return found
+
+    def _set_many(self, rpms: typing.Dict[str, RPMList]):
+        """
+        Store the RPMs of the given NVRs.
+
+        Args:
+            rpms: A mapping of NVRs to lists of RPMs.
+        """
+        now = time.time()
+        with self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO rpms (nvr, rpms, last_used) VALUES (?, ?, ?)',
+                [(nvr, json.dumps(value), now) for nvr, value in rpms.items()])
+
+    def evict(self):
+        """Remove the entries unused for more than max_age days, and those beyond max_entries."""
+        with self._lock, self._connection:
+            if self.max_age:
+                deleted = self._connection.execute(
+                    'DELETE FROM rpms WHERE last_used < ?',
+                    (time.time() - self.max_age * 24 * 60 * 60, )).rowcount
+                if deleted:
+                    log.info('Evicted %d entries unused for %d days from the RPM cache',
+                             deleted, self.max_age)
+            if self.max_entries:
+                deleted = self._connection.execute(
+                    'DELETE FROM rpms WHERE nvr IN '
+                    '(SELECT nvr FROM rpms ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                    (self.max_entries, )).rowcount
+                if deleted:
+                    log.info('Evicted %d entries beyond %d from the RPM cache',
+                             deleted, self.max_entries)
+
+    def close(self):
+        """Evict old entries, log the hit and miss counters, and close the database."""
+        super().close()
+        self._connection.close()
+
+
+class RPMHeaderCache:
+    """
+    Map build NVRs to the headers of their source RPMs, as returned by Koji's getRPMHeaders().
+
+    The headers of an RPM never change, so entries never need to be invalidated. The cache lives
+    in memory as long as the process, and the least recently used entries beyond
+    rpm_header_cache_size are evicted. Failed lookups are not cached.
+
+    The lookups and the Koji calls made for them are counted, globally and for each
+    :meth:`counting` block of the current thread, to report how many calls the cache saved.
+    """
+
+    def __init__(self):
+        """Initialize an empty cache."""
+        self._headers = OrderedDict()  # type: typing.MutableMapping[str, RPMHeaders]
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.lookups = 0
+        self.koji_calls = 0
+
+    def _count(self, lookups: int = 0, koji_calls: int = 0):
+        """
+        Add to the lookup and Koji call counters, and to those of the current counting() blocks.
+
+        Args:
+            lookups: The number of lookups to add.
+            koji_calls: The number of Koji calls to add.
+        """
+        with self._lock:
+            self.lookups += lookups
+            self.koji_calls += koji_calls
+        for counters in getattr(self._local, 'counters', []):
+            counters['lookups'] += lookups
+            counters['koji_calls'] += koji_calls
+
+    @contextlib.contextmanager
+    def counting(self, description: str) -> typing.Iterator[typing.Dict[str, int]]:
+        """
+        Count the lookups and Koji calls made by the current thread, and log them at the end.
+
+        Args:
+            description: What the lookups are done for, to start the log message with.
+        Yields:
+            A dictionary of the lookups and koji_calls made so far in the block.
+        """
+        counters = {'lookups': 0, 'koji_calls': 0}
+        if not hasattr(self._local, 'counters'):
+            self._local.counters = []
+        self._local.counters.append(counters)
+        try:
+            yield counters
+        finally:
+            self._local.counters.remove(counters)
+            log.info('%s: %d RPM header lookups, %d Koji calls, %d Koji calls saved',
+                     description, counters['lookups'], counters['koji_calls'],
+                     max(counters['lookups'] - counters['koji_calls'], 0))
+
+    def get(self, nvr: str) -> typing.Optional[RPMHeaders]:
+        """
+        Return the cached headers of the given NVR.
+
+        Args:
+            nvr: The NVR of the build.
+        Returns:
+            A copy of the cached headers, or None if they are not cached.
+        """
+        with self._lock:
+            headers = self._headers.get(nvr)
+            if headers is None:
+                return None
+            self._headers.move_to_end(nvr)
+        return dict(headers)
+
+    def set(self, nvr: str, headers: RPMHeaders):
+        """
+        Store the headers of the given NVR, evicting the least recently used entries if needed.
+
+        Args:
+            nvr: The NVR of the build.
+            headers: The headers of its source RPM.
+        """
+        size = config.get('rpm_header_cache_size')
+        if not size:
+            return
+        with self._lock:
+            self._headers[nvr] = dict(headers)
+            self._headers.move_to_end(nvr)
+            while len(self._headers) > size:
+                self._headers.popitem(last=False)
+
+    def lookup(self, nvr: str, fetch: typing.Callable[[str], RPMHeaders]) -> RPMHeaders:
+        """
+        Return the headers of the given NVR, from the cache or by calling fetch().
+
+        Args:
+            nvr: The NVR of the build.
+            fetch: Called with the NVR to fetch the headers from Koji on a cache miss. Exceptions
+                are propagated, and nothing is cached.
+        Returns:
+            The headers of the source RPM of the build.
+        """
+        self._count(lookups=1)
+        headers = self.get(nvr)
+        if headers is None:
+            self._count(koji_calls=1)
+            headers = fetch(nvr)
+            self.set(nvr, headers)
+        return headers
+
+    def prefetch(self, nvrs: typing.Iterable[str]):
+        """
+        Fetch the headers of all the given NVRs that are not cached, with Koji multicalls.
+
+        The misses are split in batches of rpm_prefetch_batch_size NVRs, and each batch is fetched
+        with one multicall. NVRs that Koji failed to return are left out, so that they are looked
+        up on their own later and raise a meaningful error.
+
+        Args:
+            nvrs: The NVRs of the builds.
+        """
+        with self._lock:
+            missing = sorted(set(str(nvr) for nvr in nvrs) - set(self._headers))
+        if not missing or not config.get('rpm_header_cache_size'):
+            return
+
+        batch_size = config.get('rpm_prefetch_batch_size')
+        log.info('Fetching the RPM headers of %d builds from Koji', len(missing))
+        koji = get_session()
+        for i in range(0, len(missing), batch_size):
+            batch = missing[i:i + batch_size]
+            koji.multicall = True
+            for nvr in batch:
+                koji.getRPMHeaders(rpmID=nvr + '.src', headers=RPM_HEADERS)
+            self._count(koji_calls=1)
+            for nvr, result in zip(batch, koji.multiCall()):
+                if isinstance(result, list) and result[0]:
+                    self.set(nvr, result[0])
+                else:
+                    log.warning('Failed to get the RPM headers of %s: %r', nvr, result)
+
+    def invalidate(self):
+        """Empty the cache and reset its counters."""
+        with self._lock:
+            self._headers.clear()
+            self.lookups = 0
+            self.koji_calls = 0
+
+
+#: The RPM headers cached by get_rpm_header().
+headers = RPMHeaderCache()
+
+
+def open_rpm_cache() -> RPMCache:
+    """
+    Return the RPMCache configured for composes.
+
+    Returns:
+        An SQLiteRPMCache in the cache_dir if it is set, or a MemoryRPMCache otherwise.
+    """
+    if not config.get('cache_dir'):
+        return MemoryRPMCache()
+    return SQLiteRPMCache(os.path.join(config['cache_dir'], 'rpms.sqlite'),
+                          max_age=config.get('rpm_cache_max_age'),
+                          max_entries=config.get('rpm_cache_max_entries'))
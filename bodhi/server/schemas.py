@@ -16,6 +16,8 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """A set of API schemas to validate input and generate documentation."""
+from datetime import datetime
+import base64
 import os
 
 import colander
@@ -269,6 +271,51 @@ class Cosmetics(colander.MappingSchema):
     )
 
 
+class Cursor(colander.SchemaType):
+    """
+    A position in a listing ordered by date and id, passed around as an opaque string.
+
+    Cursors are deserialized to (datetime, id) tuples.
+    """
+
+    def serialize(self, node, appstruct):
+        """
+        Encode the given (datetime, id) tuple.
+
+        Args:
+            node (colander.SchemaNode): The node being serialized.
+            appstruct (tuple): The date and id of the last row before the position.
+        Returns:
+            str: The cursor.
+        """
+        if appstruct is colander.null:
+            return colander.null
+        date, id = appstruct
+        cursor = f'{date.isoformat()}/{id}'.encode('utf-8')
+        return base64.urlsafe_b64encode(cursor).decode('ascii').rstrip('=')
+
+    def deserialize(self, node, cstruct):
+        """
+        Decode the given cursor.
+
+        Args:
+            node (colander.SchemaNode): The node being deserialized.
+            cstruct (str): The cursor.
+        Returns:
+            tuple: The date and id of the last row before the position.
+        Raises:
+            colander.Invalid: If the cursor can't be decoded.
+        """
+        if cstruct is colander.null or cstruct == '':
+            return colander.null
+        try:
+            cursor = base64.urlsafe_b64decode(cstruct + '=' * (-len(cstruct) % 4))
+            date, id = cursor.decode('utf-8').rsplit('/', 1)
+            return datetime.fromisoformat(date), int(id)
+        except (TypeError, ValueError):
+            raise colander.Invalid(node, f'"{cstruct}" is not a valid cursor')
+
+
 class PaginatedSchema(colander.MappingSchema):
     """A mixin class used by schemas to provide pagination support for API endpoints."""
 
@@ -630,6 +677,23 @@ class ListUpdateSchema(PaginatedSchema, SearchableSchema, Cosmetics):
         validator=colander.OneOf(list(ContentType.values())),
     )
 
+    # Continue the listing after the update this cursor points to, instead of at an offset
+    # computed from the page.
+    cursor = colander.SchemaNode(
+        Cursor(),
+        location="querystring",
+        missing=None,
+    )
+
+    # Count the total number of matching updates for every request ("exact"), or reuse the count
+    # of the same query for the dogpile.cache.expiration_time ("cached").
+    count = colander.SchemaNode(
+        colander.String(),
+        location="querystring",
+        missing='exact',
+        validator=colander.OneOf(['exact', 'cached']),
+    )
+
     user = Users(
         colander.Sequence(accept_scalar=True),
         location="querystring",
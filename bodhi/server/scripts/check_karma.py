@@ -0,0 +1,86 @@
+# Copyright © 2020 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""Check the karma counters stored on the updates against their comments."""
+
+import sys
+
+import click
+from sqlalchemy.orm import selectinload
+
+from bodhi.server import config, initialize_db, models, Session
+
+
+# The updates are checked in batches of this many updates.
+BATCH_SIZE = 500
+
+
+def find_inconsistencies(db, fix=False):
+    """
+    Compare the stored karma counters of all the updates with the ones counted from their comments.
+
+    Args:
+        db (sqlalchemy.orm.session.Session): The database session.
+        fix (bool): Whether to store the counted karma counters of the inconsistent updates.
+    Returns:
+        list: 4-tuples of the alias of an inconsistent update, the name of an inconsistent counter,
+            the stored value and the counted value.
+    """
+    inconsistencies = []
+    last_id = 0
+    while True:
+        updates = db.query(models.Update).filter(models.Update.id > last_id).order_by(
+            models.Update.id).limit(BATCH_SIZE).options(
+                selectinload(models.Update.comments).joinedload(models.Comment.user)
+                .selectinload(models.User.groups)).all()
+        if not updates:
+            break
+        for update in updates:
+            counted = update._count_karma()
+            for name, value in counted.items():
+                stored = getattr(update, name)
+                # The admin approvals that were never counted are not inconsistent.
+                if stored != value and not (name == 'admin_approvals' and stored is None):
+                    inconsistencies.append((update.alias, name, stored, value))
+            if fix:
+                update._store_karma_counters(counted)
+        last_id = updates[-1].id
+        if fix:
+            db.commit()
+        else:
+            # Don't keep all the updates in memory.
+            db.expunge_all()
+    return inconsistencies
+
+
+@click.command()
+@click.option('--fix', default=False, is_flag=True,
+              help='Store the karma counters counted from the comments of inconsistent updates.')
+@click.version_option(message='%(version)s')
+def check_karma(fix):
+    """Check the karma counters stored on the updates against their comments."""
+    initialize_db(config.config)
+    inconsistencies = find_inconsistencies(Session(), fix)
+    for alias, name, stored, counted in inconsistencies:
+        click.echo(f'{alias}: {name} is {stored}, but counts as {counted}')
+
+    if inconsistencies and not fix:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    check_karma()
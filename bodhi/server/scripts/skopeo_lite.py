@@ -37,25 +37,29 @@ Some other things that aren't implemented (but could be added if necessary):
 """
 
 from urllib.parse import urlparse, urlunparse
+import functools
+import hashlib
 import json
 import logging
 import os
 import shutil
 import tempfile
+import threading
+import time
 
 import click
 import requests
-from requests.exceptions import SSLError, ConnectionError
+from requests.exceptions import SSLError, ChunkedEncodingError, ConnectionError
 
 
 @click.group()
 def main():
     """Simplified Skopeo work-alike with manifest list support."""
-    pass  # pragma: no cover
+    # The logging is only configured here, since Bodhi also imports this module to copy containers.
+    logging.basicConfig(level=logging.INFO)  # pragma: no cover
 
 
 logger = logging.getLogger('skopeo-lite')
-logging.basicConfig(level=logging.INFO)
 
 
 MEDIA_TYPE_MANIFEST_V2 = 'application/vnd.docker.distribution.manifest.v2+json'
@@ -63,6 +67,14 @@ MEDIA_TYPE_LIST_V2 = 'application/vnd.docker.distribution.manifest.list.v2+json'
 MEDIA_TYPE_OCI = 'application/vnd.oci.image.manifest.v1+json'
 MEDIA_TYPE_OCI_INDEX = 'application/vnd.oci.image.index.v1+json'
 
+# The size of the blocks the blobs are read and written in.
+BLOCK_SIZE = 1024 * 1024
+# The blobs bigger than this are uploaded in chunks of this size, so that an interrupted upload
+# only needs to be resumed from the last chunk.
+UPLOAD_CHUNK_SIZE = 32 * 1024 * 1024
+# How many times the transfer of a blob is attempted when it is interrupted.
+MAX_TRIES = 5
+
 
 class RegistrySpec(object):
     """Information about a docker registry/repository/tag as specified on the command line."""
@@ -297,6 +309,31 @@ class RegistrySession(object):
         """
         return self._wrap_method(self.session.put, relative_url, data=data, **kwargs)
 
+    def patch(self, relative_url, data=None, **kwargs):
+        """
+        Do a HTTP PATCH.
+
+        Args:
+            relative_url (str): URL relative to the toplevel hostname.
+            data: Data to include with the patch, as for requests.SESSION.
+            kwargs: Additional arguments passed to requests.Session.patch.
+        Returns:
+            requests.Response: The response object.
+        """
+        return self._wrap_method(self.session.patch, relative_url, data=data, **kwargs)
+
+    def delete(self, relative_url, **kwargs):
+        """
+        Do a HTTP DELETE.
+
+        Args:
+            relative_url (str): URL relative to the toplevel hostname.
+            kwargs: Additional arguments passed to requests.Session.delete.
+        Returns:
+            requests.Response: The response object.
+        """
+        return self._wrap_method(self.session.delete, relative_url, **kwargs)
+
 
 class ManifestInfo(object):
     """Information about a manifest downloaded from the registry."""
@@ -348,6 +385,158 @@ def get_manifest(session, repository, ref):
                         int(response.headers['Content-Length']))
 
 
+class IncompleteBlobError(IOError):
+    """Raised when the download of a blob ends before the end of the blob."""
+
+
+# The errors after which the transfer of a blob is resumed.
+RESUMABLE_ERRORS = (ConnectionError, ChunkedEncodingError, IncompleteBlobError)
+
+
+class BlobDigest(object):
+    """Compute the digest of a blob as it is transferred, to verify it."""
+
+    def __init__(self, digest):
+        """
+        Initialize the BlobDigest.
+
+        Args:
+            digest (str): The expected digest of the blob, like sha256:<hex digest>.
+        """
+        self.digest = digest
+        algorithm, self._expected = digest.split(':', 1)
+        self._hash = hashlib.new(algorithm)
+
+    def update(self, block):
+        """
+        Add the next block of the blob's contents to the digest.
+
+        Args:
+            block (bytes): The block.
+        """
+        self._hash.update(block)
+
+    def copy(self):
+        """
+        Return a copy of the digest, to add blocks to independently.
+
+        Returns:
+            BlobDigest: The copy.
+        """
+        other = BlobDigest(self.digest)
+        other._hash = self._hash.copy()
+        return other
+
+    def verify(self):
+        """
+        Check that the blob's contents match the expected digest.
+
+        Raises:
+            RuntimeError: If they don't.
+        """
+        if self._hash.hexdigest() != self._expected:
+            raise RuntimeError("Digest mismatch for blob {}: got {}:{}".format(
+                self.digest, self._hash.name, self._hash.hexdigest()))
+
+
+class _Blocks(object):
+    """The blocks of a blob's contents, which can be split across the chunks of an upload."""
+
+    def __init__(self, blocks):
+        """
+        Initialize the _Blocks.
+
+        Args:
+            blocks (iterable): The blocks of the blob's contents.
+        """
+        self._blocks = iter(blocks)
+        self._rest = b''
+
+    def read(self, size):
+        """
+        Return up to the given number of bytes of the next block, keeping the rest for later.
+
+        Args:
+            size (int): The maximum number of bytes to return.
+        Returns:
+            bytes: The bytes, or b'' at the end of the blob.
+        """
+        block = self._rest or next(self._blocks, b'')
+        self._rest = block[size:]
+        return block[:size]
+
+    def close(self):
+        """Close the iterator of the blocks, even if it wasn't read until its end."""
+        close = getattr(self._blocks, 'close', None)
+        if close is not None:
+            close()
+
+
+class _ChunkBody(object):
+    """
+    The body of a request uploading a chunk of a blob, streamed from the blocks of its contents.
+
+    Its length is known, so that the chunk is sent with a Content-Length rather than buffered.
+    The blocks are added to a copy of the digest of the blob as they are sent, which only replaces
+    the digest once the registry received the whole chunk.
+
+    Attributes:
+        digest (BlobDigest): The digest of the blob up to the end of the chunk.
+        sent (int): The number of bytes of the chunk that were sent so far.
+    """
+
+    def __init__(self, blocks, size, digest):
+        """
+        Initialize the _ChunkBody.
+
+        Args:
+            blocks (_Blocks): The blocks of the blob's contents from the start of the chunk.
+            size (int): The size of the chunk.
+            digest (BlobDigest): The digest of the blob up to the start of the chunk. It is
+                copied.
+        """
+        self._blocks = blocks
+        self._size = size
+        self.digest = digest.copy()
+        self.sent = 0
+
+    def __len__(self):
+        """Return the size of the chunk."""
+        return self._size
+
+    def __iter__(self):
+        """
+        Yield the blocks of the chunk.
+
+        Raises:
+            IncompleteBlobError: If the blob ends before the end of the chunk.
+        """
+        while self.sent < self._size:
+            block = self._blocks.read(self._size - self.sent)
+            if not block:
+                raise IncompleteBlobError(
+                    "Blob ended after {} bytes of a {} bytes chunk".format(self.sent, self._size))
+            self.digest.update(block)
+            self.sent += len(block)
+            yield block
+
+
+def _log_throughput(registry, action, digest, size, start):
+    """
+    Log how long the transfer of a blob took.
+
+    Args:
+        registry (str): The hostname of the registry the blob was transferred from or to.
+        action (str): What was done with the blob, like 'Downloaded'.
+        digest (str): The digest of the blob.
+        size (int): The size of the blob.
+        start (float): The time.monotonic() when the transfer started.
+    """
+    duration = time.monotonic() - start
+    logger.info("%s: %s %s (%d bytes) in %.1fs (%.1f MiB/s)", registry, action, digest, size,
+                duration, size / max(duration, 0.001) / (1024 * 1024))
+
+
 class DirectoryEndpoint(object):
     """
     The source or destination of a copy operation to a local directory.
@@ -393,9 +582,7 @@ class DirectoryEndpoint(object):
         """
         path = self.get_blob_path(digest)
 
-        parent = os.path.dirname(path)
-        if not os.path.exists(parent):
-            os.makedirs(parent)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
 
         return path
 
@@ -504,39 +691,89 @@ class RegistryEndpoint(object):
         """Do setup before writing to the endpoint."""
         pass
 
-    def download_blob(self, digest, size, blob_path):
+    def iter_blob(self, digest, size, offset=0):
         """
-        Download a blob from the registry to a local file.
+        Download a blob from the registry, from the given offset.
 
         Args:
             digest (str): The digest of the blob to download.
             size (int): The size of blob.
-            blob_path (str): The local path to write the blob to.
+            offset (int): The offset to start downloading from, which is asked for with a range
+                request. Defaults to 0.
+        Yields:
+            bytes: The blocks of the blob's contents, from the offset.
+        Raises:
+            IncompleteBlobError: If the download ends before the end of the blob.
         """
-        logger.info("%s: Downloading %s (size=%s)", self.registry, blob_path, size)
-
         url = "/v2/{}/blobs/{}".format(self.repo, digest)
-        result = self.session.get(url, stream=True)
+        headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+        result = self.session.get(url, stream=True, headers=headers)
         result.raise_for_status()
 
+        # The registry may ignore the range and send the whole blob.
+        skip = offset if result.status_code != requests.codes.PARTIAL_CONTENT else 0
         try:
-            with open(blob_path, 'wb') as f:
-                for block in result.iter_content(10 * 1024):
-                    f.write(block)
+            for block in result.iter_content(BLOCK_SIZE):
+                if skip:
+                    block, skip = block[skip:], max(skip - len(block), 0)
+                    if not block:
+                        continue
+                offset += len(block)
+                yield block
         finally:
             result.close()
 
-    def upload_blob(self, digest, size, blob_path):
+        if offset < size:
+            raise IncompleteBlobError(
+                "Download of {} ended after {} of {} bytes".format(digest, offset, size))
+
+    def download_blob(self, digest, size, blob_path):
         """
-        Upload a blob from a local file to the registry.
+        Download a blob from the registry to a local file.
+
+        If the download is interrupted, it is resumed from where it stopped. The digest of the blob
+        is verified as it is downloaded.
 
         Args:
-            digest (str): The digest of the blob to upload.
-            size (int): The size of blob to upload.
-            blob_path (str): The local path to read the blob from.
+            digest (str): The digest of the blob to download.
+            size (int): The size of blob.
+            blob_path (str): The local path to write the blob to.
+        Raises:
+            RuntimeError: If the downloaded blob doesn't match its digest.
         """
-        logger.info("%s: Uploading %s (size=%s)", self.registry, blob_path, size)
+        logger.info("%s: Downloading %s (size=%s)", self.registry, blob_path, size)
+        start = time.monotonic()
+
+        blob_digest = BlobDigest(digest)
+        offset = 0
+        with open(blob_path, 'wb') as f:
+            for tries in range(1, MAX_TRIES + 1):
+                try:
+                    for block in self.iter_blob(digest, size, offset):
+                        f.write(block)
+                        blob_digest.update(block)
+                        offset += len(block)
+                    break
+                except RESUMABLE_ERRORS as e:
+                    if tries == MAX_TRIES:
+                        raise
+                    logger.warning("%s: Download of %s interrupted after %d bytes, resuming: %s",
+                                   self.registry, digest, offset, e)
+
+        try:
+            blob_digest.verify()
+        except RuntimeError:
+            os.unlink(blob_path)
+            raise
+        _log_throughput(self.registry, 'Downloaded', digest, offset, start)
 
+    def _start_upload(self):
+        """
+        Start an upload session.
+
+        Returns:
+            str: The location to upload the blob to.
+        """
         url = "/v2/{}/blobs/uploads/".format(self.repo)
         result = self.session.post(url, data='')
         result.raise_for_status()
@@ -548,21 +785,37 @@ class RegistryEndpoint(object):
             raise RuntimeError("Unexpected successful response %s (202 expected)",
                                result.status_code)
 
-        upload_url = result.headers.get('Location')
-        parsed = urlparse(upload_url)
-        if parsed.query == '':
-            query = 'digest=' + digest
-        else:
-            query = parsed.query + '&digest=' + digest
-        relative = urlunparse(('', '', parsed.path, parsed.params, query, ''))
+        return result.headers.get('Location')
 
-        headers = {
-            'Content-Length': str(size),
-            'Content-Type': 'application/octet-stream'
-        }
-        with open(blob_path, 'rb') as f:
-            result = self.session.put(relative, data=f, headers=headers)
+    def _get_upload_url(self, location, digest=None):
+        """
+        Return the URL of an upload session, relative to the registry.
 
+        Args:
+            location (str): The location of the upload session, as returned by the registry.
+            digest (str or None): The digest of the blob, to finish the upload with. Defaults to
+                None.
+        Returns:
+            str: The relative URL.
+        """
+        parsed = urlparse(location)
+        query = parsed.query
+        if digest is not None:
+            if query == '':
+                query = 'digest=' + digest
+            else:
+                query = query + '&digest=' + digest
+        return urlunparse(('', '', parsed.path, parsed.params, query, ''))
+
+    def _finish_upload(self, result):
+        """
+        Check the response to the request ending an upload session.
+
+        Args:
+            result (requests.Response): The response.
+        Raises:
+            RuntimeError: If the response doesn't have the expected status.
+        """
         result.raise_for_status()
         if result.status_code != requests.codes.CREATED:
             # if it was a failed response 4xx or 5xx then the raise_for_status()
@@ -571,6 +824,176 @@ class RegistryEndpoint(object):
             raise RuntimeError("Unexpected successful response %s (201 expected)",
                                result.status_code)
 
+    def _upload_chunk(self, location, offset, chunk):
+        """
+        Upload a chunk of a blob to an upload session.
+
+        Args:
+            location (str): The location of the upload session.
+            offset (int): The offset of the chunk in the blob.
+            chunk (bytes or _ChunkBody): The contents of the chunk.
+        Returns:
+            str: The location to upload the next chunk to.
+        """
+        headers = {
+            'Content-Range': '{}-{}'.format(offset, offset + len(chunk) - 1),
+            'Content-Type': 'application/octet-stream'
+        }
+        result = self.session.patch(self._get_upload_url(location), data=chunk, headers=headers)
+        result.raise_for_status()
+
+        if result.status_code != requests.codes.ACCEPTED:
+            raise RuntimeError("Unexpected successful response %s (202 expected)",
+                               result.status_code)
+
+        return result.headers['Location']
+
+    def _get_upload_status(self, location):
+        """
+        Ask the registry how much of a blob an upload session received.
+
+        Args:
+            location (str): The location of the upload session.
+        Returns:
+            tuple: The location to upload the next chunk to, and the number of bytes received.
+        """
+        result = self.session.get(self._get_upload_url(location))
+        result.raise_for_status()
+
+        # The Range header holds the inclusive range of the bytes received, like 0-1023. Registries
+        # report 0-0 when they didn't receive anything yet, which is taken to mean that, rather
+        # than a single byte.
+        end = int(result.headers.get('Range', '0-0').split('-', 1)[1])
+        return result.headers.get('Location', location), end + 1 if end else 0
+
+    def _upload_chunked(self, digest, size, open_source):
+        """
+        Upload a blob to the registry in chunks of UPLOAD_CHUNK_SIZE bytes.
+
+        Each chunk is streamed from the blocks of the blob as it is sent. If the upload is
+        interrupted, the registry is asked how much of the blob it received, and the upload is
+        resumed from there. If the registry kept part of the interrupted chunk, the blob is read
+        again from the start of the chunk, and the part the registry has is only added to the
+        digest. The digest of the blob is verified as it is uploaded, and the upload is canceled if
+        it doesn't match.
+
+        Args:
+            digest (str): The digest of the blob to upload.
+            size (int): The size of blob to upload.
+            open_source (callable): Called with an offset, returns an iterable of the blocks of the
+                blob's contents from that offset.
+        Raises:
+            RuntimeError: If the upload cannot be resumed, or the blob doesn't match its digest.
+        """
+        start = time.monotonic()
+        blob_digest = BlobDigest(digest)
+        location = self._start_upload()
+        offset = received = 0
+        chunk = None
+        resuming = False
+        for tries in range(1, MAX_TRIES + 1):
+            try:
+                if resuming:
+                    location, received = self._get_upload_status(location)
+                    sent = offset + (chunk.sent if chunk is not None else 0)
+                    if not offset <= received <= sent:
+                        raise RuntimeError(
+                            "Cannot resume the upload of {}: the registry has {} bytes of it, "
+                            "but {} were confirmed and {} sent".format(
+                                digest, received, offset, sent))
+                    if chunk is not None and received == offset + len(chunk):
+                        # The registry received the last chunk, but its response was lost.
+                        blob_digest = chunk.digest
+                        offset = received
+                    chunk = None
+                    resuming = False
+
+                blocks = _Blocks(open_source(offset))
+                try:
+                    if received > offset:
+                        # The registry kept part of the last chunk, which isn't sent again.
+                        kept = _ChunkBody(blocks, received - offset, blob_digest)
+                        for _ in kept:
+                            pass
+                        blob_digest = kept.digest
+                        offset = received
+                    while offset < size:
+                        chunk = _ChunkBody(blocks, min(UPLOAD_CHUNK_SIZE, size - offset),
+                                           blob_digest)
+                        location = self._upload_chunk(location, offset, chunk)
+                        blob_digest = chunk.digest
+                        offset += len(chunk)
+                        chunk = None
+                finally:
+                    blocks.close()
+                break
+            except RESUMABLE_ERRORS as e:
+                if tries == MAX_TRIES:
+                    raise
+                logger.warning("%s: Upload of %s interrupted after %d bytes, resuming: %s",
+                               self.registry, digest, offset, e)
+                resuming = True
+
+        try:
+            blob_digest.verify()
+        except RuntimeError:
+            self.session.delete(self._get_upload_url(location))
+            raise
+        self._finish_upload(self.session.put(self._get_upload_url(location, digest), data=b''))
+        _log_throughput(self.registry, 'Uploaded', digest, offset, start)
+
+    def upload_blob(self, digest, size, blob_path):
+        """
+        Upload a blob from a local file to the registry.
+
+        Blobs bigger than UPLOAD_CHUNK_SIZE are uploaded in chunks, so that the upload can be
+        resumed if it is interrupted.
+
+        Args:
+            digest (str): The digest of the blob to upload.
+            size (int): The size of blob to upload.
+            blob_path (str): The local path to read the blob from.
+        """
+        logger.info("%s: Uploading %s (size=%s)", self.registry, blob_path, size)
+
+        if size > UPLOAD_CHUNK_SIZE:
+            def read(offset):
+                with open(blob_path, 'rb') as f:
+                    f.seek(offset)
+                    yield from iter(functools.partial(f.read, BLOCK_SIZE), b'')
+
+            self._upload_chunked(digest, size, read)
+            return
+
+        start = time.monotonic()
+        location = self._start_upload()
+        headers = {
+            'Content-Length': str(size),
+            'Content-Type': 'application/octet-stream'
+        }
+        with open(blob_path, 'rb') as f:
+            result = self.session.put(self._get_upload_url(location, digest), data=f,
+                                      headers=headers)
+
+        self._finish_upload(result)
+        _log_throughput(self.registry, 'Uploaded', digest, size, start)
+
+    def stream_blob(self, digest, size, src):
+        """
+        Copy a blob from another registry, streaming it without storing it locally.
+
+        The blob is uploaded in chunks as it is downloaded. If either side is interrupted, the
+        copy is resumed from the last chunk the registry received.
+
+        Args:
+            digest (str): The digest of the blob to copy.
+            size (int): The size of blob to copy.
+            src (RegistryEndpoint): The endpoint to download the blob from.
+        """
+        logger.info("%s: Streaming %s from %s (size=%s)", self.registry, digest, src.registry,
+                    size)
+        self._upload_chunked(digest, size, functools.partial(src.iter_blob, digest, size))
+
     def link_blob(self, digest, src_repo):
         """
         Create a new reference to an object in another repository on the same registry.
@@ -633,7 +1056,7 @@ class RegistryEndpoint(object):
         else:
             return get_manifest(self.session, self.repo, digest)
 
-    def write_manifest(self, info, toplevel=False):
+    def write_manifest(self, info, toplevel=False, tag=None):
         """
         Store a manifest to the endpoint.
 
@@ -642,9 +1065,11 @@ class RegistryEndpoint(object):
                 and other relevant information.
             toplevel (bool): If True, this should be the main manifest stored
                 in the endpoint.
+            tag (str or None): The tag to store a toplevel manifest as. If None (the default),
+                the tag of the endpoint is used.
         """
         if toplevel:
-            ref = self.tag
+            ref = self.tag if tag is None else tag
         else:
             ref = info.digest
 
@@ -656,28 +1081,134 @@ class RegistryEndpoint(object):
         response.raise_for_status()
 
 
+class BlobLocations(object):
+    """
+    The repositories the blobs are known to be in, shared by several copy operations.
+
+    When several images are copied to the same registry, this lets the blobs that have already been
+    copied be skipped without asking the registry, and the blobs that have been copied to another
+    repository be linked from there instead of being uploaded again.
+    """
+
+    def __init__(self):
+        """Initialize the BlobLocations."""
+        self._lock = threading.Lock()
+        self._locks = {}
+        self._repos = {}
+
+    def lock(self, digest):
+        """
+        Return the lock held while copying the blob with the given digest.
+
+        Args:
+            digest (str): The digest of the blob.
+        Returns:
+            threading.Lock: The lock of the blob.
+        """
+        with self._lock:
+            return self._locks.setdefault(digest, threading.Lock())
+
+    def add(self, registry, repo, digest):
+        """
+        Record that a repository has a blob.
+
+        Args:
+            registry (str): The hostname of the registry.
+            repo (str): The repository within the registry.
+            digest (str): The digest of the blob.
+        """
+        with self._lock:
+            self._repos.setdefault((registry, digest), set()).add(repo)
+
+    def get_repos(self, registry, digest):
+        """
+        Return the repositories of a registry known to have a blob.
+
+        Args:
+            registry (str): The hostname of the registry.
+            digest (str): The digest of the blob.
+        Returns:
+            list: The names of the repositories, sorted.
+        """
+        with self._lock:
+            return sorted(self._repos.get((registry, digest), ()))
+
+
 class Copier(object):
     """
     Implements a copy operation between different endpoints.
 
     As currently implemented, only copying to/from a registry and a directory
-    or within the *same* registry is implemented.
+    or between registries is implemented.
     """
 
-    def __init__(self, src, dest):
+    def __init__(self, src, dest, extra_tags=(), executor=None, blob_locations=None):
         """Initialize the Copier.
 
         Args:
             src (str): The source endpoint.
             dest (str): The destination endpoint.
+            extra_tags (list): Other tags of the destination registry endpoint to store the
+                main manifest as.
+            executor (concurrent.futures.Executor or None): If given, the blobs and the manifests
+                of manifest lists are copied concurrently with it. Otherwise they are copied one
+                after the other.
+            blob_locations (BlobLocations or None): If given, the repositories the blobs are known
+                to be in, which is updated as the blobs are copied to a registry.
         """
         self.src = src
         self.dest = dest
+        self.extra_tags = extra_tags
+        self.executor = executor
+        self.blob_locations = blob_locations
+
+    def _map(self, func, *iterables):
+        """
+        Call a function for each item of iterables, concurrently if the Copier has an executor.
+
+        Args:
+            func (callable): The function to call.
+            iterables (iterable): The arguments to call the function with, as for map().
+        Returns:
+            list: The results of the calls, in order.
+        Raises:
+            Exception: The first exception raised by the calls, if any.
+        """
+        if self.executor is None:
+            return list(map(func, *iterables))
+        return list(self.executor.map(func, *iterables))
 
     def _copy_blob(self, digest, size):
         """
         Copy a blob with given digest and size from the source to the destination.
 
+        Args:
+            digest (str): The digest of the blob to copy.
+            size (int): The size of the blob to copy.
+        """
+        if self.blob_locations is None or not isinstance(self.dest, RegistryEndpoint):
+            self._transfer_blob(digest, size)
+            return
+
+        # Hold the lock of the blob, so that a blob shared by images copied at the same time is
+        # only transferred once, and the other copies find it in blob_locations.
+        with self.blob_locations.lock(digest):
+            repos = self.blob_locations.get_repos(self.dest.registry, digest)
+            if self.dest.repo in repos:
+                return
+            if repos:
+                # Another image with this blob was copied to the registry, it's cheaper to link
+                # it from there than to transfer it again.
+                if not self.dest.has_blob(digest):
+                    self.dest.link_blob(digest, repos[0])
+            else:
+                self._transfer_blob(digest, size)
+            self.blob_locations.add(self.dest.registry, self.dest.repo, digest)
+
+    def _transfer_blob(self, digest, size):
+        """
+        Transfer a blob with given digest and size from the source to the destination if needed.
+
         Args:
             digest (str): The digest of the blob to copy.
             size (int): The size of the blob to copy.
@@ -690,56 +1221,115 @@ class Copier(object):
         elif isinstance(self.src, DirectoryEndpoint) and isinstance(self.dest, RegistryEndpoint):
             self.dest.upload_blob(digest, size, self.src.get_blob_path(digest))
         else:
-            # The copy() function below ensures that the following two asserts don't fail.
+            # The copy() function below ensures that the following assert doesn't fail.
             assert (isinstance(self.src, RegistryEndpoint)
                     and isinstance(self.dest, RegistryEndpoint))
-            assert self.src.registry == self.dest.registry
 
-            self.dest.link_blob(digest, self.src.repo)
+            if self.src.registry == self.dest.registry:
+                self.dest.link_blob(digest, self.src.repo)
+            else:
+                self.dest.stream_blob(digest, size, self.src)
 
         # Other forms of copying are not needed currently, and not implemented
 
-    def _copy_manifest(self, info, toplevel=False):
+    def _get_references(self, info):
         """
-        Copy the manifest referenced by info from the source to destination.
+        Return the blobs referenced by an image manifest.
 
         Args:
-            info (ManifestInfo): References the manifest to be copied.
-            toplevel (bool): If True, this should be the main manifest referenced in the repository.
-                Defaults to False.
+            info (ManifestInfo): The image manifest.
+        Returns:
+            list: 2-tuples of the digest and the size of the blobs.
         Raises:
             RuntimeError: If the referenced media type is not supported by this client.
         """
-        references = []
-        if info.media_type in (MEDIA_TYPE_MANIFEST_V2, MEDIA_TYPE_OCI):
-            manifest = json.loads(info.contents)
-            references.append((manifest['config']['digest'], manifest['config']['size']))
-            for layer in manifest['layers']:
-                references.append((layer['digest'], layer['size']))
-        else:
+        if info.media_type not in (MEDIA_TYPE_MANIFEST_V2, MEDIA_TYPE_OCI):
             raise RuntimeError("Unhandled media type %s", info.media_type)
 
-        for digest, size in references:
-            self._copy_blob(digest, size)
+        manifest = json.loads(info.contents)
+        references = [(manifest['config']['digest'], manifest['config']['size'])]
+        for layer in manifest['layers']:
+            references.append((layer['digest'], layer['size']))
+        return references
+
+    def _write_toplevel_manifest(self, info, tag=None):
+        """
+        Store the main manifest to the destination.
 
-        self.dest.write_manifest(info, toplevel=toplevel)
+        Args:
+            info (ManifestInfo): The main manifest.
+            tag (str or None): One of the extra tags to store the manifest as, or None for the
+                destination endpoint's own.
+        """
+        if tag is None:
+            self.dest.write_manifest(info, toplevel=True)
+        else:
+            self.dest.write_manifest(info, toplevel=True, tag=tag)
 
     def copy(self):
-        """Perform the copy operation."""
+        """
+        Perform the copy operation.
+
+        The manifests are all fetched before the blobs they reference are copied, so that the
+        blobs of all the images of a manifest list can be copied at the same time, and the blobs
+        the images have in common only once.
+
+        Raises:
+            RuntimeError: If the media type of a manifest is not supported by this client.
+        """
         self.dest.start_write()
         info = self.src.get_manifest()
         if info.media_type in (MEDIA_TYPE_MANIFEST_V2, MEDIA_TYPE_OCI):
-            self._copy_manifest(info, toplevel=True)
+            images = [info]
         elif info.media_type in (MEDIA_TYPE_LIST_V2, MEDIA_TYPE_OCI_INDEX):
             manifest = json.loads(info.contents)
-            for m in manifest['manifests']:
-                referenced = self.src.get_manifest(digest=m['digest'], media_type=m['mediaType'])
-                self._copy_manifest(referenced)
-            self.dest.write_manifest(info, toplevel=True)
-
+            images = self._map(
+                lambda m: self.src.get_manifest(digest=m['digest'], media_type=m['mediaType']),
+                manifest['manifests'])
         else:
             raise RuntimeError("Unhandled media type %s", info.media_type)
 
+        references = {}
+        for image in images:
+            references.update(self._get_references(image))
+        self._map(self._copy_blob, references.keys(), references.values())
+
+        if info.media_type in (MEDIA_TYPE_LIST_V2, MEDIA_TYPE_OCI_INDEX):
+            self._map(self.dest.write_manifest, images)
+        self._map(functools.partial(self._write_toplevel_manifest, info), [None, *self.extra_tags])
+
+
+def copy_image(src, dest, extra_tags=(), executor=None, blob_locations=None,
+               via_directory=False):
+    """
+    Copy an image between registry endpoints.
+
+    Args:
+        src (RegistryEndpoint): The source endpoint.
+        dest (RegistryEndpoint): The destination endpoint.
+        extra_tags (list): Other tags of the destination to store the image as.
+        executor (concurrent.futures.Executor or None): If given, the blobs and the manifests of
+            manifest lists are copied concurrently with it.
+        blob_locations (BlobLocations or None): If given, the repositories the blobs are known to
+            be in, shared by the images copied together.
+        via_directory (bool): If True, the blobs copied between different registries are stored in
+            a temporary directory, instead of being streamed from one to the other. Defaults to
+            False.
+    """
+    # Copier._copy_blob() assumes this:
+    # - The src and dest registries are of types RegistryEndpoint or DirectoryEndpoint, at least one
+    #   must be a RegistryEndpoint.
+    if via_directory and src.registry != dest.registry:
+        tempdir = tempfile.mkdtemp()
+        try:
+            tmp = DirectoryEndpoint(tempdir)
+            Copier(src, tmp, executor=executor).copy()
+            Copier(tmp, dest, extra_tags, executor, blob_locations).copy()
+        finally:
+            shutil.rmtree(tempdir)
+    else:
+        Copier(src, dest, extra_tags, executor, blob_locations).copy()
+
 
 @main.command()
 @click.option('--src-creds', '--screds', 'src_creds', metavar='USERNAME[:PASSWORD]',
@@ -758,29 +1348,17 @@ class Copier(object):
 @click.option('--dest-cert-dir', metavar='PATH',
               help=('use certificates at PATH (*.crt, *.cert, *.key) to connect to the '
                     'destination registry'))
+@click.option('--via-directory', is_flag=True,
+              help=('copy the blobs between different registries through a temporary directory, '
+                    'instead of streaming them from one to the other'))
 @click.argument('src', metavar='SOURCE-IMAGE-NAME')
 @click.argument('dest', metavar='DEST-IMAGE-NAME')
 def copy(src, dest, src_creds, src_tls_verify, src_cert_dir, dest_creds, dest_tls_verify,
-         dest_cert_dir):
+         dest_cert_dir, via_directory):
     """Copy an image from one location to another."""
     src = parse_spec(src, src_creds, src_tls_verify, src_cert_dir)
     dest = parse_spec(dest, dest_creds, dest_tls_verify, dest_cert_dir)
-
-    # Copier._copy_blob() assumes this:
-    # - The src and dest registries are of types RegistryEndpoint or DirectoryEndpoint, at least one
-    #   must be a RegistryEndpoint.
-    # - If both are a RegistryEndpoint, they must be the same so linking is possible, therefore we
-    #   copy src reg -> local dir -> dest reg if this isn't the case.
-    if src.registry != dest.registry:
-        tempdir = tempfile.mkdtemp()
-        try:
-            tmp = DirectoryEndpoint(tempdir)
-            Copier(src.get_endpoint(), tmp).copy()
-            Copier(tmp, dest.get_endpoint()).copy()
-        finally:
-            shutil.rmtree(tempdir)
-    else:
-        Copier(src.get_endpoint(), dest.get_endpoint()).copy()
+    copy_image(src.get_endpoint(), dest.get_endpoint(), via_directory=via_directory)
 
 
 if __name__ == '__main__':
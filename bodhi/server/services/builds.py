@@ -22,6 +22,7 @@ from cornice import Service
 from cornice.validators import colander_querystring_validator
 from pyramid.exceptions import HTTPNotFound
 from sqlalchemy import func, distinct
+from sqlalchemy.orm import with_polymorphic
 from sqlalchemy.sql import or_
 
 from bodhi.server.models import Update, Build, Package, Release
@@ -89,7 +90,8 @@ def query_builds(request):
     """
     db = request.db
     data = request.validated
-    query = db.query(Build).order_by(Build.nvr.asc())
+    # Load the columns of the Build subclasses with the builds, rather than with a query per build.
+    query = db.query(with_polymorphic(Build, '*')).order_by(Build.nvr.asc())
 
     nvr = data.get('nvr')
     if nvr is not None:
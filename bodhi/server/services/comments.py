@@ -174,7 +174,8 @@ def query_comments(request):
     page = data.get('page')
     rows_per_page = data.get('rows_per_page')
     pages = int(math.ceil(total / float(rows_per_page)))
-    query = query.offset(rows_per_page * (page - 1)).limit(rows_per_page)
+    query = query.offset(rows_per_page * (page - 1)).limit(rows_per_page)\
+        .options(*Comment.serialization_options())
 
     return dict(
         comments=query.all(),
@@ -1,9 +1,9 @@
-"""Tween to hook prometheus metric collection into pyramid."""
+"""Tween to hook prometheus metric collection into pyramid, and Bodhi's other metrics."""
 
 
 from time import time
 
-from prometheus_client import Histogram, Gauge
+from prometheus_client import Counter, Histogram, Gauge
 from pyramid.interfaces import IRoutesMapper
 
 
@@ -38,6 +38,41 @@ pyramid_request = Histogram(
 )
 
 
+outbound_request = Histogram(
+    'bodhi_outbound_request',
+    'HTTP requests sent to remote services',
+    labelnames=['service', 'method', 'status'],
+)
+
+
+outbound_request_errors = Counter(
+    'bodhi_outbound_request_errors',
+    'HTTP requests to remote services that failed or were not sent',
+    labelnames=['service', 'error'],
+)
+
+
+acl_cache_lookups = Counter(
+    'bodhi_acl_cache_lookups',
+    'Lookups of the ACLs of packages in the cache of the ACL system',
+    labelnames=['result'],
+)
+
+
+consumer_handler = Histogram(
+    'bodhi_consumer_handler',
+    'Messages handled by the handlers of the fedora-messaging consumer',
+    labelnames=['handler', 'status'],
+)
+
+
+consumer_queue_depth = Gauge(
+    'bodhi_consumer_queue_depth',
+    'Messages waiting for a thread of the handlers of the fedora-messaging consumer',
+    labelnames=['handler'],
+)
+
+
 def histo_tween_factory(handler, registry):
     """
     Create a tween to monitor number of requests at a given time.
@@ -24,6 +24,7 @@ from cornice import Service
 from cornice.validators import colander_body_validator, colander_querystring_validator
 from pyramid.exceptions import HTTPNotFound
 from sqlalchemy import func, distinct
+from sqlalchemy.orm import joinedload, with_polymorphic
 from sqlalchemy.sql import or_
 
 from bodhi.server import log, security
@@ -195,7 +196,10 @@ def query_overrides(request):
     page = data.get('page')
     rows_per_page = data.get('rows_per_page')
     pages = int(math.ceil(total / float(rows_per_page)))
-    query = query.offset(rows_per_page * (page - 1)).limit(rows_per_page)
+    # Load the columns of the Build subclasses with the builds, rather than with a query per build.
+    builds = with_polymorphic(Build, '*', flat=True)
+    query = query.offset(rows_per_page * (page - 1)).limit(rows_per_page)\
+        .options(joinedload(BuildrootOverride.build.of_type(builds)))
 
     return_values = dict(
         overrides=query.all(),
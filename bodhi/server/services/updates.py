@@ -18,12 +18,13 @@
 """Defines service endpoints pertaining to Updates."""
 
 import copy
+import hashlib
 import math
 
 from cornice import Service
 from cornice.validators import colander_body_validator, colander_querystring_validator
 from sqlalchemy import func, distinct
-from sqlalchemy.sql import or_
+from sqlalchemy.sql import and_, or_
 from requests import RequestException, Timeout as RequestsTimeout
 
 from bodhi.server import log, security
@@ -243,6 +244,23 @@ validators = (
 )
 
 
+def _get_cached_count(request, count_query):
+    """
+    Return the result of the given count query, from the cache if it was run recently.
+
+    Args:
+        request (pyramid.request): The current request.
+        count_query (sqlalchemy.sql.expression.Select): The query counting the updates.
+    Returns:
+        int: The number of updates.
+    """
+    compiled = count_query.compile(dialect=request.db.get_bind().dialect)
+    key = hashlib.sha1(
+        f'{compiled}{sorted(compiled.params.items())!r}'.encode('utf-8')).hexdigest()
+    return request.cache.get_or_create(
+        f'updates-count-{key}', lambda: request.db.execute(count_query).scalar())
+
+
 @updates_rss.get(schema=bodhi.server.schemas.ListUpdateSchema, renderer='rss',
                  error_handler=bodhi.server.services.errors.html_handler,
                  validators=validators)
@@ -275,6 +293,7 @@ def query_updates(request):
             pages: The total number of pages.
             rows_per_page: How many results on on the page.
             total: The total number of updates matching the query.
+            next_cursor: The cursor to pass to get the next page, or None on the last page.
             package: The package corresponding to the first update found in the search.
     """
     db = request.db
@@ -413,19 +432,44 @@ def query_updates(request):
         else:
             query = query.filter(Update.from_tag.is_(None))
 
-    query = query.order_by(Update.date_submitted.desc())
+    query = query.order_by(Update.date_submitted.desc(), Update.id.desc())
 
     # We can't use ``query.count()`` here because it is naive with respect to
     # all the joins that we're doing above.
     count_query = query.with_labels().statement\
         .with_only_columns([func.count(distinct(Update.id))])\
         .order_by(None)
-    total = db.execute(count_query).scalar()
+    if data.get('count') == 'cached':
+        total = _get_cached_count(request, count_query)
+    else:
+        total = db.execute(count_query).scalar()
 
     page = data.get('page')
     rows_per_page = data.get('rows_per_page')
     pages = int(math.ceil(total / float(rows_per_page)))
-    query = query.offset(rows_per_page * (page - 1)).limit(rows_per_page)
+
+    # Find the keys of the updates on the page first, so that updates matching several joined rows
+    # are only counted once, and so that we know if there are more updates after the page.
+    keys = query.with_entities(Update.date_submitted, Update.id).distinct()
+    cursor = data.get('cursor')
+    if cursor is not None:
+        date_submitted, id = cursor
+        keys = keys.filter(or_(
+            Update.date_submitted < date_submitted,
+            and_(Update.date_submitted == date_submitted, Update.id < id)))
+        # The position of a cursor isn't known, so there is no page number to report.
+        page = None
+    else:
+        keys = keys.offset(rows_per_page * (page - 1))
+    keys = keys.limit(rows_per_page + 1).all()
+
+    next_cursor = None
+    if len(keys) > rows_per_page:
+        keys = keys[:rows_per_page]
+        next_cursor = bodhi.server.schemas.Cursor().serialize(None, tuple(keys[-1]))
+    query = db.query(Update).filter(Update.id.in_([key.id for key in keys]))\
+        .options(*Update.serialization_options())\
+        .order_by(Update.date_submitted.desc(), Update.id.desc())
 
     return_values = dict(
         updates=query.all(),
@@ -433,6 +477,7 @@ def query_updates(request):
         pages=pages,
         rows_per_page=rows_per_page,
         total=total,
+        next_cursor=next_cursor,
         chrome=data.get('chrome'),
         display_user=data.get('display_user', False),
         display_request=data.get('display_request', True),
@@ -22,6 +22,7 @@ from cornice import Service
 from cornice.validators import colander_querystring_validator
 from pyramid.exceptions import HTTPNotFound
 from sqlalchemy import func, distinct
+from sqlalchemy.orm import selectinload
 from sqlalchemy.sql import or_
 
 from bodhi.server.models import Group, Update, User
@@ -164,7 +165,8 @@ def query_users(request):
     page = data.get('page')
     rows_per_page = data.get('rows_per_page')
     pages = int(math.ceil(total / float(rows_per_page)))
-    query = query.offset(rows_per_page * (page - 1)).limit(rows_per_page)
+    query = query.offset(rows_per_page * (page - 1)).limit(rows_per_page)\
+        .options(selectinload(User.groups))
 
     return dict(
         users=query.all(),
@@ -17,14 +17,16 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """Comment on updates after they reach the mandatory amount of time in the testing repository."""
 
+from datetime import datetime, timedelta
 import logging
 
-from sqlalchemy import func
+from sqlalchemy import and_, false, func, or_, true
+from sqlalchemy.orm import joinedload, selectinload
 
 from bodhi.messages.schemas import update as update_schemas
 from bodhi.server import Session, notifications, buildsys
 from bodhi.server.util import transactional_session_maker
-from ..models import Update, UpdateStatus, UpdateRequest
+from ..models import Comment, Release, Update, UpdateStatus, UpdateRequest
 from ..config import config
 
 
@@ -41,8 +43,14 @@ def main():
     db_factory = transactional_session_maker()
     try:
         with db_factory() as db:
-            testing = db.query(Update).filter_by(status=UpdateStatus.testing, request=None)
-            for update in testing:
+            testing = db.query(Update.id).filter_by(status=UpdateStatus.testing, request=None)
+            ids = [id for id, in testing.filter(candidates_filter(db)).order_by(Update.id)]
+            for id in ids:
+                # Each commit expires the loaded updates, so they are loaded one at a time.
+                update = db.query(Update).filter_by(id=id).options(
+                    joinedload(Update.release),
+                    selectinload(Update.comments).joinedload(Comment.user),
+                ).one()
                 approve_update(update, db)
                 db.commit()
     except Exception:
@@ -51,6 +59,40 @@ def main():
         db_factory._end_session()
 
 
+def candidates_filter(db: Session):
+    """
+    Return an SQL filter on the updates that approve_update() may comment on.
+
+    It leaves out the updates that approve_update() would bail on whatever their comments are:
+    those without mandatory days in testing that are not autotime, and those that already have the
+    stable comment since their karma was last reset. Unless the release lets updates meet their
+    testing requirements right away, it also leaves out the updates that have not been in testing
+    long enough yet and can't have reached the required karma, as they don't have any positive
+    karma since it was last reset. The filter may let through updates that don't meet the
+    requirements, which approve_update() checks in full.
+
+    Args:
+        db: The database session.
+    Returns:
+        sqlalchemy.sql.elements.ClauseElement: The filter to apply on a query of updates.
+    """
+    now = datetime.utcnow()
+    releases = []
+    for release in db.query(Release):
+        days = release.mandatory_days_in_testing
+        # Critical path updates have their own mandatory days in testing.
+        min_days = min(days, release.critpath_mandatory_days_in_testing)
+        if min_days > 0 and release.critpath_min_karma > 0:
+            ready = or_(Update.date_testing <= now - timedelta(days=min_days),
+                        Update.stable_karma <= 0, Update.positive_karma > 0)
+        else:
+            ready = true()
+        releases.append(and_(Update.release_id == release.id,
+                             true() if days else Update.autotime == true(), ready))
+
+    return and_(or_(false(), *releases), Update.stable_comment_posted == false())
+
+
 def approve_update(update: Update, db: Session):
     """Add a comment to an update if it is ready for stable.
 
@@ -17,14 +17,79 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 """Check the enforced policies by Greenwave for each open update."""
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
 import logging
 
+from dogpile.cache import make_region
+from dogpile.cache.api import NO_VALUE
+from sqlalchemy.orm import selectinload
+
 from bodhi.server import models
+from bodhi.server.config import config
 from bodhi.server.util import transactional_session_maker
 
 
 log = logging.getLogger(__name__)
 
+# The decisions are written to the database in transactions of this many updates.
+COMMIT_BATCH_SIZE = 100
+
+# The test gating statuses that Greenwave doesn't need to be asked about again as long as the
+# requests about the update don't change.
+SETTLED_STATUSES = (models.TestGatingStatus.passed, models.TestGatingStatus.ignored)
+
+_decisions = None
+
+
+def _get_decisions():
+    """
+    Return the dogpile.cache region the decisions of Greenwave are remembered in.
+
+    Returns:
+        dogpile.cache.region.CacheRegion: The region, configured from the ``dogpile.cache.``
+            settings on first use.
+    """
+    global _decisions
+    if _decisions is None:
+        _decisions = make_region().configure_from_config(config, 'dogpile.cache.')
+    return _decisions
+
+
+def forget_decisions():
+    """Make the next run ask Greenwave about all the updates again."""
+    _get_decisions().invalidate()
+
+
+def _fingerprint(batches):
+    """
+    Return a digest of the requests to send to Greenwave about an update.
+
+    Args:
+        batches (list): The requests, as returned by Update.greenwave_request_batches().
+    Returns:
+        str: The hex digest of the requests.
+    """
+    return hashlib.sha256(json.dumps(batches, sort_keys=True).encode()).hexdigest()
+
+
+def _is_unchanged(update, fingerprint):
+    """
+    Return whether Greenwave already gave a settled decision about the same requests.
+
+    Args:
+        update (bodhi.server.models.Update): The update to check.
+        fingerprint (str): The fingerprint of the requests about the update.
+    Returns:
+        bool: True if the update doesn't need to be checked again.
+    """
+    ttl = config['greenwave_decision_cache_ttl']
+    if ttl <= 0 or update.test_gating_status not in SETTLED_STATUSES:
+        return False
+    decision = _get_decisions().get(f'greenwave-decision:{update.alias}', expiration_time=ttl)
+    return decision is not NO_VALUE and decision == (fingerprint, update.test_gating_status.value)
+
 
 def main():
     """Check the enforced policies by Greenwave for each open update."""
@@ -46,13 +111,64 @@ def main():
             # Check the older updates first so there is more time for the newer to
             # get their test results
             models.Update.id.asc()
+        ).options(
+            selectinload(models.Update.builds),
+            selectinload(models.Update.release),
         )
 
-        for update in updates:
+        # Greenwave is queried from a pool of threads, which only get the requests to send, as
+        # they must not touch the database.
+        decisions = []
+        with ThreadPoolExecutor(
+                max_workers=config['greenwave_max_concurrent_requests']) as executor:
+            for update in updates:
+                try:
+                    batches = update.greenwave_request_batches(verbose=False)
+                    fingerprint = _fingerprint(batches)
+                    if _is_unchanged(update, fingerprint):
+                        log.debug(f'The Greenwave requests about {update.alias} did not change')
+                        continue
+                    decision = executor.submit(
+                        models.Update.decide_test_gating_status, update._greenwave_api_url,
+                        batches)
+                except Exception:
+                    log.exception(f"There was an error checking the policy for {update.alias}")
+                    continue
+                decisions.append((update, fingerprint, decision))
+
+        decided = []
+        for update, fingerprint, decision in decisions:
             try:
-                update.update_test_gating_status()
-                session.commit()
+                update.test_gating_status = decision.result()
             except Exception:
                 # If there is a problem talking to Greenwave server, print the error.
                 log.exception(f"There was an error checking the policy for {update.alias}")
-                session.rollback()
+                continue
+            decided.append((update.alias, fingerprint, update.test_gating_status))
+            if len(decided) == COMMIT_BATCH_SIZE:
+                _commit(session, decided)
+                decided = []
+        _commit(session, decided)
+
+
+def _commit(session, decided):
+    """
+    Commit the new test gating statuses of the given updates, and remember the settled ones.
+
+    If the commit fails, the statuses are lost and will be checked again on the next run.
+
+    Args:
+        session (sqlalchemy.orm.session.Session): The database session.
+        decided (list): 3-tuples of the alias of an update, the fingerprint of the requests about
+            it, and its new test gating status.
+    """
+    try:
+        session.commit()
+    except Exception:
+        log.exception(f"There was an error saving the policy checks of {len(decided)} updates")
+        session.rollback()
+        return
+    if config['greenwave_decision_cache_ttl'] > 0:
+        for alias, fingerprint, status in decided:
+            if status in SETTLED_STATUSES:
+                _get_decisions().set(f'greenwave-decision:{alias}', (fingerprint, status.value))
@@ -34,23 +34,24 @@ import tempfile
 import threading
 import time
 import typing
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from http.client import IncompleteRead
 from urllib.error import HTTPError, URLError
-from urllib.request import urlopen
 
 import jinja2
 import sqlalchemy.orm.exc
+from sqlalchemy.orm import selectinload
 
 from bodhi.messages.schemas import compose as compose_schemas, update as update_schemas
-from bodhi.server import buildsys, notifications, mail
+from bodhi.server import bugs, buildsys, notifications, mail, rpmcache, waits
 from bodhi.server.config import config, validate_path
 from bodhi.server.exceptions import BodhiException
 from bodhi.server.metadata import UpdateInfoMetadata
 from bodhi.server.models import (Compose, ComposeState, Update, UpdateRequest, UpdateType, Release,
                                  UpdateStatus, ReleaseState, ContentType)
 from bodhi.server.tasks.clean_old_composes import main as clean_old_composes
-from bodhi.server.util import (copy_container, sorted_updates, sanity_check_repodata,
+from bodhi.server.util import (copy_containers, sorted_updates, sanity_check_repodata,
                                transactional_session_maker)
 
 
@@ -462,6 +463,17 @@ class ComposerThread(threading.Thread):
         # sqlalchemy will requery for the composes instead of using its cached copy.
         self.db.expire(self.compose, ['updates'])
 
+    def _load_builds(self):
+        """
+        Load the builds and bugs of all the Updates in the compose, with one query each.
+
+        Going through the builds of the Updates of the compose afterwards then doesn't query the
+        database again.
+        """
+        update_ids = [update.id for update in self.compose.updates]
+        self.db.query(Update).filter(Update.id.in_(update_ids)).options(
+            selectinload(Update.builds), selectinload(Update.bugs)).all()
+
     def eject_from_compose(self, update, reason):
         """
         Eject the given Update from the current compose for the given human-readable reason.
@@ -680,11 +692,24 @@ class ComposerThread(threading.Thread):
                 update, use_template='maillist_template')):
             self.testing_digest[prefix][update.builds[i].nvr] = subbody[1]
 
+    def _prefetch_rpm_headers(self, updates):
+        """
+        Fetch the RPM headers of the RPM builds of the given updates from Koji with multicalls.
+
+        Args:
+            updates (list): The updates whose e-mails are going to be written.
+        """
+        rpmcache.headers.prefetch(
+            build.nvr for update in updates for build in update.builds
+            if build.type is ContentType.rpm)
+
     def generate_testing_digest(self):
         """Generate a testing digest message for this release."""
         log.info('Generating testing digest for %s' % self.compose.release.name)
-        for update in self.compose.updates:
-            if update.request is UpdateRequest.testing:
+        updates = [u for u in self.compose.updates if u.request is UpdateRequest.testing]
+        with rpmcache.headers.counting('Testing digest for %s' % self.compose.release.name):
+            self._prefetch_rpm_headers(updates)
+            for update in updates:
                 self.add_to_digest(update)
         log.info('Testing digest generation for %s complete' % self.compose.release.name)
 
@@ -705,11 +730,18 @@ class ComposerThread(threading.Thread):
 
     @checkpoint
     def modify_bugs(self):
-        """Mark bugs on each Update as modified."""
+        """
+        Mark bugs on each Update as modified.
+
+        The bugs of all the updates are retrieved from Bugzilla with a single call, and modified
+        concurrently.
+        """
         log.info('Updating bugs')
-        for update in self.compose.updates:
-            log.debug('Modifying bugs for %s', update.alias)
-            update.modify_bugs()
+        bug_ids = [bug.bug_id for update in self.compose.updates for bug in update.bugs]
+        with bugs.bugtracker.batch(bug_ids):
+            for update in self.compose.updates:
+                log.debug('Modifying bugs for %s', update.alias)
+                update.modify_bugs()
 
     @checkpoint
     def status_comments(self):
@@ -722,49 +754,27 @@ class ComposerThread(threading.Thread):
     def send_stable_announcements(self):
         """Send the stable announcement e-mails out."""
         log.info('Sending stable update announcements')
-        for update in self.compose.updates:
-            if update.request is UpdateRequest.stable:
+        updates = [u for u in self.compose.updates if u.request is UpdateRequest.stable]
+        with rpmcache.headers.counting('Stable announcements'), mail.batch():
+            self._prefetch_rpm_headers(updates)
+            for update in updates:
                 update.send_update_notice()
 
     @checkpoint
     def send_testing_digest(self):
         """Send digest mail to mailing lists."""
         log.info('Sending updates-testing digest')
-        sechead = 'The following %s Security updates need testing:\n Age  URL\n'
-        crithead = 'The following %s Critical Path updates have yet to be approved:\n Age URL\n'
         testhead = 'The following builds have been pushed to %s updates-testing\n\n'
 
         for prefix, content in self.testing_digest.items():
-            release = self.db.query(Release).filter_by(long_name=prefix).one()
-            test_list_key = '%s_test_announce_list' % (
-                release.id_prefix.lower().replace('-', '_'))
-            test_list = config.get(test_list_key)
+            test_list_key, test_list = self._get_test_announce_list(prefix)
             if not test_list:
                 log.warning('%r undefined. Not sending updates-testing digest',
                             test_list_key)
                 continue
 
             log.debug("Sending digest for updates-testing %s" % prefix)
-            maildata = ''
-            security_updates = self.get_security_updates(prefix)
-            if security_updates:
-                maildata += sechead % prefix
-                for update in security_updates:
-                    maildata += ' %3i  %s   %s\n' % (
-                        update.days_in_testing,
-                        update.abs_url(),
-                        update.title)
-                maildata += '\n\n'
-
-            critpath_updates = self.get_unapproved_critpath_updates(prefix)
-            if critpath_updates:
-                maildata += crithead % prefix
-                for update in self.get_unapproved_critpath_updates(prefix):
-                    maildata += ' %3i  %s   %s\n' % (
-                        update.days_in_testing,
-                        update.abs_url(),
-                        update.title)
-                maildata += '\n\n'
+            maildata = self._render_testing_digest_header(prefix)
 
             maildata += testhead % prefix
             updlist = sorted(content.keys())
@@ -777,6 +787,55 @@ class ComposerThread(threading.Thread):
             mail.send_mail(config.get('bodhi_email'), test_list,
                            '%s updates-testing report' % prefix, maildata)
 
+    def _get_test_announce_list(self, prefix):
+        """
+        Return the mailing list that the testing digest of the given release is sent to.
+
+        Args:
+            prefix (str): The long_name of the Release.
+        Returns:
+            tuple: The name of the setting defining the mailing list, and its value.
+        """
+        release = self.db.query(Release).filter_by(long_name=prefix).one()
+        test_list_key = '%s_test_announce_list' % (
+            release.id_prefix.lower().replace('-', '_'))
+        return test_list_key, config.get(test_list_key)
+
+    def _render_testing_digest_header(self, prefix):
+        """
+        Render the lists of security and unapproved critical path updates of a testing digest.
+
+        Args:
+            prefix (str): The long_name of the Release the digest is about.
+        Returns:
+            str: The beginning of the testing digest.
+        """
+        sechead = 'The following %s Security updates need testing:\n Age  URL\n'
+        crithead = 'The following %s Critical Path updates have yet to be approved:\n Age URL\n'
+
+        maildata = ''
+        security_updates = self.get_security_updates(prefix)
+        if security_updates:
+            maildata += sechead % prefix
+            for update in security_updates:
+                maildata += ' %3i  %s   %s\n' % (
+                    update.days_in_testing,
+                    update.abs_url(),
+                    update.title)
+            maildata += '\n\n'
+
+        critpath_updates = self.get_unapproved_critpath_updates(prefix)
+        if critpath_updates:
+            maildata += crithead % prefix
+            for update in critpath_updates:
+                maildata += ' %3i  %s   %s\n' % (
+                    update.days_in_testing,
+                    update.abs_url(),
+                    update.title)
+            maildata += '\n\n'
+
+        return maildata
+
     def get_security_updates(self, release):
         """
         Return an iterable of security updates in the given release.
@@ -793,7 +852,7 @@ class ComposerThread(threading.Thread):
             Update.status == UpdateStatus.testing,
             Update.release == release,
             Update.request.is_(None)
-        ).all()
+        ).options(sqlalchemy.orm.selectinload(Update.builds)).all()
         updates = self.sort_by_days_in_testing(updates)
         return updates
 
@@ -816,7 +875,8 @@ class ComposerThread(threading.Thread):
             status=UpdateStatus.testing,
             request=None,
             release=release,
-        ).order_by(Update.date_submitted.desc()).all()
+        ).order_by(Update.date_submitted.desc()).options(
+            sqlalchemy.orm.selectinload(Update.builds)).all()
         updates = self.sort_by_days_in_testing(updates)
         return updates
 
@@ -841,11 +901,14 @@ class ContainerComposerThread(ComposerThread):
 
     def _compose_updates(self):
         """
-        Use skopeo to copy images to the correct repos and tags.
+        Copy images to the correct repos and tags, with skopeo or natively.
 
         Raises:
-            RuntimeError: If skopeo returns a non-0 exit code during copy_container.
+            RuntimeError: If skopeo returns a non-0 exit code during copy_containers.
+            requests.HTTPError: If a registry returns an error status during a native copy.
         """
+        self._load_builds()
+        copies = []
         for update in self.compose.updates:
 
             if update.request is UpdateRequest.stable:
@@ -856,8 +919,9 @@ class ContainerComposerThread(ComposerThread):
             for build in update.builds:
                 # Using None as the destination tag on the first one will default to the
                 # version-release string.
-                for dtag in [None, build.nvr_version, destination_tag]:
-                    copy_container(build, destination_tag=dtag)
+                copies.append((build, [None, build.nvr_version, destination_tag]))
+
+        copy_containers(copies)
 
 
 class FlatpakComposerThread(ContainerComposerThread):
@@ -925,14 +989,18 @@ class PungiComposerThread(ComposerThread):
 
         composedone = self._checkpoints.get('compose_done')
 
-        if not self.skip_compose and not composedone:
+        if self.skip_compose or composedone:
+            self.generate_testing_digest()
+        else:
             pungi_process = self._punge()
 
-        # Things we can do while Pungi is running
-        self.generate_testing_digest()
-
-        if not self.skip_compose and not composedone:
-            uinfo = self._generate_updateinfo()
+            # Things we can do while Pungi is running
+            prefetching = self._start_prefetching_rpm_headers()
+            try:
+                uinfo = self._generate_updateinfo()
+            finally:
+                self._finish_prefetching_rpm_headers(prefetching)
+            self.generate_testing_digest()
 
             self._wait_for_pungi(pungi_process)
 
@@ -949,6 +1017,56 @@ class PungiComposerThread(ComposerThread):
             # Wait for the repo to hit the master mirror
             self._wait_for_sync()
 
+    def _start_prefetching_rpm_headers(self):
+        """
+        Start fetching the RPM headers of the compose's builds from Koji on a separate thread.
+
+        The testing digest and the stable announcements quote the headers of the builds, which do
+        not depend on the result of the compose, so they are fetched while Pungi runs. The thread
+        has its own Koji session and does not touch the database. Nothing is fetched if a resumed
+        compose already sent the notifications that need the headers.
+
+        Returns:
+            threading.Thread or None: The started thread, or None if there is nothing to fetch.
+        """
+        if self.compose.request is UpdateRequest.stable:
+            consumer = 'send_stable_announcements'
+        else:
+            consumer = 'send_testing_digest'
+        if self.resume and self._checkpoints.get(consumer):
+            return None
+        nvrs = [build.nvr for update in self.compose.updates for build in update.builds
+                if build.type is ContentType.rpm]
+        if not nvrs:
+            return None
+
+        def prefetch():
+            try:
+                rpmcache.headers.prefetch(nvrs)
+            except Exception:
+                log.exception('Failed to prefetch the RPM headers of %s, they will be fetched '
+                              'when they are needed', self.id)
+
+        thread = threading.Thread(target=prefetch, name=f'{self.id}-rpm-headers', daemon=True)
+        thread.start()
+        return thread
+
+    def _finish_prefetching_rpm_headers(self, thread):
+        """
+        Wait for the thread started by _start_prefetching_rpm_headers() to finish.
+
+        The time the compose waited for it is recorded in the wait_durations checkpoint, so that it
+        shows whether the headers were fetched before they were needed.
+
+        Args:
+            thread (threading.Thread or None): What _start_prefetching_rpm_headers() returned.
+        """
+        if thread is None:
+            return
+        start = time.monotonic()
+        thread.join()
+        self._record_wait_duration('rpm_headers', start)
+
     def _copy_additional_pungi_files(self, pungi_conf_dir, template_env):
         """
         Child classes should override this to place type-specific Pungi files in the config dir.
@@ -1119,6 +1237,9 @@ class PungiComposerThread(ComposerThread):
         we get a repository with either hardlinks or copied files.
         This means that we when we go and sync generated repositories out, we do not need to take
         special case to copy the target files rather than symlinks.
+
+        The arches are checked concurrently by up to max_concurrent_sanity_checks threads, and how
+        long each check took is recorded in the sanity_check_durations checkpoint.
         """
         log.info("Running sanity checks on %s" % self.path)
 
@@ -1134,7 +1255,36 @@ class PungiComposerThread(ComposerThread):
             self._toss_out_repo()
             raise Exception('Empty compose found')
 
+        # Each arch is checked in its own thread, since the checks mostly wait for dnf and the disk.
+        durations = {}
+        with ThreadPoolExecutor(max_workers=config['max_concurrent_sanity_checks']) as executor:
+            futures = {arch: executor.submit(self._sanity_check_arch, arch, durations)
+                       for arch in arches}
+        self._checkpoints['sanity_check_durations'] = durations
+        log.info('Sanity checks took %s', ', '.join(
+            '%.1fs for %s' % (durations[arch], arch) for arch in sorted(durations)))
+
+        # Only toss the repo out once all the checks are done, so they don't see it disappear.
         for arch in arches:
+            if futures[arch].exception() is not None:
+                self._toss_out_repo()
+                raise futures[arch].exception()
+
+        return True
+
+    def _sanity_check_arch(self, arch, durations):
+        """
+        Sanity check the repodata and packages of the given arch of our repo.
+
+        Args:
+            arch (str): The arch to check, as named in the compose's Everything directory.
+            durations (dict): A mapping of arches to how many seconds their check took, which the
+                duration of this check is added to.
+        Raises:
+            Exception: If the repodata is invalid or the packages are symlinks.
+        """
+        start = time.monotonic()
+        try:
             # sanity check our repodata
             try:
                 if arch == 'source':
@@ -1148,7 +1298,6 @@ class PungiComposerThread(ComposerThread):
                     sanity_check_repodata(repodata, repo_type=repo_type)
             except Exception:
                 log.exception("Repodata sanity check failed, compose thrown out")
-                self._toss_out_repo()
                 raise
 
             # make sure that pungi didn't symlink our packages
@@ -1181,10 +1330,9 @@ class PungiComposerThread(ComposerThread):
                             break
             except Exception:
                 log.exception('Unable to check pungi composed repositories, compose thrown out')
-                self._toss_out_repo()
                 raise
-
-        return True
+        finally:
+            durations[arch] = round(time.monotonic() - start, 1)
 
     def _stage_repo(self):
         """Symlink our updates repository into the staging directory."""
@@ -1239,7 +1387,13 @@ class PungiComposerThread(ComposerThread):
         self._checkpoints['completed_repo'] = self.path
 
     def _wait_for_repo_signature(self):
-        """Wait for a repo signature to appear."""
+        """
+        Wait for a repo signature to appear.
+
+        The repodata directories are watched with inotify so the wait ends as soon as the last
+        signature is written. They are also checked every wait_for_repo_sig_interval seconds, in
+        case they are written by another host on a network filesystem.
+        """
         # This message indicates to consumers that the repos are fully created and ready to be
         # signed or otherwise processed.
         notifications.publish(compose_schemas.RepoDoneV1.from_dict(
@@ -1258,17 +1412,20 @@ class PungiComposerThread(ComposerThread):
                                                  'repomd.xml.asc'))
 
             log.info('Waiting for signatures in %s', ', '.join(sigpaths))
-            while True:
-                missing = []
-                for path in sigpaths:
-                    if not os.path.exists(path):
-                        missing.append(path)
-                if len(missing) == 0:
-                    log.info('All signatures were created')
-                    break
-                else:
-                    log.info('Waiting on %s', ', '.join(missing))
-                    time.sleep(300)
+            start = time.monotonic()
+            with waits.FileWatcher(os.path.dirname(path) for path in sigpaths) as watcher:
+                while True:
+                    missing = []
+                    for path in sigpaths:
+                        if not os.path.exists(path):
+                            missing.append(path)
+                    if len(missing) == 0:
+                        log.info('All signatures were created')
+                        break
+                    else:
+                        log.info('Waiting on %s', ', '.join(missing))
+                        watcher.wait(config['wait_for_repo_sig_interval'])
+            self._record_wait_duration('repo_signature', start)
         else:
             log.info('Not waiting for a repo signature')
 
@@ -1276,6 +1433,11 @@ class PungiComposerThread(ComposerThread):
         """
         Block until our repomd.xml hits the master mirror.
 
+        The master repomd.xml is polled with conditional requests, first after
+        wait_for_sync_min_interval seconds and then twice as late each time, up to
+        wait_for_sync_max_interval seconds. A poll that gets no answer within
+        wait_for_sync_max_interval seconds counts as an unchanged repomd.xml.
+
         Raises:
             Exception: If no folder other than "source" was found in the compose_path.
         """
@@ -1304,17 +1466,27 @@ class PungiComposerThread(ComposerThread):
 
         with open(repomd) as repomdf:
             checksum = hashlib.sha1(repomdf.read().encode('utf-8')).hexdigest()
+        fetcher = waits.ConditionalFetcher(master_repomd_url,
+                                           config['wait_for_sync_max_interval'])
+        delays = waits.backoff(config['wait_for_sync_min_interval'],
+                               config['wait_for_sync_max_interval'])
+        start = time.monotonic()
         while True:
             try:
                 log.info('Polling %s' % master_repomd_url)
-                masterrepomd = urlopen(master_repomd_url)
-                newsum = hashlib.sha1(masterrepomd.read()).hexdigest()
+                masterrepomd = fetcher.fetch()
             except (ConnectionResetError, IncompleteRead, URLError, HTTPError):
                 log.exception('Error fetching repomd.xml')
-                time.sleep(200)
+                time.sleep(next(delays))
                 continue
+            if masterrepomd is None:
+                log.debug("master repomd.xml hasn't changed for %r", self.id)
+                time.sleep(next(delays))
+                continue
+            newsum = hashlib.sha1(masterrepomd).hexdigest()
             if newsum == checksum:
                 log.info("master repomd.xml matches!")
+                self._record_wait_duration('sync', start)
                 notifications.publish(compose_schemas.ComposeSyncDoneV1.from_dict(
                     dict(repo=self.id, agent=self.agent)),
                     force=True)
@@ -1322,7 +1494,21 @@ class PungiComposerThread(ComposerThread):
 
             log.debug("master repomd.xml doesn't match! %s != %s for %r",
                       checksum, newsum, self.id)
-            time.sleep(200)
+            time.sleep(next(delays))
+
+    def _record_wait_duration(self, name, start):
+        """
+        Record how long a wait took in the wait_durations checkpoint, and log it.
+
+        The checkpoint is stored with the compose the next time its state is saved.
+
+        Args:
+            name (str): The name of the wait.
+            start (float): The value of time.monotonic() when the wait started.
+        """
+        duration = round(time.monotonic() - start, 1)
+        self._checkpoints.setdefault('wait_durations', {})[name] = duration
+        log.info('Waiting for %s took %.1fs', name.replace('_', ' '), duration)
 
 
 class RPMComposerThread(PungiComposerThread):
@@ -35,6 +35,7 @@ def main(alias: str, bugs: typing.List[int]):
     Iterate the given list of bugs associated with the given update. For each bug, retrieve
     details from Bugzilla, comment on the bug to let watchers know about the update, and mark
     the bug as MODIFIED. If the bug is a security issue, mark the update as a security update.
+    The bugs are all retrieved with a single call, and modified concurrently.
 
     Args:
         update: The update that the bugs are associated with.
@@ -50,37 +51,38 @@ def main(alias: str, bugs: typing.List[int]):
         if not update:
             raise BodhiException(f"Couldn't find alias {alias} in DB")
 
-        for bug_id in bugs:
-            bug = Bug.get(bug_id)
-            # Sanity check
-            if bug is None or bug not in update.bugs:
-                update_bugs_ids = [b.bug_id for b in update.bugs]
-                update.update_bugs(update_bugs_ids + [bug_id], session)
-                # Now, after update.update_bugs, bug with bug_id should exists in DB
+        with bug_module.bugtracker.batch(bugs):
+            for bug_id in bugs:
                 bug = Bug.get(bug_id)
-
-            log.info(f'Getting RHBZ bug {bug.bug_id}')
-            try:
-                rhbz_bug = bug_module.bugtracker.getbug(bug.bug_id)
-
-                log.info(f'Updating our details for {bug.bug_id}')
-                bug.update_details(rhbz_bug)
-                log.info(f'  Got title {bug.title} for {bug.bug_id}')
-
-                # If you set the type of your update to 'enhancement' but you
-                # attach a security bug, we automatically change the type of your
-                # update to 'security'. We need to do this first, so we don't
-                # accidentally comment on stuff that we shouldn't.
-                if not update.type == UpdateType.security and bug.security:
-                    log.info("Setting our UpdateType to security.")
-                    update.type = UpdateType.security
-
-                log.info(f'Commenting on {bug.bug_id}')
-                comment = config['initial_bug_msg'] % (
-                    update.alias, update.release.long_name, update.abs_url())
-
-                log.info(f'Modifying {bug.bug_id}')
-                bug.modified(update, comment)
-            except Exception:
-                log.warning('Error occurred during updating single bug', exc_info=True)
-                raise ExternalCallException
+                # Sanity check
+                if bug is None or bug not in update.bugs:
+                    update_bugs_ids = [b.bug_id for b in update.bugs]
+                    update.update_bugs(update_bugs_ids + [bug_id], session)
+                    # Now, after update.update_bugs, bug with bug_id should exists in DB
+                    bug = Bug.get(bug_id)
+
+                log.info(f'Getting RHBZ bug {bug.bug_id}')
+                try:
+                    rhbz_bug = bug_module.bugtracker.getbug(bug.bug_id)
+
+                    log.info(f'Updating our details for {bug.bug_id}')
+                    bug.update_details(rhbz_bug)
+                    log.info(f'  Got title {bug.title} for {bug.bug_id}')
+
+                    # If you set the type of your update to 'enhancement' but you
+                    # attach a security bug, we automatically change the type of your
+                    # update to 'security'. We need to do this first, so we don't
+                    # accidentally comment on stuff that we shouldn't.
+                    if not update.type == UpdateType.security and bug.security:
+                        log.info("Setting our UpdateType to security.")
+                        update.type = UpdateType.security
+
+                    log.info(f'Commenting on {bug.bug_id}')
+                    comment = config['initial_bug_msg'] % (
+                        update.alias, update.release.long_name, update.abs_url())
+
+                    log.info(f'Modifying {bug.bug_id}')
+                    bug.modified(update, comment)
+                except Exception:
+                    log.warning('Error occurred during updating single bug', exc_info=True)
+                    raise ExternalCallException
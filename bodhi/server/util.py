@@ -18,6 +18,7 @@
 """Random functions that don't fit elsewhere."""
 
 from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from urllib.parse import urlencode
 import errno
@@ -45,9 +46,10 @@ import pkg_resources
 import requests
 import rpm
 
-from bodhi.server import ffmarkdown, log, buildsys, Session
+from bodhi.server import ffmarkdown, log, buildsys, http_client, rpmcache, Session
 from bodhi.server.config import config
 from bodhi.server.exceptions import RepodataException
+from bodhi.server.scripts import skopeo_lite
 
 
 if typing.TYPE_CHECKING:  # pragma: no cover
@@ -69,6 +71,24 @@ def get_rpm_header(nvr, tries=0):
     """
     Get the rpm header for a given build.
 
+    The headers are cached by NVR in :data:`bodhi.server.rpmcache.headers`, since they never change.
+
+    Args:
+        nvr (str): The name-version-release string of the build you want headers for.
+        tries (int): The number of attempts that have been made to retrieve the nvr so far. Defaults
+            to 0.
+    Returns:
+        dict: A dictionary mapping RPM header names to their values, as returned by the Koji client.
+    Raises:
+        ValueError: If no rpm headers found in koji.
+    """
+    return rpmcache.headers.lookup(nvr, functools.partial(_fetch_rpm_header, tries=tries))
+
+
+def _fetch_rpm_header(nvr, tries=0):
+    """
+    Get the rpm header for a given build from Koji, retrying up to 3 times on errors.
+
     Args:
         nvr (str): The name-version-release string of the build you want headers for.
         tries (int): The number of attempts that have been made to retrieve the nvr so far. Defaults
@@ -79,20 +99,16 @@ def get_rpm_header(nvr, tries=0):
         ValueError: If no rpm headers found in koji.
     """
     tries += 1
-    headers = [
-        'name', 'summary', 'version', 'release', 'url', 'description',
-        'changelogtime', 'changelogname', 'changelogtext',
-    ]
     rpmID = nvr + '.src'
     koji_session = buildsys.get_session()
     try:
-        result = koji_session.getRPMHeaders(rpmID=rpmID, headers=headers)
+        result = koji_session.getRPMHeaders(rpmID=rpmID, headers=rpmcache.RPM_HEADERS)
     except Exception as e:
         msg = "Failed %i times to get rpm header data from koji for %s:  %s"
         log.warning(msg % (tries, nvr, str(e)))
         if tries < 3:
             # Try again...
-            return get_rpm_header(nvr, tries=tries)
+            return _fetch_rpm_header(nvr, tries=tries)
         else:
             # Give up for good and re-raise the failure...
             raise
@@ -119,76 +135,6 @@ def build_evr(build):
     return tuple(map(str, (build['epoch'], build['version'], build['release'])))
 
 
-class memoized(object):
-    """Decorator that permanently caches a function's return value each time it is called.
-
-    If the function is called later with the same arguments, the cached value is returned (not
-    reevaluated).
-
-    http://wiki.python.org/moin/PythonDecoratorLibrary#Memoize
-
-    Attributes:
-        func (callable): The wrapped function.
-        cache (dict): The cache, mapping arguments to the cached response.
-    """
-
-    def __init__(self, func):
-        """
-        Initialize the memoized object.
-
-        Args:
-            func: The function the memoized object is wrapping.
-        """
-        self.func = func
-        self.cache = {}
-
-    def __call__(self, *args):
-        """
-        If the args are cached, return the cached value. If not, call the wrapped function.
-
-        If the wrapped function is called, it's response is only cached if the args are hashable.
-
-        Args:
-            args (list): The list of arguments passed to the wrapped function.
-        Returns:
-            object: The response from the wrapped function, or the cached response, if available.
-        """
-        try:
-            hash(args)
-        except TypeError:
-            # uncacheable. a list, for instance.
-            # better to not cache than blow up.
-            return self.func(*args)
-        if args in self.cache:
-            return self.cache[args]
-        else:
-            value = self.func(*args)
-            self.cache[args] = value
-            return value
-
-    def __repr__(self):
-        """
-        Return the function's docstring.
-
-        Returns:
-            str: The wrapped function's docstring.
-        """
-        return self.func.__doc__
-
-    def __get__(self, obj, objtype):
-        """
-        Support instance methods.
-
-        Args:
-            obj (object): The instance of the object the wrapped method is bound to.
-            objtype (type): The type of the instance of the object the wrapped method is bound to.
-        Returns:
-            callable: A functools.partial response with the wrapped method's instance passed to it.
-        """
-        return functools.partial(self.__call__, obj)
-
-
-@memoized
 def get_critpath_components(collection='master', component_type='rpm', components=None):
     """
     Return a list of critical path packages for a given collection, filtered by components.
@@ -829,7 +775,8 @@ def taskotron_results(settings, entity='results/latest', max_queries=10, **kwarg
     try:
         while data and url:
             log.debug("Grabbing %r" % url)
-            response = requests.get(url, timeout=60)
+            response = http_client.get_service('ResultsDB').send(
+                http_session, 'GET', url, timeout=config.get('http_timeout'))
             if response.status_code != 200:
                 raise IOError("status code was %r" % response.status_code)
             json = response.json()
@@ -996,6 +943,8 @@ def call_api(api_url, service_name, error_key=None, method='GET', data=None, hea
     """
     Perform an HTTP request with response type and error handling.
 
+    The request is sent through the :class:`bodhi.server.http_client.Service` named service_name.
+
     Args:
         api_url (str): The URL to query.
         service_name (str): The service name being queried (used to form human friendly error
@@ -1005,15 +954,19 @@ def call_api(api_url, service_name, error_key=None, method='GET', data=None, hea
         method (str): The HTTP method to use for the request. Defaults to ``GET``.
         data (dict): Query string parameters that will be sent along with the request to the server.
         headers (dict): The headers to send along with the request.
-        retries (int): The number of times to retry, each after a 1 second sleep, if we get a
-            non-200 HTTP code. Defaults to 3.
+        retries (int): The number of times to retry, after an exponential backoff, if we get a
+            non-200 HTTP code or cannot connect. Defaults to 0.
     Returns:
         dict: A dictionary representing the JSON response from the remote service.
     Raises:
         RuntimeError: If the server did not give us a 200 code.
+        bodhi.server.http_client.CircuitOpenError: If the service failed too many times in a row
+            recently.
+        requests.RequestException: If the request could not be sent.
     """
     if data is None:
         data = dict()
+    service = http_client.get_service(service_name)
     log.debug("Querying url: %s", api_url)
     if method == 'POST':
         if headers is None:
@@ -1021,22 +974,26 @@ def call_api(api_url, service_name, error_key=None, method='GET', data=None, hea
         base_error_msg = (
             'Bodhi failed to send POST request to {0} at the following URL '
             '"{1}". The status code was "{2}".')
-        rv = http_session.post(api_url,
-                               headers=headers,
-                               data=json.dumps(data),
-                               timeout=60)
+        kwargs = {'headers': headers, 'data': json.dumps(data)}
     else:
         base_error_msg = (
             'Bodhi failed to get a resource from {0} at the following URL '
             '"{1}". The status code was "{2}".')
-        rv = http_session.get(api_url, timeout=60)
-
-    if rv.status_code >= 200 and rv.status_code < 300:
-        return rv.json()
-    elif retries:
-        time.sleep(1)
-        return call_api(api_url, service_name, error_key, method, data, headers, retries - 1)
-    elif rv.status_code == 500:
+        kwargs = {}
+
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(service.backoff(attempt - 1))
+        try:
+            rv = service.send(http_session, method, api_url, timeout=service.timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == retries:
+                raise
+            continue
+        if rv.status_code >= 200 and rv.status_code < 300:
+            return rv.json()
+
+    if rv.status_code == 500:
         log.debug(rv.text)
         # There will be no JSON with an error message here
         error_msg = base_error_msg.format(
@@ -1215,6 +1172,51 @@ def copy_container(build, destination_registry=None, destination_tag=None):
     cmd(skopeo_cmd, raise_on_error=True)
 
 
+def copy_containers(copies, destination_registry=None):
+    """
+    Copy ContainerBuilds from the source registry to a destination registry under several tags.
+
+    If the container.native_copy setting is true, each image is copied once with the code of
+    bodhi-skopeo-lite and stored under all of its tags, with its blobs streamed concurrently from
+    the source registry, and the blobs the images have in common only copied once. Otherwise,
+    skopeo is run to copy each image to each tag with :func:`copy_container`.
+
+    Args:
+        copies (list): 2-tuples of a ContainerBuild and the list of tags to copy it to. A tag of
+            None stands for the build's version and release.
+        destination_registry (str or None): The registry to copy the builds into. If None (the
+            default), the container.destination_registry setting is used.
+    Raises:
+        RuntimeError: If skopeo returns a non-0 exit code.
+        requests.HTTPError: If a registry returns an error status during a native copy.
+    """
+    if not config.get('container.native_copy'):
+        for build, tags in copies:
+            for tag in tags:
+                copy_container(build, destination_registry, tag)
+        return
+
+    source_registry = config['container.source_registry']
+    if destination_registry is None:
+        destination_registry = config['container.destination_registry']
+
+    blob_locations = skopeo_lite.BlobLocations()
+    with ThreadPoolExecutor(config.get('container.copy_threads')) as executor:
+        for build, tags in copies:
+            source_tag = '{}-{}'.format(build.nvr_version, build.nvr_release)
+            tags = [source_tag if tag is None else tag for tag in tags]
+            repository = _get_build_repository(build)
+            log.info('Copying %s to %s', build.nvr, ', '.join(
+                _container_image_url(destination_registry, repository, tag) for tag in tags))
+
+            src = skopeo_lite.RegistrySpec(source_registry, repository, source_tag, None, True,
+                                           None)
+            dest = skopeo_lite.RegistrySpec(destination_registry, repository, tags[0], None, True,
+                                            None)
+            skopeo_lite.copy_image(src.get_endpoint(), dest.get_endpoint(), tags[1:], executor,
+                                   blob_locations)
+
+
 def _container_image_url(registry, repository, tag=None):
     """
     Return a URL suitable for use in Skopeo for copying or deleting container images.
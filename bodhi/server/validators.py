@@ -17,6 +17,7 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """A collection of validators for Bodhi requests."""
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from functools import wraps
 
@@ -28,6 +29,7 @@ import koji
 import pyramid.threadlocal
 import rpm
 
+from bodhi.server.acls import pagure_acls
 from bodhi.server.config import config
 from bodhi.server.exceptions import BodhiException
 from . import buildsys, log
@@ -192,6 +194,57 @@ def cache_nvrs(request, build):
     request.buildinfo[build]['nvr'] = kbinfo['name'], kbinfo['version'], kbinfo['release']
 
 
+def prefetch_builds(request, builds, minimum=2):
+    """
+    Fetch the Koji build info and tags of the given builds with a single multicall.
+
+    :func:`cache_nvrs` and :func:`cache_tags` would otherwise query Koji once per build and per
+    call, one after the other. The results are stored in request.buildinfo the way these functions
+    store them, so that they don't query Koji again. Builds that Koji returned an error or nothing
+    for are left out, so that these functions query them on their own and report the error as
+    usual.
+
+    Args:
+        request (pyramid.request.Request): The current request.
+        builds (list): The NVRs of the builds to fetch.
+        minimum (int): Don't query Koji if fewer builds than this are missing. Defaults to 2, as
+            there is nothing to batch for a single build when only its tags will be needed.
+    """
+    missing = [build for build in dict.fromkeys(builds)
+               if build not in request.buildinfo
+               or not {'nvr', 'tags'}.issubset(request.buildinfo[build])]
+    if not missing or len(missing) < minimum:
+        return
+
+    koji_client = request.koji
+    try:
+        koji_client.multicall = True
+        for build in missing:
+            koji_client.getBuild(build)
+            koji_client.listTags(build)
+        results = koji_client.multiCall()
+    except Exception:
+        log.exception('Unable to prefetch the builds from Koji')
+        return
+    finally:
+        koji_client.multicall = False
+
+    if not isinstance(results, list) or len(results) != 2 * len(missing):
+        log.warning('Koji returned %r results when prefetching %d builds',
+                    len(results) if isinstance(results, list) else results, len(missing))
+        return
+
+    for i, build in enumerate(missing):
+        info, tags = results[2 * i:2 * i + 2]
+        buildinfo = request.buildinfo.setdefault(build, {})
+        # Faults are returned as dicts, and results as one element lists.
+        if isinstance(info, list) and info[0] and 'nvr' not in buildinfo:
+            buildinfo['info'] = info[0]
+            buildinfo['nvr'] = info[0]['name'], info[0]['version'], info[0]['release']
+        if isinstance(tags, list) and tags[0] and 'tags' not in buildinfo:
+            buildinfo['tags'] = [tag['name'] for tag in tags[0]] + request.from_tag_inherited
+
+
 @postschema_validator
 def validate_build_nvrs(request, **kwargs):
     """
@@ -201,6 +254,8 @@ def validate_build_nvrs(request, **kwargs):
         request (pyramid.request.Request): The current request.
         kwargs (dict): The kwargs of the related service definition. Unused.
     """
+    # Fetch what this and the following validators need to know about all the builds at once.
+    prefetch_builds(request, request.validated.get('builds') or [])
     for build in request.validated.get('builds') or []:  # cope with builds being None
         try:
             cache_nvrs(request, build)
@@ -465,6 +520,7 @@ def validate_acls(request, **kwargs):
         return
 
     # For normal updates, check against every build
+    packages = []
     for build in builds:
         # The whole point of the blocks inside this conditional is to determine
         # the "release" and "package" associated with the given build.  For raw
@@ -501,12 +557,27 @@ def validate_acls(request, **kwargs):
             package = build.package
             release = build.update.release
 
+        packages.append((buildinfo, package))
+
+    lookups = {}
+    if acl_system == 'pagure':
+        # Ask Pagure about all the packages at once, rather than one after the other. The packages
+        # stay in this thread, which owns their session, and only their names go to the workers.
+        keys = {package: (package.pagure_namespace, package.external_name)
+                for buildinfo, package in packages}
+        with ThreadPoolExecutor(
+                max_workers=config['pagure_acl_max_concurrent_requests']) as executor:
+            futures = {key: executor.submit(Package.get_committers_from_pagure, *key)
+                       for key in dict.fromkeys(keys.values())}
+        lookups = {package: futures[key] for package, key in keys.items()}
+
+    for buildinfo, package in packages:
         # Now that we know the release and the package associated with this
         # build, we can ask our ACL system about it..
         has_access = False
         if acl_system == 'pagure':
             try:
-                committers, groups = package.get_pkg_committers_from_pagure()
+                committers, groups = lookups[package].result()
                 people = committers
             except RuntimeError as error:
                 # If it's a RuntimeError, then the error will be logged
@@ -546,6 +617,10 @@ def validate_acls(request, **kwargs):
                 request.errors.add('body', 'builds', "{} does not have commit "
                                    "access to {}".format(user.name, package.name))
                 request.errors.status = 403
+                if acl_system == 'pagure':
+                    # The user may be asking for access right now, so don't hold on to the
+                    # cached answer when they try again.
+                    pagure_acls.invalidate(package.pagure_namespace, package.external_name)
 
 
 @postschema_validator
@@ -1090,6 +1165,9 @@ def validate_override_builds(request, **kwargs):
                            'with editing a buildroot override.')
         return
 
+    # New builds need both their info and their tags, so batch these even for a single build.
+    prefetch_builds(request, nvrs, minimum=1)
+
     builds = []
     for nvr in nvrs:
         result = _validate_override_build(request, nvr, db)
@@ -1101,6 +1179,22 @@ def validate_override_builds(request, **kwargs):
     request.validated['builds'] = builds
 
 
+def _get_override_build_tags(request, nvr):
+    """
+    Return the Koji tags of an override build.
+
+    Args:
+        request (pyramid.request.Request): The current request.
+        nvr (str): The NVR of the build.
+    Returns:
+        list: The names of the tags, as prefetched by :func:`prefetch_builds` if possible.
+    """
+    buildinfo = request.buildinfo.get(nvr, {})
+    if 'tags' in buildinfo:
+        return buildinfo['tags']
+    return [tag['name'] for tag in request.koji.listTags(nvr)]
+
+
 def _validate_override_build(request, nvr, db):
     """
     Workhorse function for validate_override_builds.
@@ -1127,8 +1221,8 @@ def _validate_override_build(request, nvr, db):
             tag_types, tag_rels = Release.get_tags(request.db)
             valid_tags = tag_types['candidate'] + tag_types['testing']
 
-            tags = [tag['name'] for tag in request.koji.listTags(nvr)
-                    if tag['name'] in valid_tags]
+            tags = [tag for tag in _get_override_build_tags(request, nvr)
+                    if tag in valid_tags]
 
             release = Release.from_tags(tags, db)
 
@@ -1144,7 +1238,7 @@ def _validate_override_build(request, nvr, db):
                                " release associated with the build does not support it.")
             return
 
-        for tag in build.get_tags():
+        for tag in _get_override_build_tags(request, nvr):
             if tag in (build.release.candidate_tag, build.release.testing_tag):
                 # The build is tagged as a candidate or testing
                 break
@@ -1161,8 +1255,8 @@ def _validate_override_build(request, nvr, db):
         valid_tags = tag_types['candidate'] + tag_types['testing']
 
         try:
-            tags = [tag['name'] for tag in request.koji.listTags(nvr)
-                    if tag['name'] in valid_tags]
+            tags = [tag for tag in _get_override_build_tags(request, nvr)
+                    if tag in valid_tags]
         except Exception as e:
             request.errors.add('body', 'nvr', "Couldn't determine koji tags "
                                "for %s, %r" % (nvr, str(e)))
@@ -1174,7 +1268,7 @@ def _validate_override_build(request, nvr, db):
             request.errors.add('body', 'nvr', 'Invalid build')
             return
 
-        build_info = request.koji.getBuild(nvr)
+        build_info = request.buildinfo.get(nvr, {}).get('info') or request.koji.getBuild(nvr)
         package = Package.get_or_create(db,
                                         {'nvr': (build_info['name'],
                                                  build_info['version'],
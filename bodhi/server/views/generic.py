@@ -224,7 +224,8 @@ def get_metrics(request):
     """
     Provide the metrics to be consumed by prometheus.
 
-    See the metrics_tween.py for hook to collect metrics for page requests
+    See the metrics_tween.py for hook to collect metrics for page requests, and for the metrics of
+    the requests sent to remote services.
 
     Args:
         request (pyramid.request): The current web request.
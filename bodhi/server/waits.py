@@ -0,0 +1,224 @@
+# Copyright © 2020 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""Wait for files to appear and for remote resources to change without fixed sleeps."""
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import socket
+import time
+import typing
+
+from bodhi.server import http_client
+
+
+log = logging.getLogger(__name__)
+
+# From <sys/inotify.h>
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+
+
+def _load_libc() -> typing.Optional[ctypes.CDLL]:
+    """
+    Return the C library if it provides the inotify functions.
+
+    Returns:
+        The C library, or None if inotify isn't available on this platform.
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (AttributeError, OSError):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+
+
+class FileWatcher:
+    """
+    Wake up as soon as files are created in, or moved into, the watched directories.
+
+    inotify is used where the platform supports it. It doesn't see changes made by other hosts to
+    network filesystems, so :meth:`wait` always returns once its timeout has passed as well, and
+    callers should check what they wait for again every time it returns. Directories that can't be
+    watched are only checked on those timeouts.
+    """
+
+    def __init__(self, directories: typing.Iterable[str]):
+        """
+        Start watching the given directories.
+
+        Args:
+            directories: The directories to watch.
+        """
+        self._fd = None
+        if _libc is None:
+            return
+
+        fd = _libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            log.warning('Could not initialize inotify: %s', os.strerror(ctypes.get_errno()))
+            return
+
+        watched = 0
+        for directory in set(directories):
+            if _libc.inotify_add_watch(fd, os.fsencode(directory),
+                                       _IN_CREATE | _IN_MOVED_TO | _IN_CLOSE_WRITE) < 0:
+                log.debug('Could not watch %s: %s', directory,
+                          os.strerror(ctypes.get_errno()))
+            else:
+                watched += 1
+
+        if watched:
+            self._fd = fd
+        else:
+            os.close(fd)
+
+    @property
+    def watching(self) -> bool:
+        """Return whether changes to at least one directory will wake up :meth:`wait`."""
+        return self._fd is not None
+
+    def wait(self, timeout: float):
+        """
+        Block until a file is created in a watched directory, or until timeout seconds passed.
+
+        Args:
+            timeout: The maximum number of seconds to wait.
+        """
+        if self._fd is None:
+            time.sleep(timeout)
+            return
+
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if readable:
+            # The events themselves don't matter, since the caller checks the files again.
+            try:
+                while os.read(self._fd, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        """Stop watching the directories."""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self) -> 'FileWatcher':
+        """Return the FileWatcher itself."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Stop watching the directories."""
+        self.close()
+
+
+def backoff(initial: float, ceiling: float, factor: float = 2) -> typing.Iterator[float]:
+    """
+    Generate exponentially increasing delays, capped to a ceiling.
+
+    Args:
+        initial: The first delay.
+        ceiling: The maximum delay.
+        factor: How much each delay is multiplied by to get the next one.
+    Yields:
+        The number of seconds to wait before the next attempt.
+    """
+    delay = min(initial, ceiling)
+    while True:
+        yield delay
+        delay = min(delay * factor, ceiling)
+
+
+class ConditionalFetcher:
+    """
+    Fetch a URL repeatedly, downloading it again only when the server reports it has changed.
+
+    The ETag and Last-Modified headers of the last response are sent back in the If-None-Match and
+    If-Modified-Since headers, so servers that support them can answer with a 304 instead of the
+    whole document. The requests are recorded in the metrics of the mirrors service, but are not
+    subject to its circuit breaker, since the callers already poll the mirrors on their own
+    schedule. A request that times out is treated like a response saying the document hasn't
+    changed, so that the callers simply poll again later.
+    """
+
+    def __init__(self, url: str, timeout: typing.Optional[float] = None):
+        """
+        Initialize the ConditionalFetcher.
+
+        Args:
+            url: The URL to fetch.
+            timeout: How many seconds to wait for the server to connect or send data, or None to
+                wait forever.
+        """
+        self.url = url
+        self.timeout = timeout
+        self.etag = None
+        self.last_modified = None
+
+    def fetch(self) -> typing.Optional[bytes]:
+        """
+        Fetch the URL.
+
+        Returns:
+            The body of the document, or None if it has not changed since the last fetch or the
+            request timed out.
+        Raises:
+            urllib.error.URLError: If the document could not be fetched.
+            http.client.IncompleteRead: If the connection was closed before the whole document
+                was read.
+        """
+        request = Request(self.url)
+        if self.etag:
+            request.add_header('If-None-Match', self.etag)
+        if self.last_modified:
+            request.add_header('If-Modified-Since', self.last_modified)
+
+        mirrors = http_client.get_service('mirrors')
+        start = time.monotonic()
+        try:
+            response = urlopen(request, timeout=self.timeout)
+            body = response.read()
+        except HTTPError as e:
+            mirrors.record('GET', e.code, time.monotonic() - start)
+            if e.code == 304:
+                return None
+            raise
+        except Exception as e:
+            mirrors.record('GET', e, time.monotonic() - start)
+            # Timeouts while connecting are wrapped in a URLError, but not those while reading.
+            if isinstance(e, socket.timeout) or isinstance(getattr(e, 'reason', None),
+                                                           socket.timeout):
+                log.warning('Timed out fetching %s', self.url)
+                return None
+            raise
+
+        # urlopen() raises HTTPError for all the responses that aren't successful.
+        mirrors.record('GET', 200, time.monotonic() - start)
+        self.etag = response.headers.get('ETag')
+        self.last_modified = response.headers.get('Last-Modified')
+        return body
@@ -1584,6 +1584,41 @@ class TestUpdateNotFound:
         assert str(exc) == 'Update not found: bodhi-2.2.4-1.el7'
 
 
+class TestBodhiClient_query_all:
+    """
+    Test BodhiClient.query_all().
+    """
+    def test_cursor(self):
+        """The pages should be walked with the cursors returned by the server."""
+        client = bindings.BodhiClient()
+        client.send_request = mock.MagicMock(side_effect=[
+            {'updates': [{'alias': 'a'}, {'alias': 'b'}], 'page': 1, 'pages': 2,
+             'next_cursor': 'Yg'},
+            {'updates': [{'alias': 'c'}], 'page': 1, 'pages': 2, 'next_cursor': None}])
+
+        updates = list(client.query_all(releases='F33', rows_per_page=2))
+
+        assert [u['alias'] for u in updates] == ['a', 'b', 'c']
+        assert client.send_request.mock_calls == [
+            mock.call('updates/', verb='GET', params={'releases': 'F33', 'rows_per_page': 2}),
+            mock.call('updates/', verb='GET',
+                      params={'releases': 'F33', 'rows_per_page': 2, 'count': 'cached',
+                              'cursor': 'Yg'})]
+
+    def test_no_cursor(self):
+        """Servers that don't return cursors should be walked by page number."""
+        client = bindings.BodhiClient()
+        client.send_request = mock.MagicMock(side_effect=[
+            {'updates': [{'alias': 'a'}], 'page': 1, 'pages': 2},
+            {'updates': [{'alias': 'b'}], 'page': 2, 'pages': 2}])
+
+        updates = list(client.query_all(rows_per_page=1))
+
+        assert [u['alias'] for u in updates] == ['a', 'b']
+        assert client.send_request.mock_calls[1] == mock.call(
+            'updates/', verb='GET', params={'rows_per_page': 1, 'count': 'cached', 'page': 2})
+
+
 class TestBodhiClient_candidates:
     """
     Test the BodhiClient.candidates() method.
@@ -26,8 +26,9 @@ from webtest import TestApp
 from sqlalchemy import event
 import createrepo_c
 
-from bodhi.server import (bugs, buildsys, models, initialize_db, Session, config, main, metadata,
-                          webapp)
+from bodhi.server import (acls, bugs, buildsys, critpath, http_client, models, initialize_db,
+                          Session, config, main, metadata, rpmcache, webapp)
+from bodhi.server.tasks import check_policies
 from bodhi.tests.server import create_update, populate
 
 
@@ -145,6 +146,11 @@ class BaseTestCaseMixin:
         # Ensure "cached" objects are cleared before each test.
         models.Release.clear_all_releases_cache()
         models.Release._tag_cache = None
+        acls.pagure_acls.invalidate()
+        critpath.index.invalidate()
+        check_policies.forget_decisions()
+        rpmcache.headers.invalidate()
+        http_client.reset()
 
         if engine is None:
             self.engine = _configure_test_db()
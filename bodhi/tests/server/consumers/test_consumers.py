@@ -16,13 +16,18 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """Test the bodhi.server.consumers package."""
 from unittest import mock
+import threading
+import time
 
+from prometheus_client import REGISTRY
 import pytest
 from fedora_messaging.api import Message
 from fedora_messaging.exceptions import Nack
 
-from bodhi.server import config
-from bodhi.server.consumers import Consumer, HandlerInfo, signed
+from bodhi.server import config, models
+from bodhi.server.consumers import Consumer, HandlerInfo, HandlerPool, partition_key, signed
+from bodhi.tests.server import create_update
+from bodhi.tests.server.base import BasePyTestCase, TransactionalSessionMaker
 
 
 @mock.patch.dict(
@@ -107,3 +112,199 @@ class TestConsumer:
         Handler.side_effect = lambda: handler
         Consumer()(msg)
         handler.assert_called_once_with(msg)
+
+    @mock.patch.dict(config.config, {'consumer_metrics_port': 9090})
+    @mock.patch('bodhi.server.consumers.start_http_server')
+    def test_metrics_port(self, start_http_server):
+        """The metrics should be served on the consumer_metrics_port if it is set."""
+        Consumer()
+
+        start_http_server.assert_called_once_with(9090)
+
+    @mock.patch.dict(config.config, {'consumer_handler_threads': 2})
+    @mock.patch('bodhi.server.consumers.Build.get', mock.Mock(return_value=None))
+    def test_handler_threads(self):
+        """The handlers of a message should run at the same time on their pools of threads."""
+        msg = Message(topic="org.fedoraproject.prod.buildsys.tag",
+                      body={'name': 'bodhi', 'version': '5.6', 'release': '1.fc33'})
+        barrier = threading.Barrier(2, timeout=5)
+        consumer = Consumer()
+        handlers = [mock.Mock(side_effect=lambda msg: barrier.wait()) for i in range(2)]
+        handlers[1].side_effect = lambda msg: (barrier.wait(), 1 / 0)
+        greenwave_handler = mock.Mock()
+
+        with mock.patch.object(consumer, 'handler_infos', [
+                HandlerInfo('.buildsys.tag', 'Signed', handlers[0]),
+                HandlerInfo('.buildsys.tag', 'Automatic Update', handlers[1]),
+                HandlerInfo('.greenwave.decision.update', 'Greenwave', greenwave_handler)]):
+            with pytest.raises(Nack) as exc:
+                consumer(msg)
+
+        assert str(exc.value) == ("Unable to (fully) handle message.\nAffected handlers:\n"
+                                  "\tAutomatic Update: division by zero\nMessage:\n{msg}")
+        for handler in handlers:
+            handler.assert_called_once_with(msg)
+        assert sorted(consumer.pools) == ['Automatic Update', 'Signed']
+        assert greenwave_handler.call_count == 0
+
+    @mock.patch.dict(config.config, {'consumer_handler_threads': 2})
+    @mock.patch('bodhi.server.consumers.partition_key')
+    def test_handler_threads_single_handler(self, partition_key):
+        """The messages matched by a single handler should be handled without a pool or a key."""
+        msg = Message(topic="org.fedoraproject.prod.greenwave.decision.update",
+                      body={'subject_identifier': 'bodhi-5.6-1.fc33'})
+        consumer = Consumer()
+        greenwave_handler = mock.Mock()
+
+        with mock.patch.object(consumer, 'handler_infos', [
+                HandlerInfo('.greenwave.decision.update', 'Greenwave', greenwave_handler)]):
+            consumer(msg)
+
+        greenwave_handler.assert_called_once_with(msg)
+        assert consumer.pools == {}
+        partition_key.assert_not_called()
+
+
+class TestPartitionKey(BasePyTestCase):
+    """Test the partition_key() function."""
+
+    @pytest.mark.parametrize('body,key', (
+        ({'name': 'bodhi', 'version': '5.6', 'release': '1.fc33', 'tag': 'f33'},
+         'bodhi-5.6-1.fc33'),
+        ({'subject_identifier': 'FEDORA-2020-abcdef'}, 'FEDORA-2020-abcdef'),
+        ({'artifact': {'nvr': 'bodhi-5.6-1.fc33'}, 'pipeline': {'id': 1}}, 'bodhi-5.6-1.fc33'),
+        ({'artifact': {}}, None),
+        ({}, None),
+        ('not a dict', None),
+    ))
+    def test_unknown_build(self, body, key):
+        """The key should be the build a message is about if it doesn't belong to an update."""
+        msg = Message(topic='org.fedoraproject.prod.buildsys.tag', body=body)
+
+        assert partition_key(msg, TransactionalSessionMaker(self.Session)) == key
+
+    @pytest.mark.parametrize('body', (
+        {'name': 'bodhi', 'version': '2.0', 'release': '1.fc17', 'tag': 'f17'},
+        {'subject_identifier': 'bodhi-2.0-1.fc17', 'subject_type': 'koji_build'},
+        {'artifact': {'nvr': 'bodhi-2.0-1.fc17'}, 'pipeline': {'id': 1}},
+    ))
+    def test_update(self, body):
+        """The key should be the update of the build a message is about."""
+        msg = Message(topic='org.fedoraproject.prod.buildsys.tag', body=body)
+        alias = models.Build.query.filter_by(nvr='bodhi-2.0-1.fc17').one().update.alias
+
+        assert partition_key(msg, TransactionalSessionMaker(self.Session)) == alias
+
+    @mock.patch.dict(config.config, {'consumer_handler_threads': 2})
+    @mock.patch('bodhi.server.consumers.bugs.set_bugtracker')
+    @mock.patch('bodhi.server.consumers.buildsys.setup_buildsystem')
+    @mock.patch('bodhi.server.consumers.initialize_db')
+    def test_builds_of_an_update_tagged_together(self, *args):
+        """The builds of an update tagged at the same time should be handled one at a time."""
+        update = create_update(self.db, ['tagged1-1.0-1.fc17', 'tagged2-1.0-1.fc17'])
+        self.db.commit()
+        consumer = Consumer()
+        started = threading.Event()
+        release = threading.Event()
+        handled = []
+
+        def handle(msg):
+            if msg.body['name'] == 'tagged1':
+                started.set()
+                release.wait(5)
+            handled.append(msg.body['name'])
+
+        messages = [
+            Message(topic='org.fedoraproject.prod.buildsys.tag',
+                    body={'name': name, 'version': '1.0', 'release': '1.fc17',
+                          'tag': 'f17-updates-testing-pending'})
+            for name in ('tagged1', 'tagged2')]
+        # The threads can't see the test database, so the keys are found beforehand.
+        keys = {id(msg): partition_key(msg, TransactionalSessionMaker(self.Session))
+                for msg in messages}
+        assert set(keys.values()) == {update.alias}
+        # The messages are only keyed when several handlers match them.
+        with mock.patch.object(consumer, 'handler_infos',
+                               [HandlerInfo('.buildsys.tag', 'Signed', handle),
+                                HandlerInfo('.buildsys.tag', 'Automatic Update', mock.Mock())]), \
+                mock.patch('bodhi.server.consumers.partition_key',
+                           lambda msg, db_factory: keys[id(msg)]):
+            threads = [threading.Thread(target=consumer, args=(messages[0],))]
+            threads[0].start()
+            assert started.wait(5)
+            threads.append(threading.Thread(target=consumer, args=(messages[1],)))
+            threads[1].start()
+            # The second build waits for the first one, since they are keyed by their update.
+            for i in range(500):
+                if len(consumer.pools['Signed']._queues.get(update.alias, ())) == 1:
+                    break
+                time.sleep(0.01)
+            assert list(consumer.pools['Signed']._queues) == [update.alias]
+            assert handled == []
+            release.set()
+            for thread in threads:
+                thread.join(5)
+
+        assert handled == ['tagged1', 'tagged2']
+
+
+def get_metric(name, labels):
+    """Return the value of a metric sample, or 0."""
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class TestHandlerPool:
+    """Test the HandlerPool class."""
+
+    def test_same_key_in_order(self):
+        """The messages with the same key should be handled one after the other, in order."""
+        handled = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def handle(msg):
+            if msg.body['n'] == 0:
+                started.set()
+                release.wait(5)
+            handled.append(msg.body['n'])
+
+        pool = HandlerPool(HandlerInfo('.buildsys.tag', 'Test Order', handle), 4)
+        depth = get_metric('bodhi_consumer_queue_depth', {'handler': 'Test Order'})
+        futures = [pool.submit(Message(topic='t', body={'n': 0}), 'a')]
+        started.wait(5)
+        futures += [pool.submit(Message(topic='t', body={'n': n}), 'a') for n in range(1, 4)]
+
+        # The first message is being handled, and the others are waiting for it.
+        assert get_metric('bodhi_consumer_queue_depth', {'handler': 'Test Order'}) == depth + 3
+        release.set()
+        for future in futures:
+            future.result(5)
+
+        assert handled == [0, 1, 2, 3]
+        assert get_metric('bodhi_consumer_queue_depth', {'handler': 'Test Order'}) == depth
+        assert pool._queues == {}
+
+    @pytest.mark.parametrize('keys', (('a', 'b'), (None, None)))
+    def test_other_keys_concurrently(self, keys):
+        """The messages with different keys or without keys should be handled concurrently."""
+        barrier = threading.Barrier(2, timeout=5)
+        pool = HandlerPool(HandlerInfo('.buildsys.tag', 'Test', lambda msg: barrier.wait()), 2)
+
+        futures = [pool.submit(Message(topic='t', body={}), key) for key in keys]
+
+        assert sorted(future.result(5) for future in futures) == [0, 1]
+
+    def test_exception(self):
+        """The exception raised by the handler should be raised by the future."""
+        count = get_metric('bodhi_consumer_handler_count',
+                           {'handler': 'Test Error', 'status': 'error'})
+        pool = HandlerPool(
+            HandlerInfo('.buildsys.tag', 'Test Error', mock.Mock(side_effect=ValueError('bad'))),
+            1)
+
+        with pytest.raises(ValueError, match='bad'):
+            pool.submit(Message(topic='t', body={}), 'a').result(5)
+
+        assert get_metric('bodhi_consumer_handler_count',
+                          {'handler': 'Test Error', 'status': 'error'}) == count + 1
+        assert pool._queues == {}
@@ -17,6 +17,7 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """This test suite contains tests for the bodhi.server.consumers.greenwave module."""
 
+import threading
 from unittest import mock
 
 from fedora_messaging.api import Message
@@ -122,6 +123,192 @@ class TestGreenwaveHandler(BasePyTestCase):
         # After the consumer run the gating tests status was updated.
         assert update.test_gating_status == models.TestGatingStatus.passed
 
+    def _create_multiple_builds_update(self):
+        """Create an update with two builds and return it with its decision messages."""
+        update = create_update(self.db, ['MultipleBuild1-1.0-1.fc17', 'MultipleBuild2-1.0-1.fc17'])
+        self.db.flush()
+        data = update.greenwave_request_batches(verbose=False)[0]
+        messages = [
+            Message(topic="org.fedoraproject.prod.greenwave.decision.update", body={
+                "subject_identifier": subject['item'],
+                "subject_type": subject['type'],
+                "decision_context": data['decision_context'],
+                "product_version": data['product_version'],
+                "policies_satisfied": True,
+                "summary": "all required tests passed",
+            }) for subject in data['subject']]
+        return update, messages
+
+    def _debounced_handler(self):
+        """Return a handler debouncing the re-evaluations, which the tests flush themselves."""
+        with mock.patch.dict(config, [('greenwave_handler.debounce_window', 60.0)]):
+            handler = greenwave.GreenwaveHandler()
+        handler.db_factory = TransactionalSessionMaker(self.Session)
+        return handler
+
+    @mock.patch.dict(config, [('greenwave_api_url', 'http://domain.local'),
+                              ('greenwave_handler.debounce_window', 60.0)])
+    def test_multiple_builds_from_messages(self):
+        """
+        Assert that Greenwave isn't queried once every subject of an update has a decision.
+        """
+        handler = self._debounced_handler()
+        update, messages = self._create_multiple_builds_update()
+        build1, build2, alias = messages
+        build2.body['policies_satisfied'] = False
+
+        with mock.patch('bodhi.server.models.util.greenwave_api_post') as mock_greenwave:
+            mock_greenwave.return_value = {
+                'policies_satisfied': True,
+                'summary': "all tests have passed"
+            }
+            # The decision of the second build isn't known yet.
+            handler(alias)
+            handler(build1)
+            handler.debouncer.flush()
+            assert mock_greenwave.call_count == 1
+            assert update.test_gating_status == models.TestGatingStatus.passed
+
+            for message in messages:
+                handler(message)
+            handler.debouncer.flush()
+            assert mock_greenwave.call_count == 1
+            assert update.test_gating_status == models.TestGatingStatus.failed
+
+            # The decision about the update itself doesn't trigger a re-evaluation.
+            for message in reversed(messages):
+                message.body['summary'] = 'no tests are required'
+                message.body['policies_satisfied'] = True
+                handler(message)
+            handler.debouncer.flush()
+            assert mock_greenwave.call_count == 1
+            assert update.test_gating_status == models.TestGatingStatus.ignored
+
+    @mock.patch.dict(config, [('greenwave_api_url', 'http://domain.local'),
+                              ('greenwave_handler.debounce_window', 60.0)])
+    def test_multiple_builds_stale_decision(self):
+        """
+        Assert that the decisions received long before the window of an update are not used.
+        """
+        handler = self._debounced_handler()
+        update, messages = self._create_multiple_builds_update()
+
+        with mock.patch('bodhi.server.models.util.greenwave_api_post') as mock_greenwave, \
+                mock.patch('bodhi.server.consumers.greenwave.time.monotonic',
+                           return_value=1000.0) as monotonic:
+            mock_greenwave.return_value = {
+                'policies_satisfied': True,
+                'summary': "all tests have passed"
+            }
+            for message in messages:
+                handler(message)
+            handler.debouncer.flush()
+            assert mock_greenwave.call_count == 0
+            assert update.test_gating_status == models.TestGatingStatus.passed
+
+            # Greenwave has since changed its mind about the first build.
+            monotonic.return_value += 121.0
+            mock_greenwave.return_value = {
+                'policies_satisfied': False,
+                'summary': "1 of 1 required tests failed"
+            }
+            handler(messages[1])
+            handler.debouncer.flush()
+
+        assert mock_greenwave.call_count == 1
+        assert update.test_gating_status == models.TestGatingStatus.failed
+
+    @mock.patch.dict(config, [('greenwave_api_url', 'http://domain.local')])
+    def test_multiple_builds_not_debounced(self):
+        """
+        Assert that Greenwave is always queried when the re-evaluations are not debounced.
+        """
+        update, messages = self._create_multiple_builds_update()
+
+        with mock.patch('bodhi.server.models.util.greenwave_api_post') as mock_greenwave:
+            mock_greenwave.return_value = {
+                'policies_satisfied': True,
+                'summary': "all tests have passed"
+            }
+            for message in messages:
+                self.handler(message)
+
+        assert mock_greenwave.call_count == 2
+        assert update.test_gating_status == models.TestGatingStatus.passed
+        assert self.handler._decisions == {}
+
+    @mock.patch.dict(config, [('greenwave_api_url', 'http://domain.local'),
+                              ('greenwave_handler.debounce_window', 60.0)])
+    def test_multiple_builds_other_decision_context(self):
+        """
+        Assert that the decisions about another decision context than the update's are not used.
+        """
+        handler = self._debounced_handler()
+        update, messages = self._create_multiple_builds_update()
+        messages[1].body['decision_context'] = 'some_other_context'
+
+        with mock.patch('bodhi.server.models.util.greenwave_api_post') as mock_greenwave:
+            mock_greenwave.return_value = {
+                'policies_satisfied': False,
+                'summary': "1 of 1 required tests failed"
+            }
+            for message in messages:
+                handler(message)
+            handler.debouncer.flush()
+
+        assert mock_greenwave.call_count == 1
+        assert update.test_gating_status == models.TestGatingStatus.failed
+
+    @mock.patch.dict(config, [('greenwave_api_url', 'http://domain.local'),
+                              ('greenwave_handler.debounce_window', 60.0)])
+    def test_multiple_builds_debounced(self):
+        """
+        Assert that the decisions about an update are folded into a single re-evaluation.
+        """
+        handler = self._debounced_handler()
+        update, messages = self._create_multiple_builds_update()
+
+        with mock.patch('bodhi.server.models.util.greenwave_api_post') as mock_greenwave:
+            mock_greenwave.return_value = {
+                'policies_satisfied': True,
+                'summary': "all tests have passed"
+            }
+            handler(messages[0])
+            handler(messages[1])
+            assert mock_greenwave.call_count == 0
+            assert update.test_gating_status is None
+            assert list(handler._windows) == [update.alias]
+
+            handler.debouncer.flush()
+
+        assert mock_greenwave.call_count == 1
+        assert update.test_gating_status == models.TestGatingStatus.passed
+        assert handler._windows == {}
+
+    @mock.patch('bodhi.server.consumers.greenwave.log')
+    def test_reevaluate_missing_update(self, mock_log):
+        """Assert that updates deleted before their re-evaluation are skipped."""
+        self.handler._reevaluate(['FEDORA-2019-missing'])
+
+        mock_log.debug.assert_called_once_with("Couldn't find update FEDORA-2019-missing in DB")
+
+    def test_remember_decision_without_context(self):
+        """Assert that the decisions that don't say which context they are about are ignored."""
+        self.handler._remember_decision(self.sample_message.body, 0.0)
+
+        assert self.handler._decisions == {}
+
+    @mock.patch('bodhi.server.consumers.greenwave.MAX_DECISIONS', 2)
+    def test_remember_decision_limit(self):
+        """Assert that the least recently announced decisions are forgotten first."""
+        body = {"subject_type": "koji_build", "decision_context": "bodhi_update_push_stable",
+                "product_version": "fedora-17", "policies_satisfied": True, "summary": ""}
+        for nvr in ('a-1-1.fc17', 'b-1-1.fc17', 'a-1-1.fc17', 'c-1-1.fc17'):
+            self.handler._remember_decision(dict(body, subject_identifier=nvr), 0.0)
+
+        assert list(self.handler._decisions) == [('koji_build', 'a-1-1.fc17'),
+                                                 ('koji_build', 'c-1-1.fc17')]
+
     @mock.patch('bodhi.server.consumers.greenwave.log')
     def test_greenwave_bad_message(self, mock_log):
         """ Assert that the consumer ignores messages badly formed """
@@ -170,3 +357,61 @@ class TestGreenwaveHandler(BasePyTestCase):
         self.handler(self.sample_message)
         assert mock_log.debug.call_count == 1
         mock_log.debug.assert_called_with("Not requesting a decision for a compose")
+
+
+class TestDebouncer:
+    """Test the :class:`Debouncer` class."""
+
+    def test_schedule(self):
+        """Assert that the keys are passed to the callback once, after their window."""
+        calls = []
+        done = threading.Event()
+
+        def callback(keys):
+            calls.append(keys)
+            if sum(len(k) for k in calls) == 2:
+                done.set()
+
+        debouncer = greenwave.Debouncer(callback, 0.05)
+        debouncer.schedule('a')
+        debouncer.schedule('b')
+        debouncer.schedule('a')
+
+        assert done.wait(5)
+        assert sorted(sum(calls, [])) == ['a', 'b']
+
+    @mock.patch('bodhi.server.consumers.greenwave.log')
+    def test_callback_error(self, mock_log):
+        """Assert that the debouncer keeps going if the callback fails."""
+        failed = threading.Event()
+        done = threading.Event()
+
+        def callback(keys):
+            if keys == ['a']:
+                failed.set()
+                raise RuntimeError('oops')
+            done.set()
+
+        debouncer = greenwave.Debouncer(callback, 0)
+        debouncer.schedule('a')
+        assert failed.wait(5)
+        debouncer.schedule('b')
+
+        assert done.wait(5)
+        mock_log.exception.assert_called_once_with('Failed to handle a')
+
+    def test_flush(self):
+        """Assert that flush() passes the scheduled keys to the callback right away."""
+        callback = mock.Mock()
+        debouncer = greenwave.Debouncer(callback, 60)
+
+        debouncer.flush()
+        callback.assert_not_called()
+
+        debouncer.schedule('a')
+        debouncer.schedule('b')
+        debouncer.flush()
+        callback.assert_called_once_with(['a', 'b'])
+
+        debouncer.flush()
+        assert callback.call_count == 1
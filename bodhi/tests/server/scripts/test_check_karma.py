@@ -0,0 +1,100 @@
+# Copyright © 2020 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""This module contains tests for the bodhi.server.scripts.check_karma module."""
+from unittest import mock
+
+from click import testing
+
+from bodhi.server import models
+from bodhi.server.scripts import check_karma
+from bodhi.tests.server.base import BasePyTestCase
+
+
+class TestCheckKarma(BasePyTestCase):
+    """Test the check_karma() function."""
+
+    def corrupt(self):
+        """Store wrong karma counters on the update, bypassing the ORM."""
+        update = self.db.query(models.Update).one()
+        alias = update.alias
+        self.db.query(models.Update).update({'positive_karma': 5, 'negative_karma': -2})
+        self.db.commit()
+        return alias
+
+    def test_consistent(self):
+        """Nothing should be printed if the counters are consistent."""
+        runner = testing.CliRunner()
+        r = runner.invoke(check_karma.check_karma, [])
+
+        assert r.exit_code == 0
+        assert r.output == ''
+
+    def test_inconsistent(self):
+        """The inconsistent counters should be printed, and the exit code should be 1."""
+        alias = self.corrupt()
+
+        runner = testing.CliRunner()
+        r = runner.invoke(check_karma.check_karma, [])
+
+        assert r.exit_code == 1
+        assert r.output == (f'{alias}: positive_karma is 5, but counts as 1\n'
+                            f'{alias}: negative_karma is -2, but counts as 0\n')
+        update = self.db.query(models.Update).one()
+        assert (update.positive_karma, update.negative_karma) == (5, -2)
+
+    def test_fix(self):
+        """The inconsistent counters should be stored as counted with --fix."""
+        alias = self.corrupt()
+
+        runner = testing.CliRunner()
+        r = runner.invoke(check_karma.check_karma, ['--fix'])
+
+        assert r.exit_code == 0
+        assert r.output == (f'{alias}: positive_karma is 5, but counts as 1\n'
+                            f'{alias}: negative_karma is -2, but counts as 0\n')
+        update = self.db.query(models.Update).one()
+        assert (update.positive_karma, update.negative_karma) == (1, 0)
+        assert update.karma == 1
+
+    def test_uncounted_admin_approvals(self):
+        """The admin approvals that were never counted are fine, but --fix stores them."""
+        self.db.query(models.Update).update({'admin_approvals': None})
+        self.db.commit()
+
+        runner = testing.CliRunner()
+        r = runner.invoke(check_karma.check_karma, [])
+
+        assert r.exit_code == 0
+        assert r.output == ''
+
+        r = runner.invoke(check_karma.check_karma, ['--fix'])
+
+        assert r.exit_code == 0
+        assert self.db.query(models.Update.admin_approvals).scalar() == 0
+
+    @mock.patch('bodhi.server.scripts.check_karma.BATCH_SIZE', 1)
+    def test_batches(self):
+        """All the updates should be checked when they don't fit in one batch."""
+        self.create_update(['bodhi-2.1-1.fc17'])
+        self.db.commit()
+        self.db.query(models.Update).update({'admin_approvals': 1})
+        self.db.commit()
+
+        inconsistencies = check_karma.find_inconsistencies(self.db)
+
+        assert [i[1:] for i in inconsistencies] == [('admin_approvals', 1, 0)] * 2
@@ -18,11 +18,13 @@
 """This module contains tests for bodhi.server.scripts.skopeo_lite."""
 
 from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from urllib.parse import urlparse
 from unittest import mock
 import hashlib
 import json
+import logging
 import os
 import re
 import shutil
@@ -74,8 +76,7 @@ def to_text(value):
 
 
 def make_digest(blob):
-    # Abbreviate the hexdigest for readability of debugging output if things fail
-    return 'sha256:' + hashlib.sha256(to_bytes(blob)).hexdigest()[0:10]
+    return 'sha256:' + hashlib.sha256(to_bytes(blob)).hexdigest()
 
 
 class MockRegistry(object):
@@ -89,6 +90,8 @@ class MockRegistry(object):
         self.repos = {}
         self.required_creds = required_creds
         self.flags = flags
+        self.interrupted = False
+        self.status_interrupted = False
         self._add_pattern(responses.GET, r'/v2/(.*)/manifests/([^/]+)',
                           self._get_manifest)
         self._add_pattern(responses.HEAD, r'/v2/(.*)/manifests/([^/]+)',
@@ -107,6 +110,12 @@ class MockRegistry(object):
                           self._put_blob)
         self._add_pattern(responses.POST, r'/v2/(.*)/blobs/uploads/\?mount=([^&]+)&from=(.+)',
                           self._mount_blob)
+        self._add_pattern(responses.PATCH, r'/v2/(.*)/blobs/uploads/([^?]*)(?:\?dummy=1)?',
+                          self._patch_blob)
+        self._add_pattern(responses.GET, r'/v2/(.*)/blobs/uploads/([^?]*)(?:\?dummy=1)?',
+                          self._get_upload)
+        self._add_pattern(responses.DELETE, r'/v2/(.*)/blobs/uploads/([^?]*)(?:\?dummy=1)?',
+                          self._delete_upload)
 
     def get_repo(self, name):
         return self.repos.setdefault(name, {
@@ -225,25 +234,32 @@ class MockRegistry(object):
         except KeyError:
             return (requests.codes.NOT_FOUND, {}, {'error': 'NOT_FOUND'})
 
+        blob = to_bytes(blob)
+        status = 200
+        if 'bad_blob' in self.flags:
+            blob = blob.upper()
+        if req.method == 'GET' and 'Range' in req.headers and 'ignore_range' not in self.flags:
+            offset = int(re.match(r'bytes=(\d+)-$', req.headers['Range']).group(1))
+            blob = blob[offset:]
+            status = requests.codes.PARTIAL_CONTENT
+        elif req.method == 'GET' and 'truncate_blob' in self.flags and not self.interrupted:
+            self.interrupted = True
+            blob = blob[:len(blob) // 2]
+
         headers = {
             'Docker-Content-Digest': digest,
             'Content-Type': 'application/json',
             'Content-Length': str(len(blob)),
         }
-        return (200, headers, blob)
+        return (status, headers, blob)
 
     def _post_blob(self, req, name):
         repo = self.get_repo(name)
         uuid_str = str(uuid.uuid4())
-        repo['uploads'][uuid_str] = ''
-
-        if 'include_query_parameters' in self.flags:
-            location = '/v2/{}/blobs/uploads/{}?dummy=1'.format(name, uuid_str)
-        else:
-            location = '/v2/{}/blobs/uploads/{}'.format(name, uuid_str)
+        repo['uploads'][uuid_str] = b''
 
         headers = {
-            'Location': location,
+            'Location': self._upload_location(name, uuid_str),
             'Range': 'bytes=0-0',
             'Content-Length': '0',
             'Docker-Upload-UUID': uuid_str,
@@ -254,12 +270,14 @@ class MockRegistry(object):
         repo = self.get_repo(name)
 
         assert uuid in repo['uploads']
-        del repo['uploads'][uuid]
+        blob = repo['uploads'].pop(uuid)
 
-        if isinstance(req.body, (bytes, str)):
-            blob = req.body
+        if req.body is None:
+            pass
+        elif isinstance(req.body, (bytes, str)):
+            blob += to_bytes(req.body)
         else:
-            blob = req.body.read()
+            blob += req.body.read()
 
         added_digest = self.add_blob(name, blob)
         assert added_digest == digest
@@ -289,6 +307,67 @@ class MockRegistry(object):
             }
             return (202, headers, '')
 
+    def _upload_location(self, name, uuid_str):
+        if 'include_query_parameters' in self.flags:
+            return '/v2/{}/blobs/uploads/{}?dummy=1'.format(name, uuid_str)
+        return '/v2/{}/blobs/uploads/{}'.format(name, uuid_str)
+
+    def _patch_blob(self, req, name, uuid):
+        repo = self.get_repo(name)
+        assert uuid in repo['uploads']
+
+        if 'drop_patch' in self.flags and not self.interrupted:
+            self.interrupted = True
+            raise requests.ConnectionError('Connection reset by peer')
+
+        # The chunks are streamed.
+        body = b''.join(req.body)
+        start, end = map(int, req.headers['Content-Range'].split('-'))
+        assert start == len(repo['uploads'][uuid])
+        assert end == start + len(body) - 1
+        if 'partial_patch' in self.flags and not self.interrupted:
+            self.interrupted = True
+            # The registry keeps what it received before the connection was lost.
+            repo['uploads'][uuid] += body[:2]
+            raise requests.ConnectionError('Connection reset by peer')
+        repo['uploads'][uuid] += body
+
+        if 'lose_patch_response' in self.flags and not self.interrupted:
+            self.interrupted = True
+            raise requests.ConnectionError('Connection reset by peer')
+
+        headers = {
+            'Location': self._upload_location(name, uuid),
+            'Range': self._upload_range(len(repo['uploads'][uuid])),
+            'Docker-Upload-UUID': uuid,
+        }
+        return (200 if 'bad_patch_status' in self.flags else 202, headers, '')
+
+    def _get_upload(self, req, name, uuid):
+        repo = self.get_repo(name)
+        if 'drop_upload_status' in self.flags and not self.status_interrupted:
+            self.status_interrupted = True
+            raise requests.ConnectionError('Connection reset by peer')
+
+        received = len(repo['uploads'][uuid])
+        if 'bad_upload_range' in self.flags:
+            received += 5
+
+        headers = {
+            'Location': self._upload_location(name, uuid),
+            'Range': self._upload_range(received),
+            'Docker-Upload-UUID': uuid,
+        }
+        return (204, headers, '')
+
+    def _upload_range(self, received):
+        # Like docker/distribution, 0-0 is reported when nothing was received yet.
+        return '0-{}'.format(max(received - 1, 0))
+
+    def _delete_upload(self, req, name, uuid):
+        del self.get_repo(name)['uploads'][uuid]
+        return (204, {}, '')
+
     def add_fake_image(self, name, tag, content_type,
                        arch='amd64'):
         layer_digest = self.add_blob(name, 'layer-' + arch)
@@ -693,6 +772,9 @@ def test_skopeo_copy_cli_errors(src, dest, error):
     ('docker://registry1.example.com/repo1:latest', 'docker://registry2.example.com/repo2:latest',
      '', 'bad_post_status',
      'Unexpected successful response'),
+    ('docker://registry1.example.com/repo1:latest', 'docker://registry2.example.com/repo2:latest',
+     '', 'bad_patch_status',
+     'Unexpected successful response'),
     ('docker://registry1.example.com/repo1:latest', 'docker://registry1.example.com/repo2:latest',
      'bad_mount_status', '',
      'Blob mount had unexpected status'),
@@ -733,3 +815,282 @@ def test_skopeo_copy_protocol(src, dest, flags1, flags2, error):
             [src, dest])
 
         assert result.exit_code == 0
+
+
+def get_endpoint(spec):
+    """Return the RegistryEndpoint of a docker:// reference."""
+    return skopeo_lite.parse_spec(spec, None, True, None).get_endpoint()
+
+
+def count_calls(method, pattern):
+    """Return how many requests with the given method were sent to URLs matching pattern."""
+    return len([c for c in responses.calls
+                if c.request.method == method and re.search(pattern, c.request.url)])
+
+
+@responses.activate
+@pytest.mark.parametrize('content_type',
+                         (MEDIA_TYPE_OCI, MEDIA_TYPE_OCI_INDEX,
+                          MEDIA_TYPE_MANIFEST_V2, MEDIA_TYPE_LIST_V2))
+@pytest.mark.parametrize('dest_registry', ('registry1.example.com', 'registry2.example.com'))
+def test_copy_image_extra_tags(content_type, dest_registry):
+    """
+    Test copying an image once to several tags, with the blobs copied concurrently
+    """
+    reg1 = MockRegistry('registry1.example.com')
+    reg2 = MockRegistry('registry2.example.com')
+    digest = reg1.add_fake_image('repo1', '1.2.3-1', content_type)
+
+    with ThreadPoolExecutor(4) as executor:
+        skopeo_lite.copy_image(get_endpoint('docker://registry1.example.com/repo1:1.2.3-1'),
+                               get_endpoint(f'docker://{dest_registry}/repo2:1.2.3-1'),
+                               ['1.2.3', 'testing'], executor)
+
+    dest = reg1 if dest_registry == 'registry1.example.com' else reg2
+    for tag in ('1.2.3-1', '1.2.3', 'testing'):
+        dest.check_fake_image('repo2', tag, digest, content_type)
+    # The source manifest was only fetched once.
+    assert count_calls('GET', r'registry1.example.com/v2/repo1/manifests/1.2.3-1$') == 1
+
+
+@responses.activate
+def test_copy_image_shared_blobs():
+    """
+    Test that the blobs the images copied together have in common are only transferred once
+    """
+    reg1 = MockRegistry('registry1.example.com')
+    reg2 = MockRegistry('registry2.example.com')
+    digest1 = reg1.add_fake_image('repo1', 'latest', MEDIA_TYPE_OCI_INDEX)
+    digest2 = reg1.add_fake_image('repo2', 'latest', MEDIA_TYPE_OCI_INDEX)
+    blob_locations = skopeo_lite.BlobLocations()
+
+    with ThreadPoolExecutor(4) as executor:
+        for repo in ('repo1', 'repo2'):
+            skopeo_lite.copy_image(get_endpoint(f'docker://registry1.example.com/{repo}:latest'),
+                                   get_endpoint(f'docker://registry2.example.com/{repo}:latest'),
+                                   ['testing'], executor, blob_locations)
+
+    for repo, digest in (('repo1', digest1), ('repo2', digest2)):
+        for tag in ('latest', 'testing'):
+            reg2.check_fake_image(repo, tag, digest, MEDIA_TYPE_OCI_INDEX)
+    # The images have the same layer and config: they were streamed for the first image, and
+    # linked from it for the second one.
+    assert count_calls('GET', r'registry1.example.com/v2/repo1/blobs/') == 2
+    assert count_calls('GET', r'registry1.example.com/v2/repo2/blobs/') == 0
+    assert count_calls('PATCH', r'registry2.example.com/v2/repo1/blobs/uploads/') == 2
+    assert count_calls('PUT', r'registry2.example.com/v2/repo1/blobs/uploads/') == 2
+    assert count_calls('PUT', r'registry2.example.com/v2/repo2/blobs/uploads/') == 0
+    assert count_calls('POST', r'registry2.example.com/v2/repo2/blobs/uploads/\?mount=') == 2
+    assert blob_locations.get_repos('registry2.example.com',
+                                    make_digest('layer-amd64')) == ['repo1', 'repo2']
+
+
+@responses.activate
+def test_copy_image_known_blobs():
+    """
+    Test that the registry isn't asked for the blobs already copied to the destination repository
+    """
+    reg1 = MockRegistry('registry1.example.com')
+    digest = reg1.add_fake_image('repo1', 'latest', MEDIA_TYPE_MANIFEST_V2)
+    blob_locations = skopeo_lite.BlobLocations()
+
+    for tag in ('latest', 'testing'):
+        skopeo_lite.copy_image(get_endpoint('docker://registry1.example.com/repo1:latest'),
+                               get_endpoint(f'docker://registry1.example.com/repo2:{tag}'),
+                               blob_locations=blob_locations)
+
+    for tag in ('latest', 'testing'):
+        reg1.check_fake_image('repo2', tag, digest, MEDIA_TYPE_MANIFEST_V2)
+    assert count_calls('HEAD', r'registry1.example.com/v2/repo2/blobs/') == 2
+    assert count_calls('POST', r'registry1.example.com/v2/repo2/blobs/uploads/\?mount=') == 2
+
+
+@responses.activate
+@pytest.mark.parametrize('content_type',
+                         (MEDIA_TYPE_OCI, MEDIA_TYPE_OCI_INDEX,
+                          MEDIA_TYPE_MANIFEST_V2, MEDIA_TYPE_LIST_V2))
+@pytest.mark.parametrize('chunk_size', (32 * 1024 * 1024, 4))
+def test_skopeo_copy_via_directory(content_type, chunk_size):
+    """
+    Test copying from one server to another through a temporary directory
+    """
+    runner = testing.CliRunner()
+
+    reg1 = MockRegistry('registry1.example.com')
+    reg2 = MockRegistry('registry2.example.com')
+    digest = reg1.add_fake_image('repo1', 'latest', content_type)
+
+    with mock.patch('bodhi.server.scripts.skopeo_lite.UPLOAD_CHUNK_SIZE', chunk_size):
+        result = runner.invoke(
+            skopeo_lite.copy,
+            ['--via-directory',
+             'docker://registry1.example.com/repo1:latest',
+             'docker://registry2.example.com/repo2:latest'],
+            catch_exceptions=False)
+
+    assert result.exit_code == 0
+
+    reg2.check_fake_image('repo2', 'latest', digest, content_type)
+    # The config of the image is 40 bytes long, and its layer 11 bytes.
+    assert count_calls('PATCH', 'registry2.example.com') == (0 if chunk_size > 4 else 13)
+
+
+@responses.activate
+@pytest.mark.parametrize('flags', ('truncate_blob', 'truncate_blob ignore_range'))
+@pytest.mark.parametrize('via_directory', (False, True))
+def test_skopeo_copy_resume_download(flags, via_directory, caplog):
+    """
+    Test that an interrupted download is resumed where it stopped
+    """
+    caplog.set_level(logging.INFO)
+    reg1 = MockRegistry('registry1.example.com', flags=flags)
+    reg2 = MockRegistry('registry2.example.com')
+    digest = reg1.add_fake_image('repo1', 'latest', MEDIA_TYPE_OCI)
+
+    # The streamed blobs are resumed from the last chunk uploaded. The blocks are smaller than the
+    # part of the blob to skip when the registry ignores the range.
+    with mock.patch('bodhi.server.scripts.skopeo_lite.UPLOAD_CHUNK_SIZE', 4), \
+            mock.patch('bodhi.server.scripts.skopeo_lite.BLOCK_SIZE', 8):
+        skopeo_lite.copy_image(get_endpoint('docker://registry1.example.com/repo1:latest'),
+                               get_endpoint('docker://registry2.example.com/repo2:latest'),
+                               via_directory=via_directory)
+
+    reg2.check_fake_image('repo2', 'latest', digest, MEDIA_TYPE_OCI)
+    # The 40 bytes long config of the image is copied first, and truncated to 20 bytes.
+    ranges = [c.request.headers.get('Range') for c in responses.calls
+              if c.request.method == 'GET' and 'registry1.example.com/v2/repo1/blobs/' in
+              c.request.url]
+    assert ranges == [None, 'bytes=20-', None]
+    assert 'interrupted after 20 bytes, resuming' in caplog.text
+    assert re.search(r'Uploaded sha256:\w+ \(11 bytes\) in [\d.]+s \([\d.]+ MiB/s\)',
+                     caplog.text)
+
+
+@responses.activate
+@pytest.mark.parametrize('flags', ('drop_patch', 'lose_patch_response', 'partial_patch'))
+def test_skopeo_copy_resume_upload(flags):
+    """
+    Test that an interrupted chunked upload is resumed from what the registry received
+    """
+    reg1 = MockRegistry('registry1.example.com')
+    reg2 = MockRegistry('registry2.example.com', flags=flags)
+    digest = reg1.add_fake_image('repo1', 'latest', MEDIA_TYPE_OCI)
+
+    with mock.patch('bodhi.server.scripts.skopeo_lite.UPLOAD_CHUNK_SIZE', 4):
+        skopeo_lite.copy_image(get_endpoint('docker://registry1.example.com/repo1:latest'),
+                               get_endpoint('docker://registry2.example.com/repo2:latest'))
+
+    reg2.check_fake_image('repo2', 'latest', digest, MEDIA_TYPE_OCI)
+    assert count_calls('GET', r'registry2.example.com/v2/repo2/blobs/uploads/') == 1
+    # The source is read again from the end of the last chunk the registry received.
+    ranges = [c.request.headers.get('Range') for c in responses.calls
+              if c.request.method == 'GET' and 'registry1.example.com/v2/repo1/blobs/' in
+              c.request.url]
+    assert ranges[:2] == [None, 'bytes=4-' if flags == 'lose_patch_response' else None]
+    # Only what the registry didn't keep is sent again.
+    content_ranges = [c.request.headers['Content-Range'] for c in responses.calls
+                      if c.request.method == 'PATCH']
+    assert content_ranges[:2] == ['0-3', {'drop_patch': '0-3', 'lose_patch_response': '4-7',
+                                          'partial_patch': '2-5'}[flags]]
+
+
+@responses.activate
+def test_skopeo_copy_resume_upload_status_interrupted():
+    """
+    Test that asking the registry what it received is retried if it is interrupted
+    """
+    reg1 = MockRegistry('registry1.example.com')
+    reg2 = MockRegistry('registry2.example.com', flags='drop_patch drop_upload_status')
+    digest = reg1.add_fake_image('repo1', 'latest', MEDIA_TYPE_OCI)
+
+    with mock.patch('bodhi.server.scripts.skopeo_lite.UPLOAD_CHUNK_SIZE', 4):
+        skopeo_lite.copy_image(get_endpoint('docker://registry1.example.com/repo1:latest'),
+                               get_endpoint('docker://registry2.example.com/repo2:latest'))
+
+    reg2.check_fake_image('repo2', 'latest', digest, MEDIA_TYPE_OCI)
+    assert count_calls('GET', r'registry2.example.com/v2/repo2/blobs/uploads/') == 2
+
+
+def test_chunk_body():
+    """
+    Test that the chunks are streamed from blocks split across them, and fail if the blob ends
+    """
+    blocks = skopeo_lite._Blocks([b'abc', b'defgh'])
+    digest = skopeo_lite.BlobDigest(make_digest('abcdefgh'))
+
+    first = skopeo_lite._ChunkBody(blocks, 4, digest)
+    assert len(first) == 4
+    assert list(first) == [b'abc', b'd']
+    second = skopeo_lite._ChunkBody(blocks, 4, first.digest)
+    assert list(second) == [b'efgh']
+    second.digest.verify()
+    # The digest of the previous chunks isn't changed.
+    with pytest.raises(RuntimeError):
+        first.digest.verify()
+
+    third = skopeo_lite._ChunkBody(blocks, 4, second.digest)
+    with pytest.raises(skopeo_lite.IncompleteBlobError):
+        list(third)
+    assert third.sent == 0
+    blocks.close()
+
+
+@responses.activate
+def test_skopeo_copy_upload_not_resumable():
+    """
+    Test that an upload isn't resumed if the registry lost what it received
+    """
+    reg1 = MockRegistry('registry1.example.com')
+    MockRegistry('registry2.example.com', flags='drop_patch bad_upload_range')
+    reg1.add_fake_image('repo1', 'latest', MEDIA_TYPE_OCI)
+
+    with mock.patch('bodhi.server.scripts.skopeo_lite.UPLOAD_CHUNK_SIZE', 4):
+        with pytest.raises(RuntimeError) as excinfo:
+            skopeo_lite.copy_image(get_endpoint('docker://registry1.example.com/repo1:latest'),
+                                   get_endpoint('docker://registry2.example.com/repo2:latest'))
+
+    assert 'Cannot resume the upload of sha256:' in str(excinfo.value)
+    assert 'the registry has 5 bytes of it, but 0 were confirmed and 0 sent' in str(excinfo.value)
+
+
+@responses.activate
+@mock.patch('bodhi.server.scripts.skopeo_lite.MAX_TRIES', 1)
+@pytest.mark.parametrize('flags1,flags2,error', (
+    ('truncate_blob', '', skopeo_lite.IncompleteBlobError),
+    ('', 'drop_patch', requests.ConnectionError),
+))
+@pytest.mark.parametrize('via_directory', (False, True))
+def test_skopeo_copy_too_many_tries(flags1, flags2, error, via_directory):
+    """
+    Test that the transfer of a blob is given up after MAX_TRIES interruptions
+    """
+    reg1 = MockRegistry('registry1.example.com', flags=flags1)
+    MockRegistry('registry2.example.com', flags=flags2)
+    reg1.add_fake_image('repo1', 'latest', MEDIA_TYPE_OCI)
+
+    with mock.patch('bodhi.server.scripts.skopeo_lite.UPLOAD_CHUNK_SIZE', 4):
+        with pytest.raises(error):
+            skopeo_lite.copy_image(get_endpoint('docker://registry1.example.com/repo1:latest'),
+                                   get_endpoint('docker://registry2.example.com/repo2:latest'),
+                                   via_directory=via_directory)
+
+
+@responses.activate
+@pytest.mark.parametrize('via_directory', (False, True))
+def test_skopeo_copy_digest_mismatch(via_directory):
+    """
+    Test that a blob that doesn't match its digest isn't stored
+    """
+    reg1 = MockRegistry('registry1.example.com', flags='bad_blob')
+    reg2 = MockRegistry('registry2.example.com')
+    reg1.add_fake_image('repo1', 'latest', MEDIA_TYPE_OCI)
+
+    with pytest.raises(RuntimeError) as excinfo:
+        skopeo_lite.copy_image(get_endpoint('docker://registry1.example.com/repo1:latest'),
+                               get_endpoint('docker://registry2.example.com/repo2:latest'),
+                               via_directory=via_directory)
+
+    assert 'Digest mismatch for blob sha256:' in str(excinfo.value)
+    assert reg2.get_repo('repo2')['blobs'] == {}
+    # The streamed upload was canceled.
+    assert reg2.get_repo('repo2')['uploads'] == {}
@@ -21,6 +21,7 @@ from unittest import mock
 import copy
 
 from fedora_messaging import api, testing as fml_testing
+from sqlalchemy import event
 import webtest
 
 from bodhi.messages.schemas import update as update_schemas
@@ -329,6 +330,32 @@ class TestCommentsService(base.BasePyTestCase):
 
         assert comment1 != comment2
 
+    def test_list_comments_query_count(self):
+        """The number of queries should not depend on the number of listed comments."""
+        for i in range(10):
+            update = self.create_update(['bodhi-2.0-%d.fc17' % (i + 300)])
+            user = User(name='commenter%d' % i)
+            update.comments.append(Comment(text='Works for me.', karma=1, user=user))
+        self.db.commit()
+        statements = []
+
+        def count(*args):
+            statements.append(args[2])
+
+        # Warm up anything cached across requests, such as the releases.
+        self.app.get('/comments/', {'rows_per_page': 1})
+        event.listen(self.engine, 'before_cursor_execute', count)
+        try:
+            self.app.get('/comments/', {'rows_per_page': 1})
+            one = len(statements)
+            statements.clear()
+            body = self.app.get('/comments/', {'rows_per_page': 10}).json_body
+        finally:
+            event.remove(self.engine, 'before_cursor_execute', count)
+
+        assert len(body['comments']) == 10
+        assert len(statements) == one
+
     def test_list_comments_by_since(self):
         tomorrow = datetime.utcnow() + timedelta(days=1)
         fmt = "%Y-%m-%d %H:%M:%S"
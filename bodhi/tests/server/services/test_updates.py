@@ -26,6 +26,7 @@ import textwrap
 import time
 
 from fedora_messaging import api, testing as fml_testing
+from sqlalchemy import event
 import koji
 import pytest
 import requests
@@ -35,8 +36,8 @@ from bodhi.messages.schemas import base as base_schemas, update as update_schema
 from bodhi.server import main
 from bodhi.server.config import config
 from bodhi.server.models import (
-    Build, BuildrootOverride, Compose, Group, RpmPackage, ModulePackage, Release,
-    ReleaseState, RpmBuild, Update, UpdateRequest, UpdateStatus, UpdateType,
+    Bug, Build, BuildrootOverride, Comment, Compose, Group, Package, RpmPackage, ModulePackage,
+    Release, ReleaseState, RpmBuild, Update, UpdateRequest, UpdateStatus, UpdateType,
     UpdateSeverity, UpdateSuggestion, User, TestGatingStatus, PackageManager)
 from bodhi.server.util import call_api
 from bodhi.tests import assert_multiline_equal
@@ -2122,6 +2123,122 @@ class TestUpdatesService(BasePyTestCase):
 
         assert update1 != update2
 
+    def test_list_updates_cursor(self):
+        """The cursor should walk every update once, in the same order as the pages."""
+        release = self.db.query(Release).one()
+        date_submitted = datetime(2020, 10, 1)
+        for i in range(4):
+            update = self.create_update(['bodhi-2.0-%d.fc17' % (i + 2)], release.name)
+            # Some updates have the same date, so the cursor needs to tell them apart by id.
+            update.date_submitted = date_submitted - timedelta(days=i // 2)
+        self.db.commit()
+        expected = [u['alias'] for u in self.app.get(
+            '/updates/', {'rows_per_page': 10}).json_body['updates']]
+
+        aliases = []
+        params = {'rows_per_page': 2}
+        while True:
+            body = self.app.get('/updates/', params).json_body
+            aliases.extend(u['alias'] for u in body['updates'])
+            assert body['total'] == 5
+            assert body['page'] == (1 if 'cursor' not in params else None)
+            if body['next_cursor'] is None:
+                break
+            params['cursor'] = body['next_cursor']
+
+        assert len(expected) == 5
+        assert aliases == expected
+
+    @mock.patch(**mock_valid_requirements)
+    def test_list_updates_cursor_joined_rows(self, *args):
+        """Updates matching several joined rows should fill the page only once."""
+        update = self.db.query(Update).one()
+        update.builds.append(Build(nvr='bodhi-docs-2.0-1.fc17', release=update.release,
+                                   package=Package(name='bodhi-docs')))
+        self.db.commit()
+        with fml_testing.mock_sends(api.Message):
+            self.app.post_json('/updates/', self.get_update('bodhi-2.0.0-2.fc17'))
+
+        body = self.app.get('/updates/', {'like': 'bodhi', 'rows_per_page': 1}).json_body
+        second = self.app.get('/updates/', {'like': 'bodhi', 'rows_per_page': 1,
+                                            'cursor': body['next_cursor']}).json_body
+
+        assert body['total'] == 2
+        assert len(body['updates']) == 1
+        assert len(second['updates']) == 1
+        assert second['updates'][0]['alias'] != body['updates'][0]['alias']
+        assert second['next_cursor'] is None
+
+    def test_list_updates_cursor_html(self):
+        """The pager shouldn't be rendered for a page reached with a cursor."""
+        release = self.db.query(Release).one()
+        for i in range(2):
+            self.create_update(['bodhi-2.0-%d.fc17' % (i + 2)], release.name)
+        self.db.commit()
+        body = self.app.get('/updates/', {'rows_per_page': 1}).json_body
+
+        first = self.app.get('/updates/', {'rows_per_page': 1},
+                             headers={'Accept': 'text/html'})
+        res = self.app.get('/updates/', {'rows_per_page': 1, 'cursor': body['next_cursor']},
+                           headers={'Accept': 'text/html'})
+
+        assert 'page=2' in first.text
+        assert 'page=2' not in res.text
+        assert '3 Updates' in res.text
+
+    def test_list_updates_invalid_cursor(self):
+        """An invalid cursor should be rejected."""
+        res = self.app.get('/updates/', {'cursor': 'not a cursor'}, status=400)
+
+        assert res.json_body['errors'][0]['name'] == 'cursor'
+        assert res.json_body['errors'][0]['description'] == '"not a cursor" is not a valid cursor'
+
+    def test_list_updates_cached_count(self):
+        """With count=cached, the total should be reused for the same query."""
+        with mock.patch.dict(config, {'dogpile.cache.arguments.cache_dict': {},
+                                      'dogpile.cache.expiration_time': 100}):
+            body = self.app.get('/updates/', {'count': 'cached'}).json_body
+            self.create_update(['bodhi-2.0-2.fc17'])
+            self.db.commit()
+            cached = self.app.get('/updates/', {'count': 'cached'}).json_body
+            exact = self.app.get('/updates/').json_body
+            other_query = self.app.get('/updates/', {'count': 'cached', 'locked': False}).json_body
+
+        assert body['total'] == 1
+        assert cached['total'] == 1
+        assert len(cached['updates']) == 2
+        assert exact['total'] == 2
+        assert other_query['total'] == 2
+
+    def test_list_updates_query_count(self):
+        """The number of queries should not depend on the number of listed updates."""
+        group = self.db.query(Group).filter_by(name='packager').one()
+        for i in range(10):
+            update = self.create_update(['bodhi-2.0-%d.fc17' % (i + 2)])
+            update.bugs.append(Bug(bug_id=2000 + i))
+            user = User(name='commenter%d' % i, groups=[group])
+            update.comments.append(Comment(text='Works for me.', karma=1, user=user))
+        self.db.commit()
+        statements = []
+
+        def count(*args):
+            statements.append(args[2])
+
+        # Warm up anything cached across requests, such as the releases.
+        self.app.get('/updates/', {'rows_per_page': 1})
+        event.listen(self.engine, 'before_cursor_execute', count)
+        try:
+            self.app.get('/updates/', {'rows_per_page': 1})
+            one = len(statements)
+            statements.clear()
+            body = self.app.get('/updates/', {'rows_per_page': 11}).json_body
+        finally:
+            event.remove(self.engine, 'before_cursor_execute', count)
+
+        assert len(body['updates']) == 11
+        assert all(u['comments'] for u in body['updates'][:10])
+        assert len(statements) == one
+
     def test_list_updates_by_approved_since(self):
         now = datetime.utcnow()
 
@@ -2933,6 +3050,8 @@ class TestUpdatesService(BasePyTestCase):
         firefox.status = UpdateStatus.unpushed
         python_nose = self.create_update(['python-nose-1.3.7-11.fc17'])
         python_nose.status = UpdateStatus.testing
+        # Updates are listed from the most recently submitted.
+        python_nose.date_submitted = datetime(1984, 11, 1)
         self.db.commit()
 
         res = self.app.get('/updates/', {"status": ["pending", "testing"]})
@@ -6515,9 +6634,10 @@ class TestGetTestResults(BasePyTestCase):
         }
 
     @mock.patch.dict(config, [('greenwave_api_url', 'https://greenwave.api')])
+    @mock.patch('bodhi.server.util.time.sleep')
     @mock.patch('bodhi.server.util.http_session')
     @mock.patch('bodhi.server.util.call_api', wraps=call_api)
-    def test_get_test_results_calling_greenwave_500(self, call_api, http_session, *args):
+    def test_get_test_results_calling_greenwave_500(self, call_api, http_session, sleep, *args):
         """
         Ensure if all conditions are met we do try to call greenwave with the proper
         argument but greenwave returns a 500 error
@@ -6532,7 +6652,10 @@ class TestGetTestResults(BasePyTestCase):
 
         res = self.app.get(f'/updates/{up.alias}/get-test-results', status=502)
 
-        assert call_api.call_count == 4
+        assert call_api.call_count == 1
+        # The request was retried 3 times.
+        assert http_session.post.call_count == 4
+        assert sleep.call_count == 3
         assert res.json_body == {
             'errors': [
                 {
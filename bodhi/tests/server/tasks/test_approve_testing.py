@@ -27,7 +27,7 @@ import pytest
 from bodhi.messages.schemas import update as update_schemas
 from bodhi.server.config import config
 from bodhi.server import models
-from bodhi.server.tasks import approve_testing_task
+from bodhi.server.tasks import approve_testing, approve_testing_task
 from bodhi.server.tasks.approve_testing import main as approve_testing_main
 from bodhi.tests.server.base import BasePyTestCase
 from .base import BaseTaskTestCase
@@ -896,3 +896,89 @@ class TestMain(BaseTaskTestCase):
         assert cmnts[1].text == "This update cannot be pushed to stable. "\
             "These builds bodhi-2.0-1.fc17 have a more recent build in koji's "\
             f"{update.release.stable_tag} tag."
+
+
+class TestCandidatesFilter(BaseTaskTestCase):
+    """This class contains tests for the candidates_filter() function."""
+
+    def setup_method(self, method):
+        """Put the update in testing for a day, without comments."""
+        super().setup_method(method)
+        self.update = self.db.query(models.Update).one()
+        self.update.autotime = False
+        self.update.request = None
+        self.update.status = models.UpdateStatus.testing
+        self.update.date_testing = datetime.utcnow() - timedelta(days=1)
+        for comment in self.update.comments:
+            self.db.delete(comment)
+        self.db.info['messages'] = []
+        self.db.commit()
+
+    def is_candidate(self):
+        """Return whether the update is let through by the filter."""
+        return self.db.query(models.Update).filter(
+            approve_testing.candidates_filter(self.db)).count() == 1
+
+    def comment(self, text, karma=0, author='bodhi', days_ago=0):
+        """Add a comment to the update."""
+        user = self.db.query(models.User).filter_by(name=author).first() or models.User(
+            name=author)
+        self.update.comments.append(models.Comment(
+            text=text, karma=karma, user=user,
+            timestamp=datetime.utcnow() - timedelta(days=days_ago)))
+        self.db.commit()
+
+    def test_not_in_testing_long_enough(self):
+        """Updates that are too new and have no positive karma should be left out."""
+        assert not self.is_candidate()
+
+        self.update.date_testing = datetime.utcnow() - timedelta(days=7)
+        self.db.commit()
+        assert self.is_candidate()
+
+    def test_positive_karma(self):
+        """Updates that may have reached the required karma should be let through."""
+        self.comment('LGTM', karma=1, author='guest')
+
+        assert self.is_candidate()
+
+    @patch.dict(config, [('critpath.min_karma', 0)])
+    def test_no_min_karma(self):
+        """New updates should be let through if they don't need karma to meet the requirements."""
+        assert self.is_candidate()
+
+    @patch.dict(config, [('fedora.mandatory_days_in_testing', 0)])
+    def test_no_mandatory_days_in_testing(self):
+        """Only autotime updates should be let through if the release has no mandatory days."""
+        assert not self.is_candidate()
+
+        self.update.autotime = True
+        self.db.commit()
+        assert self.is_candidate()
+
+    def test_stable_comment(self):
+        """Updates with the stable comment since their last karma reset should be left out."""
+        self.update.date_testing = datetime.utcnow() - timedelta(days=7)
+        self.comment('Removed build', days_ago=3)
+        self.comment(config['testing_approval_msg'], author='guest', days_ago=2)
+        assert self.is_candidate()
+
+        self.comment(config['testing_approval_msg'], days_ago=2)
+        assert not self.is_candidate()
+
+        self.comment('New build', days_ago=1)
+        assert self.is_candidate()
+
+    @patch('bodhi.server.tasks.approve_testing.approve_update')
+    def test_main_only_approves_candidates(self, approve_update):
+        """main() should only load the candidates."""
+        update2 = self.create_update(['bodhi2-2.0-1.fc17'])
+        update2.request = None
+        update2.status = models.UpdateStatus.testing
+        update2.date_testing = datetime.utcnow() - timedelta(days=8)
+        self.db.info['messages'] = []
+        self.db.commit()
+
+        approve_testing_main()
+
+        assert [c[0][0].alias for c in approve_update.call_args_list] == [update2.alias]
@@ -19,10 +19,13 @@
 
 from unittest.mock import patch
 import datetime
+import threading
+import time
 
 from bodhi.server import models
 from bodhi.server.tasks import check_policies_task
 from bodhi.server.tasks.check_policies import main as check_policies_main
+from bodhi.tests.server import create_update
 from bodhi.tests.server.base import BasePyTestCase
 from bodhi.server.config import config
 from .base import BaseTaskTestCase
@@ -268,3 +271,109 @@ class TestCheckPolicies(BaseTaskTestCase):
             check_policies_main()
 
         assert mock_greenwave.call_count == 0
+
+    def _create_updates(self, count):
+        """
+        Create the given number of updates in testing, and return them with the existing one.
+
+        Args:
+            count (int): The number of updates to create.
+        Returns:
+            list: The updates in testing, ordered by id.
+        """
+        for i in range(count):
+            update = create_update(self.db, [f'package{i}-1.0-1.fc17'])
+            update.status = models.UpdateStatus.testing
+        update = self.db.query(models.Update).filter_by(status=models.UpdateStatus.pending).one()
+        update.status = models.UpdateStatus.testing
+        # Clear pending messages
+        self.db.info['messages'] = []
+        self.db.commit()
+        return self.db.query(models.Update).order_by(models.Update.id).all()
+
+    @patch.dict(config, [('greenwave_api_url', 'http://domain.local')])
+    @patch('bodhi.server.tasks.check_policies.COMMIT_BATCH_SIZE', 2)
+    def test_concurrent_decisions(self):
+        """The updates should be decided concurrently, and the statuses committed in batches."""
+        updates = self._create_updates(4)
+        failing = updates[2].alias
+        lock = threading.Lock()
+        in_flight = [0, 0]
+
+        def greenwave(url, data):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+            time.sleep(0.05)
+            with lock:
+                in_flight[0] -= 1
+            if data['subject'][-1]['item'] == failing:
+                raise RuntimeError('Greenwave is broken')
+            return {'policies_satisfied': True, 'summary': 'All required tests passed'}
+
+        with patch('bodhi.server.models.util.greenwave_api_post', side_effect=greenwave):
+            check_policies_main()
+
+        statuses = [u.test_gating_status for u in
+                    self.db.query(models.Update).order_by(models.Update.id)]
+        assert statuses == [models.TestGatingStatus.passed] * 2 + [
+            models.TestGatingStatus.waiting] + [models.TestGatingStatus.passed] * 2
+        assert in_flight[1] > 1
+
+    @patch.dict(config, [('greenwave_api_url', 'http://domain.local')])
+    def test_unchanged_skipped(self):
+        """Updates with a settled decision about the same requests should not be checked again."""
+        updates = self._create_updates(1)
+        responses = {
+            updates[0].alias: {'policies_satisfied': True, 'summary': 'All required tests passed'},
+            updates[1].alias: {'policies_satisfied': False, 'summary': '1 of 1 tests failed'}}
+
+        with patch('bodhi.server.models.util.greenwave_api_post',
+                   side_effect=lambda url, data: responses[data['subject'][-1]['item']]) as post:
+            check_policies_main()
+            assert post.call_count == 2
+
+            # Only the failed update should be checked again.
+            check_policies_main()
+            assert post.call_args_list[-1][0][1]['subject'][-1]['item'] == updates[1].alias
+            assert post.call_count == 3
+
+            # Changing the builds changes the requests.
+            update = self.db.query(models.Update).filter_by(alias=updates[0].alias).one()
+            update.builds.append(create_update(self.db, ['other-1.0-1.fc17']).builds[0])
+            self.db.commit()
+            check_policies_main()
+            assert post.call_count == 6
+
+    @patch.dict(config, [('greenwave_api_url', 'http://domain.local'),
+                         ('greenwave_decision_cache_ttl', 0)])
+    def test_unchanged_not_skipped_without_ttl(self):
+        """All the updates should be checked on every run if the decisions aren't remembered."""
+        self._create_updates(1)
+
+        with patch('bodhi.server.models.util.greenwave_api_post') as post:
+            post.return_value = {'policies_satisfied': True,
+                                 'summary': 'All required tests passed'}
+            check_policies_main()
+            check_policies_main()
+
+        assert post.call_count == 4
+
+    @patch.dict(config, [('greenwave_api_url', 'http://domain.local')])
+    @patch('bodhi.server.tasks.check_policies.log.exception')
+    def test_commit_error(self, exception):
+        """Decisions that could not be committed should not be remembered."""
+        update = self._create_updates(0)[0]
+        update.test_gating_status = models.TestGatingStatus.passed
+        self.db.commit()
+
+        with patch('bodhi.server.models.util.greenwave_api_post') as post:
+            post.return_value = {'policies_satisfied': True,
+                                 'summary': 'All required tests passed'}
+            with patch.object(self.db, 'commit', side_effect=[IOError('db down'), None]):
+                check_policies_main()
+            check_policies_main()
+
+        assert post.call_count == 2
+        exception.assert_called_once_with(
+            'There was an error saving the policy checks of 1 updates')
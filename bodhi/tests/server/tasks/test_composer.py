@@ -15,15 +15,18 @@
 # You should have received a copy of the GNU General Public License
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+from concurrent.futures import ThreadPoolExecutor
 from unittest import mock
 from urllib.error import HTTPError, URLError
 import urllib.parse as urlparse
 import datetime
 import errno
+import http.server
 import json
 import os
 import shutil
 import tempfile
+import threading
 import time
 from http.client import IncompleteRead
 
@@ -31,11 +34,12 @@ import pytest
 from click import testing
 from fedora_messaging import api
 from fedora_messaging.testing import mock_sends
+from sqlalchemy import event, inspect
 
 from bodhi.messages.schemas import (
     base as base_schemas, buildroot_override as override_schemas, compose as compose_schemas,
     errata as errata_schemas, update as update_schemas)
-from bodhi.server import buildsys, exceptions, log, push
+from bodhi.server import bugs, buildsys, exceptions, log, push
 from bodhi.server.config import config
 from bodhi.server.tasks import compose as compose_task
 from bodhi.server.tasks.composer import (
@@ -763,6 +767,74 @@ That was the actual one'''
         assert 'completed_repo' in t._checkpoints
         save_state.assert_not_called()
 
+    def _make_sanity_check_thread(self):
+        """Return an RPMComposerThread with a completed repo whose arches have Packages dirs."""
+        task = self._make_task()
+        t = RPMComposerThread(self.semmock, task['composes'][0],
+                              'ralph', self.db_factory, self.tempdir)
+        t.devnull = mock.MagicMock()
+        t.id = 'f17-updates-testing'
+        with self.db_factory() as session:
+            t.db = session
+            t.compose = session.query(Compose).one()
+            t._checkpoints = {}
+            t._startyear = datetime.datetime.utcnow().year
+            t._wait_for_pungi(self._generate_fake_pungi(t, 'testing_tag', t.compose.release)())
+            t.db = None
+
+        for arch in ('i386', 'x86_64', 'armhfp'):
+            for packages in (('os', 'Packages', 'a'), ('debug', 'tree', 'Packages', 'a')):
+                os.makedirs(os.path.join(t.path, 'compose', 'Everything', arch, *packages))
+        os.makedirs(os.path.join(t.path, 'compose', 'Everything', 'source', 'tree', 'Packages',
+                                 'a'))
+        return t
+
+    @mock.patch.dict(config, {'max_concurrent_sanity_checks': 2})
+    @mock.patch('bodhi.server.tasks.composer.ComposerThread.save_state')
+    @mock.patch('bodhi.server.tasks.composer.sanity_check_repodata')
+    def test_sanity_check_durations(self, sanity_check_repodata, save_state):
+        """The arches should be checked concurrently, and their durations recorded."""
+        t = self._make_sanity_check_thread()
+        threads = set()
+        sanity_check_repodata.side_effect = \
+            lambda repodata, repo_type: threads.add(threading.get_ident())
+
+        with mock.patch('bodhi.server.tasks.composer.ThreadPoolExecutor',
+                        wraps=ThreadPoolExecutor) as executor:
+            t._sanity_check_repo()
+
+        executor.assert_called_once_with(max_workers=2)
+        assert sanity_check_repodata.call_count == 4
+        assert threading.get_ident() not in threads
+        durations = t._checkpoints['sanity_check_durations']
+        assert sorted(durations) == ['armhfp', 'i386', 'source', 'x86_64']
+        assert all(isinstance(d, float) for d in durations.values())
+        assert 'completed_repo' in t._checkpoints
+
+    @mock.patch('bodhi.server.tasks.composer.ComposerThread.save_state')
+    @mock.patch('bodhi.server.tasks.composer.sanity_check_repodata')
+    def test_sanity_check_one_arch_fails(self, sanity_check_repodata, save_state):
+        """The repo should be thrown out once, after every arch was checked."""
+        t = self._make_sanity_check_thread()
+        checked = []
+
+        def check(repodata, repo_type):
+            checked.append(repodata)
+            if '/x86_64/' in repodata:
+                raise exceptions.RepodataException('broken')
+
+        sanity_check_repodata.side_effect = check
+
+        with mock.patch.object(t, '_toss_out_repo', wraps=t._toss_out_repo) as toss_out_repo:
+            with pytest.raises(exceptions.RepodataException):
+                t._sanity_check_repo()
+
+        assert len(checked) == 4
+        toss_out_repo.assert_called_once_with()
+        assert 'completed_repo' not in t._checkpoints
+        assert sorted(t._checkpoints['sanity_check_durations']) == \
+            ['armhfp', 'i386', 'source', 'x86_64']
+
     @mock.patch('bodhi.server.tasks.composer.ComposerThread.save_state')
     def test_sanity_check_broken_repodata(self, save_state):
         task = self._make_task()
@@ -1196,7 +1268,8 @@ That was the actual one'''
             compose = Compose.from_dict(session, task['composes'][0])
             assert compose.state == ComposeState.failed
             assert compose.error_message == 'Pungi exited with status 1'
-        assert t._checkpoints == {'determine_and_perform_tag_actions': True}
+        assert t._checkpoints == {'determine_and_perform_tag_actions': True,
+                                  'wait_durations': {'rpm_headers': mock.ANY}}
 
     @mock.patch.dict('bodhi.server.tasks.composer.config', {'clean_old_composes': False})
     @mock.patch(**mock_taskotron_results)
@@ -2316,6 +2389,34 @@ class TestContainerComposerThread__compose_updates(ComposerThreadBaseTestCase):
         Release._tag_cache = None
         self.db.flush()
 
+    def test_load_builds(self):
+        """Ensure that the builds of the compose are loaded with a single query."""
+        task = self._make_task(['--releases', 'F28C'])
+        t = ContainerComposerThread(self.semmock, task['composes'][0],
+                                    'bowlofeggs', self.Session, self.tempdir)
+        t.compose = Compose.from_dict(self.db, task['composes'][0])
+        t.db = self.db
+        updates = t.compose.updates
+        self.db.expire_all()
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            if 'FROM builds' in statement:
+                statements.append(statement)
+
+        event.listen(self.engine, 'before_cursor_execute', count)
+        try:
+            t._load_builds()
+        finally:
+            event.remove(self.engine, 'before_cursor_execute', count)
+
+        assert len(statements) == 1
+        loaded = inspect(updates[0]).dict
+        assert 'builds' in loaded
+        assert 'bugs' in loaded
+        assert [b.nvr for b in updates[0].builds] == [
+            'testcontainer1-2.0.1-71.fc28container', 'testcontainer2-1.0.1-1.fc28container']
+
     @mock.patch('bodhi.server.tasks.composer.subprocess.Popen')
     def test_request_not_stable(self, Popen):
         """Ensure that the correct destination tag is used for non-stable updates."""
@@ -2325,6 +2426,7 @@ class TestContainerComposerThread__compose_updates(ComposerThreadBaseTestCase):
         t = ContainerComposerThread(self.semmock, task['composes'][0],
                                     'bowlofeggs', self.Session, self.tempdir)
         t.compose = Compose.from_dict(self.db, task['composes'][0])
+        t.db = self.db
 
         t._compose_updates()
 
@@ -2354,6 +2456,7 @@ class TestContainerComposerThread__compose_updates(ComposerThreadBaseTestCase):
         t = ContainerComposerThread(self.semmock, task['composes'][0],
                                     'bowlofeggs', self.Session, self.tempdir)
         t.compose = Compose.from_dict(self.db, task['composes'][0])
+        t.db = self.db
 
         t._compose_updates()
 
@@ -2383,6 +2486,7 @@ class TestContainerComposerThread__compose_updates(ComposerThreadBaseTestCase):
         t = ContainerComposerThread(self.semmock, task['composes'][0],
                                     'bowlofeggs', self.Session, self.tempdir)
         t.compose = Compose.from_dict(self.db, task['composes'][0])
+        t.db = self.db
 
         with pytest.raises(RuntimeError) as exc:
             t._compose_updates()
@@ -2407,6 +2511,7 @@ class TestContainerComposerThread__compose_updates(ComposerThreadBaseTestCase):
         t = ContainerComposerThread(self.semmock, task['composes'][0],
                                     'bowlofeggs', self.Session, self.tempdir)
         t.compose = Compose.from_dict(self.db, task['composes'][0])
+        t.db = self.db
 
         t._compose_updates()
 
@@ -2426,6 +2531,33 @@ class TestContainerComposerThread__compose_updates(ComposerThreadBaseTestCase):
                 expected_mock_calls.append(mock.call().communicate())
         assert Popen.mock_calls == expected_mock_calls
 
+    @mock.patch.dict(config, {'container.native_copy': True})
+    @mock.patch('bodhi.server.util.skopeo_lite.copy_image')
+    @mock.patch('bodhi.server.tasks.composer.subprocess.Popen')
+    def test_native_copy(self, Popen, copy_image):
+        """With container.native_copy, each image should be copied once, to all its tags."""
+        task = self._make_task(['--releases', 'F28C'])
+        t = ContainerComposerThread(self.semmock, task['composes'][0],
+                                    'bowlofeggs', self.Session, self.tempdir)
+        t.compose = Compose.from_dict(self.db, task['composes'][0])
+        t.db = self.db
+
+        t._compose_updates()
+
+        assert Popen.call_count == 0
+        assert copy_image.call_count == 2
+        for call, source in zip(copy_image.mock_calls, ('testcontainer1:2.0.1-71.fc28container',
+                                                        'testcontainer2:1.0.1-1.fc28container')):
+            name, tag = source.split(':')
+            src, dest, extra_tags, executor, blob_locations = call[1]
+            assert (src.registry, src.repo, src.tag) == (
+                config['container.source_registry'], f'f28/{name}', tag)
+            assert (dest.registry, dest.repo, dest.tag) == (
+                config['container.destination_registry'], f'f28/{name}', tag)
+            assert extra_tags == [tag.split('-')[0], 'testing']
+        # The blobs are shared by all the copies.
+        assert copy_image.mock_calls[0][1][3:] == copy_image.mock_calls[1][1][3:]
+
 
 class TestPungiComposerThread__compose_updates(ComposerThreadBaseTestCase):
     """This class contains tests for the PungiComposerThread._compose_updates() method."""
@@ -2438,12 +2570,130 @@ class TestPungiComposerThread__compose_updates(ComposerThreadBaseTestCase):
                                 'bowlofeggs', self.Session, compose_dir)
         t._checkpoints = {'cool': 'checkpoint'}
         t.compose = Compose.from_dict(self.db, task['composes'][0])
+        t.db = self.db
         t.skip_compose = True
 
         t._compose_updates()
 
         assert os.path.exists(compose_dir)
 
+    def _make_thread(self, resume=False):
+        """Return a PungiComposerThread whose compose stages after starting Pungi are mocked."""
+        task = self._make_task()
+        t = PungiComposerThread(self.semmock, task['composes'][0], 'bowlofeggs', self.Session,
+                                self.tempdir, resume=resume)
+        t._checkpoints = {}
+        t.compose = Compose.from_dict(self.db, task['composes'][0])
+        t.db = self.db
+        t.id = 'f17-updates-testing'
+        t.skip_compose = False
+        for stage in ('_punge', '_generate_updateinfo', '_wait_for_pungi', '_sanity_check_repo',
+                      '_wait_for_repo_signature', '_stage_repo', '_wait_for_sync', 'save_state',
+                      'generate_testing_digest'):
+            setattr(t, stage, mock.MagicMock())
+        return t
+
+    def test_rpm_headers_prefetched_while_pungi_runs(self):
+        """The RPM headers are fetched on another thread while the updateinfo is generated."""
+        t = self._make_thread()
+        generated = threading.Event()
+        threads = []
+
+        def prefetch(nvrs):
+            threads.append((threading.current_thread(), list(nvrs)))
+            # Let the updateinfo be generated before the headers are fetched.
+            assert generated.wait(5)
+
+        def generate_updateinfo():
+            generated.set()
+            return mock.DEFAULT
+
+        t._generate_updateinfo.side_effect = generate_updateinfo
+        t.generate_testing_digest.side_effect = lambda: t._wait_for_pungi.assert_not_called()
+
+        with mock.patch('bodhi.server.rpmcache.headers.prefetch', side_effect=prefetch):
+            t._compose_updates()
+
+        [(thread, nvrs)] = threads
+        assert thread is not threading.current_thread()
+        assert thread.name == 'f17-updates-testing-rpm-headers'
+        assert not thread.is_alive()
+        assert nvrs == ['bodhi-2.0-1.fc17']
+        t._punge.assert_called_once_with()
+        t.generate_testing_digest.assert_called_once_with()
+        t._wait_for_pungi.assert_called_once_with(t._punge.return_value)
+        assert 'rpm_headers' in t._checkpoints['wait_durations']
+        assert t._checkpoints['compose_done']
+
+    def test_rpm_headers_prefetch_failure(self, caplog):
+        """A failure to prefetch the headers is logged, and does not fail the compose."""
+        t = self._make_thread()
+
+        with mock.patch('bodhi.server.rpmcache.headers.prefetch',
+                        side_effect=IOError('Koji is down')):
+            t._compose_updates()
+
+        assert ('Failed to prefetch the RPM headers of f17-updates-testing, they will be fetched '
+                'when they are needed') in caplog.text
+        t.generate_testing_digest.assert_called_once_with()
+        assert t._checkpoints['compose_done']
+
+    def test_rpm_headers_prefetch_updateinfo_failure(self):
+        """The prefetching thread is waited for even if the updateinfo can't be generated."""
+        t = self._make_thread()
+        t._generate_updateinfo.side_effect = IOError('disk full')
+
+        with mock.patch('bodhi.server.rpmcache.headers.prefetch') as prefetch:
+            with pytest.raises(IOError):
+                t._compose_updates()
+
+        prefetch.assert_called_once_with(['bodhi-2.0-1.fc17'])
+        assert 'rpm_headers' in t._checkpoints['wait_durations']
+        t._wait_for_pungi.assert_not_called()
+
+    @pytest.mark.parametrize('request_, checkpoint', (
+        (UpdateRequest.testing, 'send_testing_digest'),
+        (UpdateRequest.stable, 'send_stable_announcements'),
+    ))
+    def test_rpm_headers_not_prefetched_when_resumed(self, request_, checkpoint):
+        """A resumed compose that already sent its notifications doesn't prefetch the headers."""
+        t = self._make_thread(resume=True)
+        t.compose.request = request_
+        t._checkpoints[checkpoint] = True
+
+        with mock.patch('bodhi.server.rpmcache.headers.prefetch') as prefetch:
+            t._compose_updates()
+
+        prefetch.assert_not_called()
+        assert 'wait_durations' not in t._checkpoints
+        t._wait_for_pungi.assert_called_once_with(t._punge.return_value)
+
+    def test_rpm_headers_not_prefetched_without_rpms(self):
+        """Nothing is prefetched if the compose has no RPM builds."""
+        t = self._make_thread()
+        t.compose.updates[0].builds[0].type = ContentType.module
+
+        with mock.patch('bodhi.server.rpmcache.headers.prefetch') as prefetch:
+            t._compose_updates()
+
+        prefetch.assert_not_called()
+        assert 'wait_durations' not in t._checkpoints
+
+    @pytest.mark.parametrize('skip_compose, checkpoints', ((True, {}),
+                                                           (False, {'compose_done': True})))
+    def test_rpm_headers_not_prefetched_without_pungi(self, skip_compose, checkpoints):
+        """Without Pungi to wait for, the testing digest is generated without a prefetch."""
+        t = self._make_thread()
+        t.skip_compose = skip_compose
+        t._checkpoints = checkpoints
+
+        with mock.patch('bodhi.server.rpmcache.headers.prefetch') as prefetch:
+            t._compose_updates()
+
+        prefetch.assert_not_called()
+        t._punge.assert_not_called()
+        t.generate_testing_digest.assert_called_once_with()
+
 
 class TestFlatpakComposerThread__compose_updates(ComposerThreadBaseTestCase):
     """Test FlatpakComposerThread._compose_update()."""
@@ -2499,6 +2749,7 @@ class TestFlatpakComposerThread__compose_updates(ComposerThreadBaseTestCase):
         t = FlatpakComposerThread(self.semmock, task['composes'][0],
                                   'otaylor', self.Session, self.tempdir)
         t.compose = Compose.from_dict(self.db, task['composes'][0])
+        t.db = self.db
 
         t._compose_updates()
 
@@ -2963,7 +3214,7 @@ class TestPungiComposerThread__wait_for_sync(ComposerThreadBaseTestCase):
     @mock.patch('bodhi.server.tasks.composer.PungiComposerThread.save_state')
     @mock.patch('bodhi.server.tasks.composer.time.sleep',
                 mock.MagicMock(side_effect=Exception('This should not happen during this test.')))
-    @mock.patch('bodhi.server.tasks.composer.urlopen')
+    @mock.patch('bodhi.server.waits.urlopen')
     def test_checksum_match_immediately(self, urlopen, save):
         """
         Assert correct operation when the repomd checksum matches immediately.
@@ -2972,6 +3223,7 @@ class TestPungiComposerThread__wait_for_sync(ComposerThreadBaseTestCase):
         t = PungiComposerThread(self.semmock, self._make_task()['composes'][0],
                                 'bowlofeggs', self.Session, self.tempdir)
         t.compose = self.db.query(Compose).one()
+        t._checkpoints = {}
         t.id = 'f26-updates-testing'
         t.path = os.path.join(self.tempdir, t.id + '-' + time.strftime("%y%m%d.%H%M"))
         for arch in ['aarch64', 'x86_64']:
@@ -2987,15 +3239,14 @@ class TestPungiComposerThread__wait_for_sync(ComposerThreadBaseTestCase):
             t._wait_for_sync()
 
         assert urlopen.call_count == 1
+        assert urlopen.mock_calls[0][2] == {'timeout': config['wait_for_sync_max_interval']}
         # Since os.listdir() isn't deterministic about the order of the items it returns, the test
         # won't be deterministic about which of these URLs get called. However, either one of them
         # would be correct so we will just assert that one of them is called.
-        expected_calls = [
-            mock.call('http://example.com/pub/fedora/linux/updates/testing/17/x86_64/'
-                      'repodata.repomd.xml'),
-            mock.call('http://example.com/pub/fedora/linux/updates/testing/17/aarch64/'
-                      'repodata.repomd.xml')]
-        assert urlopen.mock_calls[0] in expected_calls
+        expected_urls = [
+            'http://example.com/pub/fedora/linux/updates/testing/17/x86_64/repodata.repomd.xml',
+            'http://example.com/pub/fedora/linux/updates/testing/17/aarch64/repodata.repomd.xml']
+        assert urlopen.mock_calls[0][1][0].full_url in expected_urls
         save.assert_called_once_with(ComposeState.syncing_repo)
 
     @mock.patch.dict(
@@ -3005,7 +3256,7 @@ class TestPungiComposerThread__wait_for_sync(ComposerThreadBaseTestCase):
     @mock.patch('bodhi.server.tasks.composer.PungiComposerThread.save_state')
     @mock.patch('bodhi.server.tasks.composer.time.sleep',
                 mock.MagicMock(side_effect=Exception('This should not happen during this test.')))
-    @mock.patch('bodhi.server.tasks.composer.urlopen')
+    @mock.patch('bodhi.server.waits.urlopen')
     def test_no_checkarch(self, urlopen, save):
         """
         Assert error when no checkarch is found.
@@ -3014,6 +3265,7 @@ class TestPungiComposerThread__wait_for_sync(ComposerThreadBaseTestCase):
         t = PungiComposerThread(self.semmock, self._make_task()['composes'][0],
                                 'bowlofeggs', self.Session, self.tempdir)
         t.compose = self.db.query(Compose).one()
+        t._checkpoints = {}
         t.id = 'f26-updates-testing'
         t.path = os.path.join(self.tempdir, t.id + '-' + time.strftime("%y%m%d.%H%M"))
         for arch in ['source']:
@@ -3034,7 +3286,7 @@ class TestPungiComposerThread__wait_for_sync(ComposerThreadBaseTestCase):
             'http://example.com/pub/fedora/linux/updates/testing/%s/%s/repodata.repomd.xml'})
     @mock.patch('bodhi.server.tasks.composer.PungiComposerThread.save_state')
     @mock.patch('bodhi.server.tasks.composer.time.sleep')
-    @mock.patch('bodhi.server.tasks.composer.urlopen')
+    @mock.patch('bodhi.server.waits.urlopen')
     def test_checksum_match_third_try(self, urlopen, sleep, save):
         """
         Assert correct operation when the repomd checksum matches on the third try.
@@ -3043,6 +3295,7 @@ class TestPungiComposerThread__wait_for_sync(ComposerThreadBaseTestCase):
         t = PungiComposerThread(self.semmock, self._make_task()['composes'][0],
                                 'bowlofeggs', self.Session, self.tempdir)
         t.compose = self.db.query(Compose).one()
+        t._checkpoints = {}
         t.id = 'f26-updates-testing'
         t.path = os.path.join(self.tempdir, t.id + '-' + time.strftime("%y%m%d.%H%M"))
         for arch in ['aarch64', 'x86_64']:
@@ -3060,14 +3313,11 @@ class TestPungiComposerThread__wait_for_sync(ComposerThreadBaseTestCase):
         # Since os.listdir() isn't deterministic about the order of the items it returns, the test
         # won't be deterministic about which of arch URL gets used. However, either one of them
         # would be correct so we will just assert that the one that is used is used correctly.
-        arch = 'x86_64' if 'x86_64' in urlopen.mock_calls[0][1][0] else 'aarch64'
-        expected_calls = [
-            mock.call('http://example.com/pub/fedora/linux/updates/testing/17/'
-                      '{}/repodata.repomd.xml'.format(arch)),
-            mock.call().read()]
-        expected_calls = expected_calls * 3
-        urlopen.assert_has_calls(expected_calls)
-        sleep.assert_has_calls([mock.call(200), mock.call(200)])
+        arch = 'x86_64' if 'x86_64' in urlopen.mock_calls[0][1][0].full_url else 'aarch64'
+        assert [c[0][0].full_url for c in urlopen.call_args_list] == \
+            ['http://example.com/pub/fedora/linux/updates/testing/17/'
+             '{}/repodata.repomd.xml'.format(arch)] * 3
+        assert sleep.mock_calls == [mock.call(10), mock.call(20)]
         save.assert_called_with(ComposeState.syncing_repo)
 
     @mock.patch.dict(
@@ -3076,7 +3326,7 @@ class TestPungiComposerThread__wait_for_sync(ComposerThreadBaseTestCase):
             'http://example.com/pub/fedora/linux/updates/testing/%s/%s/repodata.repomd.xml'})
     @mock.patch('bodhi.server.tasks.composer.PungiComposerThread.save_state')
     @mock.patch('bodhi.server.tasks.composer.time.sleep')
-    @mock.patch('bodhi.server.tasks.composer.urlopen')
+    @mock.patch('bodhi.server.waits.urlopen')
     @mock.patch('bodhi.server.tasks.composer.log')
     def test_httperror(self, mocked_log, urlopen, sleep, save):
         """
@@ -3089,6 +3339,7 @@ class TestPungiComposerThread__wait_for_sync(ComposerThreadBaseTestCase):
         t = PungiComposerThread(self.semmock, self._make_task()['composes'][0],
                                 'bowlofeggs', self.Session, self.tempdir)
         t.compose = self.db.query(Compose).one()
+        t._checkpoints = {}
         t.id = 'f26-updates-testing'
         t.path = os.path.join(self.tempdir, t.id + '-' + time.strftime("%y%m%d.%H%M"))
         for arch in ['aarch64', 'x86_64']:
@@ -3106,14 +3357,12 @@ class TestPungiComposerThread__wait_for_sync(ComposerThreadBaseTestCase):
         # Since os.listdir() isn't deterministic about the order of the items it returns, the test
         # won't be deterministic about which of arch URL gets used. However, either one of them
         # would be correct so we will just assert that the one that is used is used correctly.
-        arch = 'x86_64' if 'x86_64' in urlopen.mock_calls[0][1][0] else 'aarch64'
-        expected_calls = [
-            mock.call('http://example.com/pub/fedora/linux/updates/testing/17/'
-                      '{}/repodata.repomd.xml'.format(arch))
-            for i in range(2)]
-        urlopen.assert_has_calls(expected_calls)
+        arch = 'x86_64' if 'x86_64' in urlopen.mock_calls[0][1][0].full_url else 'aarch64'
+        assert [c[0][0].full_url for c in urlopen.call_args_list] == \
+            ['http://example.com/pub/fedora/linux/updates/testing/17/'
+             '{}/repodata.repomd.xml'.format(arch)] * 2
         mocked_log.exception.assert_called_once_with('Error fetching repomd.xml')
-        sleep.assert_called_once_with(200)
+        sleep.assert_called_once_with(10)
         save.assert_called_once_with(ComposeState.syncing_repo)
 
     @mock.patch.dict(
@@ -3122,7 +3371,7 @@ class TestPungiComposerThread__wait_for_sync(ComposerThreadBaseTestCase):
             'http://example.com/pub/fedora/linux/updates/testing/%s/%s/repodata.repomd.xml'})
     @mock.patch('bodhi.server.tasks.composer.PungiComposerThread.save_state')
     @mock.patch('bodhi.server.tasks.composer.time.sleep')
-    @mock.patch('bodhi.server.tasks.composer.urlopen')
+    @mock.patch('bodhi.server.waits.urlopen')
     @mock.patch('bodhi.server.tasks.composer.log')
     def test_connectionreseterror(self, mocked_log, urlopen, sleep, save):
         """
@@ -3136,6 +3385,7 @@ class TestPungiComposerThread__wait_for_sync(ComposerThreadBaseTestCase):
         t = PungiComposerThread(self.semmock, self._make_task()['composes'][0],
                                 'bowlofeggs', self.Session, self.tempdir)
         t.compose = self.db.query(Compose).one()
+        t._checkpoints = {}
         t.id = 'f26-updates-testing'
         t.path = os.path.join(self.tempdir, t.id + '-' + time.strftime("%y%m%d.%H%M"))
         for arch in ['aarch64', 'x86_64']:
@@ -3153,14 +3403,12 @@ class TestPungiComposerThread__wait_for_sync(ComposerThreadBaseTestCase):
         # Since os.listdir() isn't deterministic about the order of the items it returns, the test
         # won't be deterministic about which of arch URL gets used. However, either one of them
         # would be correct so we will just assert that the one that is used is used correctly.
-        arch = 'x86_64' if 'x86_64' in urlopen.mock_calls[0][1][0] else 'aarch64'
-        expected_calls = [
-            mock.call('http://example.com/pub/fedora/linux/updates/testing/17/'
-                      '{}/repodata.repomd.xml'.format(arch))
-            for i in range(2)]
-        urlopen.assert_has_calls(expected_calls)
+        arch = 'x86_64' if 'x86_64' in urlopen.mock_calls[0][1][0].full_url else 'aarch64'
+        assert [c[0][0].full_url for c in urlopen.call_args_list] == \
+            ['http://example.com/pub/fedora/linux/updates/testing/17/'
+             '{}/repodata.repomd.xml'.format(arch)] * 2
         mocked_log.exception.assert_called_once_with('Error fetching repomd.xml')
-        sleep.assert_called_once_with(200)
+        sleep.assert_called_once_with(10)
         save.assert_called_once_with(ComposeState.syncing_repo)
 
     @mock.patch.dict(
@@ -3169,7 +3417,7 @@ class TestPungiComposerThread__wait_for_sync(ComposerThreadBaseTestCase):
             'http://example.com/pub/fedora/linux/updates/testing/%s/%s/repodata.repomd.xml'})
     @mock.patch('bodhi.server.tasks.composer.PungiComposerThread.save_state')
     @mock.patch('bodhi.server.tasks.composer.time.sleep')
-    @mock.patch('bodhi.server.tasks.composer.urlopen')
+    @mock.patch('bodhi.server.waits.urlopen')
     @mock.patch('bodhi.server.tasks.composer.log')
     def test_incompleteread(self, mocked_log, urlopen, sleep, save):
         """
@@ -3180,6 +3428,7 @@ class TestPungiComposerThread__wait_for_sync(ComposerThreadBaseTestCase):
         t = PungiComposerThread(self.semmock, self._make_task()['composes'][0],
                                 'bowlofeggs', self.Session, self.tempdir)
         t.compose = self.db.query(Compose).one()
+        t._checkpoints = {}
         t.id = 'f26-updates-testing'
         t.path = os.path.join(self.tempdir, t.id + '-' + time.strftime("%y%m%d.%H%M"))
         for arch in ['aarch64', 'x86_64']:
@@ -3197,16 +3446,13 @@ class TestPungiComposerThread__wait_for_sync(ComposerThreadBaseTestCase):
         # Since os.listdir() isn't deterministic about the order of the items it returns, the test
         # won't be deterministic about which of arch URL gets used. However, either one of them
         # would be correct so we will just assert that the one that is used is used correctly.
-        arch = 'x86_64' if 'x86_64' in urlopen.mock_calls[0][1][0] else 'aarch64'
-        expected_calls = []
-        for i in range(2):
-            expected_calls.append(
-                mock.call('http://example.com/pub/fedora/linux/updates/testing/17/'
-                          '{}/repodata.repomd.xml'.format(arch)))
-            expected_calls.append(mock.call().read())
-        urlopen.assert_has_calls(expected_calls)
+        arch = 'x86_64' if 'x86_64' in urlopen.mock_calls[0][1][0].full_url else 'aarch64'
+        assert [c[0][0].full_url for c in urlopen.call_args_list] == \
+            ['http://example.com/pub/fedora/linux/updates/testing/17/'
+             '{}/repodata.repomd.xml'.format(arch)] * 2
+        assert urlopen.return_value.read.call_count == 2
         mocked_log.exception.assert_called_once_with('Error fetching repomd.xml')
-        sleep.assert_called_once_with(200)
+        sleep.assert_called_once_with(10)
         save.assert_called_once_with(ComposeState.syncing_repo)
 
     @mock.patch.dict(
@@ -3215,7 +3461,7 @@ class TestPungiComposerThread__wait_for_sync(ComposerThreadBaseTestCase):
     @mock.patch('bodhi.server.tasks.composer.PungiComposerThread.save_state')
     @mock.patch('bodhi.server.tasks.composer.time.sleep',
                 mock.MagicMock(side_effect=Exception('This should not happen during this test.')))
-    @mock.patch('bodhi.server.tasks.composer.urlopen',
+    @mock.patch('bodhi.server.waits.urlopen',
                 mock.MagicMock(side_effect=Exception('urlopen should not be called')))
     def test_missing_config_key(self, save):
         """
@@ -3224,6 +3470,7 @@ class TestPungiComposerThread__wait_for_sync(ComposerThreadBaseTestCase):
         t = PungiComposerThread(self.semmock, self._make_task()['composes'][0],
                                 'bowlofeggs', self.Session, self.tempdir)
         t.compose = self.db.query(Compose).one()
+        t._checkpoints = {}
         t.id = 'f26-updates-testing'
         t.path = os.path.join(self.tempdir, t.id + '-' + time.strftime("%y%m%d.%H%M"))
         for arch in ['aarch64', 'x86_64']:
@@ -3247,7 +3494,7 @@ class TestPungiComposerThread__wait_for_sync(ComposerThreadBaseTestCase):
     @mock.patch('bodhi.server.tasks.composer.PungiComposerThread.save_state')
     @mock.patch('bodhi.server.tasks.composer.time.sleep',
                 mock.MagicMock(side_effect=Exception('This should not happen during this test.')))
-    @mock.patch('bodhi.server.tasks.composer.urlopen',
+    @mock.patch('bodhi.server.waits.urlopen',
                 mock.MagicMock(side_effect=Exception('urlopen should not be called')))
     @mock.patch('bodhi.server.tasks.composer.log')
     def test_missing_repomd(self, mocked_log, save):
@@ -3258,6 +3505,7 @@ class TestPungiComposerThread__wait_for_sync(ComposerThreadBaseTestCase):
         t = PungiComposerThread(self.semmock, self._make_task()['composes'][0],
                                 'bowlofeggs', self.Session, self.tempdir)
         t.compose = self.db.query(Compose).one()
+        t._checkpoints = {}
         t.id = 'f26-updates-testing'
         t.path = os.path.join(self.tempdir, t.id + '-' + time.strftime("%y%m%d.%H%M"))
         repodata = os.path.join(t.path, 'compose', 'Everything', 'x86_64', 'os', 'repodata')
@@ -3277,7 +3525,7 @@ class TestPungiComposerThread__wait_for_sync(ComposerThreadBaseTestCase):
             'http://example.com/pub/fedora/linux/updates/testing/%s/%s/repodata.repomd.xml'})
     @mock.patch('bodhi.server.tasks.composer.PungiComposerThread.save_state')
     @mock.patch('bodhi.server.tasks.composer.time.sleep')
-    @mock.patch('bodhi.server.tasks.composer.urlopen')
+    @mock.patch('bodhi.server.waits.urlopen')
     @mock.patch('bodhi.server.tasks.composer.log')
     def test_urlerror(self, mocked_log, urlopen, sleep, save):
         """
@@ -3290,6 +3538,7 @@ class TestPungiComposerThread__wait_for_sync(ComposerThreadBaseTestCase):
         t = PungiComposerThread(self.semmock, self._make_task()['composes'][0],
                                 'bowlofeggs', self.Session, self.tempdir)
         t.compose = self.db.query(Compose).one()
+        t._checkpoints = {}
         t.id = 'f26-updates-testing'
         t.path = os.path.join(self.tempdir, t.id + '-' + time.strftime("%y%m%d.%H%M"))
         for arch in ['aarch64', 'x86_64']:
@@ -3307,16 +3556,77 @@ class TestPungiComposerThread__wait_for_sync(ComposerThreadBaseTestCase):
         # Since os.listdir() isn't deterministic about the order of the items it returns, the test
         # won't be deterministic about which of arch URL gets used. However, either one of them
         # would be correct so we will just assert that the one that is used is used correctly.
-        arch = 'x86_64' if 'x86_64' in urlopen.mock_calls[0][1][0] else 'aarch64'
-        expected_calls = [
-            mock.call('http://example.com/pub/fedora/linux/updates/testing/17/'
-                      '{}/repodata.repomd.xml'.format(arch))
-            for i in range(2)]
-        urlopen.assert_has_calls(expected_calls)
+        arch = 'x86_64' if 'x86_64' in urlopen.mock_calls[0][1][0].full_url else 'aarch64'
+        assert [c[0][0].full_url for c in urlopen.call_args_list] == \
+            ['http://example.com/pub/fedora/linux/updates/testing/17/'
+             '{}/repodata.repomd.xml'.format(arch)] * 2
         mocked_log.exception.assert_called_once_with('Error fetching repomd.xml')
-        sleep.assert_called_once_with(200)
+        sleep.assert_called_once_with(10)
         save.assert_called_once_with(ComposeState.syncing_repo)
 
+    @mock.patch('bodhi.server.tasks.composer.PungiComposerThread.save_state')
+    def test_conditional_requests(self, save):
+        """
+        Assert that the master mirror is polled with conditional requests and exponential backoff.
+        """
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.server.etags.append(self.headers.get('If-None-Match'))
+                etag = '"%s"' % len(self.server.body)
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(self.server.body)
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.HTTPServer(('127.0.0.1', 0), Handler)
+        server.body = b'old'
+        server.etags = []
+        serving = threading.Thread(target=server.serve_forever)
+        serving.start()
+        t = PungiComposerThread(self.semmock, self._make_task()['composes'][0],
+                                'bowlofeggs', self.Session, self.tempdir)
+        t.compose = self.db.query(Compose).one()
+        t._checkpoints = {}
+        t.id = 'f26-updates-testing'
+        t.path = os.path.join(self.tempdir, t.id + '-' + time.strftime("%y%m%d.%H%M"))
+        repodata = os.path.join(t.path, 'compose', 'Everything', 'x86_64', 'os', 'repodata')
+        os.makedirs(repodata)
+        with open(os.path.join(repodata, 'repomd.xml'), 'w') as repomd:
+            repomd.write('---\nyaml: rules')
+
+        def sleep(delay):
+            # The mirror gets synced after the second poll.
+            if len(server.etags) == 2:
+                server.body = b'---\nyaml: rules'
+
+        url = 'http://127.0.0.1:%d/%%s/%%s/repomd.xml' % server.server_port
+
+        try:
+            with mock.patch.dict(config, {
+                    'fedora_testing_master_repomd': url,
+                    'wait_for_sync_min_interval': 10, 'wait_for_sync_max_interval': 15}):
+                with mock.patch('bodhi.server.tasks.composer.time.sleep',
+                                side_effect=sleep) as sleep:
+                    with mock_sends(compose_schemas.ComposeSyncWaitV1,
+                                    compose_schemas.ComposeSyncDoneV1):
+                        t._wait_for_sync()
+        finally:
+            server.shutdown()
+            serving.join()
+            server.server_close()
+
+        # The second request was answered with a 304, as the repomd.xml hadn't changed.
+        assert server.etags == [None, '"3"', '"3"']
+        assert sleep.mock_calls == [mock.call(10), mock.call(15)]
+        assert 'sync' in t._checkpoints['wait_durations']
+
 
 class TestComposerThread__mark_status_changes(ComposerThreadBaseTestCase):
     """Test the _mark_status_changes() method."""
@@ -3405,9 +3715,13 @@ class TestComposerThread_send_testing_digest(ComposerThreadBaseTestCase):
         # Clear pending messages
         self.db.info['messages'] = []
 
-        with mock.patch.dict(config, {'smtp_server': 'smtp.example.com'}):
+        with mock.patch.dict(config, {'smtp_server': 'smtp.example.com'}), \
+                mock.patch.object(t, 'get_unapproved_critpath_updates',
+                                  wraps=t.get_unapproved_critpath_updates) as get_critpath:
             t.send_testing_digest()
 
+        # The critical path updates are only queried once.
+        assert get_critpath.call_count == 1
         SMTP.assert_called_once_with('smtp.example.com')
         sendmail = SMTP.return_value.sendmail
         assert sendmail.call_count == 1
@@ -3469,6 +3783,66 @@ class TestComposerThread_send_testing_digest(ComposerThreadBaseTestCase):
             '%r undefined. Not sending updates-testing digest', 'fedora_test_announce_list')
 
 
+class TestComposerThread_generate_testing_digest(ComposerThreadBaseTestCase):
+    """Test ComposerThread.generate_testing_digest()."""
+
+    @mock.patch('bodhi.server.rpmcache.log.info')
+    def test_rpm_headers_prefetched(self, info):
+        """The RPM headers of the digest's builds should be fetched once, with a multicall."""
+        t = ComposerThread(self.semmock, self._make_task()['composes'][0],
+                           'bowlofeggs', self.Session, self.tempdir)
+        t.compose = self.db.query(Compose).one()
+        t._checkpoints = {}
+        t.db = self.Session
+        t.compose.updates[0].request = UpdateRequest.testing
+        koji = buildsys.DevBuildsys()
+
+        with mock.patch('bodhi.server.rpmcache.get_session', return_value=koji), \
+                mock.patch('bodhi.server.util.buildsys.get_session', return_value=koji), \
+                mock.patch.object(koji, 'getRPMHeaders',
+                                  wraps=koji.getRPMHeaders) as getRPMHeaders:
+            t.generate_testing_digest()
+
+        # The e-mail template and the changelog both use the prefetched headers.
+        assert [c[2]['rpmID'] for c in getRPMHeaders.mock_calls] == ['bodhi-2.0-1.fc17.src']
+        info.assert_called_with(
+            '%s: %d RPM header lookups, %d Koji calls, %d Koji calls saved',
+            'Testing digest for F17', 2, 1, 1)
+
+
+class TestComposerThread_modify_bugs(ComposerThreadBaseTestCase):
+    """Test ComposerThread.modify_bugs()."""
+
+    @mock.patch.dict(config, {'bz_products': ['Fedora'], 'bz_threads': 2})
+    def test_bugs_prefetched(self):
+        """The bugs of all the updates should be retrieved with a single call."""
+        t = ComposerThread(self.semmock, self._make_task()['composes'][0],
+                           'bowlofeggs', self.Session, self.tempdir)
+        t.compose = self.db.query(Compose).one()
+        t._checkpoints = {}
+        t.db = self.Session
+        update = t.compose.updates[0]
+        update.status = UpdateStatus.testing
+        # Clear pending messages
+        self.db.info['messages'] = []
+        bug_ids = [bug.bug_id for bug in update.bugs]
+        bugzilla = bugs.Bugzilla()
+        bugzilla._bz = mock.MagicMock()
+        bugzilla._bz.getbugs.return_value = [
+            mock.MagicMock(bug_id=bug_id, product='Fedora', bug_status='NEW')
+            for bug_id in bug_ids]
+
+        with mock.patch('bodhi.server.bugs.bugtracker', bugzilla), \
+                mock.patch('bodhi.server.bugs.bugzilla.Bugzilla'):
+            t.modify_bugs()
+
+        assert bug_ids
+        bugzilla._bz.getbugs.assert_called_once_with(bug_ids, permissive=True)
+        bugzilla._bz.getbug.assert_not_called()
+        for bug in bugzilla._bz.getbugs.return_value:
+            assert bug.setstatus.mock_calls[0][1][0] == 'ON_QA'
+
+
 class TestComposerThread__unlock_updates(ComposerThreadBaseTestCase):
     """Test the _unlock_updates() method."""
     def test__unlock_updates(self):
@@ -3581,6 +3955,7 @@ class TestPungiComposerThread__wait_for_repo_signature(ComposerThreadBaseTestCas
         mocked_log.info = mock.MagicMock()
         t = PungiComposerThread(self.semmock, self._make_task()['composes'][0],
                                 'ralph', self.Session, self.tempdir)
+        t._checkpoints = {}
         t.id = 'f17-updates-testing'
         t.path = os.path.join(self.tempdir, 'latest-f17-updates-testing')
 
@@ -3609,6 +3984,7 @@ class TestPungiComposerThread__wait_for_repo_signature(ComposerThreadBaseTestCas
         mocked_log.info = mock.MagicMock()
         t = PungiComposerThread(self.semmock, self._make_task()['composes'][0],
                                 'ralph', self.Session, self.tempdir)
+        t._checkpoints = {}
         t.id = 'f17-updates-testing'
         t.path = '/composepath'
 
@@ -3629,7 +4005,8 @@ class TestPungiComposerThread__wait_for_repo_signature(ComposerThreadBaseTestCas
                        "/composepath/compose/Everything/source/tree/repodata/repomd.xml.asc"),
              mock.call('Waiting on %s',
                        "/composepath/compose/Everything/aarch64/os/repodata/repomd.xml.asc"),
-             mock.call('All signatures were created')]
+             mock.call('All signatures were created'),
+             mock.call('Waiting for %s took %.1fs', 'repo signature', 0.0)]
         assert exists.mock_calls == \
             [mock.call('/composepath/compose/Everything/x86_64/os/repodata/repomd.xml.asc'),
              mock.call('/composepath/compose/Everything/aarch64/os/repodata/repomd.xml.asc'),
@@ -3641,6 +4018,38 @@ class TestPungiComposerThread__wait_for_repo_signature(ComposerThreadBaseTestCas
              mock.call('/composepath/compose/Everything/aarch64/os/repodata/repomd.xml.asc'),
              mock.call('/composepath/compose/Everything/source/tree/repodata/repomd.xml.asc')]
         save.assert_called_once_with(ComposeState.signing_repo)
+        assert t._checkpoints['wait_durations'] == {'repo_signature': 0.0}
+
+    @mock.patch('bodhi.server.tasks.composer.PungiComposerThread.save_state')
+    def test_woken_up_by_signatures(self, save):
+        """The wait should end as soon as the signatures are written, not on the next poll."""
+        t = PungiComposerThread(self.semmock, self._make_task()['composes'][0],
+                                'ralph', self.Session, self.tempdir)
+        t._checkpoints = {}
+        t.id = 'f17-updates-testing'
+        t.path = os.path.join(self.tempdir, 'latest-f17-updates-testing')
+        repodatas = [os.path.join(t.path, 'compose', 'Everything', 'x86_64', 'os', 'repodata'),
+                     os.path.join(t.path, 'compose', 'Everything', 'source', 'tree', 'repodata')]
+        for repodata in repodatas:
+            os.makedirs(repodata)
+
+        def sign():
+            for repodata in repodatas:
+                time.sleep(0.2)
+                with open(os.path.join(repodata, 'repomd.xml.asc'), 'w') as signature:
+                    signature.write('signature')
+
+        signer = threading.Thread(target=sign)
+        signer.start()
+        try:
+            with mock.patch.dict(config, {'wait_for_repo_sig': True,
+                                          'wait_for_repo_sig_interval': 60}):
+                with mock_sends(compose_schemas.RepoDoneV1):
+                    t._wait_for_repo_signature()
+        finally:
+            signer.join()
+
+        assert t._checkpoints['wait_durations']['repo_signature'] < 10
 
 
 class TestPungiComposerThread__wait_for_pungi(ComposerThreadBaseTestCase):
@@ -0,0 +1,222 @@
+# Copyright © 2020 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""This test suite contains tests for bodhi.server.acls."""
+from unittest import mock
+import http.server
+import json
+import threading
+import time
+
+from cornice.errors import Errors
+from prometheus_client import REGISTRY
+import pytest
+
+from bodhi.server import acls, buildsys, models, validators
+from bodhi.server.config import config
+from bodhi.tests.server.base import BasePyTestCase
+
+
+class TestACLCache:
+    """Test the ACLCache class."""
+
+    def setup_method(self, method):
+        """Create an empty cache."""
+        self.cache = acls.ACLCache()
+        self.fetch = mock.Mock(return_value=(['guest'], ['packager']))
+
+    def test_hits_and_misses(self):
+        """The ACL should only be fetched once, and copies of it should be returned."""
+        def sample(result):
+            return REGISTRY.get_sample_value('bodhi_acl_cache_lookups_total',
+                                             {'result': result}) or 0
+        hits, misses = sample('hit'), sample('miss')
+
+        acl = self.cache.get('rpms', 'bodhi', self.fetch)
+        acl[0].append('mallory')
+
+        assert self.cache.get('rpms', 'bodhi', self.fetch) == (['guest'], ['packager'])
+        assert self.cache.get('modules', 'bodhi', self.fetch) == (['guest'], ['packager'])
+        assert self.fetch.call_count == 2
+        assert (self.cache.hits, self.cache.misses) == (1, 2)
+        assert (sample('hit') - hits, sample('miss') - misses) == (1, 2)
+
+    def test_expiry(self):
+        """Entries older than the TTL should be fetched again."""
+        with mock.patch('bodhi.server.acls.time.monotonic', return_value=1000):
+            self.cache.get('rpms', 'bodhi', self.fetch)
+        with mock.patch('bodhi.server.acls.time.monotonic', return_value=1299):
+            self.cache.get('rpms', 'bodhi', self.fetch)
+        assert self.fetch.call_count == 1
+
+        with mock.patch('bodhi.server.acls.time.monotonic', return_value=1300):
+            self.cache.get('rpms', 'bodhi', self.fetch)
+        assert self.fetch.call_count == 2
+
+    @mock.patch.dict(config, {'pagure_acl_cache_ttl': 0})
+    def test_disabled(self):
+        """Nothing should be cached if the TTL is 0."""
+        self.cache.get('rpms', 'bodhi', self.fetch)
+        self.cache.get('rpms', 'bodhi', self.fetch)
+
+        assert self.fetch.call_count == 2
+        assert len(self.cache) == 0
+
+    @mock.patch.dict(config, {'pagure_acl_cache_max_size': 2})
+    def test_eviction(self):
+        """The least recently used entries should be evicted beyond the maximum size."""
+        self.cache.get('rpms', 'a', self.fetch)
+        self.cache.get('rpms', 'b', self.fetch)
+        # Using a should save it from eviction.
+        self.cache.get('rpms', 'a', self.fetch)
+        self.cache.get('rpms', 'c', self.fetch)
+
+        assert len(self.cache) == 2
+        self.fetch.reset_mock()
+        self.cache.get('rpms', 'a', self.fetch)
+        self.cache.get('rpms', 'c', self.fetch)
+        self.fetch.assert_not_called()
+        self.cache.get('rpms', 'b', self.fetch)
+        self.fetch.assert_called_once_with()
+
+    def test_errors_not_cached(self):
+        """Errors raised while fetching should not be cached."""
+        self.fetch.side_effect = [RuntimeError('Pagure is down'), (['guest'], [])]
+
+        with pytest.raises(RuntimeError):
+            self.cache.get('rpms', 'bodhi', self.fetch)
+
+        assert self.cache.get('rpms', 'bodhi', self.fetch) == (['guest'], [])
+
+    def test_invalidate(self):
+        """Invalidated entries should be fetched again."""
+        self.cache.get('rpms', 'a', self.fetch)
+        self.cache.get('rpms', 'b', self.fetch)
+
+        self.cache.invalidate('rpms', 'a')
+        self.cache.invalidate('rpms', 'unknown')
+        assert len(self.cache) == 1
+        self.cache.invalidate()
+        assert len(self.cache) == 0
+
+
+class TestPagureACLs(BasePyTestCase):
+    """Test the caching of Pagure ACLs against a local HTTP server."""
+
+    def setup_method(self, method):
+        """Start a server that slowly answers with the same ACL for every package."""
+        super().setup_method(method)
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                server = self.server
+                with server.lock:
+                    server.paths.append(self.path)
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                time.sleep(server.delay)
+                body = json.dumps({
+                    'access_users': {'owner': ['guest'], 'admin': [], 'commit': []},
+                    'access_groups': {'admin': [], 'commit': []}}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                with server.lock:
+                    server.in_flight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.delay = 0
+        self.server.in_flight = 0
+        self.server.lock = threading.Lock()
+        self.server.max_in_flight = 0
+        self.server.paths = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self._config = mock.patch.dict(config, {
+            'acl_system': 'pagure',
+            'pagure_url': 'http://127.0.0.1:%d/' % self.server.server_port})
+        self._config.start()
+
+    def teardown_method(self, method):
+        """Stop the server."""
+        self._config.stop()
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        super().teardown_method(method)
+
+    def get_request(self, nvrs, user='guest'):
+        """
+        Return a request that submits the given builds.
+
+        Args:
+            nvrs (list): The NVRs of the builds.
+            user (str): The name of the user submitting the builds.
+        Returns:
+            mock.Mock: The request.
+        """
+        request = mock.Mock()
+        request.user = self.db.query(models.User).filter_by(name=user).one()
+        request.db = self.db
+        request.buildinfo = {}
+        request.from_tag_inherited = []
+        request.errors = Errors()
+        request.koji = buildsys.get_session()
+        request.validated = {'builds': nvrs}
+        return request
+
+    def test_cached(self):
+        """Pagure should only be queried once per package."""
+        package = self.db.query(models.Package).filter_by(name='bodhi').one()
+
+        assert package.get_pkg_committers_from_pagure() == (['guest'], [])
+        assert package.get_pkg_committers_from_pagure() == (['guest'], [])
+
+        assert self.server.paths == ['/api/0/rpms/bodhi?expand_group=1']
+
+    def test_validate_acls_concurrent(self):
+        """The ACLs of the packages of an update should be fetched concurrently, and once."""
+        self.server.delay = 0.2
+        nvrs = ['package%d-1.0-1.fc17' % i for i in range(4)] + ['package0-docs-1.0-1.fc17']
+        nvrs.append('package0-2.0-1.fc17')
+
+        validators.validate_acls(self.get_request(nvrs))
+
+        assert sorted(self.server.paths) == sorted(
+            '/api/0/rpms/package%s?expand_group=1' % name
+            for name in ('0', '0-docs', '1', '2', '3'))
+        assert self.server.max_in_flight > 1
+
+    @mock.patch.dict(config, {'acl_dummy_committer': None})
+    def test_validate_acls_denied_invalidates(self):
+        """A cached ACL that denied access should be fetched again on the next request."""
+        guest = self.db.query(models.User).filter_by(name='guest').one()
+        self.db.add(models.User(name='mallory', groups=guest.groups))
+        self.db.flush()
+        nvrs = ['bodhi-2.0-1.fc17']
+        request = self.get_request(nvrs, 'mallory')
+
+        validators.validate_acls(request)
+        validators.validate_acls(self.get_request(nvrs))
+
+        assert request.errors.status == 403
+        assert self.server.paths == ['/api/0/rpms/bodhi?expand_group=1'] * 2
@@ -18,8 +18,11 @@
 """This test suite contains tests for bodhi.server.bugs."""
 
 from unittest import mock
+import threading
 import xmlrpc.client
 
+import pytest
+
 from bodhi.server import bugs, models
 
 
@@ -626,6 +629,161 @@ class TestBugzilla:
         assert bz._bz.getbug.return_value.setstatus.call_count == 0
 
 
+class TestBugzillaBatch:
+    """This test class contains tests for the getbugs() and batch() methods of Bugzilla."""
+
+    def make_bug(self, bug_id, product='aproduct', bug_status='NEW'):
+        """Return a mock Bugzilla bug."""
+        return mock.MagicMock(bug_id=bug_id, product=product, bug_status=bug_status)
+
+    def test_getbugs(self):
+        """getbugs() should retrieve the bugs with one call, leaving out the missing ones."""
+        bz = bugs.Bugzilla()
+        bz._bz = mock.MagicMock()
+        bug = self.make_bug(1411188)
+        bz._bz.getbugs.return_value = [bug, None]
+
+        assert bz.getbugs(['1411188', 1411189, 1411188]) == {1411188: bug}
+        bz._bz.getbugs.assert_called_once_with([1411188, 1411189], permissive=True)
+
+    @mock.patch('bodhi.server.bugs.log.exception')
+    def test_getbugs_exception(self, exception):
+        """getbugs() should log exceptions, and return no bugs."""
+        bz = bugs.Bugzilla()
+        bz._bz = mock.MagicMock()
+        bz._bz.getbugs.side_effect = xmlrpc.client.Fault(42, 'oops')
+
+        assert bz.getbugs([1411188]) == {}
+        exception.assert_called_once_with('Unable to retrieve bugs %s', [1411188])
+
+    def test_getbugs_none(self):
+        """getbugs() should not call Bugzilla without bug ids."""
+        bz = bugs.Bugzilla()
+        bz._bz = mock.MagicMock()
+
+        assert bz.getbugs([]) == {}
+        bz._bz.getbugs.assert_not_called()
+
+    @mock.patch.dict('bodhi.server.bugs.config', {'bz_products': 'aproduct', 'bz_threads': 4})
+    def test_batch(self):
+        """The prefetched bugs should be changed by the pool, and getbug() shouldn't be called."""
+        bz = bugs.Bugzilla()
+        bz._bz = mock.MagicMock()
+        prefetched = [self.make_bug(i) for i in range(1, 4)]
+        bz._bz.getbugs.return_value = prefetched
+        threads = set()
+        for bug in prefetched:
+            bug.setstatus.side_effect = lambda *a, **k: threads.add(threading.get_ident())
+        client = mock.MagicMock()
+
+        with mock.patch('bodhi.server.bugs.bugzilla.Bugzilla', return_value=client) as Bugzilla:
+            with bz.batch([1, 2, 3, None]):
+                assert bz.getbug(2) is prefetched[1]
+                bz.modified(1, 'modified')
+                bz.on_qa(2, 'on_qa')
+                bz.close(3, {}, 'close')
+                bz.comment(1, 'comment')
+                # The changes are only made on exit.
+                prefetched[0].setstatus.assert_not_called()
+
+        bz._bz.getbugs.assert_called_once_with([1, 2, 3], permissive=True)
+        prefetched[0].setstatus.assert_called_once_with('MODIFIED', comment='modified')
+        prefetched[1].setstatus.assert_called_once_with('ON_QA', comment='on_qa')
+        prefetched[2].close.assert_called_once_with('ERRATA', comment='close')
+        assert threading.get_ident() not in threads
+        # The threads of the pool changed the bugs with their own clients.
+        assert Bugzilla.call_count == len(threads)
+        for bug in prefetched:
+            assert bug.bugzilla is client
+        # The second change to bug 1 retrieved it again, since it was changed.
+        client.getbug.assert_called_once_with(1)
+        client.getbug.return_value.addcomment.assert_called_once_with('comment')
+        bz._bz.getbug.assert_not_called()
+        # Outside of the batch, the bugs are retrieved again.
+        assert bz.getbug(2) is bz._bz.getbug.return_value
+
+    @mock.patch.dict('bodhi.server.bugs.config', {'bz_products': 'aproduct', 'bz_threads': 4})
+    def test_batch_in_order(self):
+        """The changes to a bug should be made one at a time, in order, by a single task."""
+        bz = bugs.Bugzilla()
+        bz._bz = mock.MagicMock()
+        bz._bz.getbugs.return_value = [self.make_bug(1)]
+        calls = []
+
+        def addcomment(comment):
+            calls.append((comment, threading.get_ident()))
+
+        bz._bz.getbugs.return_value[0].addcomment.side_effect = addcomment
+        with mock.patch('bodhi.server.bugs.bugzilla.Bugzilla') as Bugzilla:
+            Bugzilla.return_value.getbug.return_value.addcomment.side_effect = addcomment
+            with bz.batch([1]):
+                for i in range(10):
+                    bz.comment(1, str(i))
+
+        assert [comment for comment, thread in calls] == [str(i) for i in range(10)]
+        assert len({thread for comment, thread in calls}) == 1
+
+    def test_thread_local_client(self):
+        """Each thread should connect its own client."""
+        bz = bugs.Bugzilla()
+        clients = []
+
+        with mock.patch('bodhi.server.bugs.bugzilla.Bugzilla',
+                        side_effect=lambda **kw: mock.MagicMock()):
+            main = bz.bz
+            thread = threading.Thread(target=lambda: clients.append(bz.bz))
+            thread.start()
+            thread.join()
+
+        assert bz.bz is main
+        assert clients[0] is not main
+
+    @mock.patch.dict('bodhi.server.bugs.config', {'bz_products': 'aproduct', 'bz_threads': 1})
+    def test_batch_one_thread(self):
+        """With one thread, the bugs should be changed right away by the calling thread."""
+        bz = bugs.Bugzilla()
+        bz._bz = mock.MagicMock()
+        bug = self.make_bug(1)
+        bz._bz.getbugs.return_value = [bug]
+
+        with bz.batch([1]):
+            bz.modified(1, 'modified')
+            bug.setstatus.assert_called_once_with('MODIFIED', comment='modified')
+
+        bz._bz.getbug.assert_not_called()
+
+    @mock.patch.dict('bodhi.server.bugs.config', {'bz_products': 'aproduct', 'bz_threads': 4})
+    def test_batch_nested(self):
+        """Nested batches should prefetch the missing bugs into the outer one."""
+        bz = bugs.Bugzilla()
+        bz._bz = mock.MagicMock()
+        bz._bz.getbugs.side_effect = lambda ids, **kw: [self.make_bug(i) for i in ids]
+
+        with bz.batch([1]):
+            with bz.batch([1, 2]):
+                pass
+            assert bz.getbug(2).bug_id == 2
+
+        assert [c[1][0] for c in bz._bz.getbugs.mock_calls] == [[1], [2]]
+        bz._bz.getbug.assert_not_called()
+
+    @mock.patch.dict('bodhi.server.bugs.config', {'bz_products': 'aproduct', 'bz_threads': 4})
+    def test_batch_exception(self):
+        """Exceptions raised by the changes should be raised at the end of the batch."""
+        bz = bugs.Bugzilla()
+        bz._bz = mock.MagicMock()
+        bug = self.make_bug(1)
+        bug.close.side_effect = RuntimeError('oops')
+        bz._bz.getbugs.return_value = [bug, self.make_bug(2)]
+
+        with pytest.raises(RuntimeError), mock.patch('bodhi.server.bugs.bugzilla.Bugzilla'):
+            with bz.batch([1, 2]):
+                bz.close(1, {}, 'close')
+                bz.close(2, {}, 'close')
+
+        bz._bz.getbugs.return_value[1].close.assert_called_once_with('ERRATA', comment='close')
+
+
 class TestFakeBugTracker:
     """This test class contains tests for the FakeBugTracker class."""
     def test_getbug(self):
@@ -637,6 +795,20 @@ class TestFakeBugTracker:
         assert isinstance(b, bugs.FakeBug)
         assert b.bug_id == 1234
 
+    def test_getbugs(self):
+        """Ensure correct return value of the getbugs() method."""
+        bt = bugs.FakeBugTracker()
+
+        assert bt.getbugs(['1234', 5678]) == {1234: bugs.FakeBug(bug_id=1234),
+                                              5678: bugs.FakeBug(bug_id=5678)}
+
+    def test_batch(self):
+        """The batch() method should do nothing."""
+        bt = bugs.FakeBugTracker()
+
+        with bt.batch([1234]):
+            bt.modified(1234, 'comment')
+
     @mock.patch('bodhi.server.bugs.log.debug')
     def test___noop__(self, debug):
         """Assert correct behavior from the __noop__ method."""
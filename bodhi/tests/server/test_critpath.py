@@ -0,0 +1,135 @@
+# Copyright © 2020 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""This test suite contains tests for bodhi.server.critpath."""
+from unittest import mock
+import threading
+import time
+
+from bodhi.server import critpath, models
+from bodhi.server.config import config
+from bodhi.tests.server.base import BasePyTestCase
+
+
+@mock.patch.dict(config, {'critpath.type': 'pdc', 'pdc_url': 'http://domain.local'})
+@mock.patch('bodhi.server.util.get_critpath_components_from_pdc')
+class TestCritpathIndex(BasePyTestCase):
+    """Test the CritpathIndex class."""
+
+    def setup_method(self, method):
+        """Create an empty index."""
+        super().setup_method(method)
+        self.index = critpath.CritpathIndex()
+
+    def test_fetched_whole_once(self, from_pdc):
+        """The components of a branch and type should be fetched whole, and only once."""
+        from_pdc.return_value = ['gcc', 'kernel']
+
+        assert self.index.get('f33') == frozenset(['gcc', 'kernel'])
+        assert self.index.contains('f33', 'rpm', ['bodhi', 'kernel'])
+        assert not self.index.contains('f33', 'rpm', ['bodhi'])
+        self.index.get('f33', 'module')
+
+        assert from_pdc.mock_calls == [mock.call('f33', 'rpm', None),
+                                       mock.call('f33', 'module', None)]
+
+    def test_expired_refreshed_in_background(self, from_pdc):
+        """Expired entries should be served while they are fetched again in a thread."""
+        from_pdc.return_value = ['gcc']
+        self.index.get('f33')
+        from_pdc.return_value = ['gcc', 'kernel']
+        threads = []
+        Thread = threading.Thread
+
+        def start_thread(**kwargs):
+            threads.append(Thread(**kwargs))
+            return threads[-1]
+
+        with mock.patch('time.time', return_value=time.time() + 3601), \
+                mock.patch('bodhi.server.critpath.threading.Thread', side_effect=start_thread):
+            assert self.index.get('f33') == frozenset(['gcc'])
+            threads[0].join()
+
+        assert self.index.get('f33') == frozenset(['gcc', 'kernel'])
+        assert from_pdc.call_count == 2
+
+    @mock.patch('bodhi.server.critpath.log.exception')
+    def test_refresh_error(self, exception, from_pdc):
+        """Expired entries should still be served if they can't be fetched again."""
+        from_pdc.return_value = ['gcc']
+        self.index.get('f33')
+        from_pdc.side_effect = RuntimeError('PDC is down')
+        threads = []
+        Thread = threading.Thread
+
+        def start_thread(**kwargs):
+            threads.append(Thread(**kwargs))
+            return threads[-1]
+
+        with mock.patch('time.time', return_value=time.time() + 3601), \
+                mock.patch('bodhi.server.critpath.threading.Thread', side_effect=start_thread):
+            assert self.index.get('f33') == frozenset(['gcc'])
+            threads[0].join()
+            assert self.index.get('f33') == frozenset(['gcc'])
+            threads[1].join()
+
+        exception.assert_called_with('Unable to refresh the critical path index %s',
+                                     'critpath:f33:rpm')
+
+    def test_invalidate(self, from_pdc):
+        """Invalidated entries should be fetched again."""
+        from_pdc.return_value = ['gcc']
+        self.index.get('f33')
+
+        self.index.invalidate()
+        self.index.get('f33')
+
+        assert from_pdc.call_count == 2
+
+    @mock.patch('bodhi.server.critpath.log.exception')
+    def test_warm(self, exception, from_pdc):
+        """Warming should fetch the components of the given branches, and log errors."""
+        from_pdc.side_effect = [['gcc'], RuntimeError('PDC is down'), ['gcc'], ['kernel']]
+
+        self.index.warm(['f32', 'f33'], ['rpm', 'module'])
+
+        assert self.index.get('f33', 'module') == frozenset(['kernel'])
+        assert from_pdc.call_count == 4
+        exception.assert_called_once_with(
+            'Unable to fetch the %s critical path components of %s', 'module', 'f32')
+
+    @mock.patch.dict(config, {'critpath.type': None, 'critpath_pkgs': ['kernel']})
+    def test_not_pdc(self, from_pdc):
+        """The critpath_pkgs setting should be used if critpath.type is not pdc."""
+        self.index.warm(['f33'])
+
+        assert self.index.contains('f33', 'rpm', ['kernel'])
+        assert not self.index.contains('f33', 'rpm', ['gcc'])
+        from_pdc.assert_not_called()
+
+    def test_contains_critpath_component(self, from_pdc):
+        """Updates should be checked against the index, without querying PDC per component."""
+        from_pdc.side_effect = lambda branch, *args: ['bodhi'] if branch == 'f17' else ['gcc']
+        update = self.db.query(models.Update).one()
+        builds = update.builds * 20
+
+        assert models.Update.contains_critpath_component(builds, 'F17')
+        assert not models.Update.contains_critpath_component(builds, 'F18')
+        assert models.Update.contains_critpath_component(builds, 'F17')
+
+        assert from_pdc.mock_calls == [mock.call('f17', 'rpm', None),
+                                       mock.call('f18', 'rpm', None)]
@@ -0,0 +1,233 @@
+# Copyright © 2020 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""This test suite contains tests for bodhi.server.http_client."""
+from unittest import mock
+import gc
+import threading
+
+from prometheus_client import REGISTRY
+import pytest
+import requests
+
+from bodhi.server import http_client
+from bodhi.server.config import config
+
+
+def sample(name, **labels):
+    """Return the value of a metric sample, or 0 if it was never recorded."""
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class TestService:
+    """Test the Service class."""
+
+    def setup_method(self, method):
+        """Create a Service and a mock session."""
+        self.service = http_client.Service('Test', 'greenwave_api_url', 'http_pool_size')
+        self.session = mock.MagicMock()
+        self.session.get.return_value.status_code = 200
+
+    @mock.patch.dict(config, {'http_backoff_base': 1.0, 'http_backoff_max': 5.0})
+    @mock.patch('bodhi.server.http_client.random.uniform')
+    def test_backoff(self, uniform):
+        """The delays should double with each attempt, up to the maximum, with jitter."""
+        delays = [self.service.backoff(attempt) for attempt in range(5)]
+
+        assert delays == [uniform.return_value] * 5
+        assert uniform.mock_calls == [
+            mock.call(0.5, 1), mock.call(1, 2), mock.call(2, 4), mock.call(2.5, 5),
+            mock.call(2.5, 5)]
+
+    @mock.patch.dict(config, {'greenwave_api_url': 'https://greenwave.example.com/api/v1.0',
+                              'http_pool_size': 3})
+    def test_send(self):
+        """The pool should be mounted once, and the requests recorded in the metrics."""
+        before = sample('bodhi_outbound_request_count', service='Test', method='GET',
+                        status='200')
+
+        response = self.service.send(self.session, 'GET', 'https://greenwave.example.com/x',
+                                     timeout=60)
+        self.service.send(self.session, 'GET', 'https://greenwave.example.com/y', timeout=60)
+
+        assert response is self.session.get.return_value
+        self.session.get.assert_called_with('https://greenwave.example.com/y', timeout=60)
+        self.session.mount.assert_called_once_with('https://greenwave.example.com/', mock.ANY)
+        adapter = self.session.mount.mock_calls[0][1][1]
+        assert adapter._pool_maxsize == 3
+        assert sample('bodhi_outbound_request_count', service='Test', method='GET',
+                      status='200') == before + 2
+
+    @mock.patch.dict(config, {'greenwave_api_url': 'https://greenwave.example.com/api/v1.0'})
+    def test_send_several_sessions(self):
+        """The pool should be mounted once on each session, without keeping them alive."""
+        other = mock.MagicMock()
+        other.get.return_value.status_code = 200
+
+        for session in (self.session, other, self.session, other):
+            self.service.send(session, 'GET', 'https://greenwave.example.com/x')
+
+        self.session.mount.assert_called_once_with('https://greenwave.example.com/', mock.ANY)
+        other.mount.assert_called_once_with('https://greenwave.example.com/', mock.ANY)
+        del other, session
+        gc.collect()
+        assert list(self.service._mounted_on) == [self.session]
+
+    def test_send_exception(self):
+        """Exceptions should be recorded as failures and raised."""
+        self.session.post.side_effect = requests.ConnectionError('oops')
+        before = sample('bodhi_outbound_request_errors_total', service='Test',
+                        error='ConnectionError')
+
+        with pytest.raises(requests.ConnectionError):
+            self.service.send(self.session, 'POST', 'https://greenwave.example.com/x')
+
+        assert self.service.failures == 1
+        assert sample('bodhi_outbound_request_errors_total', service='Test',
+                      error='ConnectionError') == before + 1
+
+    def test_client_errors_are_not_failures(self):
+        """4xx responses should not count as failures of the service."""
+        self.service.record('GET', 500, 0.1)
+        self.service.record('GET', 404, 0.1)
+
+        assert self.service.failures == 0
+
+    @mock.patch.dict(config, {'http_circuit_breaker_threshold': 2,
+                              'http_circuit_breaker_timeout': 60})
+    @mock.patch('bodhi.server.http_client.time.monotonic')
+    def test_circuit_breaker(self, monotonic):
+        """The circuit should open after too many failures, and close after a success."""
+        monotonic.return_value = 1000
+        self.service.record('GET', 503, 0.1)
+        self.service.check_circuit()
+        self.service.record('GET', requests.Timeout(), 0.1)
+
+        with pytest.raises(http_client.CircuitOpenError) as exc:
+            self.service.send(self.session, 'GET', 'https://greenwave.example.com/x')
+
+        assert str(exc.value) == ('Bodhi is not sending requests to Test for now, after 2 failed '
+                                  'requests in a row.')
+        assert isinstance(exc.value, RuntimeError)
+        self.session.get.assert_not_called()
+
+        # After the timeout, a request is let through, and it closes the circuit.
+        monotonic.return_value = 1060
+        self.service.send(self.session, 'GET', 'https://greenwave.example.com/x')
+        assert self.service.failures == 0
+
+    @mock.patch.dict(config, {'http_circuit_breaker_threshold': 2,
+                              'http_circuit_breaker_timeout': 60})
+    @mock.patch('bodhi.server.http_client.time.monotonic')
+    def test_circuit_breaker_reopens(self, monotonic):
+        """A failure after the timeout should open the circuit again."""
+        monotonic.return_value = 1000
+        self.service.record('GET', 503, 0.1)
+        self.service.record('GET', 503, 0.1)
+        monotonic.return_value = 1060
+        self.service.check_circuit()
+
+        self.service.record('GET', 503, 0.1)
+
+        with pytest.raises(http_client.CircuitOpenError):
+            self.service.check_circuit()
+
+    @mock.patch.dict(config, {'http_circuit_breaker_threshold': 2,
+                              'http_circuit_breaker_timeout': 60})
+    @mock.patch('bodhi.server.http_client.time.monotonic')
+    def test_circuit_breaker_single_probe(self, monotonic):
+        """Only one request should probe the service at a time after the timeout."""
+        monotonic.return_value = 1000
+        self.service.record('GET', 503, 0.1)
+        self.service.record('GET', 503, 0.1)
+        monotonic.return_value = 1060
+        self.service.check_circuit()
+
+        # Other threads are refused while the probe is in flight.
+        errors = []
+
+        def check():
+            try:
+                self.service.check_circuit()
+            except http_client.CircuitOpenError as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=check)
+        thread.start()
+        thread.join()
+        assert len(errors) == 1
+        # Their outcome doesn't end the probe.
+        thread = threading.Thread(target=self.service.record, args=('GET', 503, 0.1))
+        thread.start()
+        thread.join()
+        with pytest.raises(http_client.CircuitOpenError):
+            self.service.check_circuit()
+
+        # A probe that didn't finish in time is replaced.
+        monotonic.return_value = 1120
+        thread = threading.Thread(target=check)
+        thread.start()
+        thread.join()
+        assert len(errors) == 1
+
+        # The successful probe closes the circuit.
+        self.service.record('GET', 200, 0.1)
+        assert self.service.failures == 0
+        assert self.service._probe is None
+        self.service.check_circuit()
+
+    @mock.patch.dict(config, {'http_circuit_breaker_threshold': 0})
+    def test_circuit_breaker_disabled(self):
+        """The circuit should never open if the threshold is 0."""
+        for i in range(10):
+            self.service.record('GET', 503, 0.1)
+
+        self.service.check_circuit()
+
+    def test_reset(self):
+        """reset() should close the circuit."""
+        self.service.record('GET', 503, 0.1)
+
+        self.service.reset()
+
+        assert self.service.failures == 0
+
+
+class TestGetService:
+    """Test the get_service() and reset() functions."""
+
+    def test_known_service(self):
+        """The known services should have their own settings."""
+        service = http_client.get_service('Greenwave')
+
+        assert service.url_setting == 'greenwave_api_url'
+        assert service.pool_size_setting == 'greenwave_max_concurrent_requests'
+
+    def test_unknown_service(self):
+        """Unknown services should be created once, without a pool of their own."""
+        service = http_client.get_service('Unknown service')
+
+        assert http_client.get_service('Unknown service') is service
+        assert service.url_setting is None
+
+    def test_reset(self):
+        """reset() should close the circuits of all the services."""
+        http_client.get_service('PDC').record('GET', 503, 0.1)
+
+        http_client.reset()
+
+        assert http_client.get_service('PDC').failures == 0
@@ -20,6 +20,10 @@
 from unittest import mock
 import os
 import smtplib
+import socket
+
+from aiosmtpd.controller import Controller
+import pytest
 
 from bodhi.server import config, mail, models
 from bodhi.server.util import get_absolute_path
@@ -350,3 +354,173 @@ class Test_SendMail:
 
         assert SMTP.call_count == 0
         info.assert_called_once_with('Not sending email: No smtp_server defined')
+
+
+class SMTPStub:
+    """An SMTP server on localhost that records the envelopes it receives."""
+
+    def __init__(self):
+        """Start the server on a free port."""
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        self.envelopes = []
+        self.rejected = set()
+        self.controller = Controller(self, hostname='127.0.0.1', port=port)
+        self.controller.start()
+        self.address = f'127.0.0.1:{port}'
+
+    async def handle_DATA(self, server, session, envelope):
+        """Record the envelope and the connection it was received on, unless it is rejected."""
+        if self.rejected.intersection(envelope.rcpt_tos):
+            return '554 Rejected'
+        self.envelopes.append((session.peer, envelope.mail_from, envelope.rcpt_tos,
+                               envelope.content.decode('utf-8')))
+        return '250 OK'
+
+    @property
+    def connections(self):
+        """Return the number of connections the envelopes were received on."""
+        return len({peer for peer, *envelope in self.envelopes})
+
+    def stop(self):
+        """Stop the server."""
+        self.controller.stop()
+
+
+@pytest.fixture
+def smtp_stub():
+    """Return an SMTP server stub that Bodhi delivers e-mail to."""
+    stub = SMTPStub()
+    with mock.patch.dict(config.config, {'smtp_server': stub.address}):
+        yield stub
+    mail.transport.close()
+    stub.stop()
+
+
+class TestSMTPTransport:
+    """Test the SMTPTransport class against an SMTP server stub."""
+
+    def test_identical_mails_one_envelope(self, smtp_stub):
+        """Identical e-mails should be delivered in one envelope, and the others in their own."""
+        mail.transport.deliver([
+            ('bodhi@example.com', ['a@example.com'], 'Subject: hi\r\n\r\nhi'),
+            ('bodhi@example.com', ['b@example.com', 'a@example.com'], 'Subject: hi\r\n\r\nhi'),
+            ('bodhi@example.com', ['c@example.com'], 'Subject: bye\r\n\r\nbye')])
+
+        assert [envelope[1:3] for envelope in smtp_stub.envelopes] == [
+            ('bodhi@example.com', ['a@example.com', 'b@example.com']),
+            ('bodhi@example.com', ['c@example.com'])]
+        assert smtp_stub.connections == 1
+
+    @mock.patch.dict(config.config, {'smtp_pool_size': 0})
+    def test_not_pooled(self, smtp_stub):
+        """Connections should not be kept open if smtp_pool_size is 0."""
+        mail.send_mail('bodhi@example.com', 'a@example.com', 'hi', 'hi')
+        mail.send_mail('bodhi@example.com', 'a@example.com', 'hi', 'hi')
+
+        assert smtp_stub.connections == 2
+        assert mail.transport._idle == []
+
+    @mock.patch.dict(config.config, {'smtp_pool_size': 1})
+    def test_pooled(self, smtp_stub):
+        """Connections should be kept open for the next deliveries."""
+        mail.send_mail('bodhi@example.com', 'a@example.com', 'hi', 'hi')
+        mail.send_mail('bodhi@example.com', 'b@example.com', 'hi', 'hi')
+
+        assert len(smtp_stub.envelopes) == 2
+        assert smtp_stub.connections == 1
+
+    @mock.patch.dict(config.config, {'smtp_pool_size': 1, 'smtp_idle_timeout': 0})
+    def test_idle_timeout(self, smtp_stub):
+        """Connections unused for longer than smtp_idle_timeout should not be used again."""
+        mail.send_mail('bodhi@example.com', 'a@example.com', 'hi', 'hi')
+        mail.send_mail('bodhi@example.com', 'b@example.com', 'hi', 'hi')
+
+        assert smtp_stub.connections == 2
+
+    @mock.patch.dict(config.config, {'smtp_pool_size': 1})
+    def test_server_closed_connection(self, smtp_stub):
+        """A kept connection that was closed meanwhile should be replaced."""
+        mail.send_mail('bodhi@example.com', 'a@example.com', 'hi', 'hi')
+        mail.transport._idle[0][2].close()
+
+        mail.send_mail('bodhi@example.com', 'b@example.com', 'hi', 'hi')
+
+        assert [envelope[2] for envelope in smtp_stub.envelopes] == [
+            ['a@example.com'], ['b@example.com']]
+        assert smtp_stub.connections == 2
+
+    @mock.patch('bodhi.server.mail.log.exception')
+    def test_rejected_envelope(self, exception, smtp_stub):
+        """An envelope the server rejects should not prevent the others from being delivered."""
+        smtp_stub.rejected.add('b@example.com')
+
+        mail.transport.deliver([
+            ('bodhi@example.com', ['a@example.com'], 'Subject: hi\r\n\r\nhi'),
+            ('bodhi@example.com', ['b@example.com'], 'Subject: hey\r\n\r\nhey'),
+            ('bodhi@example.com', ['c@example.com'], 'Subject: bye\r\n\r\nbye')])
+
+        assert [envelope[2] for envelope in smtp_stub.envelopes] == [
+            ['a@example.com'], ['c@example.com']]
+        assert smtp_stub.connections == 1
+        exception.assert_called_once_with('Unable to send mail to b@example.com')
+
+    @mock.patch.dict(config.config, {'smtp_pool_size': 1})
+    @mock.patch('bodhi.server.mail.log.exception')
+    def test_reconnect_failed(self, exception, smtp_stub):
+        """The delivery should stop if the connection can't be established again."""
+        mail.send_mail('bodhi@example.com', 'a@example.com', 'hi', 'hi')
+        mail.transport._idle[0][2].close()
+
+        with mock.patch('bodhi.server.mail.smtplib.SMTP',
+                        side_effect=ConnectionRefusedError('refused')) as SMTP:
+            mail.transport.deliver([
+                ('bodhi@example.com', ['b@example.com'], 'Subject: hi\r\n\r\nhi'),
+                ('bodhi@example.com', ['c@example.com'], 'Subject: bye\r\n\r\nbye')])
+
+        assert [envelope[2] for envelope in smtp_stub.envelopes] == [['a@example.com']]
+        SMTP.assert_called_once_with(smtp_stub.address)
+        exception.assert_called_once_with('Unable to send mail')
+        assert mail.transport._idle == []
+
+    @mock.patch.dict(config.config, {'smtp_background_queue': True})
+    def test_background_queue(self, smtp_stub):
+        """E-mails should be delivered from the queue if smtp_background_queue is set."""
+        with mock.patch.object(mail.transport, 'deliver', wraps=mail.transport.deliver) as deliver:
+            mail.send_mail('bodhi@example.com', 'a@example.com', 'hi', 'hi')
+            mail.mail_queue.join()
+
+        assert [envelope[2] for envelope in smtp_stub.envelopes] == [['a@example.com']]
+        assert deliver.call_count == 1
+        assert mail.mail_queue._thread.is_alive()
+
+    def test_batch(self, smtp_stub):
+        """E-mails sent in a batch should be delivered together once the outermost batch exits."""
+        with pytest.raises(ValueError):
+            with mail.batch():
+                mail.send_mail('bodhi@example.com', 'a@example.com', 'hi', 'hi')
+                with mail.batch():
+                    mail.send_mail('bodhi@example.com', 'b@example.com', 'hi', 'hi')
+                assert smtp_stub.envelopes == []
+                raise ValueError('The e-mails sent so far should be delivered anyway.')
+
+        assert [envelope[2] for envelope in smtp_stub.envelopes] == [
+            ['a@example.com'], ['b@example.com']]
+        assert smtp_stub.connections == 1
+
+
+class TestSendBatched(BasePyTestCase):
+    """Test that send() delivers its e-mails together."""
+
+    def test_send(self, smtp_stub):
+        """Each recipient should get their own e-mail, over the same connection."""
+        update = models.Update.query.first()
+
+        mail.send(['a@example.com', 'b@example.com', 'c@example.com'], 'comment', update,
+                  agent='bowlofeggs')
+
+        assert [envelope[2] for envelope in smtp_stub.envelopes] == [
+            ['a@example.com'], ['b@example.com'], ['c@example.com']]
+        assert 'To: b@example.com\r\n' in smtp_stub.envelopes[1][3]
+        assert smtp_stub.connections == 1
@@ -22,6 +22,7 @@ from os.path import join, exists, basename
 from unittest import mock
 import glob
 import os
+import shelve
 import shutil
 import tempfile
 
@@ -79,7 +80,7 @@ class TestAddUpdate(UpdateInfoMetadataTestCase):
 
         md.add_update(update)
 
-        md.shelf.close()
+        md.rpm_cache.close()
 
         assert len(md.uinfo.updates) == 1
         assert md.uinfo.updates[0].title == update.title
@@ -137,7 +138,7 @@ class TestAddUpdate(UpdateInfoMetadataTestCase):
 
         md.add_update(update)
 
-        md.shelf.close()
+        md.rpm_cache.close()
         assert len(md.uinfo.updates) == 1
         assert test_start_time <= md.uinfo.updates[0].updated_date <= datetime.utcnow()
 
@@ -154,7 +155,7 @@ class TestAddUpdate(UpdateInfoMetadataTestCase):
 
         md.add_update(update)
 
-        md.shelf.close()
+        md.rpm_cache.close()
         assert len(md.uinfo.updates) == 1
         assert test_start_time <= md.uinfo.updates[0].issued_date <= datetime.utcnow()
 
@@ -173,7 +174,7 @@ class TestAddUpdate(UpdateInfoMetadataTestCase):
         with mock.patch.object(md, 'get_rpms', mock.MagicMock(return_value=fake_rpms)):
             md.add_update(update)
 
-        md.shelf.close()
+        md.rpm_cache.close()
         col = md.uinfo.updates[0].collections[0]
         assert len(col.packages) == 1
         pkg = col.packages[0]
@@ -196,7 +197,7 @@ class TestAddUpdate(UpdateInfoMetadataTestCase):
         with mock.patch.object(md, 'get_rpms', mock.MagicMock(return_value=fake_rpms)):
             md.add_update(update)
 
-        md.shelf.close()
+        md.rpm_cache.close()
         col = md.uinfo.updates[0].collections[0]
         assert len(col.packages) == 1
         pkg = col.packages[0]
@@ -324,6 +325,104 @@ class TestUpdateInfoMetadata(UpdateInfoMetadataTestCase):
         DevBuildsys.__rpms__ = []
         self._test_extended_metadata()
 
+    def _push_to_testing(self):
+        """Pretend the update was pushed to testing, and return it."""
+        update = self.db.query(Update).one()
+        update.status = UpdateStatus.testing
+        update.request = None
+        update.date_pushed = datetime(2020, 1, 2, 3, 4, 5)
+        update.date_modified = datetime(2020, 1, 1, 3, 4, 5)
+        DevBuildsys.__tagged__[update.title] = ['f17-updates-testing']
+        return update
+
+    def test_rpms_prefetched(self):
+        """The RPMs of the builds missing from the cache should be listed in one multicall."""
+        update = self._push_to_testing()
+
+        with mock.patch.object(DevBuildsys, 'multiCall', autospec=True,
+                               side_effect=DevBuildsys.multiCall) as multiCall:
+            md = UpdateInfoMetadata(update.release, update.request, self.db, self.tempcompdir,
+                                    close_shelf=False)
+            md.rpm_cache.close()
+            assert multiCall.call_count == 1
+            assert (md.rpm_cache.hits, md.rpm_cache.misses) == (0, 1)
+
+            md = UpdateInfoMetadata(update.release, update.request, self.db, self.tempcompdir,
+                                    close_shelf=False)
+            md.rpm_cache.close()
+            assert multiCall.call_count == 1
+            assert (md.rpm_cache.hits, md.rpm_cache.misses) == (1, 0)
+
+    @mock.patch.dict(config, {'incremental_updateinfo': True})
+    def test_incremental_reuses_unchanged_records(self):
+        """The record of an unchanged update should be reused from the previous compose."""
+        update = self._push_to_testing()
+        md = UpdateInfoMetadata(update.release, update.request, self.db, self.tempcompdir)
+        assert md.reused_records == 0
+
+        with mock.patch.object(UpdateInfoMetadata, '_serialize_update') as serialize:
+            incremental_md = UpdateInfoMetadata(update.release, update.request, self.db,
+                                                self.tempcompdir)
+
+        serialize.assert_not_called()
+        assert incremental_md.reused_records == 1
+        assert incremental_md.uinfo.xml_dump() == md.uinfo.xml_dump()
+
+    @mock.patch.dict(config, {'incremental_updateinfo': True})
+    def test_incremental_regenerates_modified_records(self):
+        """The record of an update that was edited since the previous compose is generated again."""
+        update = self._push_to_testing()
+        UpdateInfoMetadata(update.release, update.request, self.db, self.tempcompdir)
+        update.date_modified = datetime(2020, 1, 3, 3, 4, 5)
+        update.notes = 'Edited notes'
+
+        md = UpdateInfoMetadata(update.release, update.request, self.db, self.tempcompdir)
+
+        assert md.reused_records == 0
+        assert md.uinfo.updates[0].description == 'Edited notes'
+        assert md.uinfo.updates[0].updated_date == datetime(2020, 1, 3, 3, 4, 5)
+
+    @mock.patch.dict(config, {'incremental_updateinfo': True})
+    def test_incremental_regenerates_records_of_retitled_bugs(self):
+        """The record of an update is generated again if the title of one of its bugs changed."""
+        update = self._push_to_testing()
+        UpdateInfoMetadata(update.release, update.request, self.db, self.tempcompdir)
+        update.bugs[0].title = 'A new title from Bugzilla'
+
+        md = UpdateInfoMetadata(update.release, update.request, self.db, self.tempcompdir)
+
+        assert md.reused_records == 0
+        assert md.uinfo.updates[0].references[0].title == 'A new title from Bugzilla'
+
+    @mock.patch.dict(config, {'incremental_updateinfo': True})
+    def test_incremental_drops_untagged_records(self):
+        """Records of updates that are not in the tag anymore are dropped."""
+        update = self._push_to_testing()
+        UpdateInfoMetadata(update.release, update.request, self.db, self.tempcompdir)
+        del DevBuildsys.__tagged__[update.title]
+
+        md = UpdateInfoMetadata(update.release, update.request, self.db, self.tempcompdir)
+
+        assert len(md.uinfo.updates) == 0
+        records = shelve.open(join(config['cache_dir'], 'f17-updates-testing-updateinfo.shelve'))
+        try:
+            assert update.alias not in records
+        finally:
+            records.close()
+
+    @mock.patch.dict(config, {'incremental_updateinfo': True})
+    def test_incremental_discards_records_of_other_file_url(self):
+        """Records created for another file_url must not be reused."""
+        update = self._push_to_testing()
+        UpdateInfoMetadata(update.release, update.request, self.db, self.tempcompdir)
+
+        with mock.patch.dict(config, {'file_url': 'https://example.com/updates'}):
+            md = UpdateInfoMetadata(update.release, update.request, self.db, self.tempcompdir)
+
+        assert md.reused_records == 0
+        assert md.uinfo.updates[0].collections[0].packages[0].src.startswith(
+            'https://example.com/updates/testing/17/')
+
     def _test_extended_metadata(self):
         update = self.db.query(Update).one()
 
@@ -30,6 +30,7 @@ from fedora_messaging.testing import mock_sends
 from fedora_messaging.api import Message
 from pyramid.testing import DummyRequest
 import pytest
+from sqlalchemy import event, inspect
 from sqlalchemy.exc import IntegrityError
 import cornice
 import requests.exceptions
@@ -169,6 +170,29 @@ class TestBodhiBase(BasePyTestCase):
         j_with_text['unique_testcase_feedback'] = j['unique_testcase_feedback']
         assert j == j_with_text
 
+    def test__to_json_caches_plans(self):
+        """_to_json() should only inspect the mapper once per model and exclude/include."""
+        c = model.Comment.query.all()[0]
+        expected = c._to_json(c)
+
+        with mock.patch.dict(model._json_plans, clear=True):
+            with mock.patch('bodhi.server.models.class_mapper',
+                            wraps=model.class_mapper) as class_mapper:
+                assert c._to_json(c) == expected
+                assert c._to_json(c) == expected
+                assert 'text' not in c._to_json(c, exclude=['text'])
+
+        assert [call[1][0] for call in class_mapper.mock_calls].count(model.Comment) == 2
+
+    def test__to_json_formats_extras(self):
+        """Datetimes and EnumSymbols in the included extras should be formatted too."""
+        u = model.Update.query.all()[0]
+
+        j = u._to_json(u, include=['date_submitted', 'status'], exclude=['date_submitted'])
+
+        assert j['date_submitted'] == '1984-11-02 00:00:00'
+        assert j['status'] == 'pending'
+
     def test__to_json_falsey_object(self):
         """Assert that _to_json() returns None when handed a Falsey object."""
         assert model.Build._to_json(False, seen=None) is None
@@ -1595,6 +1619,58 @@ class TestBuild(ModelTest):
         assert str(exc_context.value) == 'Failed retrieving testcases from Wiki'
 
 
+class TestBuildFromNvrs(BasePyTestCase):
+    """Test the Build.from_nvrs() classmethod."""
+
+    def test_chunks(self):
+        """The NVRs should be looked up chunk_size at a time."""
+        self.create_update(['bodhi-3.0-1.fc17', 'python-fedora-1.0-1.fc17'])
+        self.db.flush()
+        nvrs = ['bodhi-2.0-1.fc17', 'bodhi-3.0-1.fc17', 'python-fedora-1.0-1.fc17']
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            if 'WHERE builds.nvr IN' in statement:
+                statements.append(statement)
+
+        event.listen(self.engine, 'before_cursor_execute', count)
+        try:
+            builds = model.Build.from_nvrs(nvrs, self.db, chunk_size=2)
+        finally:
+            event.remove(self.engine, 'before_cursor_execute', count)
+
+        assert sorted(builds) == nvrs
+        assert all(builds[nvr].nvr == nvr for nvr in nvrs)
+        assert len(statements) == 2
+
+    def test_eager_loading(self):
+        """The Updates, with their builds and bugs, should be loaded with the Builds."""
+        self.db.expire_all()
+
+        builds = model.Build.from_nvrs(['bodhi-2.0-1.fc17'], self.db)
+
+        update = builds['bodhi-2.0-1.fc17'].update
+        loaded = inspect(update).dict
+        assert 'builds' in loaded
+        assert 'bugs' in loaded
+        assert 'release' in loaded
+        assert [b.nvr for b in update.builds] == ['bodhi-2.0-1.fc17']
+        assert [b.bug_id for b in update.bugs] == [12345]
+
+    def test_unknown_nvrs(self):
+        """NVRs that are not in the database should be absent from the result."""
+        builds = model.Build.from_nvrs(['bodhi-2.0-1.fc17', 'unknown-1.0-1.fc17'], self.db)
+
+        assert list(builds) == ['bodhi-2.0-1.fc17']
+
+    def test_no_nvrs(self):
+        """No query should be needed when there are no NVRs."""
+        with mock.patch.object(self.db, 'query') as query:
+            assert model.Build.from_nvrs([], self.db) == {}
+
+        query.assert_not_called()
+
+
 class TestRpmBuild(ModelTest):
     """Unit test case for the ``RpmBuild`` model."""
     klass = model.RpmBuild
@@ -2222,6 +2298,7 @@ class TestUpdateSigned(BasePyTestCase):
 class TestUpdateUpdateTestGatingStatus(BasePyTestCase):
     """Test the Update.update_test_gating_status() method."""
 
+    @mock.patch('bodhi.server.http_client.random.uniform', new=lambda low, high: high)
     @mock.patch('bodhi.server.models.log.error')
     @mock.patch('bodhi.server.util.http_session.post')
     @mock.patch('bodhi.server.util.time.sleep')
@@ -2237,7 +2314,7 @@ class TestUpdateUpdateTestGatingStatus(BasePyTestCase):
         update.update_test_gating_status()
 
         assert update.test_gating_status == model.TestGatingStatus.waiting
-        assert sleep.mock_calls == [mock.call(1), mock.call(1), mock.call(1)]
+        assert sleep.mock_calls == [mock.call(1), mock.call(2), mock.call(4)]
         expected_post = mock.call(
             'https://greenwave-web-greenwave.app.os.fedoraproject.org/api/v1.0/decision',
             data={"product_version": "fedora-17", "decision_context": "bodhi_update_push_testing",
@@ -2265,6 +2342,7 @@ class TestUpdateUpdateTestGatingStatus(BasePyTestCase):
                 '"https://greenwave-web-greenwave.app.os.fedoraproject.org/api/v1.0/decision". The '
                 'status code was "500".')) for i in range(2)])
 
+    @mock.patch('bodhi.server.http_client.random.uniform', new=lambda low, high: high)
     @mock.patch('bodhi.server.models.log.error')
     @mock.patch('bodhi.server.util.http_session.post')
     @mock.patch('bodhi.server.util.time.sleep')
@@ -2279,8 +2357,8 @@ class TestUpdateUpdateTestGatingStatus(BasePyTestCase):
         update.update_test_gating_status()
 
         assert update.test_gating_status == model.TestGatingStatus.waiting
-        # The call_url() handler doesn't catch a Timeout so there are no sleeps/retries.
-        assert sleep.mock_calls == []
+        # The timeouts are retried like the errors.
+        assert sleep.mock_calls == [mock.call(1), mock.call(2), mock.call(4)]
         expected_post = mock.call(
             'https://greenwave-web-greenwave.app.os.fedoraproject.org/api/v1.0/decision',
             data={"product_version": "fedora-17", "decision_context": "bodhi_update_push_testing",
@@ -2288,19 +2366,20 @@ class TestUpdateUpdateTestGatingStatus(BasePyTestCase):
                               {"item": f"{update.alias}", "type": "bodhi_update"}],
                   "verbose": False},
             headers={'Content-Type': 'application/json'}, timeout=60)
-        assert post.call_count == 1
-        # Make sure the positional arguments are correct.
-        assert post.mock_calls[0][1] == expected_post[1]
-        assert post.mock_calls[0][2].keys() == expected_post[2].keys()
-        # The request has serialized our data as JSON. We should probably not just serialize our
-        # expected JSON, because we don't have a guarantee that it will serialize to the same
-        # string. So instead, let's deserialize the JSON that the mock captured and compare it
-        # to our dictionary above.
-        assert json.loads(post.mock_calls[0][2]['data']) == expected_post[2]['data']
-        # Make sure the other stuff is all the same
-        for key in expected_post[2].keys():
-            if key != 'data':
-                assert post.mock_calls[0][2][key] == expected_post[2][key]
+        assert post.call_count == 4
+        for i in range(4):
+            # Make sure the positional arguments are correct.
+            assert post.mock_calls[i][1] == expected_post[1]
+            assert post.mock_calls[i][2].keys() == expected_post[2].keys()
+            # The request has serialized our data as JSON. We should probably not just serialize
+            # our expected JSON, because we don't have a guarantee that it will serialize to the
+            # same string. So instead, let's deserialize the JSON that the mock captured and compare
+            # it to our dictionary above.
+            assert json.loads(post.mock_calls[i][2]['data']) == expected_post[2]['data']
+            # Make sure the other stuff is all the same
+            for key in expected_post[2].keys():
+                if key != 'data':
+                    assert post.mock_calls[i][2][key] == expected_post[2][key]
         assert error.mock_calls == [mock.call('The connection timed out.')]
 
 
@@ -3388,6 +3467,94 @@ class TestUpdate(ModelTest):
 
         assert self.obj._composite_karma == (2, -1)
 
+    def test_karma_counters_maintained_by_comment(self):
+        """comment() should keep the stored karma counters up to date without counting them."""
+        self.db.flush()
+        admin = model.User(name='bodhiadmin', groups=[model.Group(name='bodhiadmin')])
+        self.db.add(admin)
+        self.obj.comment(self.db, "ignored", -1, 'foo1')
+
+        with mock.patch.object(model.Update, '_count_karma') as count_karma:
+            self.obj.comment(self.db, "Removed build", 0, 'bodhi')
+            self.obj.comment(self.db, "Nice job", -1, 'foo')
+            self.obj.comment(self.db, "Whoops my last comment was wrong", 1, 'foo')
+            self.obj.comment(self.db, "LGTM", 1, 'bodhiadmin')
+            self.obj.comment(
+                self.db, 'This update can be pushed to stable now if the maintainer wishes', 0,
+                'bodhi')
+            self.db.flush()
+
+        count_karma.assert_not_called()
+        assert (self.obj.positive_karma, self.obj.negative_karma) == (2, 0)
+        assert self.obj.admin_approvals == 1
+        assert self.obj.stable_comment_posted
+        assert self.obj.date_karma_reset == self.obj.comments[-5].timestamp
+        assert self.obj._count_karma() == self.obj._karma_counters
+
+    def test_karma_counters_comment_changed(self):
+        """The karma counters should be counted again when comments change outside comment()."""
+        self.obj.comment(self.db, "foo", 1, 'foo')
+        self.obj.comment(self.db, "foo", 1, 'bar')
+        self.db.flush()
+
+        self.obj.comments[-1].karma = -1
+        # The stale counters aren't used.
+        assert self.obj._composite_karma == (1, -1)
+        self.db.flush()
+        assert (self.obj.positive_karma, self.obj.negative_karma) == (1, -1)
+
+        self.db.delete(self.obj.comments[-2])
+        self.db.flush()
+        assert (self.obj.positive_karma, self.obj.negative_karma) == (0, -1)
+
+    def test_karma_counters_comment_appended(self):
+        """Comments appended to an update should be counted before the next flush."""
+        self.db.flush()
+        user = model.User(name='biz')
+        self.obj.comments.append(model.Comment(text='LGTM', karma=1, user=user))
+
+        assert self.obj.karma == 1
+        self.db.flush()
+        assert self.obj.positive_karma == 1
+        assert not self.obj._karma_stale
+
+    def _forget_admin_approvals(self):
+        """Leave the admin approvals of the update uncounted, like the migration does."""
+        admin = model.User(name='bodhiadmin', groups=[model.Group(name='bodhiadmin')])
+        self.db.add(admin)
+        self.db.flush()
+        self.obj.comment(self.db, "LGTM", 1, 'bodhiadmin')
+        self.db.flush()
+        self.db.query(model.Update).filter_by(id=self.obj.id).update({'admin_approvals': None})
+        self.db.expire(self.obj)
+
+    def test_karma_counters_uncounted_admin_approvals(self):
+        """The admin approvals that were never counted should be stored when first needed."""
+        self._forget_admin_approvals()
+
+        assert self.obj.num_admin_approvals == 1
+        assert self.obj.admin_approvals == 1
+
+    def test_karma_counters_uncounted_admin_approvals_comment(self):
+        """comment() should count the karma counters if the admin approvals were never counted."""
+        self._forget_admin_approvals()
+
+        self.obj.comment(self.db, "LGTM", 1, 'foo')
+
+        assert self.obj.admin_approvals == 1
+        assert self.obj.positive_karma == 2
+
+    def test_karma_counters_uncounted_admin_approvals_flush(self):
+        """The changed updates should have their uncounted admin approvals counted on flush."""
+        self._forget_admin_approvals()
+
+        self.obj.notes = 'Changed'
+        self.db.flush()
+
+        assert self.obj.admin_approvals == 1
+        assert self.db.query(model.Update.admin_approvals).filter_by(
+            id=self.obj.id).scalar() == 1
+
     def test_check_karma_thresholds_obsolete(self):
         """check_karma_thresholds() should no-op on an obsolete update."""
         self.obj.status = UpdateStatus.obsolete
@@ -0,0 +1,404 @@
+# Copyright © 2020 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""This test suite contains tests for bodhi.server.rpmcache."""
+from unittest import mock
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import pytest
+
+from bodhi.server import rpmcache
+from bodhi.server.buildsys import DevBuildsys
+from bodhi.server.config import config
+
+
+RPMS = [{'arch': 'src', 'epoch': None, 'name': 'bodhi', 'release': '1.fc17', 'version': '2.0'}]
+
+
+class TestRPMCache:
+    """Test the RPMCache base class."""
+
+    def test_storage_not_implemented(self):
+        """Subclasses must implement the storage methods."""
+        cache = rpmcache.RPMCache()
+
+        with pytest.raises(NotImplementedError):
+            cache.get('bodhi-2.0-1.fc17')
+        with pytest.raises(NotImplementedError):
+            cache.set('bodhi-2.0-1.fc17', RPMS)
+
+    @mock.patch('bodhi.server.rpmcache.log.info')
+    def test_close_logs_counters(self, info):
+        """close() should log the hits and misses."""
+        cache = rpmcache.MemoryRPMCache()
+        cache.set('bodhi-2.0-1.fc17', RPMS)
+        cache.get_many(['bodhi-2.0-1.fc17', 'bodhi-3.0-1.fc17'])
+
+        cache.close()
+
+        info.assert_called_once_with('RPM cache: %d hits, %d misses', 1, 1)
+
+
+class TestRPMCachePrefetch:
+    """Test RPMCache.prefetch()."""
+
+    def setup_method(self, method):
+        """Set up a DevBuildsys to record the calls made to it."""
+        self.koji = DevBuildsys()
+        self.cache = rpmcache.MemoryRPMCache()
+        self._get_session_patch = mock.patch('bodhi.server.rpmcache.get_session',
+                                             return_value=self.koji)
+        self.get_session = self._get_session_patch.start()
+
+    def teardown_method(self, method):
+        """Stop the get_session() patch."""
+        self._get_session_patch.stop()
+
+    def test_all_cached(self):
+        """Koji should not be queried if all the NVRs are cached."""
+        self.cache.set('bodhi-2.0-1.fc17', RPMS)
+
+        rpms = self.cache.prefetch(['bodhi-2.0-1.fc17'])
+
+        assert rpms == {'bodhi-2.0-1.fc17': RPMS}
+        self.get_session.assert_not_called()
+        assert (self.cache.hits, self.cache.misses) == (1, 0)
+
+    def test_misses_with_known_build_ids(self):
+        """Misses with known build IDs should be listed in one multicall without getBuild()."""
+        self.cache.set('bodhi-2.0-1.fc17', RPMS)
+        builds = {'TurboGears-1.0.2.2-2.fc17': {'id': 16058}}
+
+        with mock.patch.object(self.koji, 'getBuild') as getBuild:
+            with mock.patch.object(self.koji, 'multiCall',
+                                   wraps=self.koji.multiCall) as multiCall:
+                rpms = self.cache.prefetch(
+                    ['bodhi-2.0-1.fc17', 'TurboGears-1.0.2.2-2.fc17'], builds)
+
+        getBuild.assert_not_called()
+        assert multiCall.call_count == 1
+        assert rpms['bodhi-2.0-1.fc17'] == RPMS
+        assert [r['nvr'] for r in rpms['TurboGears-1.0.2.2-2.fc17']] == \
+            ['TurboGears-1.0.2.2-2.fc17'] * 2
+        # The fetched RPMs should have been stored in the cache.
+        assert self.cache.get('TurboGears-1.0.2.2-2.fc17') == rpms['TurboGears-1.0.2.2-2.fc17']
+
+    def test_misses_with_unknown_build_ids(self):
+        """The IDs of the unknown builds should be looked up with one more multicall."""
+        with mock.patch.object(self.koji, 'multiCall', wraps=self.koji.multiCall) as multiCall:
+            rpms = self.cache.prefetch(['TurboGears-1.0.2.2-2.fc17'])
+
+        assert multiCall.call_count == 2
+        assert list(rpms) == ['TurboGears-1.0.2.2-2.fc17']
+
+    def test_koji_errors(self):
+        """NVRs that Koji returns errors for should be left out."""
+        fault = {'faultCode': 1000, 'faultString': 'oops'}
+        self.koji.multiCall = mock.Mock(side_effect=[
+            [[{'id': 1}], [None], fault],
+            [fault]])
+
+        with mock.patch('bodhi.server.rpmcache.log.warning') as warning:
+            rpms = self.cache.prefetch(['a-1-1.fc17', 'b-1-1.fc17', 'c-1-1.fc17'])
+
+        assert rpms == {}
+        assert self.cache.get('a-1-1.fc17') is None
+        warning.assert_called_once_with('Failed to list the RPMs of %s: %r', 'a-1-1.fc17', fault)
+
+    @mock.patch.dict(config, {'rpm_prefetch_batch_size': 2})
+    def test_batches(self):
+        """The misses should be fetched with one multicall per batch."""
+        builds = {'bodhi-%d-1.fc17' % i: {'id': i} for i in range(5)}
+
+        with mock.patch.object(self.koji, 'multiCall', wraps=self.koji.multiCall) as multiCall:
+            with mock.patch.object(self.koji, 'listBuildRPMs',
+                                   wraps=self.koji.listBuildRPMs) as listBuildRPMs:
+                rpms = self.cache.prefetch(sorted(builds), builds)
+
+        assert sorted(rpms) == sorted(builds)
+        assert multiCall.call_count == 3
+        assert [c[1][0] for c in listBuildRPMs.mock_calls] == [0, 1, 2, 3, 4]
+        self.get_session.assert_called_once_with()
+
+    @mock.patch.dict(config, {'rpm_prefetch_batch_size': 2, 'rpm_prefetch_threads': 2})
+    def test_threads(self):
+        """With several threads, each thread should use its own Koji session."""
+        builds = {'bodhi-%d-1.fc17' % i: {'id': i} for i in range(6)}
+        sessions = []
+
+        def get_session():
+            sessions.append(DevBuildsys())
+            return sessions[-1]
+
+        self.get_session.side_effect = get_session
+
+        rpms = self.cache.prefetch(sorted(builds), builds)
+
+        assert sorted(rpms) == sorted(builds)
+        assert sorted(self.cache.get_many(builds)) == sorted(builds)
+        assert 1 <= len(sessions) <= 2
+
+
+class TestSQLiteRPMCache:
+    """Test the SQLiteRPMCache class."""
+
+    def setup_method(self, method):
+        """Create a temporary directory for the database."""
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'rpms.sqlite')
+
+    def teardown_method(self, method):
+        """Remove the temporary directory."""
+        shutil.rmtree(self.tempdir)
+
+    def test_persistence(self):
+        """Entries should be found by another cache opened on the same file."""
+        cache = rpmcache.SQLiteRPMCache(self.path)
+        cache.set_many({'bodhi-2.0-1.fc17': RPMS, 'bodhi-3.0-1.fc17': []})
+        cache.close()
+
+        cache = rpmcache.SQLiteRPMCache(self.path)
+        try:
+            assert cache.get_many(['bodhi-2.0-1.fc17', 'bodhi-3.0-1.fc17', 'bodhi-4.0-1.fc17']) \
+                == {'bodhi-2.0-1.fc17': RPMS, 'bodhi-3.0-1.fc17': []}
+            assert (cache.hits, cache.misses) == (2, 1)
+        finally:
+            cache.close()
+
+    def test_chunked_lookups(self):
+        """More NVRs than the chunk size should be looked up in several queries."""
+        cache = rpmcache.SQLiteRPMCache(self.path)
+        cache.chunk_size = 2
+        nvrs = ['bodhi-%d-1.fc17' % i for i in range(5)]
+        cache.set_many({nvr: RPMS for nvr in nvrs})
+
+        try:
+            assert sorted(cache.get_many(nvrs)) == nvrs
+        finally:
+            cache.close()
+
+    def test_concurrent_caches(self):
+        """Several threads with their own caches should be able to share the database."""
+        def fill(i):
+            cache = rpmcache.SQLiteRPMCache(self.path)
+            for j in range(20):
+                cache.set('bodhi-%d.%d-1.fc17' % (i, j), RPMS)
+            cache.close()
+
+        threads = [threading.Thread(target=fill, args=(i, )) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        cache = rpmcache.SQLiteRPMCache(self.path)
+        try:
+            assert len(cache.get_many(['bodhi-%d.%d-1.fc17' % (i, j)
+                                       for i in range(4) for j in range(20)])) == 80
+        finally:
+            cache.close()
+
+    def test_evict_by_age(self):
+        """Entries unused for more than max_age days should be evicted on close()."""
+        cache = rpmcache.SQLiteRPMCache(self.path, max_age=30)
+        with mock.patch('bodhi.server.rpmcache.time.time', return_value=time.time() - 31 * 86400):
+            cache.set('bodhi-2.0-1.fc17', RPMS)
+        cache.set('bodhi-3.0-1.fc17', RPMS)
+        cache.close()
+
+        cache = rpmcache.SQLiteRPMCache(self.path)
+        try:
+            assert list(cache.get_many(['bodhi-2.0-1.fc17', 'bodhi-3.0-1.fc17'])) == \
+                ['bodhi-3.0-1.fc17']
+        finally:
+            cache.close()
+
+    def test_evict_by_size(self):
+        """The least recently used entries beyond max_entries should be evicted on close()."""
+        cache = rpmcache.SQLiteRPMCache(self.path, max_entries=2)
+        for i, nvr in enumerate(['bodhi-1.0-1.fc17', 'bodhi-2.0-1.fc17', 'bodhi-3.0-1.fc17']):
+            with mock.patch('bodhi.server.rpmcache.time.time', return_value=1000 + i):
+                cache.set(nvr, RPMS)
+        # Using the oldest entry should save it from eviction.
+        with mock.patch('bodhi.server.rpmcache.time.time', return_value=2000):
+            cache.get('bodhi-1.0-1.fc17')
+        cache.close()
+
+        cache = rpmcache.SQLiteRPMCache(self.path)
+        try:
+            assert sorted(cache.get_many(
+                ['bodhi-1.0-1.fc17', 'bodhi-2.0-1.fc17', 'bodhi-3.0-1.fc17'])) == \
+                ['bodhi-1.0-1.fc17', 'bodhi-3.0-1.fc17']
+        finally:
+            cache.close()
+
+
+class TestOpenRPMCache:
+    """Test the open_rpm_cache() function."""
+
+    @mock.patch.dict(config, {'cache_dir': None})
+    def test_no_cache_dir(self):
+        """Without a cache_dir, the cache should only live in memory."""
+        assert isinstance(rpmcache.open_rpm_cache(), rpmcache.MemoryRPMCache)
+
+    def test_cache_dir(self):
+        """With a cache_dir, the cache should be stored in it with the configured limits."""
+        tempdir = tempfile.mkdtemp()
+        try:
+            with mock.patch.dict(config, {'cache_dir': tempdir, 'rpm_cache_max_age': 7,
+                                          'rpm_cache_max_entries': 1000}):
+                cache = rpmcache.open_rpm_cache()
+            cache.close()
+
+            assert isinstance(cache, rpmcache.SQLiteRPMCache)
+            assert cache.path == os.path.join(tempdir, 'rpms.sqlite')
+            assert (cache.max_age, cache.max_entries) == (7, 1000)
+        finally:
+            shutil.rmtree(tempdir)
+
+
+class TestRPMHeaderCache:
+    """Test the RPMHeaderCache class."""
+
+    def setup_method(self, method):
+        """Set up a DevBuildsys to record the calls made to it."""
+        self.koji = DevBuildsys()
+        self.cache = rpmcache.RPMHeaderCache()
+        self._get_session_patch = mock.patch('bodhi.server.rpmcache.get_session',
+                                             return_value=self.koji)
+        self.get_session = self._get_session_patch.start()
+
+    def teardown_method(self, method):
+        """Stop the get_session() patch."""
+        self._get_session_patch.stop()
+
+    def test_lookup(self):
+        """Only the first lookup of an NVR should call fetch(), and copies should be returned."""
+        fetch = mock.Mock(return_value={'name': 'bodhi'})
+
+        first = self.cache.lookup('bodhi-2.0-1.fc17', fetch)
+        first['name'] = 'modified'
+        second = self.cache.lookup('bodhi-2.0-1.fc17', fetch)
+
+        fetch.assert_called_once_with('bodhi-2.0-1.fc17')
+        assert second == {'name': 'bodhi'}
+        assert (self.cache.lookups, self.cache.koji_calls) == (2, 1)
+
+    def test_lookup_error(self):
+        """Errors raised by fetch() should be propagated and not cached."""
+        fetch = mock.Mock(side_effect=[ValueError('oops'), {'name': 'bodhi'}])
+
+        with pytest.raises(ValueError):
+            self.cache.lookup('bodhi-2.0-1.fc17', fetch)
+
+        assert self.cache.lookup('bodhi-2.0-1.fc17', fetch) == {'name': 'bodhi'}
+        assert fetch.call_count == 2
+
+    @mock.patch.dict(config, {'rpm_header_cache_size': 2})
+    def test_evicts_least_recently_used(self):
+        """The least recently used entries beyond rpm_header_cache_size should be evicted."""
+        self.cache.set('a-1-1.fc17', {'name': 'a'})
+        self.cache.set('b-1-1.fc17', {'name': 'b'})
+        self.cache.get('a-1-1.fc17')
+
+        self.cache.set('c-1-1.fc17', {'name': 'c'})
+
+        assert self.cache.get('a-1-1.fc17') == {'name': 'a'}
+        assert self.cache.get('b-1-1.fc17') is None
+        assert self.cache.get('c-1-1.fc17') == {'name': 'c'}
+
+    @mock.patch.dict(config, {'rpm_header_cache_size': 0})
+    def test_disabled(self):
+        """Nothing should be cached or prefetched if rpm_header_cache_size is 0."""
+        self.cache.set('a-1-1.fc17', {'name': 'a'})
+        self.cache.prefetch(['libseccomp-2.1.0-1.fc20'])
+
+        assert self.cache.get('a-1-1.fc17') is None
+        self.get_session.assert_not_called()
+
+    @mock.patch.dict(config, {'rpm_prefetch_batch_size': 2})
+    def test_prefetch(self):
+        """The missing headers should be fetched with one multicall per batch."""
+        self.cache.set('a-1-1.fc17', {'name': 'a'})
+        nvrs = ['a-1-1.fc17', 'b-1-1.fc17', 'c-1-1.fc17', 'd-1-1.fc17']
+
+        with mock.patch.object(self.koji, 'multiCall', wraps=self.koji.multiCall) as multiCall:
+            with mock.patch.object(self.koji, 'getRPMHeaders',
+                                   wraps=self.koji.getRPMHeaders) as getRPMHeaders:
+                self.cache.prefetch(nvrs)
+
+        assert multiCall.call_count == 2
+        assert [c[2]['rpmID'] for c in getRPMHeaders.mock_calls] == \
+            ['b-1-1.fc17.src', 'c-1-1.fc17.src', 'd-1-1.fc17.src']
+        assert getRPMHeaders.mock_calls[0][2]['headers'] == rpmcache.RPM_HEADERS
+        assert self.cache.get('d-1-1.fc17')['name'] == 'libseccomp'
+        assert self.cache.koji_calls == 2
+
+    def test_prefetch_koji_errors(self):
+        """NVRs that Koji returns errors or nothing for should not be cached."""
+        fault = {'faultCode': 1000, 'faultString': 'oops'}
+        self.koji.multiCall = mock.Mock(return_value=[[{'name': 'a'}], [None], fault])
+
+        with mock.patch('bodhi.server.rpmcache.log.warning') as warning:
+            self.cache.prefetch(['a-1-1.fc17', 'b-1-1.fc17', 'c-1-1.fc17'])
+
+        assert self.cache.get('a-1-1.fc17') == {'name': 'a'}
+        assert self.cache.get('b-1-1.fc17') is None
+        assert self.cache.get('c-1-1.fc17') is None
+        assert warning.call_count == 2
+
+    @mock.patch('bodhi.server.rpmcache.log.info')
+    def test_counting(self, info):
+        """counting() should count the lookups and Koji calls of its block, and log them."""
+        fetch = mock.Mock(return_value={'name': 'bodhi'})
+        self.cache.lookup('a-1-1.fc17', fetch)
+
+        with self.cache.counting('Testing digest') as counters:
+            self.cache.prefetch(['b-1-1.fc17', 'c-1-1.fc17'])
+            for nvr in ['a-1-1.fc17', 'b-1-1.fc17', 'c-1-1.fc17', 'c-1-1.fc17', 'd-1-1.fc17']:
+                self.cache.lookup(nvr, fetch)
+
+        assert counters == {'lookups': 5, 'koji_calls': 2}
+        info.assert_called_with(
+            '%s: %d RPM header lookups, %d Koji calls, %d Koji calls saved',
+            'Testing digest', 5, 2, 3)
+        assert (self.cache.lookups, self.cache.koji_calls) == (6, 3)
+
+    def test_counting_other_threads(self):
+        """Lookups made by other threads should not be counted by counting()."""
+        fetch = mock.Mock(return_value={'name': 'bodhi'})
+
+        with self.cache.counting('Testing digest') as counters:
+            thread = threading.Thread(target=self.cache.lookup, args=('a-1-1.fc17', fetch))
+            thread.start()
+            thread.join()
+
+        assert counters == {'lookups': 0, 'koji_calls': 0}
+        assert self.cache.lookups == 1
+
+    def test_invalidate(self):
+        """invalidate() should empty the cache and reset the counters."""
+        self.cache.lookup('a-1-1.fc17', mock.Mock(return_value={'name': 'a'}))
+
+        self.cache.invalidate()
+
+        assert self.cache.get('a-1-1.fc17') is None
+        assert (self.cache.lookups, self.cache.koji_calls) == (0, 0)
@@ -16,6 +16,11 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
+from datetime import datetime
+
+import colander
+import pytest
+
 from bodhi.server import schemas
 
 
@@ -41,3 +46,27 @@ class TestSchemas:
         schema = schemas.SaveCommentSchema()
         nested_structure = schema.unflatten(flat_structure)
         assert nested_structure == expected
+
+
+class TestCursor:
+    """Test the Cursor colander type."""
+
+    def test_round_trip(self):
+        """A serialized cursor should be deserialized to the same date and id."""
+        node = colander.SchemaNode(schemas.Cursor())
+        position = (datetime(2020, 10, 1, 12, 30, 15, 123456), 42)
+
+        cursor = node.serialize(position)
+
+        assert '=' not in cursor
+        assert node.deserialize(cursor) == position
+
+    @pytest.mark.parametrize('cursor', ['not a cursor', 'MjAyMC0xMC0wMQ', 'bm90L2FuX2lk'])
+    def test_invalid(self, cursor):
+        """Cursors that can't be decoded should be invalid."""
+        node = colander.SchemaNode(schemas.Cursor())
+
+        with pytest.raises(colander.Invalid) as exc:
+            node.deserialize(cursor)
+
+        assert exc.value.msg == f'"{cursor}" is not a valid cursor'
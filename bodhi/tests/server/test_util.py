@@ -27,11 +27,13 @@ from webob.multidict import MultiDict
 import bleach
 import pkg_resources
 import pytest
+import requests
 
-from bodhi.server import util, models
+from bodhi.server import buildsys, http_client, util, models
 from bodhi.server.config import config
 from bodhi.server.exceptions import RepodataException
 from bodhi.server.models import TestGatingStatus, Update
+from bodhi.server.scripts import skopeo_lite
 from bodhi.tests.server import base
 
 
@@ -171,6 +173,7 @@ class TestBugLink:
              "class='notblue'>BZ#1234567</a>")
 
 
+@mock.patch('bodhi.server.http_client.random.uniform', new=lambda low, high: high)
 @mock.patch('bodhi.server.util.time.sleep')
 class TestCallAPI:
     """Test the call_api() function."""
@@ -219,63 +222,29 @@ class TestCallAPI:
         assert get.mock_calls == [mock.call('url', timeout=60), mock.call('url', timeout=60)]
         sleep.assert_called_once_with(1)
 
+    @mock.patch('bodhi.server.util.http_session.get')
+    def test_retries_connection_errors(self, get, sleep):
+        """Connection errors should be retried, and raised once there are no retries left."""
+        get.side_effect = [requests.ConnectionError('oops'), requests.Timeout('oops'),
+                           requests.ConnectionError('oops')]
 
-class TestMemoized:
-    """Test the memoized class."""
-
-    def test_caching(self):
-        """Ensure that caching works for hashable parameters."""
-        return_value = True
-
-        @util.memoized
-        def some_function(arg):
-            return return_value
-
-        assert some_function(42)
-        # Let's flip the value of return_value just to make sure the cached value is used and not
-        # the new value.
-        return_value = False
-        # It should still return True, indicating that some_function() was not called again.
-        assert some_function(42)
-
-    def test_caching_different_args(self):
-        """Ensure that caching works for hashable parameters, but is sensitive to arguments."""
-        return_value = True
-
-        @util.memoized
-        def some_function(arg):
-            return return_value
-
-        assert some_function(42)
-        # Let's flip the value of return_value just to make sure the cached value is not used.
-        return_value = False
-        # It should return False because the argument is different.
-        assert not some_function(41)
-
-    def test_dont_cache_lists(self):
-        """memoized should not cache calls with list arguments."""
-        return_value = True
-
-        @util.memoized
-        def some_function(arg):
-            return return_value
-
-        assert some_function(['some', 'list'])
-        # Let's flip the value of return_value just to make sure it isn't cached.
-        return_value = False
-        assert not some_function(['some', 'list'])
+        with pytest.raises(requests.ConnectionError):
+            util.call_api('url', 'service_name', retries=2)
 
-    def test___get__(self):
-        """__get__() should allow us to set the function as an attribute of another object."""
-        @util.memoized
-        def some_function(arg):
-            """Some docblock"""
-            return 42
+        assert get.call_count == 3
+        assert sleep.mock_calls == [mock.call(1), mock.call(2)]
 
-        class some_class(object):
-            thing = some_function
+    @mock.patch('bodhi.server.util.http_session.get')
+    def test_circuit_open(self, get, sleep):
+        """Requests should not be sent, nor retried, while the circuit of the service is open."""
+        service = http_client.get_service('service_name')
+        with mock.patch.object(service, 'check_circuit',
+                               side_effect=http_client.CircuitOpenError('open')):
+            with pytest.raises(http_client.CircuitOpenError):
+                util.call_api('url', 'service_name', retries=2)
 
-        assert some_class().thing() == 42
+        get.assert_not_called()
+        sleep.assert_not_called()
 
 
 class TestNoAutoflush:
@@ -587,6 +556,7 @@ class TestUtils(base.BasePyTestCase):
         'critpath.type': 'pdc',
         'pdc_url': 'http://domain.local'
     })
+    @mock.patch('bodhi.server.http_client.random.uniform', new=lambda low, high: high)
     def test_get_critpath_components_pdc_error(self, sleep, session):
         """ Ensure an error is thrown in Bodhi if there is an error in PDC
         getting the critpath packages.
@@ -600,7 +570,7 @@ class TestUtils(base.BasePyTestCase):
         # guarantee of the ordering of the GET parameters.
         assert 'Bodhi failed to get a resource from PDC' in str(exc.value)
         assert 'The status code was "500".' in str(exc.value)
-        assert sleep.mock_calls == [mock.call(1), mock.call(1), mock.call(1)]
+        assert sleep.mock_calls == [mock.call(1), mock.call(2), mock.call(4)]
 
     @mock.patch('bodhi.server.util.log')
     @mock.patch.dict(util.config, {'critpath.type': None, 'critpath_pkgs': ['kernel', 'glibc']})
@@ -776,6 +746,7 @@ class TestUtils(base.BasePyTestCase):
         rv = util.pagure_api_get('http://domain.local/api/0/rpms/python')
         assert rv == expected_json
 
+    @mock.patch('bodhi.server.http_client.random.uniform', new=lambda low, high: high)
     @mock.patch('bodhi.server.util.http_session')
     @mock.patch('bodhi.server.util.time.sleep')
     def test_pagure_api_get_non_500_error(self, sleep, session):
@@ -794,8 +765,9 @@ class TestUtils(base.BasePyTestCase):
             '"http://domain.local/api/0/rpms/python". The status code was '
             '"404". The error was "Project not found".')
         assert str(exc.value) == expected_error
-        assert sleep.mock_calls == [mock.call(1), mock.call(1), mock.call(1)]
+        assert sleep.mock_calls == [mock.call(1), mock.call(2), mock.call(4)]
 
+    @mock.patch('bodhi.server.http_client.random.uniform', new=lambda low, high: high)
     @mock.patch('bodhi.server.util.http_session')
     @mock.patch('bodhi.server.util.time.sleep')
     def test_pagure_api_get_500_error(self, sleep, session):
@@ -811,8 +783,9 @@ class TestUtils(base.BasePyTestCase):
             '"http://domain.local/api/0/rpms/python". The status code was '
             '"500".')
         assert str(exc.value) == expected_error
-        assert sleep.mock_calls, [mock.call(1), mock.call(1), mock.call(1)]
+        assert sleep.mock_calls == [mock.call(1), mock.call(2), mock.call(4)]
 
+    @mock.patch('bodhi.server.http_client.random.uniform', new=lambda low, high: high)
     @mock.patch('bodhi.server.util.http_session')
     @mock.patch('bodhi.server.util.time.sleep')
     def test_pagure_api_get_non_500_error_no_json(self, sleep, session):
@@ -829,7 +802,7 @@ class TestUtils(base.BasePyTestCase):
             '"http://domain.local/api/0/rpms/python". The status code was '
             '"404". The error was "".')
         assert str(exc.value) == expected_error
-        assert sleep.mock_calls, [mock.call(1), mock.call(1), mock.call(1)]
+        assert sleep.mock_calls == [mock.call(1), mock.call(2), mock.call(4)]
 
     @mock.patch('bodhi.server.util.http_session')
     def test_pdc_api_get(self, session):
@@ -861,6 +834,7 @@ class TestUtils(base.BasePyTestCase):
             'http://domain.local/rest_api/v1/component-branch-slas/')
         assert rv == expected_json
 
+    @mock.patch('bodhi.server.http_client.random.uniform', new=lambda low, high: high)
     @mock.patch('bodhi.server.util.http_session')
     @mock.patch('bodhi.server.util.time.sleep')
     def test_pdc_api_get_500_error(self, sleep, session):
@@ -876,8 +850,9 @@ class TestUtils(base.BasePyTestCase):
             '"http://domain.local/rest_api/v1/component-branch-slas/". The '
             'status code was "500".')
         assert str(exc.value) == expected_error
-        assert sleep.mock_calls == [mock.call(1), mock.call(1), mock.call(1)]
+        assert sleep.mock_calls == [mock.call(1), mock.call(2), mock.call(4)]
 
+    @mock.patch('bodhi.server.http_client.random.uniform', new=lambda low, high: high)
     @mock.patch('bodhi.server.util.http_session')
     @mock.patch('bodhi.server.util.time.sleep')
     def test_pdc_api_get_non_500_error(self, sleep, session):
@@ -898,8 +873,9 @@ class TestUtils(base.BasePyTestCase):
             'status code was "404". The error was '
             '"{\'detail\': \'Not found.\'}".')
         assert str(exc.value) == expected_error
-        assert sleep.mock_calls == [mock.call(1), mock.call(1), mock.call(1)]
+        assert sleep.mock_calls == [mock.call(1), mock.call(2), mock.call(4)]
 
+    @mock.patch('bodhi.server.http_client.random.uniform', new=lambda low, high: high)
     @mock.patch('bodhi.server.util.http_session')
     @mock.patch('bodhi.server.util.time.sleep')
     def test_pdc_api_get_non_500_error_no_json(self, sleep, session):
@@ -917,7 +893,7 @@ class TestUtils(base.BasePyTestCase):
             '"http://domain.local/rest_api/v1/component-branch-slas/3/". The '
             'status code was "404". The error was "".')
         assert str(exc.value) == expected_error
-        assert sleep.mock_calls == [mock.call(1), mock.call(1), mock.call(1)]
+        assert sleep.mock_calls == [mock.call(1), mock.call(2), mock.call(4)]
 
     @mock.patch('bodhi.server.util.http_session')
     def test_greenwave_api_post(self, session):
@@ -940,6 +916,7 @@ class TestUtils(base.BasePyTestCase):
                                            data)
         assert decision == expected_json
 
+    @mock.patch('bodhi.server.http_client.random.uniform', new=lambda low, high: high)
     @mock.patch('bodhi.server.util.http_session')
     @mock.patch('bodhi.server.util.time.sleep')
     def test_greenwave_api_post_500_error(self, sleep, session):
@@ -960,8 +937,9 @@ class TestUtils(base.BasePyTestCase):
             'Bodhi failed to send POST request to Greenwave at the following URL '
             '"http://domain.local/api/v1.0/decision". The status code was "500".')
         assert str(exc.value) == expected_error
-        assert sleep.mock_calls == [mock.call(1), mock.call(1), mock.call(1)]
+        assert sleep.mock_calls == [mock.call(1), mock.call(2), mock.call(4)]
 
+    @mock.patch('bodhi.server.http_client.random.uniform', new=lambda low, high: high)
     @mock.patch('bodhi.server.util.http_session')
     @mock.patch('bodhi.server.util.time.sleep')
     def test_greenwave_api_post_non_500_error(self, sleep, session):
@@ -986,8 +964,9 @@ class TestUtils(base.BasePyTestCase):
             '"http://domain.local/api/v1.0/decision". The status code was "404". '
             'The error was "{\'message\': \'Not found.\'}".')
         assert str(exc.value) == expected_error
-        assert sleep.mock_calls == [mock.call(1), mock.call(1), mock.call(1)]
+        assert sleep.mock_calls == [mock.call(1), mock.call(2), mock.call(4)]
 
+    @mock.patch('bodhi.server.http_client.random.uniform', new=lambda low, high: high)
     @mock.patch('bodhi.server.util.http_session')
     @mock.patch('bodhi.server.util.time.sleep')
     def test_greenwave_api_post_non_500_error_no_json(self, sleep, session):
@@ -1010,7 +989,7 @@ class TestUtils(base.BasePyTestCase):
             '"http://domain.local/api/v1.0/decision". The status code was "404". '
             'The error was "".')
         assert str(exc.value) == expected_error
-        assert sleep.mock_calls == [mock.call(1), mock.call(1), mock.call(1)]
+        assert sleep.mock_calls == [mock.call(1), mock.call(2), mock.call(4)]
 
     @mock.patch('bodhi.server.util.http_session')
     def test_waiverdb_api_post(self, session):
@@ -1106,6 +1085,18 @@ class TestUtils(base.BasePyTestCase):
         h = util.get_rpm_header('libseccomp')
         assert h['name'] == 'libseccomp'
 
+    def test_rpm_header_cached(self):
+        """The headers should only be fetched from Koji once per NVR."""
+        koji = buildsys.DevBuildsys()
+        with mock.patch('bodhi.server.util.buildsys.get_session', return_value=koji):
+            with mock.patch.object(koji, 'getRPMHeaders',
+                                   wraps=koji.getRPMHeaders) as getRPMHeaders:
+                util.get_rpm_header('libseccomp')
+                h = util.get_rpm_header('libseccomp')
+
+        assert h['name'] == 'libseccomp'
+        getRPMHeaders.assert_called_once_with(rpmID='libseccomp.src', headers=mock.ANY)
+
     def test_rpm_header_exception(self):
         with pytest.raises(Exception):
             util.get_rpm_header('raise-exception')
@@ -1184,7 +1175,7 @@ class TestUtils(base.BasePyTestCase):
         splitspacestring = util.splitter("build-0.1 build-0.2")
         assert splitspacestring == ['build-0.1', 'build-0.2']
 
-    @mock.patch('bodhi.server.util.requests.get')
+    @mock.patch('bodhi.server.util.http_session.get')
     @mock.patch('bodhi.server.util.log.exception')
     def test_taskotron_results_non_200(self, log_exception, mock_get):
         '''Query should stop when error is encountered'''
@@ -1199,7 +1190,7 @@ class TestUtils(base.BasePyTestCase):
         assert 'Problem talking to' in msg
         assert 'status code was %r' % mock_get.return_value.status_code in msg
 
-    @mock.patch('bodhi.server.util.requests.get')
+    @mock.patch('bodhi.server.util.http_session.get')
     def test_taskotron_results_paging(self, mock_get):
         '''Next pages should be retrieved'''
         mock_get.return_value.status_code = 200
@@ -1219,7 +1210,7 @@ class TestUtils(base.BasePyTestCase):
         assert mock_get.call_args[0][0] == 'url2'
         assert mock_get.call_args[1]['timeout'] == 60
 
-    @mock.patch('bodhi.server.util.requests.get')
+    @mock.patch('bodhi.server.util.http_session.get')
     @mock.patch('bodhi.server.util.log.debug')
     def test_taskotron_results_max_queries(self, log_debug, mock_get):
         '''Only max_queries should be performed'''
@@ -1408,6 +1399,58 @@ class TestCopyContainer:
                                     raise_on_error=True)
 
 
+@mock.patch('bodhi.server.util.config', new_callable=lambda: {
+    'container.copy_threads': 2,
+    'container.native_copy': False,
+    'container.source_registry': 'src',
+    'container.destination_registry': 'dest',
+    'skopeo.cmd': 'skopeo',
+})
+@mock.patch('bodhi.server.util._get_build_repository', new=lambda b: 'testrepo')
+class TestCopyContainers:
+    """Test the copy_containers() function."""
+
+    def setup_method(self, method):
+        self.build = mock.Mock(nvr='test-1-1')
+        self.build.nvr_version = '1'
+        self.build.nvr_release = '1'
+
+    @mock.patch('bodhi.server.util.cmd', autospec=True)
+    @mock.patch('bodhi.server.util._container_image_url', new=lambda sr, r, st: f'{sr}:{r}:{st}')
+    def test_skopeo(self, cmd, config):
+        """Skopeo should be run for each tag without container.native_copy."""
+        util.copy_containers([(self.build, [None, '1', 'testing'])], destination_registry='boo')
+
+        assert cmd.mock_calls == [
+            mock.call(['skopeo', 'copy', 'src:testrepo:1-1', f'boo:testrepo:{tag}'],
+                      raise_on_error=True)
+            for tag in ('1-1', '1', 'testing')]
+
+    @mock.patch('bodhi.server.util.cmd', autospec=True)
+    @mock.patch('bodhi.server.util.skopeo_lite.copy_image')
+    def test_native(self, copy_image, cmd, config):
+        """Each image should be copied once to all its tags with container.native_copy."""
+        config['container.native_copy'] = True
+        other_build = mock.Mock(nvr='test-2-1')
+        other_build.nvr_version = '2'
+        other_build.nvr_release = '1'
+
+        util.copy_containers([(self.build, [None, '1', 'testing']),
+                              (other_build, [None, '2', 'latest'])])
+
+        assert cmd.call_count == 0
+        assert copy_image.call_count == 2
+        for call, tags in zip(copy_image.mock_calls, (['1-1', '1', 'testing'],
+                                                      ['2-1', '2', 'latest'])):
+            src, dest, extra_tags, executor, blob_locations = call[1]
+            assert (src.registry, src.repo, src.tag) == ('src', 'testrepo', tags[0])
+            assert (dest.registry, dest.repo, dest.tag) == ('dest', 'testrepo', tags[0])
+            assert extra_tags == tags[1:]
+            assert executor._max_workers == 2
+            assert isinstance(blob_locations, skopeo_lite.BlobLocations)
+        assert copy_image.mock_calls[0][1][3:] == copy_image.mock_calls[1][1][3:]
+
+
 class TestTransactionalSessionMaker(base.BasePyTestCase):
     """This class contains tests on the TransactionalSessionMaker class."""
     @mock.patch('bodhi.server.util.log.exception')
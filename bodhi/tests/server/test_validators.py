@@ -64,7 +64,7 @@ class TestValidateCSRFToken(BasePyTestCase):
 
 class TestGetValidRequirements:
     """Test the _get_valid_requirements() function."""
-    @mock.patch('bodhi.server.util.requests.get')
+    @mock.patch('bodhi.server.util.http_session.get')
     def test__get_valid_requirements(self, get):
         """Test normal operation."""
         get.return_value.status_code = 200
@@ -115,7 +115,7 @@ class TestValidateAcls(BasePyTestCase):
         mock_request.buildinfo = {'bodhi-2.0-1.fc17': {}}
         return mock_request
 
-    @mock.patch('bodhi.server.models.Package.get_pkg_committers_from_pagure',
+    @mock.patch('bodhi.server.models.Package.get_committers_from_pagure',
                 return_value=([], ['infra-sig']))
     @mock.patch.dict('bodhi.server.validators.config', {'acl_system': 'pagure'})
     def test_allowed_via_group(self, gpcfp):
@@ -129,7 +129,7 @@ class TestValidateAcls(BasePyTestCase):
         validators.validate_acls(request)
 
         assert not len(request.errors)
-        gpcfp.assert_called_once_with()
+        gpcfp.assert_called_once_with('rpms', 'bodhi')
 
     def test_unable_to_infer_content_type(self):
         """Test the error handler for when Bodhi cannot determine the content type of a build."""
@@ -163,10 +163,10 @@ class TestValidateAcls(BasePyTestCase):
         ]
         assert request.errors.status == 501
 
-    # Mocking the get_pkg_committers_from_pagure function because it will
+    # Mocking the get_committers_from_pagure function because it will
     # simplify the overall number of mocks. This function is tested on its own
     # elsewhere.
-    @mock.patch('bodhi.server.models.Package.get_pkg_committers_from_pagure',
+    @mock.patch('bodhi.server.models.Package.get_committers_from_pagure',
                 return_value=(['guest'], []))
     @mock.patch.dict('bodhi.server.validators.config', {'acl_system': 'pagure'})
     def test_validate_acls_pagure(self, mock_gpcfp):
@@ -177,7 +177,7 @@ class TestValidateAcls(BasePyTestCase):
         assert not len(mock_request.errors)
         mock_gpcfp.assert_called_once()
 
-    @mock.patch('bodhi.server.models.Package.get_pkg_committers_from_pagure',
+    @mock.patch('bodhi.server.models.Package.get_committers_from_pagure',
                 return_value=(['tbrady'], []))
     @mock.patch.dict('bodhi.server.validators.config', {'acl_system': 'pagure'})
     def test_validate_acls_pagure_proven_packager(self, mock_gpcfp):
@@ -195,7 +195,7 @@ class TestValidateAcls(BasePyTestCase):
         assert not len(mock_request.errors)
         mock_gpcfp.assert_not_called()
 
-    @mock.patch('bodhi.server.models.Package.get_pkg_committers_from_pagure',
+    @mock.patch('bodhi.server.models.Package.get_committers_from_pagure',
                 return_value=(['guest'], []))
     @mock.patch.dict('bodhi.server.validators.config', {'acl_system': 'pagure'})
     def test_validate_acls_pagure_not_a_packager(self, mock_gpcfp):
@@ -217,7 +217,7 @@ class TestValidateAcls(BasePyTestCase):
         assert mock_request.errors == error
         mock_gpcfp.assert_not_called()
 
-    @mock.patch('bodhi.server.models.Package.get_pkg_committers_from_pagure',
+    @mock.patch('bodhi.server.models.Package.get_committers_from_pagure',
                 return_value=(['tbrady'], []))
     @mock.patch.dict('bodhi.server.validators.config', {'acl_system': 'pagure'})
     def test_validate_acls_pagure_no_commit_access(self, mock_gpcfp):
@@ -234,7 +234,7 @@ class TestValidateAcls(BasePyTestCase):
         assert mock_request.errors == error
         mock_gpcfp.assert_called_once()
 
-    @mock.patch('bodhi.server.models.Package.get_pkg_committers_from_pagure',
+    @mock.patch('bodhi.server.models.Package.get_committers_from_pagure',
                 return_value=(['guest'], []))
     @mock.patch.dict('bodhi.server.validators.config', {'acl_system': 'pagure'})
     def test_validate_acls_pagure_runtime_error(self, mock_gpcfp):
@@ -253,7 +253,7 @@ class TestValidateAcls(BasePyTestCase):
         assert mock_request.errors == expected_error
         mock_gpcfp.assert_called_once()
 
-    @mock.patch('bodhi.server.models.Package.get_pkg_committers_from_pagure',
+    @mock.patch('bodhi.server.models.Package.get_committers_from_pagure',
                 return_value=(['guest'], []))
     @mock.patch.dict('bodhi.server.validators.config', {'acl_system': 'pagure'})
     def test_validate_acls_pagure_exception(self, mock_gpcfp):
@@ -308,7 +308,7 @@ class TestValidateAcls(BasePyTestCase):
         }]
         assert mock_request.errors == error
 
-    @mock.patch('bodhi.server.models.Package.get_pkg_committers_from_pagure',
+    @mock.patch('bodhi.server.models.Package.get_committers_from_pagure',
                 return_value=(['guest'], []))
     @mock.patch.dict('bodhi.server.validators.config', {'acl_system': 'pagure'})
     def test_validate_acls_sidetag(self, mock_gpcfp):
@@ -318,7 +318,7 @@ class TestValidateAcls(BasePyTestCase):
         assert not len(mock_request.errors)
         mock_gpcfp.assert_not_called()
 
-    @mock.patch('bodhi.server.models.Package.get_pkg_committers_from_pagure',
+    @mock.patch('bodhi.server.models.Package.get_committers_from_pagure',
                 return_value=(['guest'], []))
     @mock.patch.dict('bodhi.server.validators.config', {'acl_system': 'pagure'})
     def test_validate_acls_sidetag_wrong_owner(self, mock_gpcfp):
@@ -334,7 +334,7 @@ class TestValidateAcls(BasePyTestCase):
         assert mock_request.errors == error
         mock_gpcfp.assert_not_called()
 
-    @mock.patch('bodhi.server.models.Package.get_pkg_committers_from_pagure',
+    @mock.patch('bodhi.server.models.Package.get_committers_from_pagure',
                 return_value=(['guest'], []))
     @mock.patch.dict('bodhi.server.validators.config', {'acl_system': 'pagure'})
     def test_validate_acls_sidetag_owner_not_set(self, mock_gpcfp):
@@ -466,6 +466,7 @@ class TestValidateOverrideBuild(BasePyTestCase):
         """Assert exception handling when the build is not found and koji is unavailable."""
         request = mock.Mock()
         request.db = self.db
+        request.buildinfo = {}
         request.errors = Errors()
         request.koji.listTags.side_effect = IOError('You forgot to pay your ISP.')
         request.validated = {'edited': None}
@@ -483,6 +484,7 @@ class TestValidateOverrideBuild(BasePyTestCase):
         """If a build does not have tags that identify a Release, the validator should complain."""
         request = mock.Mock()
         request.db = self.db
+        request.buildinfo = {}
         request.errors = Errors()
         request.koji.listTags.return_value = [{'name': 'invalid'}]
         request.validated = {'edited': None}
@@ -505,6 +507,7 @@ class TestValidateOverrideBuild(BasePyTestCase):
         release = models.Release.query.first()
         request = mock.Mock()
         request.db = self.db
+        request.buildinfo = {}
         request.errors = Errors()
         request.koji.listTags.return_value = [{'name': release.candidate_tag}]
         request.validated = {'edited': None}
@@ -518,16 +521,15 @@ class TestValidateOverrideBuild(BasePyTestCase):
         build = models.Build.query.filter_by(nvr=build.nvr).one()
         assert build.release.name == release.name
 
-    @mock.patch('bodhi.server.models.buildsys.get_session')
-    def test_wrong_tag(self, get_session):
+    def test_wrong_tag(self):
         """If a build does not have a candidate or testing tag, the validator should complain."""
         release = models.Release.query.first()
         request = mock.Mock()
         request.db = self.db
+        request.buildinfo = {}
         request.errors = Errors()
         request.koji.listTags.return_value = [{'name': release.stable_tag}]
         request.validated = {'edited': None}
-        get_session.return_value.listTags.return_value = request.koji.listTags.return_value
         build = models.Build.query.first()
 
         validators._validate_override_build(request, build.nvr, self.db)
@@ -538,10 +540,32 @@ class TestValidateOverrideBuild(BasePyTestCase):
         ]
         assert request.errors.status == exceptions.HTTPBadRequest.code
 
+    def test_prefetched(self):
+        """The tags and info prefetched from Koji should be used instead of querying it again."""
+        release = models.Release.query.first()
+        request = mock.Mock()
+        request.db = self.db
+        request.buildinfo = {'new-1.0-1.fc17': {
+            'info': {'name': 'new', 'version': '1.0', 'release': '1.fc17', 'id': 1234,
+                     'epoch': None},
+            'nvr': ('new', '1.0', '1.fc17'),
+            'tags': [release.candidate_tag]}}
+        request.errors = Errors()
+        request.validated = {'edited': None}
+
+        build = validators._validate_override_build(request, 'new-1.0-1.fc17', self.db)
+
+        assert not len(request.errors)
+        assert build.nvr == 'new-1.0-1.fc17'
+        assert build.release.name == release.name
+        request.koji.listTags.assert_not_called()
+        request.koji.getBuild.assert_not_called()
+
     def test_test_gating_status_is_failed(self):
         """If a build's test gating status is failed, the validator should complain."""
         request = mock.Mock()
         request.db = self.db
+        request.buildinfo = {}
         request.errors = Errors()
         request.validated = {'edited': None}
         build = models.Build.query.first()
@@ -565,6 +589,7 @@ class TestValidateOverrideBuilds(BasePyTestCase):
         """If the request has invalid nvrs, it should add an error to the request."""
         request = mock.Mock()
         request.db = self.db
+        request.buildinfo = {}
         request.errors = Errors()
         request.koji.listTags.return_value = [{'name': 'invalid'}]
         request.validated = {'nvr': 'invalid'}
@@ -581,6 +606,7 @@ class TestValidateOverrideBuilds(BasePyTestCase):
         """If the request has no nvrs, it should add an error to the request."""
         request = mock.Mock()
         request.db = self.db
+        request.buildinfo = {}
         request.errors = Errors()
         request.validated = {'nvr': ''}
 
@@ -604,6 +630,7 @@ class TestValidateOverrideBuilds(BasePyTestCase):
 
         request = mock.Mock()
         request.db = self.db
+        request.buildinfo = {}
         request.errors = Errors()
         request.validated = {'nvr': 'bodhi-2.0-1.fc17', 'edited': False}
 
@@ -811,6 +838,101 @@ class TestValidateBuildNvrs(BasePyTestCase):
         ]
 
 
+class TestPrefetchBuilds(BasePyTestCase):
+    """Test the prefetch_builds() function."""
+
+    def setup_method(self, method):
+        """Sets up the environment for each test method call."""
+        super().setup_method(method)
+
+        self.request = mock.Mock()
+        self.request.buildinfo = {}
+        self.request.from_tag_inherited = ['f17-build-side-7777']
+        self.request.koji = buildsys.get_session()
+
+    def test_single_multicall(self):
+        """All the builds should be fetched with one multicall, and not fetched again."""
+        nvrs = ['bodhi-2.0-1.fc17', 'TurboGears-1.0.2.2-2.fc17', 'bodhi-2.0-1.fc17']
+
+        with mock.patch.object(self.request.koji, 'multiCall',
+                               wraps=self.request.koji.multiCall) as multiCall:
+            validators.prefetch_builds(self.request, nvrs)
+
+        multiCall.assert_called_once_with()
+        assert not self.request.koji.multicall
+        assert set(self.request.buildinfo) == {'bodhi-2.0-1.fc17', 'TurboGears-1.0.2.2-2.fc17'}
+        assert self.request.buildinfo['bodhi-2.0-1.fc17']['nvr'] == ('bodhi', '2.0', '1.fc17')
+        assert self.request.buildinfo['bodhi-2.0-1.fc17']['info']['nvr'] == 'bodhi-2.0-1.fc17'
+        assert self.request.buildinfo['bodhi-2.0-1.fc17']['tags'] == [
+            tag['name'] for tag in self.request.koji.listTags('bodhi-2.0-1.fc17')
+        ] + ['f17-build-side-7777']
+        with mock.patch.object(self.request.koji, 'getBuild') as getBuild, \
+                mock.patch.object(self.request.koji, 'listTags') as listTags:
+            for nvr in nvrs:
+                validators.cache_nvrs(self.request, nvr)
+                validators.cache_tags(self.request, nvr)
+        getBuild.assert_not_called()
+        listTags.assert_not_called()
+
+    def test_single_build(self):
+        """Koji should not be queried for a single build, as there is nothing to batch."""
+        with mock.patch.object(self.request.koji, 'multiCall') as multiCall:
+            validators.prefetch_builds(self.request, ['bodhi-2.0-1.fc17'])
+
+        multiCall.assert_not_called()
+        assert self.request.buildinfo == {}
+
+    def test_already_cached(self):
+        """Builds that are already cached should not be fetched again."""
+        self.request.buildinfo = {
+            'bodhi-2.0-1.fc17': {'nvr': ('bodhi', '2.0', '1.fc17'), 'tags': ['f17']},
+            'TurboGears-1.0.2.2-2.fc17': {'nvr': ('TurboGears', '1.0.2.2', '2.fc17')}}
+
+        with mock.patch.object(self.request.koji, 'multiCall') as multiCall:
+            validators.prefetch_builds(
+                self.request, ['bodhi-2.0-1.fc17', 'TurboGears-1.0.2.2-2.fc17'])
+
+        multiCall.assert_not_called()
+
+    def test_faults_left_to_cache_functions(self):
+        """Builds Koji returned an error or nothing for should not be cached."""
+        results = [
+            [{'name': 'bodhi', 'version': '2.0', 'release': '1.fc17'}],
+            {'faultCode': 1000, 'faultString': 'No such build'},
+            [None], [[]]]
+
+        with mock.patch.object(self.request.koji, 'multiCall', return_value=results):
+            validators.prefetch_builds(self.request, ['bodhi-2.0-1.fc17', 'missing-1-1.fc17'])
+
+        assert self.request.buildinfo == {
+            'bodhi-2.0-1.fc17': {
+                'info': {'name': 'bodhi', 'version': '2.0', 'release': '1.fc17'},
+                'nvr': ('bodhi', '2.0', '1.fc17')},
+            'missing-1-1.fc17': {}}
+
+    @mock.patch('bodhi.server.validators.log.exception')
+    def test_koji_error(self, exception):
+        """Errors should be logged and leave the multicall mode."""
+        with mock.patch.object(self.request.koji, 'multiCall', side_effect=IOError('Koji down')):
+            validators.prefetch_builds(
+                self.request, ['bodhi-2.0-1.fc17', 'TurboGears-1.0.2.2-2.fc17'])
+
+        exception.assert_called_once_with('Unable to prefetch the builds from Koji')
+        assert not self.request.koji.multicall
+        assert self.request.buildinfo == {}
+
+    @mock.patch('bodhi.server.validators.log.warning')
+    def test_unexpected_results(self, warning):
+        """The results should be ignored if there aren't as many as the calls."""
+        with mock.patch.object(self.request.koji, 'multiCall', return_value=[[None]]):
+            validators.prefetch_builds(
+                self.request, ['bodhi-2.0-1.fc17', 'TurboGears-1.0.2.2-2.fc17'])
+
+        warning.assert_called_once_with(
+            'Koji returned %r results when prefetching %d builds', 1, 2)
+        assert self.request.buildinfo == {}
+
+
 class TestValidateBuildTags(BasePyTestCase):
     """Test the validate_build_tags() function."""
 
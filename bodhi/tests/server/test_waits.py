@@ -0,0 +1,210 @@
+# Copyright © 2020 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""This test suite contains tests for bodhi.server.waits."""
+from unittest import mock
+from urllib.error import HTTPError, URLError
+import http.server
+import itertools
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+import pytest
+
+from bodhi.server import waits
+
+
+class TestFileWatcher:
+    """Test the FileWatcher class."""
+
+    def setup_method(self, method):
+        """Create a temporary directory to watch."""
+        self.tempdir = tempfile.mkdtemp()
+
+    def teardown_method(self, method):
+        """Remove the temporary directory."""
+        shutil.rmtree(self.tempdir)
+
+    @pytest.mark.skipif(waits._libc is None, reason='inotify is not available')
+    def test_woken_up_by_new_file(self):
+        """wait() should return as soon as a file is written in a watched directory."""
+        def write():
+            time.sleep(0.1)
+            with open(os.path.join(self.tempdir, 'repomd.xml.asc'), 'w') as signature:
+                signature.write('signature')
+
+        writer = threading.Thread(target=write)
+        with waits.FileWatcher([self.tempdir]) as watcher:
+            assert watcher.watching
+            start = time.monotonic()
+            writer.start()
+            watcher.wait(60)
+            writer.join()
+
+        assert time.monotonic() - start < 10
+        assert not watcher.watching
+
+    @pytest.mark.skipif(waits._libc is None, reason='inotify is not available')
+    def test_timeout(self):
+        """wait() should return after the timeout if nothing happens."""
+        with waits.FileWatcher([self.tempdir]) as watcher:
+            start = time.monotonic()
+            watcher.wait(0.1)
+
+        assert time.monotonic() - start >= 0.1
+
+    @mock.patch('bodhi.server.waits.time.sleep')
+    def test_missing_directories(self, sleep):
+        """wait() should fall back to sleeping if no directory can be watched."""
+        with waits.FileWatcher([os.path.join(self.tempdir, 'missing')]) as watcher:
+            assert not watcher.watching
+            watcher.wait(300)
+
+        sleep.assert_called_once_with(300)
+
+    @mock.patch('bodhi.server.waits._libc', None)
+    @mock.patch('bodhi.server.waits.time.sleep')
+    def test_no_inotify(self, sleep):
+        """wait() should fall back to sleeping on platforms without inotify."""
+        with waits.FileWatcher([self.tempdir]) as watcher:
+            assert not watcher.watching
+            watcher.wait(300)
+
+        sleep.assert_called_once_with(300)
+
+
+def test_backoff():
+    """The delays should double until they reach the ceiling."""
+    assert list(itertools.islice(waits.backoff(10, 200), 7)) == [10, 20, 40, 80, 160, 200, 200]
+    assert list(itertools.islice(waits.backoff(300, 200), 2)) == [200, 200]
+
+
+class TestConditionalFetcher:
+    """Test the ConditionalFetcher class against a local HTTP server."""
+
+    def setup_method(self, method):
+        """Start a server that honors If-Modified-Since."""
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.server.requests.append(dict(self.headers))
+                time.sleep(self.server.delay)
+                if self.server.status != 200:
+                    self.send_error(self.server.status)
+                elif self.headers.get('If-Modified-Since') == self.server.last_modified:
+                    self.send_response(304)
+                    self.end_headers()
+                else:
+                    self.send_response(200)
+                    self.send_header('Last-Modified', self.server.last_modified)
+                    self.end_headers()
+                    self.wfile.write(self.server.body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.HTTPServer(('127.0.0.1', 0), Handler)
+        self.server.body = b'repomd'
+        self.server.last_modified = 'Mon, 05 Oct 2020 12:00:00 GMT'
+        self.server.requests = []
+        self.server.status = 200
+        self.server.delay = 0
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/repomd.xml' % self.server.server_port
+
+    def teardown_method(self, method):
+        """Stop the server."""
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+
+    def test_not_modified(self):
+        """The document should only be returned again once it has been modified."""
+        fetcher = waits.ConditionalFetcher(self.url)
+
+        assert fetcher.fetch() == b'repomd'
+        assert fetcher.fetch() is None
+        self.server.body = b'new repomd'
+        self.server.last_modified = 'Mon, 05 Oct 2020 12:05:00 GMT'
+        assert fetcher.fetch() == b'new repomd'
+
+        assert [r.get('If-Modified-Since') for r in self.server.requests] == \
+            [None, 'Mon, 05 Oct 2020 12:00:00 GMT', 'Mon, 05 Oct 2020 12:00:00 GMT']
+        assert fetcher.last_modified == 'Mon, 05 Oct 2020 12:05:00 GMT'
+        assert fetcher.etag is None
+
+    @mock.patch('bodhi.server.waits.log')
+    def test_read_timeout(self, log):
+        """A server that doesn't answer in time should be treated as unchanged."""
+        self.server.delay = 0.5
+        fetcher = waits.ConditionalFetcher(self.url, timeout=0.05)
+
+        assert fetcher.fetch() is None
+
+        log.warning.assert_called_once_with('Timed out fetching %s', self.url)
+        assert fetcher.last_modified is None
+
+    @mock.patch('bodhi.server.waits.log')
+    @mock.patch('bodhi.server.waits.urlopen')
+    def test_connect_timeout(self, urlopen, log):
+        """A server that can't be connected to in time should be treated as unchanged."""
+        urlopen.side_effect = URLError(socket.timeout('timed out'))
+        fetcher = waits.ConditionalFetcher(self.url, timeout=3)
+
+        assert fetcher.fetch() is None
+
+        assert urlopen.mock_calls[0][2] == {'timeout': 3}
+        log.warning.assert_called_once_with('Timed out fetching %s', self.url)
+
+    @mock.patch('bodhi.server.waits.urlopen')
+    def test_url_error(self, urlopen):
+        """Errors other than timeouts while connecting should be raised."""
+        urlopen.side_effect = URLError(ConnectionRefusedError())
+        fetcher = waits.ConditionalFetcher(self.url)
+
+        with pytest.raises(URLError):
+            fetcher.fetch()
+
+    def test_error(self):
+        """Errors other than 304 should be raised."""
+        self.server.status = 404
+        fetcher = waits.ConditionalFetcher(self.url)
+
+        with pytest.raises(HTTPError) as exc:
+            fetcher.fetch()
+
+        assert exc.value.code == 404
+
+    @mock.patch('bodhi.server.waits.http_client.get_service')
+    def test_records_metrics(self, get_service):
+        """The requests should be recorded in the metrics of the mirrors service."""
+        fetcher = waits.ConditionalFetcher(self.url)
+
+        fetcher.fetch()
+        fetcher.fetch()
+        self.server.status = 404
+        with pytest.raises(HTTPError):
+            fetcher.fetch()
+
+        get_service.assert_called_with('mirrors')
+        assert get_service.return_value.record.mock_calls == [
+            mock.call('GET', 200, mock.ANY), mock.call('GET', 304, mock.ANY),
+            mock.call('GET', 404, mock.ANY)]
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# Copyright © 2020 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+Measure how long the check_policies task takes against a local Greenwave stub.
+
+A temporary SQLite database is filled with the given number of updates in testing, each with some
+builds, and a local HTTP server answers every Greenwave decision request after the given latency.
+The task is then timed in these scenarios:
+
+* sequential: Greenwave is asked about one update after the other, and every update is committed
+  on its own, as the task did before the decisions were requested concurrently.
+* concurrent: the task as it is, with nothing remembered from previous runs.
+* unchanged: the task run again, which skips the updates whose decisions are settled.
+
+Messages are not published.
+
+Usage::
+
+    $ python3 devel/benchmarks/check_policies.py --updates 500 --latency 0.05 --workers 8
+"""
+from datetime import datetime
+from unittest import mock
+import argparse
+import http.server
+import json
+import threading
+import time
+
+from bodhi.server import initialize_db, models, Session
+from bodhi.server.config import config
+from bodhi.server.tasks import check_policies
+from bodhi.server.models import (
+    Release, ReleaseState, RpmBuild, RpmPackage, Update, UpdateStatus, UpdateType, User)
+
+
+class GreenwaveHandler(http.server.BaseHTTPRequestHandler):
+    """Answer every decision request with satisfied policies, after the server's latency."""
+
+    def do_POST(self):
+        """Answer a decision request."""
+        self.rfile.read(int(self.headers['Content-Length']))
+        time.sleep(self.server.latency)
+        body = json.dumps({'policies_satisfied': True,
+                           'summary': 'All required tests passed'}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        """Don't log the requests."""
+
+
+def populate(db, count, builds):
+    """
+    Insert a release and count updates in testing with builds.
+
+    Args:
+        db (sqlalchemy.orm.session.Session): The database session.
+        count (int): How many updates to create.
+        builds (int): How many builds each update has.
+    """
+    release = Release(
+        name='F33', long_name='Fedora 33', id_prefix='FEDORA', version='33', dist_tag='f33',
+        stable_tag='f33-updates', testing_tag='f33-updates-testing',
+        candidate_tag='f33-updates-candidate', pending_signing_tag='f33-signing-pending',
+        pending_testing_tag='f33-updates-testing-pending',
+        pending_stable_tag='f33-updates-pending', override_tag='f33-override', branch='f33',
+        state=ReleaseState.current)
+    user = User(name='packager')
+    db.add_all([release, user, User(name='bodhi')])
+
+    for i in range(count):
+        update = Update(
+            release=release, user=user, status=UpdateStatus.testing, type=UpdateType.bugfix,
+            notes='Fixes stuff.', stable_karma=3, unstable_karma=-3,
+            date_submitted=datetime(2020, 10, 1))
+        for j in range(builds):
+            package = RpmPackage(name='package%05d-%d' % (i, j))
+            update.builds.append(RpmBuild(
+                nvr='%s-1.0-1.fc33' % package.name, package=package, release=release,
+                signed=True))
+        db.add(update)
+
+    db.commit()
+
+
+def reset(db):
+    """
+    Forget the test gating statuses of all the updates, and the decisions of previous runs.
+
+    Args:
+        db (sqlalchemy.orm.session.Session): The database session.
+    """
+    db.query(Update).update({'test_gating_status': None})
+    db.commit()
+    check_policies.forget_decisions()
+
+
+def sequential():
+    """Check the updates one after the other, like the task did before it used a pool."""
+    db = Session()
+    for update in db.query(Update).order_by(Update.id.asc()):
+        update.update_test_gating_status()
+        db.commit()
+    Session.remove()
+
+
+def run(label, function, count):
+    """
+    Run the given function and print how long it took.
+
+    Args:
+        label (str): A description of the scenario.
+        function (callable): The function to time.
+        count (int): The number of updates, to print the time per update.
+    """
+    start = time.monotonic()
+    function()
+    elapsed = time.monotonic() - start
+    print('%-12s %8.2fs %8.2fms per update' % (label, elapsed, elapsed * 1000 / count))
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--updates', type=int, default=500, help='Number of updates in testing.')
+    parser.add_argument('--builds', type=int, default=2, help='Number of builds per update.')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Seconds Greenwave takes to answer a request.')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='Number of concurrent requests to Greenwave.')
+    args = parser.parse_args()
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), GreenwaveHandler)
+    server.latency = args.latency
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        config.load_config({
+            'sqlalchemy.url': 'sqlite://', 'authtkt.secret': 'benchmark',
+            'session.secret': 'benchmark', 'dogpile.cache.backend': 'dogpile.cache.memory',
+            'greenwave_api_url': 'http://127.0.0.1:%d/api/v1.0' % server.server_port,
+            'greenwave_max_concurrent_requests': args.workers})
+        engine = initialize_db(config)
+        models.metadata.create_all(engine)
+        populate(Session(), args.updates, args.builds)
+
+        with mock.patch('bodhi.server.notifications.api.publish'):
+            run('sequential', sequential, args.updates)
+            reset(Session())
+            run('concurrent', check_policies.main, args.updates)
+            run('unchanged', check_policies.main, args.updates)
+    finally:
+        Session.remove()
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# Copyright © 2020 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+Measure how long serializing a page of updates to JSON takes.
+
+A temporary SQLite database is filled with the given number of updates, each with some builds,
+bugs, and comments. The updates are loaded once, and serializing all of them is then timed in these
+scenarios:
+
+* uncached: the serialization plans are computed again for every update, which costs about as much
+  as inspecting the mappers for every object did before the plans were cached.
+* cached: the serialization plans are reused, as they are by the web server.
+
+Usage::
+
+    $ python3 devel/benchmarks/serialization.py --updates 100 --repeat 20
+"""
+from datetime import datetime
+import argparse
+import time
+
+from bodhi.server import initialize_db, models, Session
+from bodhi.server.config import config
+from bodhi.server.models import (
+    Bug, Comment, Release, ReleaseState, RpmBuild, RpmPackage, TestCase, Update, UpdateStatus,
+    UpdateType, User)
+
+
+def populate(db, count, builds, comments):
+    """
+    Insert a release and count updates with builds, bugs, and comments.
+
+    Args:
+        db (sqlalchemy.orm.session.Session): The database session.
+        count (int): How many updates to create.
+        builds (int): How many builds, and bugs, each update has.
+        comments (int): How many comments each update has.
+    """
+    release = Release(
+        name='F33', long_name='Fedora 33', id_prefix='FEDORA', version='33', dist_tag='f33',
+        stable_tag='f33-updates', testing_tag='f33-updates-testing',
+        candidate_tag='f33-updates-candidate', pending_signing_tag='f33-signing-pending',
+        pending_testing_tag='f33-updates-testing-pending',
+        pending_stable_tag='f33-updates-pending', override_tag='f33-override', branch='f33',
+        state=ReleaseState.current)
+    testcase = TestCase(name='QA:Testcase_smoke')
+    users = [User(name='user%d' % i) for i in range(comments + 1)]
+    db.add(release)
+
+    for i in range(count):
+        update = Update(
+            release=release, user=users[0], status=UpdateStatus.testing, type=UpdateType.bugfix,
+            notes='Fixes stuff.', stable_karma=3, unstable_karma=-3,
+            date_submitted=datetime(2020, 10, 1))
+        for j in range(builds):
+            package = RpmPackage(name='package%05d-%d' % (i, j))
+            update.builds.append(RpmBuild(
+                nvr='%s-1.0-1.fc33' % package.name, package=package, release=release,
+                signed=True, testcases=[testcase]))
+            update.bugs.append(Bug(bug_id=i * builds + j, title='Bug %d' % j))
+        for j in range(comments):
+            update.comments.append(Comment(text='Works for me.', karma=1, user=users[j + 1]))
+        db.add(update)
+
+    db.commit()
+
+
+def run(updates, repeat, label, cached):
+    """
+    Serialize all the updates repeat times, and print how long it took on average.
+
+    Args:
+        updates (list): The updates to serialize.
+        repeat (int): How many times to serialize all the updates.
+        label (str): A description of the scenario.
+        cached (bool): Whether the serialization plans are reused between updates.
+    """
+    start = time.monotonic()
+    for i in range(repeat):
+        for update in updates:
+            if not cached:
+                models._json_plans.clear()
+            update.__json__()
+    elapsed = (time.monotonic() - start) / repeat
+    print('%-10s %8.2fms per page %8.3fms per update' % (
+        label, elapsed * 1000, elapsed * 1000 / len(updates)))
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--updates', type=int, default=100, help='Number of updates in a page.')
+    parser.add_argument('--builds', type=int, default=2, help='Number of builds per update.')
+    parser.add_argument('--comments', type=int, default=3, help='Number of comments per update.')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='Number of times to serialize the page.')
+    args = parser.parse_args()
+
+    try:
+        config.load_config({'sqlalchemy.url': 'sqlite://', 'authtkt.secret': 'benchmark',
+                            'session.secret': 'benchmark'})
+        engine = initialize_db(config)
+        models.metadata.create_all(engine)
+        db = Session()
+        populate(db, args.updates, args.builds, args.comments)
+        updates = db.query(Update).options(*Update.serialization_options()).all()
+        # Load everything else the serialization touches, so that only serializing is timed.
+        for update in updates:
+            update.__json__()
+
+        run(updates, args.repeat, 'uncached', cached=False)
+        run(updates, args.repeat, 'cached', cached=True)
+    finally:
+        Session.remove()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# Copyright © 2020 Red Hat, Inc. and others.
+#
+# This file is part of Bodhi.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+Measure the end-to-end time it takes to generate updateinfo.xml for a large tag.
+
+A temporary SQLite database is filled with the given number of stable updates (one build and one
+bug each), and a fake Koji session tags all of their builds. The generation of the updateinfo is
+then timed in these scenarios:
+
+* cold: nothing is cached, as for the first compose of a tag.
+* cold, N threads: as above, with the RPMs fetched from Koji by several threads.
+* warm: the RPM lists are cached, but every record is generated again.
+* incremental: the records of the previous compose are reused.
+* incremental, 1% edited: as above, but 1% of the updates were edited since the previous compose.
+
+Usage::
+
+    $ python3 devel/benchmarks/updateinfo.py --builds 20000 --koji-latency 0.02
+"""
+from datetime import datetime, timedelta
+from unittest import mock
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from bodhi.server import initialize_db, Session
+from bodhi.server.config import config
+from bodhi.server.metadata import UpdateInfoMetadata
+from bodhi.server.models import (
+    Bug, Build, ContentType, metadata, Package, Release, ReleaseState, Update, update_bug_table,
+    UpdateRequest, UpdateStatus, UpdateType)
+
+
+class FakeKoji:
+    """A Koji client that tags the given builds, and sleeps to emulate the hub's latency."""
+
+    def __init__(self, nvrs, latency):
+        """
+        Initialize the FakeKoji.
+
+        Args:
+            nvrs (list): The NVRs of the builds tagged in every tag.
+            latency (float): How many seconds each call (or multicall) to the hub takes.
+        """
+        self.nvrs = nvrs
+        self.latency = latency
+        self.calls = 0
+        self.multicall = False
+        self._multicall_results = []
+
+    def _call(self, result):
+        if self.multicall:
+            self._multicall_results.append([result])
+            return
+        self.calls += 1
+        time.sleep(self.latency)
+        return result
+
+    def multiCall(self, *args, **kwargs):
+        """Return the results of the queued calls."""
+        results = self._multicall_results
+        self._multicall_results = []
+        self.multicall = False
+        self.calls += 1
+        time.sleep(self.latency)
+        return results
+
+    def listTagged(self, tag, *args, **kwargs):
+        """Return every build."""
+        return self._call([self._build(i, nvr) for i, nvr in enumerate(self.nvrs)])
+
+    def getBuild(self, nvr, *args, **kwargs):
+        """Return the given build."""
+        return self._call(self._build(self.nvrs.index(nvr), nvr))
+
+    def listBuildRPMs(self, build_id, *args, **kwargs):
+        """Return a source and a binary RPM for the given build."""
+        nvr = self.nvrs[build_id]
+        name, version, release = nvr.rsplit('-', 2)
+        return self._call([
+            {'arch': arch, 'epoch': None, 'name': name, 'nvr': nvr, 'release': release,
+             'version': version}
+            for arch in ('src', 'x86_64')])
+
+    @staticmethod
+    def _build(build_id, nvr):
+        name, version, release = nvr.rsplit('-', 2)
+        return {'id': build_id, 'nvr': nvr, 'name': name, 'version': version, 'release': release,
+                'epoch': None}
+
+
+def populate(db, count):
+    """
+    Insert a release, and count stable updates with one build and one bug each.
+
+    Args:
+        db (sqlalchemy.orm.session.Session): The database session.
+        count (int): How many updates to create.
+    Returns:
+        list: The NVRs of the builds.
+    """
+    release = Release(
+        name='F33', long_name='Fedora 33', id_prefix='FEDORA', version='33', dist_tag='f33',
+        stable_tag='f33-updates', testing_tag='f33-updates-testing',
+        candidate_tag='f33-updates-candidate', pending_signing_tag='f33-signing-pending',
+        pending_testing_tag='f33-updates-testing-pending',
+        pending_stable_tag='f33-updates-pending', override_tag='f33-override', branch='f33',
+        state=ReleaseState.current)
+    db.add(release)
+    db.flush()
+
+    pushed = datetime(2020, 10, 1)
+    nvrs = ['package%05d-1.0-1.fc33' % i for i in range(count)]
+    db.execute(Package.__table__.insert(), [
+        {'id': i + 1, 'name': nvr.rsplit('-', 2)[0], 'type': ContentType.rpm}
+        for i, nvr in enumerate(nvrs)])
+    db.execute(Update.__table__.insert(), [
+        {'id': i + 1, 'alias': 'FEDORA-2020-%010d' % i, 'release_id': release.id,
+         'status': UpdateStatus.stable, 'type': UpdateType.bugfix, 'notes': 'Fixes stuff.',
+         'stable_karma': 3, 'unstable_karma': -3, 'date_pushed': pushed + timedelta(seconds=i)}
+        for i in range(count)])
+    db.execute(Build.__table__.insert(), [
+        {'id': i + 1, 'nvr': nvr, 'package_id': i + 1, 'release_id': release.id,
+         'update_id': i + 1, 'type': ContentType.rpm, 'signed': True}
+        for i, nvr in enumerate(nvrs)])
+    db.execute(Bug.__table__.insert(), [
+        {'id': i + 1, 'bug_id': 1000000 + i, 'title': 'Bug %d' % i} for i in range(count)])
+    db.execute(update_bug_table.insert(), [
+        {'update_id': i + 1, 'bug_id': i + 1} for i in range(count)])
+    db.commit()
+    return nvrs
+
+
+def run(db, release, koji, label):
+    """
+    Generate the updateinfo for the stable tag of the given release, and print how long it took.
+
+    Args:
+        db (sqlalchemy.orm.session.Session): The database session.
+        release (bodhi.server.models.Release): The release to generate the updateinfo for.
+        koji (FakeKoji): The fake Koji client.
+        label (str): A description of the scenario.
+    """
+    db.expire_all()
+    koji.calls = 0
+    start = time.monotonic()
+    with mock.patch('bodhi.server.metadata.get_session', return_value=koji), \
+            mock.patch('bodhi.server.rpmcache.get_session', return_value=koji):
+        md = UpdateInfoMetadata(release, UpdateRequest.stable, db, None)
+        md.uinfo.xml_dump()
+    print('%-28s %8.2fs %8d Koji calls' % (label, time.monotonic() - start, koji.calls))
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--builds', type=int, default=20000, help='Number of tagged builds.')
+    parser.add_argument('--koji-latency', type=float, default=0.0,
+                        help='Seconds each call to Koji takes.')
+    parser.add_argument('--prefetch-threads', type=int, default=4,
+                        help='Number of threads fetching RPMs from Koji in the threaded scenario.')
+    args = parser.parse_args()
+
+    cache_dir = tempfile.mkdtemp(prefix='bodhi-benchmark-')
+    try:
+        config.load_config({'sqlalchemy.url': 'sqlite://', 'cache_dir': cache_dir,
+                            'authtkt.secret': 'benchmark', 'session.secret': 'benchmark'})
+        engine = initialize_db(config)
+        metadata.create_all(engine)
+        db = Session()
+        nvrs = populate(db, args.builds)
+        release = db.query(Release).one()
+        koji = FakeKoji(nvrs, args.koji_latency)
+
+        run(db, release, koji, 'cold')
+        os.unlink(os.path.join(cache_dir, 'rpms.sqlite'))
+        config['rpm_prefetch_threads'] = args.prefetch_threads
+        run(db, release, koji, 'cold, %d threads' % args.prefetch_threads)
+        run(db, release, koji, 'warm')
+        config['incremental_updateinfo'] = True
+        # The first incremental run fills the records cache.
+        run(db, release, koji, 'warm, filling records')
+        run(db, release, koji, 'incremental')
+        edited = db.query(Update).filter(Update.id % 100 == 0).all()
+        for update in edited:
+            update.date_modified = datetime.utcnow()
+        db.commit()
+        run(db, release, koji, 'incremental, %d edited' % len(edited))
+    finally:
+        Session.remove()
+        shutil.rmtree(cache_dir)
+
+
+if __name__ == '__main__':
+    main()
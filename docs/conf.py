@@ -244,6 +244,8 @@ latex_documents = [
 # (source start file, name, description, authors, manual section).
 man_pages = [
     ('user/man_pages/bodhi', 'bodhi', 'manage Fedora updates', ['Randy Barlow', 'Luke Macken'], 1),
+    ('user/man_pages/bodhi-check-karma', 'bodhi-check-karma',
+     'check the karma counters of updates against their comments', ['Bodhi developers'], 1),
     ('user/man_pages/bodhi-push', 'bodhi-push', 'push Fedora updates', ['Randy Barlow'], 1),
     ('user/man_pages/initialize_bodhi_db', 'initialize_bodhi_db', 'initialize bodhi\'s database',
      ['Randy Barlow'], 1),
@@ -0,0 +1 @@
+The arches of a compose are sanity checked concurrently, and the time each check took is recorded
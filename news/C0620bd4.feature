@@ -0,0 +1 @@
+The critical path components of each branch and type are cached in the dogpile.cache backend and refreshed in the background
@@ -0,0 +1 @@
+Bugs are prefetched with a single call and changed concurrently when working on the bugs of updates and composes
@@ -0,0 +1 @@
+The Koji RPM headers used by e-mails and changelogs are cached and prefetched
@@ -0,0 +1 @@
+Buildroot overrides fetch the info and tags of their builds from Koji with a single multicall
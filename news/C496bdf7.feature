@@ -0,0 +1 @@
+The composer waits for repo signatures with inotify and polls the master mirror with conditional requests and a backoff, instead of sleeping for fixed intervals
@@ -0,0 +1 @@
+The karma counters of updates are stored in the database and kept up to date, and the new bodhi-check-karma command checks and fixes them
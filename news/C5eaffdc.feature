@@ -0,0 +1 @@
+GET /updates/ accepts a cursor parameter, and returns a next_cursor to walk the results with, which is stable while updates are submitted. Pages reached with a cursor are returned with a null page number. A count=cached parameter lets the server reuse a recently computed total count
@@ -0,0 +1 @@
+The updates approve_testing looks at are prefiltered in SQL
@@ -0,0 +1 @@
+Blobs are streamed between registries with resumable, verified transfers
@@ -0,0 +1 @@
+Updateinfo can be generated incrementally, reusing the records of the updates that didn't change since the previous compose
@@ -0,0 +1 @@
+The builds of the composed updates are loaded with batched queries instead of one query per build
@@ -0,0 +1 @@
+The composer fetches the RPM headers of the builds its notifications quote from Koji while Pungi runs, and the lists of security and unapproved critical path updates heading the testing digest are built with fewer queries
@@ -0,0 +1 @@
+The serialization plans of the models are cached, which makes serializing large listings faster
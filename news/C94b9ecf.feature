@@ -0,0 +1 @@
+The commit ACLs of packages are cached for pagure_acl_cache_ttl seconds, and the ACLs of the packages of an update are fetched from Pagure concurrently. The cache hits and misses are exported in the bodhi_acl_cache_lookups metric
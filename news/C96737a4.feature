@@ -0,0 +1 @@
+E-mails are delivered over pooled SMTP connections, in batches
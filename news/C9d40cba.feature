@@ -0,0 +1 @@
+The Greenwave handler only decides from the decisions received during the debounce window of an update, and otherwise queries Greenwave
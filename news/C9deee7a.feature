@@ -0,0 +1 @@
+Greenwave is asked about the open updates concurrently when checking policies
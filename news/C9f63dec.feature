@@ -0,0 +1 @@
+The handlers matching a message of the consumer can run at the same time on their own pools of threads, keeping the messages about the builds of an update in order across queues
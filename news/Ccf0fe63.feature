@@ -0,0 +1 @@
+Container images are copied natively, once per image and with shared blobs
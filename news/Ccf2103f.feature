@@ -0,0 +1 @@
+Requests to remote services are sent through per-service connection pools, with backoff and a circuit breaker
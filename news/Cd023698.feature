@@ -0,0 +1 @@
+The RPMs of builds are cached in an SQLite database in cache_dir that is shared by all the composes and pruned by age and size
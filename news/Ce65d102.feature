@@ -0,0 +1 @@
+The RPM lists of builds missing from the cache are fetched from Koji in bounded batches of multicalls, optionally from several threads
@@ -0,0 +1 @@
+The listings of updates, comments, overrides, builds and users load what they serialize with a fixed number of queries, whatever the size of the page
@@ -93,6 +93,7 @@ bodhi_setup = {
     'include_package_data': True,
     'install_requires': [],
     'tests_require': [
+        'aiosmtpd',
         'requests',
         'flake8',
         'pytest',
@@ -206,6 +207,7 @@ server_setup = {
         bodhi-untag-branched = bodhi.server.scripts.untag_branched:main
         bodhi-skopeo-lite = bodhi.server.scripts.skopeo_lite:main
         bodhi-sar = bodhi.server.scripts.sar:get_user_data
+        bodhi-check-karma = bodhi.server.scripts.check_karma:check_karma
         bodhi-shell = bodhi.server.scripts.bshell:get_bodhi_shell
         bodhi-clean-old-composes = bodhi.server.scripts.compat:clean_old_composes
         bodhi-expire-overrides = bodhi.server.scripts.compat:expire_overrides